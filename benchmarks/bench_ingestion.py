@@ -0,0 +1,224 @@
+"""
+Offline benchmarks for extraction, chunking and ingestion.
+
+Generates synthetic PDFs of different sizes and densities and runs extract_and_chunk
+(pypdf, every page through Document AI, and the extraction router, which sends only pages
+without a usable text layer to Document AI), page splitting (a PdfWriter per page against the one-pass
+PdfSplitter), the context chunker and IngestionService.ingest_document end-to-end against
+local stand-ins (benchmarks/fakes.py). Each scenario runs in its own
+subprocess so peak RSS is per scenario. Results are compared with benchmarks/baseline.json.
+
+Usage (from the repository root):
+    PYTHONPATH=src python -m benchmarks.bench_ingestion                  # run and compare
+    PYTHONPATH=src python -m benchmarks.bench_ingestion --save-baseline  # record a new baseline
+    PYTHONPATH=src python -m benchmarks.bench_ingestion --scenario small-dense --docai-latency 0.2
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+# The governor would otherwise rate limit the fake Document AI to the production quota
+os.environ.setdefault("DOCUMENT_AI_RATE_PER_SECOND", "1000000")
+os.environ.setdefault("DOCUMENT_AI_BURST", "1000000")
+# Every run must pay for extraction; the Document AI store would serve repeats
+os.environ.setdefault("DOCAI_STORE_ENABLED", "false")
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+SCENARIOS = {
+    "small-sparse": {"pages": 10, "words_per_page": 80, "image_kb": 0},
+    "small-dense": {"pages": 10, "words_per_page": 900, "image_kb": 0},
+    "medium-dense": {"pages": 100, "words_per_page": 600, "image_kb": 0},
+    "drawing-set": {"pages": 120, "words_per_page": 150, "image_kb": 512},
+}
+
+# Higher is better for throughput, lower is better for memory
+TOLERANCE = float(os.getenv("BENCH_TOLERANCE", "0.25"))
+
+
+def _stage_totals():
+    from services.metrics import STAGE_DURATION
+    with STAGE_DURATION.lock:
+        return {dict(key)["stage"]: (series[1], series[2]) for key, series in STAGE_DURATION.series.items()}
+
+
+def _stage_delta(before, after):
+    delta = {}
+    for stage, (total, count) in after.items():
+        base_total, base_count = before.get(stage, (0.0, 0))
+        if count > base_count:
+            delta[stage] = {"seconds": round(total - base_total, 4), "count": count - base_count}
+    return delta
+
+
+def _measure(fn, pages, repeat):
+    best = None
+    for _ in range(repeat):
+        before = _stage_totals()
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        if best is None or elapsed < best["seconds"]:
+            best = {"seconds": round(elapsed, 4), "pages_per_sec": round(pages / elapsed, 2),
+                    "stages": _stage_delta(before, _stage_totals())}
+    return best
+
+
+def _peak_alloc_mb(fn):
+    """Peak Python heap allocated while fn runs, in MB."""
+    tracemalloc.start()
+    try:
+        fn()
+        return round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+    finally:
+        tracemalloc.stop()
+
+
+def run_scenario(name, docai_latency=0.0, repeat=3):
+    """Runs every benchmark for one scenario in this process and returns the results."""
+    from benchmarks.fakes import FakeDocumentAIClient, FakeDocumentDAO, FakeWeaviateClient
+    from benchmarks.pdfgen import generate_pdf
+    from services import extraction_service, pdf_splitter
+    from services.context_service import ContextChunk, assemble_context
+    from services.ingestion_service import IngestionService
+    from database.dao.DocumentRecord import DocumentRecord
+
+    config = SCENARIOS[name]
+    pdf_bytes = generate_pdf(config["pages"], config["words_per_page"], image_kb=config["image_kb"], seed=42)
+    pages = config["pages"]
+    fake_documentai = FakeDocumentAIClient(latency=docai_latency)
+    extraction_service.get_documentai_client = lambda: fake_documentai
+
+    page_texts = extraction_service.extract_and_chunk(pdf_bytes, 0)
+    chunks = [ContextChunk(text, "bench.pdf", page_num) for page_num, text in enumerate(page_texts)]
+
+    def extract_documentai():
+        # The synthetic pages all have a good text layer, so the router would send none of them
+        router_enabled = extraction_service.EXTRACTION_ROUTER_ENABLED
+        extraction_service.EXTRACTION_ROUTER_ENABLED = False
+        try:
+            extraction_service.extract_and_chunk(pdf_bytes, 0, use_document_ai=True)
+        finally:
+            extraction_service.EXTRACTION_ROUTER_ENABLED = router_enabled
+
+    def split_writer():
+        reader = extraction_service.open_pdf(pdf_bytes)
+        for _, page in extraction_service.iter_pages(reader):
+            extraction_service.split_page(page)
+
+    def split_onepass():
+        reader = extraction_service.open_pdf(pdf_bytes)
+        splitter = pdf_splitter.PdfSplitter(reader)
+        for page_num, _ in extraction_service.iter_pages(reader):
+            splitter.part([page_num])
+
+    def ingest():
+        record = DocumentRecord(None, "bench.pdf", 1, "s3://bench/bench.pdf", 0)
+        with IngestionService(FakeWeaviateClient(), FakeDocumentDAO()) as service:
+            assert service.ingest_document(record, pdf_bytes) is not None
+
+    results = {
+        "pdf_bytes": len(pdf_bytes),
+        "pages": pages,
+        "extract_pypdf": _measure(lambda: extraction_service.extract_and_chunk(pdf_bytes, 0), pages, repeat),
+        "extract_documentai": _measure(extract_documentai, pages, repeat),
+        "extract_routed": _measure(lambda: extraction_service.extract_and_chunk(pdf_bytes, 0, use_document_ai=True), pages, repeat),
+        "split_writer": _measure(split_writer, pages, repeat),
+        "split_onepass": _measure(split_onepass, pages, repeat),
+        "split_writer_peak_mb": _peak_alloc_mb(split_writer),
+        "split_onepass_peak_mb": _peak_alloc_mb(split_onepass),
+        "context_chunker": _measure(lambda: assemble_context("door hardware 08 71 00", chunks, token_budget=20000), pages, repeat),
+        "ingest_document": _measure(ingest, pages, repeat),
+    }
+    # Document AI requests of all runs, so a lane that silently stopped calling it shows up
+    results["documentai_calls"] = fake_documentai.calls
+    # ru_maxrss is reported in kilobytes on Linux
+    results["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return results
+
+
+def run_isolated(name, docai_latency, repeat):
+    env = dict(os.environ)
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_ingestion", "--run-scenario", name,
+         "--docai-latency", str(docai_latency), "--repeat", str(repeat)],
+        capture_output=True, text=True, env=env)
+    if result.returncode != 0:
+        raise RuntimeError(f"Scenario {name} failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline):
+    """Returns a list of regression messages versus the baseline."""
+    regressions = []
+    for scenario, scenario_results in results.items():
+        base = baseline.get(scenario)
+        if not base:
+            continue
+        for bench, measured in scenario_results.items():
+            if not isinstance(measured, dict) or bench not in base:
+                continue
+            expected = base[bench]["pages_per_sec"]
+            if measured["pages_per_sec"] < expected * (1 - TOLERANCE):
+                regressions.append(f"{scenario}/{bench}: {measured['pages_per_sec']} pages/s vs baseline {expected}")
+        if scenario_results["peak_rss_mb"] > base["peak_rss_mb"] * (1 + TOLERANCE):
+            regressions.append(f"{scenario}: peak RSS {scenario_results['peak_rss_mb']} MB vs baseline {base['peak_rss_mb']} MB")
+    return regressions
+
+
+def print_report(results):
+    print(f"{'scenario':<14} {'benchmark':<20} {'pages/s':>10} {'seconds':>9}  top stages")
+    for scenario, scenario_results in results.items():
+        for bench, measured in scenario_results.items():
+            if not isinstance(measured, dict):
+                continue
+            stages = sorted(measured["stages"].items(), key=lambda item: -item[1]["seconds"])[:3]
+            stage_text = ", ".join(f"{stage}={data['seconds']}s" for stage, data in stages)
+            print(f"{scenario:<14} {bench:<20} {measured['pages_per_sec']:>10} {measured['seconds']:>9}  {stage_text}")
+        for key in ("split_writer_peak_mb", "split_onepass_peak_mb"):
+            if key in scenario_results:
+                print(f"{scenario:<14} {key[:-3] + ' heap':<20} {scenario_results[key]:>9}M")
+        print(f"{scenario:<14} {'peak RSS':<20} {scenario_results['peak_rss_mb']:>9}M")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="Run only these scenarios")
+    parser.add_argument("--docai-latency", type=float, default=0.0, help="Seconds the fake Document AI sleeps per page")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark; the fastest is reported")
+    parser.add_argument("--save-baseline", action="store_true", help=f"Write results to {BASELINE_PATH}")
+    parser.add_argument("--output", help="Also write the results JSON to this path")
+    parser.add_argument("--run-scenario", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        print(json.dumps(run_scenario(args.run_scenario, args.docai_latency, args.repeat)))
+        return 0
+
+    results = {name: run_isolated(name, args.docai_latency, args.repeat) for name in (args.scenario or SCENARIOS)}
+    print_report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {BASELINE_PATH}")
+        return 0
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            regressions = compare(results, json.load(f))
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    print("No baseline found; run with --save-baseline to record one.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+import threading
+import time
+from io import BytesIO
+from types import SimpleNamespace
+from pypdf import PdfReader
+
+""" Local stand-ins for the external services used by benchmarks and load tests: an
+in-memory S3, a Document AI client with configurable latency, an in-memory Weaviate client
+and a document DAO. They implement only the calls this repository makes. """
+
+
+class NoSuchKey(Exception):
+    pass
+
+
+class _Body:
+    def __init__(self, data: bytes):
+        self._stream = BytesIO(data)
+
+    def read(self, size=-1):
+        return self._stream.read(size)
+
+    def iter_chunks(self, chunk_size=1024 * 1024):
+        while True:
+            data = self._stream.read(chunk_size)
+            if not data:
+                return
+            yield data
+
+    def close(self):
+        pass
+
+
+class InMemoryS3:
+    """A thread-safe dict-backed S3 client with optional per-call latency."""
+
+    def __init__(self, latency=0.0):
+        self.objects = {}
+        self.latency = latency
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.exceptions = SimpleNamespace(NoSuchKey=NoSuchKey)
+
+    def _call(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._call("put_object")
+        data = Body if isinstance(Body, (bytes, bytearray)) else Body.read()
+        with self.lock:
+            self.objects[(Bucket, Key)] = bytes(data)
+        return {"ETag": f'"{hash(bytes(data)) & 0xffffffff:08x}"'}
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        self._call("get_object")
+        with self.lock:
+            if (Bucket, Key) not in self.objects:
+                raise NoSuchKey(Key)
+            data = self.objects[(Bucket, Key)]
+        if Range:
+            start, end = Range.split("=")[1].split("-")
+            data = data[int(start):int(end) + 1 if end else None]
+        return {"Body": _Body(data), "ContentLength": len(data), "ETag": f'"{hash(data) & 0xffffffff:08x}"'}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._call("head_object")
+        with self.lock:
+            if (Bucket, Key) not in self.objects:
+                raise NoSuchKey(Key)
+            data = self.objects[(Bucket, Key)]
+        return {"ContentLength": len(data), "ETag": f'"{hash(data) & 0xffffffff:08x}"'}
+
+    def list_objects_v2(self, Bucket, Prefix="", ContinuationToken=None, MaxKeys=1000, **kwargs):
+        self._call("list_objects_v2")
+        with self.lock:
+            keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix or ""))
+        start = int(ContinuationToken or 0)
+        page = keys[start:start + MaxKeys]
+        response = {"KeyCount": len(page)}
+        if page:
+            response["Contents"] = [{"Key": key, "Size": len(self.objects[(Bucket, key)]),
+                                     "ETag": f'"{hash(self.objects[(Bucket, key)]) & 0xffffffff:08x}"'} for key in page]
+        if start + MaxKeys < len(keys):
+            response["IsTruncated"] = True
+            response["NextContinuationToken"] = str(start + MaxKeys)
+        else:
+            response["IsTruncated"] = False
+        return response
+
+
+class FakeDocumentAIClient:
+    """Mimics DocumentProcessorServiceClient.process_document: sleeps, then returns the pypdf text layer."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def processor_path(self, project, location, processor):
+        return f"projects/{project}/locations/{location}/processors/{processor}"
+
+    def process_document(self, request=None, **kwargs):
+        with self.lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        reader = PdfReader(BytesIO(request.raw_document.content))
+        text = "\n".join(page.extract_text() for page in reader.pages)
+        pages = [SimpleNamespace(page_number=i + 1, tables=[]) for i in range(len(reader.pages))]
+        document = SimpleNamespace(text=text, pages=pages)
+        return SimpleNamespace(document=document)
+
+
+class _FakeBatch:
+    def __init__(self, collection):
+        self.collection = collection
+        self.number_errors = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def add_object(self, properties, vector=None, uuid=None, **kwargs):
+        self.collection.objects.append({"properties": dict(properties), "vector": vector})
+
+
+class FakeCollection:
+    def __init__(self, name, latency=0.0):
+        self.name = name
+        self.latency = latency
+        self.objects = []
+        self.batch = SimpleNamespace(dynamic=self._dynamic, fixed_size=lambda **kwargs: self._dynamic(), failed_objects=[])
+        self.data = SimpleNamespace(delete_many=self._delete_many)
+
+    def _dynamic(self):
+        if self.latency:
+            time.sleep(self.latency)
+        return _FakeBatch(self)
+
+    def _delete_many(self, where=None, **kwargs):
+        before = len(self.objects)
+        self.objects = []
+        return SimpleNamespace(successful=before, failed=0, matches=before)
+
+
+class FakeWeaviateClient:
+    """In-memory Weaviate client: collections.get/exists/create/delete and batch inserts."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._collections = {"Document": FakeCollection("Document", latency)}
+        self.collections = SimpleNamespace(get=self._get, exists=lambda name: name in self._collections,
+                                           create=self._create, delete=self._delete)
+
+    def _get(self, name):
+        return self._collections.setdefault(name, FakeCollection(name, self.latency))
+
+    def _create(self, name, **kwargs):
+        self._collections[name] = FakeCollection(name, self.latency)
+        return self._collections[name]
+
+    def _delete(self, name):
+        self._collections.pop(name, None)
+
+    def close(self):
+        pass
+
+
+class FakeDocumentDAO:
+    """Assigns ids in memory instead of talking to Postgres."""
+
+    def __init__(self):
+        self.documents = {}
+        self.next_id = 1
+
+    def create_document(self, document_record):
+        document_record.document_id = self.next_id
+        self.documents[self.next_id] = document_record
+        self.next_id += 1
+        return document_record
+
+    def update_document(self, document_record):
+        self.documents[document_record.document_id] = document_record
+        return document_record
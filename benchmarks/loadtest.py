@@ -0,0 +1,246 @@
+"""
+Load test for POST /query with a latency SLO report.
+
+Starts benchmarks.stub_app (main:app with S3, Document AI, Gemini and Weaviate replaced by
+local stand-ins of configurable latency) under uvicorn, or targets --url, then drives
+/query with a weighted query mix at each requested concurrency level. Every virtual user
+sends its next request as soon as the previous one returns (closed loop), so the
+concurrency level is the number of simultaneous users one task is serving.
+
+For each level it reports throughput, p50/p95/p99 latency, error rate and the server's
+event-loop lag, and marks whether the p95 SLO holds. The highest level that meets the SLO
+is the per-task capacity used to size the ECS service (terraform/infra-ephemeral/main.tf:
+desired_count, fargate_cpu, fargate_memory); pass --target-users to get a task count.
+
+Usage (from the repository root):
+    PYTHONPATH=src:. python -m benchmarks.loadtest
+    PYTHONPATH=src:. python -m benchmarks.loadtest --concurrency 1,8,32,64 --duration 30 --gemini-latency 2.5
+    PYTHONPATH=src:. python -m benchmarks.loadtest --url http://localhost:8000 --mix my_queries.json
+
+A mix file is a JSON list of {"query": ..., "location": ..., "weight": ...} objects.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+DEFAULT_PROJECTS = 3
+
+# Recurring questions dominate real traffic; the rest are one-off questions
+QUESTION_TEMPLATES = [
+    ("What are the door hardware requirements in section 08 71 00?", 5),
+    ("Summarize the concrete slab and footing specifications.", 4),
+    ("Which submittals are required from the contractor?", 3),
+    ("List the duct, damper and diffuser requirements on sheet M-301.", 2),
+    ("What does addendum bulletin say about the curtain wall glazing?", 1),
+]
+
+
+def default_mix(projects=DEFAULT_PROJECTS):
+    return [{"query": query, "location": f"projects/project-{project_num}/", "weight": weight}
+            for project_num in range(projects) for query, weight in QUESTION_TEMPLATES]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list; 0.0 when empty."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class QueryMix:
+    """Weighted random choice over the mix; unique_ratio of queries get a random suffix so they cannot be coalesced."""
+
+    def __init__(self, entries, unique_ratio=0.3, seed=0):
+        self.entries = entries
+        self.weights = [entry.get("weight", 1) for entry in entries]
+        self.unique_ratio = unique_ratio
+        self.rng = random.Random(seed)
+
+    def next(self):
+        entry = self.rng.choices(self.entries, weights=self.weights)[0]
+        query = entry["query"]
+        if self.rng.random() < self.unique_ratio:
+            query = f"{query} (ref {self.rng.randrange(1_000_000)})"
+        return {"query": query, "location": entry["location"]}
+
+
+class LevelResult:
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+        self.latencies = []
+        self.errors = {}
+        self.elapsed = 0.0
+        self.loop_lag = []
+
+    @property
+    def requests(self):
+        return len(self.latencies) + sum(self.errors.values())
+
+    def as_dict(self, slo_p95):
+        total = self.requests
+        p95 = percentile(self.latencies, 95)
+        return {
+            "concurrency": self.concurrency,
+            "requests": total,
+            "throughput_rps": round(len(self.latencies) / self.elapsed, 2) if self.elapsed else 0.0,
+            "p50": round(percentile(self.latencies, 50), 4),
+            "p95": round(p95, 4),
+            "p99": round(percentile(self.latencies, 99), 4),
+            "error_rate": round(sum(self.errors.values()) / total, 4) if total else 0.0,
+            "errors": dict(self.errors),
+            "loop_lag_p99": round(percentile(self.loop_lag, 99), 4),
+            "loop_lag_max": round(max(self.loop_lag, default=0.0), 4),
+            "meets_slo": bool(self.latencies) and p95 <= slo_p95 and not self.errors,
+        }
+
+
+async def virtual_user(client, mix, deadline, result, timeout):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            response = await client.post("/query", json=mix.next(), timeout=timeout)
+            if response.status_code == 200:
+                result.latencies.append(time.perf_counter() - started)
+            else:
+                result.errors[str(response.status_code)] = result.errors.get(str(response.status_code), 0) + 1
+        except httpx.HTTPError as e:
+            result.errors[type(e).__name__] = result.errors.get(type(e).__name__, 0) + 1
+
+
+async def fetch_loop_lag(client):
+    response = await client.get("/_loadtest/loop-lag")
+    return response.json().get("samples", []) if response.status_code == 200 else []
+
+
+async def run_level(base_url, mix, concurrency, duration, timeout):
+    result = LevelResult(concurrency)
+    limits = httpx.Limits(max_connections=concurrency + 1, max_keepalive_connections=concurrency + 1)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits) as client:
+        # Discard lag accumulated between levels
+        await fetch_loop_lag(client)
+        started = time.perf_counter()
+        deadline = started + duration
+        await asyncio.gather(*(virtual_user(client, mix, deadline, result, timeout) for _ in range(concurrency)))
+        result.elapsed = time.perf_counter() - started
+        result.loop_lag = await fetch_loop_lag(client)
+    return result
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_stub_server(args):
+    """Runs benchmarks.stub_app under uvicorn in a subprocess and waits until it answers."""
+    port = _free_port()
+    env = dict(os.environ)
+    env.update({
+        "LOADTEST_S3_LATENCY": str(args.s3_latency),
+        "LOADTEST_DOCAI_LATENCY": str(args.docai_latency),
+        "LOADTEST_GEMINI_LATENCY": str(args.gemini_latency),
+        "LOADTEST_PROJECTS": str(args.projects),
+    })
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "benchmarks.stub_app:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Stub server exited during startup")
+        try:
+            if httpx.get(f"{base_url}/_loadtest/loop-lag", timeout=1).status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Stub server did not start within 120 seconds")
+
+
+def print_report(rows, slo_p95):
+    print(f"{'users':>6} {'reqs':>7} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'err%':>6} {'lag p99':>8} {'lag max':>8}  SLO p95<={slo_p95}s")
+    for row in rows:
+        print(f"{row['concurrency']:>6} {row['requests']:>7} {row['throughput_rps']:>8} {row['p50']:>8} {row['p95']:>8} "
+              f"{row['p99']:>8} {row['error_rate'] * 100:>6.1f} {row['loop_lag_p99']:>8} {row['loop_lag_max']:>8}  "
+              f"{'ok' if row['meets_slo'] else 'MISS'}")
+
+
+def capacity_summary(rows, target_users):
+    """Highest tested concurrency that meets the SLO and, given target_users, the task count it implies."""
+    passing = [row["concurrency"] for row in rows if row["meets_slo"]]
+    summary = {"max_users_per_task": max(passing) if passing else 0}
+    if target_users and passing:
+        summary["tasks_for_target"] = math.ceil(target_users / summary["max_users_per_task"])
+    return summary
+
+
+async def run(args, base_url):
+    if args.mix:
+        with open(args.mix) as f:
+            entries = json.load(f)
+    else:
+        entries = default_mix(args.projects)
+    mix = QueryMix(entries, unique_ratio=args.unique_ratio, seed=args.seed)
+    rows = []
+    for concurrency in args.concurrency:
+        result = await run_level(base_url, mix, concurrency, args.duration, args.timeout)
+        rows.append(result.as_dict(args.slo_p95))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Target an already running server instead of starting the stub app")
+    parser.add_argument("--concurrency", default="1,4,16,32", type=lambda value: [int(v) for v in value.split(",")],
+                        help="Comma separated concurrent user levels")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per concurrency level")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument("--mix", help="JSON query mix file; defaults to a built-in mix over the stub projects")
+    parser.add_argument("--unique-ratio", type=float, default=0.3, help="Share of queries made unique so they are not coalesced")
+    parser.add_argument("--projects", type=int, default=DEFAULT_PROJECTS, help="Stub projects to generate and query")
+    parser.add_argument("--s3-latency", type=float, default=0.02, help="Stub S3 seconds per call")
+    parser.add_argument("--docai-latency", type=float, default=0.3, help="Stub Document AI seconds per page")
+    parser.add_argument("--gemini-latency", type=float, default=1.5, help="Stub Gemini seconds per call")
+    parser.add_argument("--slo-p95", type=float, default=5.0, help="p95 latency objective in seconds")
+    parser.add_argument("--target-users", type=int, default=0, help="Expected peak concurrent users, for a task count")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the results JSON to this path")
+    args = parser.parse_args()
+
+    process = None
+    base_url = args.url
+    if not base_url:
+        process, base_url = start_stub_server(args)
+    try:
+        rows = asyncio.run(run(args, base_url))
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=30)
+
+    print_report(rows, args.slo_p95)
+    summary = capacity_summary(rows, args.target_users)
+    print(f"Max concurrent users per task within SLO: {summary['max_users_per_task']}")
+    if "tasks_for_target" in summary:
+        print(f"Tasks needed for {args.target_users} users: {summary['tasks_for_target']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"levels": rows, "summary": summary}, f, indent=2)
+    return 0 if summary["max_users_per_task"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+import random
+import zlib
+
+""" Synthetic PDF generator for benchmarks. Produces text-layer pages of configurable
+density, optionally sharing one large image XObject across every page the way drawing
+sets share title blocks and scanned overlays. """
+
+VOCABULARY = (
+    "concrete rebar formwork slab footing column beam girder joist truss steel weld bolt anchor "
+    "masonry mortar grout membrane flashing insulation drywall stud partition ceiling door frame "
+    "hardware glazing curtain wall louver damper duct diffuser valve pump pipe conduit panel "
+    "breaker transformer fixture submittal addendum bulletin specification section schedule "
+    "contractor architect engineer owner install provide verify coordinate comply shall"
+).split()
+
+SECTION_NUMBERS = ["03 30 00", "05 12 00", "07 21 00", "08 71 00", "09 29 00", "23 31 13", "26 24 16"]
+SHEET_IDS = ["A-101", "A-501", "S-201", "M-301", "E-401", "P-101"]
+
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def page_lines(rng, words_per_page, words_per_line=12):
+    words = []
+    for _ in range(words_per_page):
+        roll = rng.random()
+        if roll < 0.02:
+            words.append(rng.choice(SECTION_NUMBERS))
+        elif roll < 0.04:
+            words.append(rng.choice(SHEET_IDS))
+        else:
+            words.append(rng.choice(VOCABULARY))
+    return [" ".join(words[i:i + words_per_line]) for i in range(0, len(words), words_per_line)]
+
+
+def generate_pdf(pages, words_per_page, image_kb=0, seed=0, duplicate_every=0) -> bytes:
+    """
+    Builds a PDF in memory.
+
+    Args:
+        pages: Number of pages
+        words_per_page: Text density
+        image_kb: Size of an incompressible image shared by every page (0 for none)
+        seed: Random seed so runs are reproducible
+        duplicate_every: If > 0, every Nth page repeats the text of the previous page (reissued sheets)
+    """
+    rng = random.Random(seed)
+    objects = {}
+    objects[1] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[3] = b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+    next_id = 4
+    image_ref = b""
+    if image_kb:
+        side = int((image_kb * 1024) ** 0.5)
+        pixels = rng.randbytes(side * side)
+        objects[next_id] = (b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceGray "
+                            b"/BitsPerComponent 8 /Length %d >>\nstream\n" % (side, side, len(pixels))) + pixels + b"\nendstream"
+        image_ref = b" /XObject << /Im1 %d 0 R >>" % next_id
+        next_id += 1
+
+    kids = []
+    previous_lines = None
+    for page_num in range(pages):
+        if duplicate_every and previous_lines is not None and page_num % duplicate_every == 0:
+            lines = previous_lines
+        else:
+            lines = page_lines(rng, words_per_page)
+        previous_lines = lines
+        content = [b"BT /F1 9 Tf 11 TL 40 760 Td"]
+        for line in lines:
+            content.append(b"(" + _escape(line).encode("latin-1") + b") '")
+        content.append(b"ET")
+        if image_ref:
+            content.append(b"q 200 0 0 200 380 40 cm /Im1 Do Q")
+        stream = zlib.compress(b"\n".join(content))
+        content_id, page_id = next_id, next_id + 1
+        next_id += 2
+        objects[content_id] = b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(stream) + stream + b"\nendstream"
+        objects[page_id] = (b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents %d 0 R "
+                            b"/Resources << /Font << /F1 3 0 R >>%s >> >>" % (content_id, image_ref))
+        kids.append(page_id)
+
+    objects[2] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % kid for kid in kids), len(kids))
+
+    out = bytearray(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(out)
+        out += b"%d 0 obj\n" % object_id + objects[object_id] + b"\nendobj\n"
+    xref_offset = len(out)
+    size = max(objects) + 1
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % size
+    for object_id in range(1, size):
+        out += b"%010d 00000 n \n" % offsets[object_id]
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, xref_offset)
+    return bytes(out)
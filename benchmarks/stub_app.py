@@ -0,0 +1,143 @@
+"""
+The main:app ASGI application wired to local stand-ins, for load testing.
+
+S3 is an in-memory store pre-populated with synthetic projects, Document AI and Gemini are
+fakes with configurable latency, and a background task measures event-loop lag, exposed at
+GET /_loadtest/loop-lag. Serve it with:
+
+    PYTHONPATH=src:. uvicorn benchmarks.stub_app:app --port 8001
+
+Environment:
+    LOADTEST_PROJECTS        number of projects (default 3)
+    LOADTEST_PDFS            PDFs per project (default 5)
+    LOADTEST_PAGES           pages per PDF (default 20)
+    LOADTEST_UNCACHED_RATIO  share of PDFs without saved text, extracted on first query (default 0.2)
+    LOADTEST_S3_LATENCY      seconds per S3 call (default 0.02)
+    LOADTEST_DOCAI_LATENCY   seconds per Document AI page (default 0.3)
+    LOADTEST_GEMINI_LATENCY  seconds per Gemini call (default 1.5)
+"""
+import asyncio
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+# Load tests measure the app, not the production quota
+os.environ.setdefault("DOCUMENT_AI_RATE_PER_SECOND", "1000000")
+os.environ.setdefault("DOCUMENT_AI_BURST", "1000000")
+# Every run must pay for extraction; the Document AI store would serve repeats
+os.environ.setdefault("DOCAI_STORE_ENABLED", "false")
+# There is no Postgres for the project manifest; queries list the stub S3 instead
+os.environ.setdefault("PROJECT_MANIFEST_ENABLED", "false")
+os.environ.setdefault("GEMINI_RATE_PER_SECOND", "1000000")
+os.environ.setdefault("GEMINI_BURST", "1000000")
+os.environ.setdefault("GEMINI_CONCURRENCY", "64")
+os.environ.setdefault("S3_BUCKET_NAME", "loadtest-bucket")
+
+import main
+from benchmarks.fakes import FakeDocumentAIClient, FakeWeaviateClient, InMemoryS3
+from benchmarks.pdfgen import generate_pdf
+from services import client_provider
+from services.extraction_service import extract_and_chunk
+
+PROJECTS = int(os.getenv("LOADTEST_PROJECTS", "3"))
+PDFS_PER_PROJECT = int(os.getenv("LOADTEST_PDFS", "5"))
+PAGES_PER_PDF = int(os.getenv("LOADTEST_PAGES", "20"))
+UNCACHED_RATIO = float(os.getenv("LOADTEST_UNCACHED_RATIO", "0.2"))
+S3_LATENCY = float(os.getenv("LOADTEST_S3_LATENCY", "0.02"))
+DOCAI_LATENCY = float(os.getenv("LOADTEST_DOCAI_LATENCY", "0.3"))
+GEMINI_LATENCY = float(os.getenv("LOADTEST_GEMINI_LATENCY", "1.5"))
+
+
+class FakeGeminiModel:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def generate_content(self, prompt_parts):
+        time.sleep(self.latency)
+        prompt = "".join(part["text"] for part in prompt_parts)
+        return SimpleNamespace(text=f"Stub answer based on {len(prompt)} prompt characters.")
+
+
+def project_location(project_num):
+    return f"projects/project-{project_num}/"
+
+
+def build_s3():
+    s3 = InMemoryS3(latency=S3_LATENCY)
+    bucket = main.S3_BUCKET_NAME
+    uncached_every = round(1 / UNCACHED_RATIO) if UNCACHED_RATIO else 0
+    for project_num in range(PROJECTS):
+        for pdf_num in range(PDFS_PER_PROJECT):
+            key = f"{project_location(project_num)}doc-{pdf_num}.pdf"
+            pdf_bytes = generate_pdf(PAGES_PER_PDF, 400, seed=project_num * 1000 + pdf_num)
+            s3.objects[(bucket, key)] = pdf_bytes
+            if uncached_every and pdf_num % uncached_every == uncached_every - 1:
+                continue
+            pages = extract_and_chunk(pdf_bytes)
+            main.save_text_to_s3(s3, bucket, key, pages)
+    s3.calls.clear()
+    return s3
+
+
+s3_stub = build_s3()
+documentai_stub = FakeDocumentAIClient(latency=DOCAI_LATENCY)
+gemini_stub = FakeGeminiModel(GEMINI_LATENCY)
+weaviate_stub = FakeWeaviateClient()
+
+main.get_s3_client = lambda: s3_stub
+main.get_documentai_client = lambda: documentai_stub
+main.get_gemini_model = lambda: gemini_stub
+# main imports this on use (ingestion, deletion, hybrid retrieval), so replace it where it is defined
+client_provider.get_weaviate_client = lambda: weaviate_stub
+
+app = main.app
+
+
+class LoopLagMonitor:
+    """Schedules a wake-up every interval and records how late the event loop runs it."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.samples = []
+        self.lock = threading.Lock()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            with self.lock:
+                self.samples.append(max(0.0, loop.time() - expected))
+
+    def drain(self):
+        with self.lock:
+            samples, self.samples = self.samples, []
+        return samples
+
+
+loop_lag = LoopLagMonitor()
+
+
+_app_lifespan = app.router.lifespan_context
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """The app's own lifespan, with the loop-lag monitor running for as long as it serves."""
+    task = asyncio.create_task(loop_lag.run())
+    try:
+        async with _app_lifespan(app) as state:
+            yield state
+    finally:
+        task.cancel()
+
+
+app.router.lifespan_context = lifespan
+
+
+@app.get("/_loadtest/loop-lag")
+async def get_loop_lag():
+    """Returns (and resets) event-loop lag samples in seconds since the previous call."""
+    return {"samples": loop_lag.drain(), "s3_calls": dict(s3_stub.calls), "documentai_calls": documentai_stub.calls}
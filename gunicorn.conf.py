@@ -0,0 +1,96 @@
+import gc
+import importlib
+import os
+import shutil
+import signal
+import threading
+import time
+
+""" Gunicorn settings for production serving: several Uvicorn workers forked from a master
+that has already imported the app, so modules and read-only tables are loaded once and
+shared copy-on-write. Start it through serve.py, which adds draining on SIGTERM.
+Every setting can be overridden with the environment variables below. """
+
+bind = os.getenv("BIND", "0.0.0.0:80")
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.getenv("WEB_CONCURRENCY", str(len(os.sched_getaffinity(0)))))
+# Read by the app: the governors split their quota between the workers
+os.environ["WEB_CONCURRENCY"] = str(workers)
+# Workers write their metrics here and /metrics reports the sum over all of them
+os.environ.setdefault("METRICS_MULTIPROCESS_DIR", "/tmp/gemini-poc-metrics")
+METRICS_MULTIPROCESS_DIR = os.environ["METRICS_MULTIPROCESS_DIR"]
+
+# Import main (and PRELOAD_MODULES) in the master before forking
+preload_app = True
+
+# Recycle workers after this many requests (with jitter so they do not all restart together)
+max_requests = int(os.getenv("MAX_REQUESTS", "2000"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "200"))
+# ... or once their resident memory passes this many MB (0 disables)
+WORKER_MAX_RSS_MB = int(os.getenv("WORKER_MAX_RSS_MB", "0"))
+WORKER_RSS_CHECK_SECONDS = 15
+
+# In-flight requests get this long to finish after SIGTERM; long Document AI extractions need it
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+keepalive = int(os.getenv("KEEPALIVE", "75"))  # above the ALB idle timeout (60 s)
+
+# Modules the app otherwise imports on first use; loaded before fork so workers share them
+PRELOAD_MODULES = [name for name in os.getenv(
+    "PRELOAD_MODULES", "services.ingestion_service,services.weaviate_service,google.generativeai").split(",") if name]
+
+accesslog = "-"
+errorlog = "-"
+
+
+def on_starting(server):
+    # Counters of a previous run would otherwise be added to this one's
+    shutil.rmtree(METRICS_MULTIPROCESS_DIR, ignore_errors=True)
+    os.makedirs(METRICS_MULTIPROCESS_DIR, exist_ok=True)
+
+
+def when_ready(server):
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            server.log.warning(f"Could not preload {name}: {e}")
+    # Objects created so far are never freed; keeping them out of GC stops the collector from
+    # touching (and so un-sharing) their pages in every worker
+    gc.collect()
+    gc.freeze()
+    server.log.info(f"Preloaded {len(PRELOAD_MODULES)} modules, {gc.get_freeze_count()} objects frozen")
+
+
+def _resident_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def _watch_memory(worker):
+    while True:
+        time.sleep(WORKER_RSS_CHECK_SECONDS)
+        resident = _resident_mb()
+        if resident > WORKER_MAX_RSS_MB:
+            worker.log.warning(f"Worker {worker.pid} uses {resident:.0f} MB (limit {WORKER_MAX_RSS_MB} MB); recycling")
+            # Graceful: the worker finishes its requests and the master starts a replacement
+            os.kill(worker.pid, signal.SIGTERM)
+            return
+
+
+def post_worker_init(worker):
+    from services.metrics import REGISTRY
+    REGISTRY.start_flusher()
+    if WORKER_MAX_RSS_MB:
+        threading.Thread(target=_watch_memory, args=(worker,), name="rss-watch", daemon=True).start()
+
+
+def worker_exit(server, worker):
+    from services.metrics import REGISTRY
+    REGISTRY.flush()
+
+
+def child_exit(server, worker):
+    # Keep the exited worker's counts in the totals so counters never go backwards
+    from services.metrics import record_worker_exit
+    record_worker_exit(METRICS_MULTIPROCESS_DIR, worker.pid)
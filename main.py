@@ -1,23 +1,34 @@
+import asyncio
+import json
 import logging
+import mmap
+import shutil
 import sys
 import os
-import json
-from io import BytesIO
+import tempfile
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-import boto3
-import google.cloud.documentai_v1 as documentai
-import google.generativeai as genai
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
-from pypdf import PdfReader, PdfWriter
-import google.oauth2.service_account
-from services.extraction_service import extract_and_chunk
-from services.weaviate_service import create_collections, get_weaviate_client, insert_document_chunks
-from services.ingestion_service import IngestionService
-from database.dao.DocumentRecord import DocumentRecord
-
+from database import dbutil
+from database.dao.ManifestRecord import ManifestRecord
+from services.extraction_service import EXTRACTION_ROUTER_ENABLED, extract_pages_routed, extract_pages_with_document_ai
+from services import manifest_service, page_text_store
+from services.client_provider import get_documentai_client, get_gemini_model, get_s3_client
+from services.context_service import ByteTracker, ChunkDeduplicator, ContextChunk, assemble_context
+from services.retrieval_service import RETRIEVAL_MODES, retrieve, retrieve_batch
+from services.session_store import SESSION_REUSE_MIN_COVERAGE, SESSION_STORE
+from services.singleflight import SingleFlight
+from services.governor import CircuitOpenError, get_governor, governor_snapshots
+from services.page_cache import PAGE_TEXT_CACHE
+from services.metrics import CHUNKS, CONTEXT_PEAK_BYTES, render_latest, timed
+from services.profiling import load_profile, profile_request
+from services.upload_service import StreamingUpload, UploadTooLargeError
+
+# Postgres statements show up in the stage latency metrics and request profiles
+dbutil.set_query_timer(timed)
 
 load_dotenv()
 
@@ -57,189 +68,249 @@ async def read_root():
     return FileResponse('static/index.html')
 
 
+# Set by serve.py; the file appears once the process is draining before shutdown
+DRAIN_FILE = os.getenv("DRAIN_FILE")
+
+@app.get("/healthz")
+async def healthz():
+    """Load balancer health check. Fails while draining so new requests go to other tasks."""
+    if DRAIN_FILE and os.path.exists(DRAIN_FILE):
+        return JSONResponse({"status": "draining"}, status_code=503)
+    return JSONResponse({"status": "ok"})
+
+
 # Serve index.html from the root path
 @app.get("/start")
 async def read_root():
     return FileResponse('static/start.html')
 
-# Configure AWS, Gemini API and Google Cloud Document AI credentials
-AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
-AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
-AWS_REGION_NAME = os.getenv("AWS_REGION_NAME")
+# AWS, Gemini and Document AI credentials and clients come from services.client_provider
 S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-
-# Google Cloud Document AI Configuration
-PROJECT_ID = os.getenv("GOOGLE_CLOUD_PROJECT_ID")
-PROCESSOR_ID = os.getenv("GOOGLE_DOCUMENT_AI_PROCESSOR_ID")
-PROCESSOR_LOCATION = os.getenv("GOOGLE_DOCUMENT_AI_PROCESSOR_LOCATION")
-GOOGLE_SERVICE_ACCOUNT_SECRET_NAME = os.getenv("GOOGLE_SERVICE_ACCOUNT_SECRET_NAME")
-
-genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel('gemini-2.0-flash')
-
-def get_s3_client():
-    """Creates and returns an S3 client."""
-    return boto3.client(
-        's3',
-        aws_access_key_id=AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-        region_name=AWS_REGION_NAME
-    )
-def get_secretmanager_client():
-    """Creates and returns a secretmanager client."""
-    return boto3.client(
-        'secretsmanager',
-        aws_access_key_id=AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-        region_name=AWS_REGION_NAME
-    )
 
-# setup Google credentials for Document AI 
-try:
-        
-    service_account_key_json_str = get_secretmanager_client().get_secret_value(SecretId=GOOGLE_SERVICE_ACCOUNT_SECRET_NAME)    
-    if service_account_key_json_str:
-        super_secret = service_account_key_json_str['SecretString']
-        google_service_account_info = json.loads(str(super_secret))
-    else:
-        google_service_account_info = None
-        print("Warning: google-service-account-key-prod secret not parsed. Falling back to default credentials.")
-        # You might choose to raise an exception here in production if the key is mandatory
-        # raise ValueError("GOOGLE_SERVICE_ACCOUNT_JSON_KEY environment variable not set.")
-except Exception as e:
-    print(f"Error loading Google Service Account key: {e}")
-    # Handle error appropriately - maybe raise HTTPException or use default credentials if possible
-
-
-def save_text_to_s3(s3_client, s3_bucket_name, pdf_key, text_content):
-    """Saves extracted text content to S3 as a .txt file."""
-    text_key = pdf_key.rsplit('.', 1)[0] + '.txt'  # Replace .pdf with .txt
-    print(f"Saving extracted text to S3: {text_key}")
+# Coalesce duplicate in-flight work: per-PDF extractions and identical (project, query) requests
+extraction_flight = SingleFlight()
+query_flight = SingleFlight()
+
+# Batch queries: questions per request, and how many of a batch's Gemini calls run at once
+BATCH_QUERY_MAX_QUERIES = int(os.getenv("BATCH_QUERY_MAX_QUERIES", "100"))
+BATCH_QUERY_CONCURRENCY = int(os.getenv("BATCH_QUERY_CONCURRENCY", "4"))
+
+# S3 prefix for documents uploaded through the API; objects go to <prefix><project_id>/<file name>
+UPLOAD_PREFIX = os.getenv("UPLOAD_PREFIX", "uploads/")
+
+# Read size when streaming a PDF from S3 to its temporary file
+PDF_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+def save_text_to_s3(s3_client, s3_bucket_name, pdf_key, page_texts):
+    """Saves extracted page texts to S3 next to the PDF, as one compressed .pages object."""
+    print(f"Saving extracted text to S3: {page_text_store.text_key_for(pdf_key)}")
     try:
-        s3_client.put_object(Bucket=s3_bucket_name, Key=text_key, Body=text_content.encode('utf-8'))
+        page_text_store.save_pages(s3_client, s3_bucket_name, pdf_key, page_texts)
     except Exception as e:
         print(f"Error saving text to S3: {e}")
 
-def load_text_from_s3(s3_client, s3_bucket_name, pdf_key):
-    """Loads extracted text content from S3 if it exists."""
-    text_key = pdf_key.rsplit('.', 1)[0] + '.txt'
-    print(f"Checking for saved text in S3: {text_key}")
+def load_text_from_s3(s3_client, s3_bucket_name, pdf_key, text_key=None):
+    """Loads the saved page texts of a PDF from S3 if they exist (.pages, or an unmigrated .txt)."""
+    print(f"Checking for saved text in S3: {text_key or pdf_key}")
     try:
-        response = s3_client.get_object(Bucket=s3_bucket_name, Key=text_key)
-        return response['Body'].read().decode('utf-8')
-    except s3_client.exceptions.NoSuchKey:
-        print(f"No saved text found in S3 for: {text_key}")
-        return None
+        saved_pages = page_text_store.load_pages(s3_client, s3_bucket_name, pdf_key, text_key)
+        if saved_pages is None:
+            print(f"No saved text found in S3 for: {pdf_key}")
+        return saved_pages
     except Exception as e:
         print(f"Error loading text from S3: {e}")
         return None
 
 
-def fetch_pdf_text_from_s3_document_ai(project_location):
+def extract_pdf_pages_with_document_ai(s3_client, pdf_key, document_ai_client):
+    """
+    Downloads a PDF, extracts it page by page with Document AI and saves the text to S3. Returns the page texts.
+    The PDF is streamed to a temporary file and read memory-mapped, so its bytes are never on the heap
+    and are released as soon as the extraction finishes.
+    """
+    print(f"Extracting text from PDF page by page using Document AI: {pdf_key}", flush=True)
+    with tempfile.TemporaryFile() as spool:
+        with timed("s3_get"):
+            body = s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=pdf_key)['Body']
+            shutil.copyfileobj(body, spool, PDF_DOWNLOAD_CHUNK_SIZE)
+        spool.flush()
+        with mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ) as pdf_file:
+            # Pages with a usable text layer are read locally; Document AI only sees the rest, and
+            # pages it has already processed come from the Document AI store
+            if EXTRACTION_ROUTER_ENABLED:
+                extracted_text_pages, _ = extract_pages_routed(pdf_file, document_ai_client=document_ai_client)
+            else:
+                extracted_text_pages = extract_pages_with_document_ai(pdf_file, document_ai_client)
+
+    save_text_to_s3(s3_client, S3_BUCKET_NAME, pdf_key, extracted_text_pages) # Save text to S3
+    return extracted_text_pages
+
+
+def plan_project_documents(s3_client, project_location):
+    """
+    Returns the PDFs to read for a project and the manifest DAO to keep up to date (None when
+    the entries come from listing S3 because the manifest is disabled or unavailable).
     """
-    Fetches text content from all PDF files within a specified folder in the S3 bucket,
-    processes them page by page using Document AI, using saved text if available.
+    if manifest_service.PROJECT_MANIFEST_ENABLED:
+        try:
+            manifest_dao = manifest_service.get_manifest_dao()
+            return manifest_service.load_project_manifest(manifest_dao, s3_client, S3_BUCKET_NAME, project_location), manifest_dao
+        except Exception as e:
+            print(f"Error reading the project manifest, listing S3 instead: {e}")
+    objects = manifest_service.list_objects_parallel(s3_client, S3_BUCKET_NAME, project_location)
+    return [ManifestRecord(obj['Key'], obj.get('ETag'), obj.get('Size')) for obj in objects
+            if obj['Key'].lower().endswith('.pdf')], None
+
+
+def extract_manifest_entry(s3_client, entry, document_ai_client, manifest_dao):
+    """Extracts one PDF and records the result in the manifest. Returns the page texts."""
+    try:
+        extracted_text_pages = extract_pdf_pages_with_document_ai(s3_client, entry.s3_key, document_ai_client)
+    except Exception:
+        if manifest_dao:
+            manifest_service.record_failure(manifest_dao, entry)
+        raise
+    if manifest_dao:
+        manifest_service.record_extraction(manifest_dao, entry, len(extracted_text_pages))
+    return extracted_text_pages
+
+
+def iter_project_pages(project_location, tracker=None):
+    """
+    Yields the text of every PDF page within a specified folder in the S3 bucket, one page at a time,
+    processing PDFs page by page with Document AI and using saved text if available.
+    The PDFs and their extraction status come from the project manifest, so a query makes no
+    S3 LIST calls and only reads saved text that exists.
+    Only one PDF's text is held at a time; closing the generator stops further downloads and extraction.
 
     Args:
         project_location (str): The folder path (prefix) in the S3 bucket to search within.
                                  If empty or None, it will search the entire bucket.
-    Returns:
-        str: Concatenated text content from all processed PDF files, separated by newlines.
+        tracker (ByteTracker): Optional; counts the text held while its pages are consumed.
+    Yields:
+        ContextChunk: One chunk per extracted page, in key order.
     """
+    tracker = tracker or ByteTracker()
     s3_client = get_s3_client()
-    pdf_texts = []
     try:
-         # Instantiates a client
-        if google_service_account_info: # Use service account credentials if available
+        entries, manifest_dao = plan_project_documents(s3_client, project_location)
+        if not entries:
+            print(f"No PDF files found in S3 bucket under location: {project_location} in bucket: {S3_BUCKET_NAME}")
+            return
+        document_ai_client = None
+        for entry in entries:
+            pdf_key = entry.s3_key
+            # Active projects are served from this worker's page cache, keyed by PDF version
+            cached = PAGE_TEXT_CACHE.get(pdf_key, entry.etag)
+            if cached is not None:
+                # Counted like saved or extracted text, so the peak does not depend on cache hits
+                cached_size = len(cached.buffer)
+                tracker.hold(cached_size)
+                for page_num, page_text in enumerate(cached.pages()):
+                    yield ContextChunk(page_text, pdf_key, page_num)
+                tracker.release(cached_size)
+                continue
+            # Entries without a status come from a listing: probe for saved text as before
+            saved_pages = None
+            if entry.status in (None, manifest_service.MANIFEST_EXTRACTED):
+                saved_pages = load_text_from_s3(s3_client, S3_BUCKET_NAME, pdf_key, entry.text_key)
+            if saved_pages:
+                print(f"Using saved text from S3 for: {pdf_key}")
+                saved_size = sum(len(page_text) for page_text in saved_pages)
+                tracker.hold(saved_size)
+                PAGE_TEXT_CACHE.put(pdf_key, entry.etag, saved_pages)
+                for page_num, page_text in enumerate(saved_pages):
+                    yield ContextChunk(page_text, pdf_key, page_num)
+                tracker.release(saved_size)
+                continue
             try:
-                document_ai_client = documentai.DocumentProcessorServiceClient.from_service_account_info(google_service_account_info)
+                document_ai_client = document_ai_client or get_documentai_client()
+                # Concurrent queries over the same project share one extraction per PDF version
+                flight_key = (S3_BUCKET_NAME, pdf_key, entry.etag)
+                extracted_text_pages = extraction_flight.do(flight_key, extract_manifest_entry,
+                                                            s3_client, entry, document_ai_client, manifest_dao)
             except Exception as e:
-                print(f"Error creating Document AI client with service account: {e}")
-                raise HTTPException(status_code=500, detail=f"Error creating Document AI client with service account: {e}")
-        else: # Fallback to default credentials (e.g., for local dev if ADC is configured)
-            print("Using default Google Cloud credentials for Document AI client.")
-            document_ai_client = documentai.DocumentProcessorServiceClient()
-        # List objects in S3 bucket with the given prefix (project_location)
-        response = s3_client.list_objects_v2(Bucket=S3_BUCKET_NAME, Prefix=project_location)
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                pdf_key = obj['Key']
-                if pdf_key.lower().endswith('.pdf'):                    
-                    saved_text = load_text_from_s3(s3_client, S3_BUCKET_NAME, pdf_key)
-                    if saved_text:
-                        print(f"Using saved text from S3 for: {pdf_key}")
-                        pdf_texts.append(saved_text)
-                    else:
-                        print(f"Extracting text from PDF page by page using Document AI: {pdf_key}", flush=True)
-                        try:
-                            pdf_file_bytes = s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=pdf_key)['Body'].read()
-
-                            pdf_reader = PdfReader(BytesIO(pdf_file_bytes))
-                            page_count = len(pdf_reader.pages)
-                            extracted_text_pages = []
-                            for page_num in range(page_count):
-                                page = pdf_reader.pages[page_num]
-                                print(f"Extracting from {page_num} of {page_count} pages")
-                                # Extract content of each page to bytes
-                                with BytesIO() as page_bytes_stream:
-                                    writer = PdfWriter()  # Create a NEW PdfWriter object here                                    
-                                    writer.add_page(page)
-                                    writer.write(page_bytes_stream)
-                                    page_content_bytes = page_bytes_stream.getvalue()
-
-                                page_text = process_pdf_with_document_ai(page_content_bytes, document_ai_client) # Process each page as PDF bytes
-                                extracted_text_pages.append(page_text)
-
-                            extracted_text = "\n".join(extracted_text_pages) # Join text from all pages
-                            pdf_texts.append(extracted_text)
-                            save_text_to_s3(s3_client, S3_BUCKET_NAME, pdf_key, extracted_text) # Save text to S3
-                        except Exception as e:
-                            print(f"Error processing {pdf_key} with Document AI page by page: {e}")
-                else:
-                    print(f"Skipping non-PDF file: {pdf_key}") # Added logging for non-PDF files
-        else:
-            print(f"No files found in S3 bucket under location: {project_location} in bucket: {S3_BUCKET_NAME}")
+                print(f"Error processing {pdf_key} with Document AI page by page: {e}")
+                continue
+            PAGE_TEXT_CACHE.put(pdf_key, entry.etag, extracted_text_pages)
+            extracted_size = sum(len(page_text) for page_text in extracted_text_pages)
+            tracker.hold(extracted_size)
+            for page_num, page_text in enumerate(extracted_text_pages):
+                yield ContextChunk(page_text, pdf_key, page_num)
+            tracker.release(extracted_size)
     except Exception as e:
         print(f"Error accessing S3 bucket: {e}")
-    return "\n".join(pdf_texts)
-
-def process_pdf_with_document_ai(file_content: bytes, document_ai_client) -> str:
-    """Processes a single PDF file content (or a page) using Google Document AI and returns extracted text."""
-   
-    # The full resource name of the processor, e.g.:
-    # projects/project-id/locations/location/processors/processor-id
-    name = document_ai_client.processor_path(
-        PROJECT_ID, PROCESSOR_LOCATION, PROCESSOR_ID
-    )
-    # Load binary document from file path
-    raw_document_object = documentai.RawDocument(content=file_content, mime_type="application/pdf") # Create RawDocument object
-    # Configure the process request
-    request = documentai.ProcessRequest(name=name, raw_document=raw_document_object) # Use raw_document parameter
-    try:
-        # Recognizes text in the PDF document
-        result = document_ai_client.process_document(request=request)
-        document_object = result.document
-        document_text = document_object.text
-        document_pages = document_object.pages
-        for page in document_pages:
-            if page.tables:
-                print(f"Page {page.page_number} has {len(page.tables)} tables.")
-        return document_text
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing PDF with Document AI: {e}")
 
 
-def call_gemini_api(query, context_text):
-    """Calls the Gemini API with the given query and context."""
+def fetch_pdf_text_from_s3_document_ai(project_location):
+    """
+    Fetches text content from all PDF files within a specified folder in the S3 bucket.
+    Holds the whole project in memory; the query path streams iter_project_pages instead.
+
+    Returns:
+        list[ContextChunk]: One chunk per extracted page, in bucket listing order.
+    """
+    return list(iter_project_pages(project_location))
+
+# Fixed prompt parts, built once at import (and shared by forked workers)
+PROMPT_CONTEXT_PART = {"text": "Context information from PDF documents:\n\n"}
+PROMPT_INSTRUCTIONS = "Answer the user query based on the provided context. If the context is not relevant, answer to the best of your ability."
+
+def call_gemini_api(query, context_text, history=None):
+    """Calls the Gemini API with the given query and context, and the (query, answer) turns of a chat before it."""
+    # Separate parts, so the (large) context is sent as is instead of copied into one prompt string
     prompt_parts = [
-        {"text": f"Context information from PDF documents:\n\n{context_text}\n\nUser Query: {query}\n\nAnswer the user query based on the provided context. If the context is not relevant, answer to the best of your ability."}
+        PROMPT_CONTEXT_PART,
+        {"text": context_text},
     ]
+    if history:
+        turns = "\n".join(f"User: {turn_query}\nAssistant: {turn_answer}" for turn_query, turn_answer in history)
+        prompt_parts.append({"text": f"\n\nConversation so far:\n{turns}"})
+    prompt_parts.append({"text": f"\n\nUser Query: {query}\n\n{PROMPT_INSTRUCTIONS}"})
     try:
-        response = model.generate_content(prompt_parts)
+        with timed("gemini_generate"):
+            response = get_governor("gemini").call(get_gemini_model().generate_content, prompt_parts)
         return response.text
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=f"Gemini API temporarily unavailable: {e}")
     except Exception as e:
-        return f"Error calling Gemini API: {e}"
+        raise HTTPException(status_code=502, detail=f"Error calling Gemini API: {e}")
+
+def answer_query(user_query, project_location, project_id=None, retrieval="full"):
+    """
+    Builds the context for a project and asks Gemini. Returns the answer and the context report.
+    With a project_id, "lexical" and "hybrid" retrieval send only the best matching pages;
+    projects without an index yet fall back to the full project text, which is streamed
+    into the context assembler page by page.
+    """
+    tracker = ByteTracker()
+    pdf_chunks = []
+    if project_id is not None and retrieval != "full":
+        pdf_chunks = retrieve(project_id, user_query, retrieval)
+    if not pdf_chunks:
+        pdf_chunks = iter_project_pages(project_location, tracker) # Pass project_location to the function
+    # Includes fetching and extraction, since pages are pulled through the assembler as it goes
+    with timed("context_assembly"):
+        pdf_context, context_report = assemble_context(user_query, pdf_chunks, tracker=tracker)
+    pdf_chunks = None
+    CHUNKS.inc(context_report.chunks_included, destination="context")
+    CONTEXT_PEAK_BYTES.observe(context_report.peak_bytes)
+    print(f"Context assembled: {context_report.as_dict()}", flush=True)
+    gemini_response = call_gemini_api(user_query, pdf_context)
+    return gemini_response, context_report.as_dict()
+
+def answer_query_profiled(user_query, project_location, project_id=None, retrieval="full"):
+    """Runs answer_query under a profiling session. Returns the answer, the context report and the profile id."""
+    with profile_request(f"query {project_location}") as session:
+        gemini_response, context_report = answer_query(user_query, project_location, project_id, retrieval)
+    return gemini_response, context_report, session.profile_id
+
+def project_id_from(data):
+    """The optional project_id of a request body: an int or null, anything else is a 400."""
+    project_id = data.get('project_id')
+    if project_id is not None and (not isinstance(project_id, int) or isinstance(project_id, bool)):
+        raise HTTPException(status_code=400, detail="project_id must be an integer")
+    return project_id
 
 @app.post("/query")
 async def ask_gemini_with_context(request: Request):
@@ -248,25 +319,414 @@ async def ask_gemini_with_context(request: Request):
         data = await request.json()
         user_query = data.get('query')
         project_location = data.get('location') # Expecting 'location' from the request body for project location
+        project_id = project_id_from(data) # Optional; enables lexical or hybrid retrieval from the project's indexes
+        retrieval = data.get('retrieval', 'full')
         print(f"Received user query: {user_query} about project {project_location}", flush=True)
 
         if not user_query:
             raise HTTPException(status_code=400, detail="No query provided")
+        if retrieval not in RETRIEVAL_MODES:
+            raise HTTPException(status_code=400, detail=f"retrieval must be one of {', '.join(RETRIEVAL_MODES)}")
+
+        if request.headers.get("X-Profile", "").lower() in ("1", "true", "yes"):
+            # Profiled requests run on their own so the profile reflects this request only
+            with timed("query"):
+                gemini_response, context_report, profile_id = await run_in_threadpool(
+                    answer_query_profiled, user_query, project_location, project_id, retrieval)
+            return JSONResponse({"response": gemini_response, "context": context_report, "profile_id": profile_id},
+                                headers={"X-Profile-Id": profile_id})
+
+        # Identical concurrent queries attach to the one already running; the blocking
+        # work runs in the threadpool so other requests keep being served meanwhile
+        with timed("query"):
+            gemini_response, context_report = await run_in_threadpool(
+                query_flight.do, (project_location, project_id, retrieval, user_query), answer_query,
+                user_query, project_location, project_id, retrieval)
+
+        return JSONResponse({"response": gemini_response, "context": context_report})
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error processing user query: {e}", flush=True)
+        raise HTTPException(status_code=500, detail=f"Internal Server Error: {e}")
 
-        pdf_context = fetch_pdf_text_from_s3_document_ai(project_location) # Pass project_location to the function
-        gemini_response = call_gemini_api(user_query, pdf_context)
 
-        return JSONResponse({"response": gemini_response})
+def prepare_batch_chunks(queries, project_location, project_id=None, retrieval="full"):
+    """
+    Retrieval for a batch of queries on one project, done once for the whole batch: the
+    vector searches of every query go out as one request, a project without an index is read
+    once, and the chunks are deduplicated across the batch so each distinct text is held once.
+    Returns (one list of ContextChunks per query, summary).
+    """
+    per_query = [[] for _ in queries]
+    if project_id is not None and retrieval != "full":
+        per_query = retrieve_batch(project_id, queries, retrieval)
+    deduplicator = ChunkDeduplicator(keep_chunks=True)
+    project_pages = None
+    duplicates = 0
+    chunk_lists = []
+    for chunks in per_query:
+        if not chunks:
+            if project_pages is None:
+                project_pages = []
+                for page in iter_project_pages(project_location):
+                    if deduplicator.duplicate_of(page) is None:
+                        project_pages.append(page)
+                    else:
+                        duplicates += 1
+            # Every query ranks the shared pages itself, so each gets unscored copies
+            chunk_lists.append([ContextChunk(page.text, page.source, page.page, page.chunk_no) for page in project_pages])
+            continue
+        selected = {}
+        for chunk in chunks:
+            canonical = deduplicator.duplicate_of(chunk) or chunk
+            if canonical is not chunk:
+                duplicates += 1
+            best = selected.get(id(canonical))
+            if best is None or chunk.score > best.score:
+                selected[id(canonical)] = ContextChunk(canonical.text, canonical.source, canonical.page,
+                                                       canonical.chunk_no, chunk.score)
+        chunk_lists.append(list(selected.values()))
+    summary = {"queries": len(queries), "shared_chunks": len(deduplicator.by_hash), "duplicates_dropped": duplicates}
+    print(f"Batch retrieval: {summary}", flush=True)
+    return chunk_lists, summary
+
+
+def answer_batch_item(user_query, chunks):
+    """Assembles one query's context from its (already deduplicated) batch chunks and asks Gemini."""
+    with timed("context_assembly"):
+        pdf_context, context_report = assemble_context(user_query, chunks, dedupe=False)
+    CHUNKS.inc(context_report.chunks_included, destination="context")
+    return call_gemini_api(user_query, pdf_context), context_report.as_dict()
+
+
+@app.post("/query/batch")
+async def ask_gemini_batch(request: Request):
+    """
+    Answers many queries about one project. Retrieval is shared across the batch and the
+    Gemini calls run concurrently (at most BATCH_QUERY_CONCURRENCY at a time). The response
+    is NDJSON: one line per query in the order they finish, then a summary line.
+    """
+    data = await request.json()
+    queries = data.get('queries')
+    project_location = data.get('location')
+    project_id = project_id_from(data)
+    retrieval = data.get('retrieval', 'full')
+    if not isinstance(queries, list) or not queries or not all(isinstance(query, str) and query for query in queries):
+        raise HTTPException(status_code=400, detail="queries must be a non-empty list of strings")
+    if len(queries) > BATCH_QUERY_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_QUERY_MAX_QUERIES} queries per batch")
+    if retrieval not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=400, detail=f"retrieval must be one of {', '.join(RETRIEVAL_MODES)}")
+    concurrency = data.get('concurrency') or BATCH_QUERY_CONCURRENCY
+    if not isinstance(concurrency, int) or isinstance(concurrency, bool):
+        raise HTTPException(status_code=400, detail="concurrency must be an integer")
+    concurrency = max(1, min(concurrency, BATCH_QUERY_CONCURRENCY))
+    print(f"Received batch of {len(queries)} queries about project {project_location}", flush=True)
 
-    except HTTPException as http_exc:
-        return http_exc
+    try:
+        with timed("batch_retrieval"):
+            chunk_lists, summary = await run_in_threadpool(prepare_batch_chunks, queries, project_location,
+                                                           project_id, retrieval)
     except Exception as e:
-        print(f"Error processing user query: {e}", flush=True)
+        print(f"Error preparing batch: {e}", flush=True)
+        raise HTTPException(status_code=500, detail=f"Internal Server Error: {e}")
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def answer(index):
+        async with semaphore:
+            result = {"index": index, "query": queries[index]}
+            try:
+                with timed("query"):
+                    result["response"], result["context"] = await run_in_threadpool(
+                        answer_batch_item, queries[index], chunk_lists[index])
+            except HTTPException as e:
+                result.update(error=e.detail, status=e.status_code)
+            except Exception as e:
+                print(f"Error answering batch query {index}: {e}", flush=True)
+                result.update(error=f"Internal Server Error: {e}", status=500)
+            chunk_lists[index] = None
+            return result
+
+    async def stream_results():
+        tasks = [asyncio.ensure_future(answer(index)) for index in range(len(queries))]
+        failed = 0
+        try:
+            for finished in asyncio.as_completed(tasks):
+                result = await finished
+                failed += "error" in result
+                yield json.dumps(result) + "\n"
+            yield json.dumps({"done": True, "failed": failed, **summary}) + "\n"
+        finally:
+            # A client that disconnects stops the Gemini calls that have not started
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+
+def _chain_chunks(first, then):
+    # A generator, so closing it also closes a page stream it was reading
+    yield from first
+    yield from then
+
+
+def answer_session_query(session, user_query):
+    """
+    Answers one turn of a chat session. A follow-up whose terms are mostly covered by the
+    chunks the session already holds is answered from those; otherwise the project is searched
+    again and what makes it into the prompt joins the session's chunks. Retrieval and ranking
+    use the follow-up together with the previous question, since follow-ups ("and for level 2?")
+    tend to leave out the subject. The conversation so far is sent along with the context.
+    """
+    with session.lock:
+        coverage = session.coverage(user_query)
+        reused = coverage >= SESSION_REUSE_MIN_COVERAGE
+        search_query = f"{session.turns[-1][0]} {user_query}" if session.turns else user_query
+        tracker = ByteTracker()
+        pdf_chunks = session.context_chunks()
+        if not reused:
+            new_chunks = []
+            if session.project_id is not None and session.retrieval != "full":
+                # Unscored, so they are ranked on the same scale as the session's chunks
+                new_chunks = [ContextChunk(chunk.text, chunk.source, chunk.page, chunk.chunk_no)
+                              for chunk in retrieve(session.project_id, search_query, session.retrieval)]
+            if not new_chunks:
+                new_chunks = iter_project_pages(session.project_location, tracker)
+            pdf_chunks = _chain_chunks(pdf_chunks, new_chunks)
+        with timed("context_assembly"):
+            pdf_context, context_report = assemble_context(search_query, pdf_chunks, tracker=tracker, keep_selected=True)
+        pdf_chunks = None
+        chunks_added = session.remember(context_report.selected)
+        context_report.selected = None
+        CHUNKS.inc(context_report.chunks_included, destination="context")
+        CONTEXT_PEAK_BYTES.observe(context_report.peak_bytes)
+        gemini_response = call_gemini_api(user_query, pdf_context, history=list(session.turns))
+        session.add_turn(user_query, gemini_response)
+        SESSION_STORE.save(session)
+        turn = session.turn_count
+    report = context_report.as_dict()
+    report.update(session_reused=reused, session_coverage=round(coverage, 3), session_chunks_added=chunks_added)
+    print(f"Session {session.session_id} turn {turn}: {report}", flush=True)
+    return gemini_response, report, turn
+
+
+def get_session_or_404(session_id):
+    session = SESSION_STORE.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    return session
+
+
+@app.post("/sessions")
+async def create_session(request: Request):
+    """Starts a chat session about a project (location, optional project_id and retrieval mode)."""
+    data = await request.json()
+    retrieval = data.get('retrieval', 'full')
+    if retrieval not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=400, detail=f"retrieval must be one of {', '.join(RETRIEVAL_MODES)}")
+    session = SESSION_STORE.create(data.get('location'), project_id_from(data), retrieval)
+    return JSONResponse({"session_id": session.session_id}, status_code=201)
+
+
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    return JSONResponse(get_session_or_404(session_id).as_dict())
+
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    if not SESSION_STORE.delete(session_id):
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    return Response(status_code=204)
+
+
+@app.post("/sessions/{session_id}/query")
+async def ask_gemini_in_session(session_id: str, request: Request):
+    """Asks a question in a chat session; follow-ups reuse the context retrieved for earlier turns."""
+    session = get_session_or_404(session_id)
+    data = await request.json()
+    user_query = data.get('query')
+    if not user_query:
+        raise HTTPException(status_code=400, detail="No query provided")
+    print(f"Received query in session {session_id}: {user_query}", flush=True)
+    try:
+        with timed("session_query"):
+            gemini_response, context_report, turn = await run_in_threadpool(answer_session_query, session, user_query)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error processing session query: {e}", flush=True)
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {e}")
+    return JSONResponse({"response": gemini_response, "context": context_report, "session_id": session_id, "turn": turn})
+
+
+def ingest_uploaded_document(project_id, file_name, s3_key, pdf_source, etag=None, size=None):
+    """
+    Creates the document record and runs ingestion on the uploaded (memory-mapped) PDF. Returns the document id.
+    The upload is recorded in the project manifest; re-uploading a file with the same ETag returns
+    the document it was already ingested as instead of ingesting it again.
+    """
+    # Ingestion pulls in Weaviate and the extraction pipeline, which /query does not need at startup
+    from database.dbutil import Database
+    from database.dao.ChunkDAO import ChunkDAO
+    from database.dao.DocumentDAO import DocumentDAO
+    from database.dao.DocumentRecord import DocumentRecord
+    from database.dao.PageFingerprintDAO import PageFingerprintDAO
+    from services import dedup_service
+    from services.client_provider import get_weaviate_client
+    from services.ingestion_service import IngestionService
+
+    # A new version of the PDF replaces whatever this worker has cached for the key
+    PAGE_TEXT_CACHE.invalidate(s3_key)
+    manifest_dao = None
+    if manifest_service.PROJECT_MANIFEST_ENABLED:
+        manifest_dao = manifest_service.get_manifest_dao()
+        existing = manifest_dao.get_entry(s3_key)
+        if existing and existing.document_id and etag and existing.etag == etag:
+            print(f"{s3_key} is unchanged since it was ingested as document {existing.document_id}")
+            return existing.document_id
+        manifest_dao.upsert_entries([ManifestRecord(s3_key, etag, size, status=manifest_service.MANIFEST_PENDING,
+                                                    project_id=project_id)])
+
+    # Pages of reissued sets reuse the extraction and vectors of the pages they duplicate
+    fingerprint_dao = PageFingerprintDAO(Database()) if dedup_service.PAGE_DEDUP_ENABLED else None
+    document_record = DocumentRecord(None, file_name, project_id, f"s3://{S3_BUCKET_NAME}/{s3_key}", 0)
+    with DocumentDAO(Database()) as document_dao, \
+         IngestionService(get_weaviate_client(), document_dao, manifest_dao=manifest_dao,
+                          fingerprint_dao=fingerprint_dao, chunk_dao=ChunkDAO(Database()),
+                          s3_client=get_s3_client()) as ingest:
+        return ingest.ingest_document(document_record, pdf_source)
+
+
+@app.put("/projects/{project_id}/documents/{file_name}")
+async def upload_document(project_id: int, file_name: str, request: Request):
+    """
+    Uploads a PDF sent as the raw request body and ingests it. The body is streamed to a
+    spooled temp file and to S3 (multipart) in one pass, then extracted from the memory-mapped
+    file, so memory use does not grow with the file size.
+    """
+    file_name = os.path.basename(file_name)
+    if not file_name.lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="Only PDF uploads are supported")
+    s3_key = f"{UPLOAD_PREFIX}{project_id}/{file_name}"
+    upload = StreamingUpload(get_s3_client(), S3_BUCKET_NAME, s3_key)
+    head = b""
+    try:
+        with timed("upload"):
+            await run_in_threadpool(upload.start)
+            async for data in request.stream():
+                if len(head) < 5:
+                    head += data[:5 - len(head)]
+                    if len(head) == 5 and head != b"%PDF-":
+                        raise HTTPException(status_code=400, detail="Body is not a PDF")
+                upload.write(data)
+                if upload.part_ready:
+                    await run_in_threadpool(upload.flush_parts)
+            if head != b"%PDF-":
+                raise HTTPException(status_code=400, detail="Body is not a PDF")
+            pdf_source = await run_in_threadpool(upload.complete)
+    except HTTPException:
+        await run_in_threadpool(upload.abort)
+        raise
+    except UploadTooLargeError as e:
+        await run_in_threadpool(upload.abort)
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        await run_in_threadpool(upload.abort)
+        print(f"Error uploading {s3_key}: {e}", flush=True)
+        raise HTTPException(status_code=500, detail=f"Upload failed: {e}")
+
+    try:
+        document_id = await run_in_threadpool(ingest_uploaded_document, project_id, file_name, s3_key, pdf_source,
+                                              upload.etag, upload.size)
+    finally:
+        pdf_source.close()
+        upload.close()
+    if document_id is None:
+        raise HTTPException(status_code=500, detail=f"Ingestion failed for {s3_key}")
+    return JSONResponse({"document_id": document_id, "s3_key": s3_key, "bytes": upload.size})
+
+
+def deletion_job_dao():
+    from database.dbutil import Database
+    from database.dao.DeletionJobDAO import DeletionJobDAO
+    return DeletionJobDAO(Database())
+
+
+def run_deletion(scope, target_id):
+    """Deletes (or resumes deleting) a project or an organization. Returns the finished job."""
+    from services import deletion_service
+    from services.client_provider import get_weaviate_client
+
+    with deletion_job_dao() as job_dao:
+        return deletion_service.delete(job_dao, get_weaviate_client(), scope, target_id)
+
+
+def load_deletion_job(job_id):
+    with deletion_job_dao() as job_dao:
+        return job_dao.get_job(job_id)
+
+
+async def delete_with_job(scope, target_id):
+    try:
+        with timed(f"delete_{scope}"):
+            job = await run_in_threadpool(run_deletion, scope, target_id)
+    except Exception as e:
+        print(f"Error deleting {scope} {target_id}: {e}", flush=True)
+        raise HTTPException(status_code=500, detail=f"Deletion of {scope} {target_id} failed and can be resumed: {e}")
+    return JSONResponse(job.as_dict())
+
+
+@app.delete("/projects/{project_id}")
+async def delete_project(project_id: int):
+    """Deletes a project's documents, chunks, vectors and indexes. Calling it again resumes a failed deletion."""
+    return await delete_with_job("project", project_id)
+
+
+@app.delete("/organizations/{organization_id}")
+async def delete_organization(organization_id: int):
+    """Deletes an organization, its users and all its projects."""
+    return await delete_with_job("organization", organization_id)
+
+
+@app.get("/deletion-jobs/{job_id}")
+async def get_deletion_job(job_id: int):
+    job = await run_in_threadpool(load_deletion_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Deletion job not found")
+    return JSONResponse(job.as_dict())
+
+
+@app.get("/governors")
+async def get_governor_state():
+    """Rate limiter, concurrency and circuit breaker state for outbound Google API calls."""
+    return JSONResponse(governor_snapshots())
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus scrape endpoint: per-stage latency histograms, counters and governor state."""
+    return PlainTextResponse(render_latest(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/profiles/{profile_id}/{kind}")
+async def get_profile(profile_id: str, kind: str):
+    """Downloads a stored profile: kind is 'speedscope' (sampled stacks) or 'spans' (stage timeline)."""
+    body = load_profile(profile_id, kind)
+    if body is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return Response(body, media_type="application/json",
+                    headers={"Content-Disposition": f'attachment; filename="{profile_id}.{kind}.json"'})
 
 
 if __name__ == "__main__":
     configure_logging()
+    # Weaviate and ingestion are only needed by this script, so the app does not pay for importing them
+    from services.weaviate_service import create_collections, get_weaviate_client, insert_document_chunks
+
     # Initialize Weaviate collections on first run
 
     client = get_weaviate_client()
@@ -277,7 +737,9 @@ if __name__ == "__main__":
     from database.dao.DocumentDAO import DocumentDAO
     from database.dao.UserDAO import UserDAO
     from database.dao.ProjectDAO import ProjectDAO
-    from services.weaviate_service import get_weaviate_client
+    from database.dao.DocumentRecord import DocumentRecord
+    from services.extraction_service import extract_and_chunk
+    from services.ingestion_service import IngestionService
     
     file_path = 'files/1-G0.5ArchSpecs.pdf'
     with open(file_path, 'rb') as file:
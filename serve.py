@@ -0,0 +1,51 @@
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+""" Production entry point: runs the app under gunicorn with several Uvicorn workers
+(see gunicorn.conf.py) and drains gracefully on SIGTERM.
+
+    python serve.py [extra gunicorn arguments]
+
+On SIGTERM (ECS stopping the task) the app first reports itself unhealthy on /healthz for
+DRAIN_SECONDS while still serving, so the load balancer stops routing new requests to it;
+then gunicorn stops accepting connections and gives in-flight requests GRACEFUL_TIMEOUT
+seconds to finish. Keep DRAIN_SECONDS + GRACEFUL_TIMEOUT below the container stopTimeout.
+
+Useful settings: WEB_CONCURRENCY (workers, default one per CPU), MAX_REQUESTS and
+WORKER_MAX_RSS_MB (worker recycling), PRELOAD_MODULES, BIND. For development keep using
+`uvicorn main:app --reload`. """
+
+DRAIN_SECONDS = float(os.getenv("DRAIN_SECONDS", "10"))
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gunicorn.conf.py")
+
+
+def main():
+    drain_file = os.path.join(tempfile.gettempdir(), f"gemini-poc-draining-{os.getpid()}")
+    env = dict(os.environ, DRAIN_FILE=drain_file)
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", CONFIG_PATH, *sys.argv[1:], "main:app"], env=env)
+    stop_requested = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_requested.append(signum))
+
+    try:
+        while server.poll() is None and not stop_requested:
+            time.sleep(0.2)
+        if server.poll() is None:
+            print(f"SIGTERM received: failing health checks for {DRAIN_SECONDS:.0f}s before shutting down", flush=True)
+            open(drain_file, "w").close()
+            time.sleep(DRAIN_SECONDS)
+            server.send_signal(signal.SIGTERM)
+        return server.wait()
+    except KeyboardInterrupt:
+        # The terminal's Ctrl-C also reached gunicorn, which shuts down on its own
+        return server.wait()
+    finally:
+        if os.path.exists(drain_file):
+            os.remove(drain_file)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
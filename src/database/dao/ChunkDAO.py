@@ -0,0 +1,107 @@
+import io
+from database.dbutil import Database
+from database.dao.ChunkRecord import ChunkRecord
+
+_COPY_COLUMNS = "document_id, project_id, page_number, chunk_no, text, content_hash, extractor_version"
+
+# COPY text format: backslash, tab, newline and carriage return must be escaped
+_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def _copy_value(value):
+    if value is None:
+        return "\\N"
+    # Postgres text cannot hold NUL, which some PDF text layers contain
+    return str(value).replace("\x00", "").translate(_COPY_ESCAPES)
+
+
+class ChunkDAO:
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        if self.db:
+            self.db.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.db: self.db.close()
+
+    def copy_chunks(self, records):
+        """Bulk-loads chunks with COPY in one round trip. Returns the number of rows loaded."""
+        if not records:
+            return 0
+        buffer = io.StringIO()
+        for record in records:
+            row = (record.document_id, record.project_id, record.page_number, record.chunk_no, record.text,
+                   record.content_hash, record.extractor_version)
+            buffer.write("\t".join(_copy_value(value) for value in row))
+            buffer.write("\n")
+        buffer.seek(0)
+        return self.db.copy_from(f"COPY chunks ({_COPY_COLUMNS}) FROM STDIN", buffer)
+
+    def delete_by_document(self, document_id):
+        """Removes a document's chunks (before re-ingesting it)"""
+        query = """
+            DELETE FROM chunks
+            WHERE document_id = %s
+        """
+        self.db.execute_query(query, (document_id,))
+
+    def count_chunks(self, project_id=None):
+        """Number of stored chunks, in one project or overall"""
+        query = """
+            SELECT COUNT(*) FROM chunks
+            WHERE %s IS NULL OR project_id = %s
+        """
+        return self.db.execute_query(query, (project_id, project_id), fetch=True)[0][0]
+
+    def project_watermark(self, project_id):
+        """[largest chunk id, number of chunks] of a project; any load or delete changes it"""
+        query = """
+            SELECT COALESCE(MAX(id), 0), COUNT(*) FROM chunks
+            WHERE project_id = %s
+        """
+        row = self.db.execute_query(query, (project_id,), fetch=True)[0]
+        return [row[0], row[1]]
+
+    def project_document_ids_after(self, project_id, chunk_id):
+        """Ids of a project's documents with chunks loaded after chunk_id (new or re-ingested documents)"""
+        query = """
+            SELECT DISTINCT document_id FROM chunks
+            WHERE project_id = %s AND id > %s
+            ORDER BY document_id
+        """
+        return [row[0] for row in self.db.execute_query(query, (project_id, chunk_id), fetch=True)]
+
+    def clock(self):
+        """The database's current time, comparable with the chunks' created_at"""
+        return self.db.execute_query("SELECT LOCALTIMESTAMP", fetch=True)[0][0]
+
+    def document_ids_written_since(self, since):
+        """Ids of documents with chunks loaded at or after since (new or re-ingested documents)"""
+        query = """
+            SELECT DISTINCT document_id FROM chunks
+            WHERE created_at >= %s
+            ORDER BY document_id
+        """
+        return [row[0] for row in self.db.execute_query(query, (since,), fetch=True)]
+
+    def iter_chunks(self, project_id=None, document_id=None, min_document_id=None, itersize=2000):
+        """
+        Streams chunks ordered by document and chunk number from a server-side cursor, so a
+        whole project (or the whole table) can be read without holding it in memory.
+        min_document_id limits the scan to documents with a larger id (created later).
+        """
+        query = """
+            SELECT c.id, c.document_id, c.project_id, c.page_number, c.chunk_no, c.text, c.content_hash,
+                   c.extractor_version, d.file_name, d.source_url, d.source_page
+            FROM chunks c JOIN documents d ON d.id = c.document_id
+            WHERE (%s IS NULL OR c.project_id = %s) AND (%s IS NULL OR c.document_id = %s)
+              AND (%s IS NULL OR c.document_id > %s)
+            ORDER BY c.document_id, c.chunk_no
+        """
+        params = (project_id, project_id, document_id, document_id, min_document_id, min_document_id)
+        for row in self.db.stream_query(query, params, itersize=itersize):
+            yield ChunkRecord(row[1], row[2], row[3], row[4], row[5], row[6], row[7], chunk_id=row[0],
+                              file_name=row[8], source_url=row[9], source_page=row[10])
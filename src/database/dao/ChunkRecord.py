@@ -0,0 +1,20 @@
+class ChunkRecord:
+    """One extracted chunk of a document, as stored in the chunks table."""
+
+    def __init__(self, document_id, project_id, page_number, chunk_no, text, content_hash, extractor_version,
+                 chunk_id=None, file_name=None, source_url=None, source_page=None):
+        self.chunk_id = chunk_id
+        self.document_id = document_id
+        self.project_id = project_id
+        self.page_number = page_number
+        self.chunk_no = chunk_no
+        self.text = text
+        self.content_hash = content_hash
+        self.extractor_version = extractor_version
+        # Joined from documents when chunks are streamed back
+        self.file_name = file_name
+        self.source_url = source_url
+        self.source_page = source_page
+
+    def __repr__(self):
+        return f"ChunkRecord(document_id={self.document_id}, chunk_no={self.chunk_no}, extractor_version={self.extractor_version!r})"
@@ -0,0 +1,150 @@
+import json
+from database.dao.DeletionJobRecord import DeletionJobRecord
+
+_COLUMNS = "id, scope, target_id, project_ids, vectors_deleted, status, rows_deleted, error"
+
+_PROJECT_DOCUMENTS = "SELECT id FROM documents WHERE project_id = ANY(%(project_ids)s)"
+
+# Children before parents; each statement removes the rows of every project of the job at once
+_PURGE_PROJECTS = (
+    ("page_fingerprints", f"""
+        DELETE FROM page_fingerprints
+        WHERE project_id = ANY(%(project_ids)s) OR document_id IN ({_PROJECT_DOCUMENTS})
+    """),
+    ("chunks", f"""
+        DELETE FROM chunks
+        WHERE project_id = ANY(%(project_ids)s) OR document_id IN ({_PROJECT_DOCUMENTS})
+    """),
+    ("project_manifest", f"""
+        DELETE FROM project_manifest
+        WHERE project_id = ANY(%(project_ids)s) OR document_id IN ({_PROJECT_DOCUMENTS})
+    """),
+    ("documents", """
+        DELETE FROM documents
+        WHERE project_id = ANY(%(project_ids)s)
+    """),
+    ("projects", """
+        DELETE FROM projects
+        WHERE id = ANY(%(project_ids)s)
+    """),
+)
+
+_PURGE_ORGANIZATION = (
+    # Projects of other organizations that one of its users created outlive the user
+    (None, """
+        UPDATE projects SET created_by_user = NULL
+        WHERE created_by_user IN (SELECT id FROM users WHERE organization_id = %(organization_id)s)
+    """),
+    ("users", """
+        DELETE FROM users
+        WHERE organization_id = %(organization_id)s
+    """),
+    ("organizations", """
+        DELETE FROM organizations
+        WHERE id = %(organization_id)s
+    """),
+)
+
+
+def _record(row):
+    return DeletionJobRecord(row[0], row[1], row[2], row[3], row[4], row[5], row[6], row[7])
+
+
+class DeletionJobDAO:
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        if self.db:
+            self.db.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.db: self.db.close()
+
+    def get_job(self, job_id):
+        """Get a deletion job by its ID"""
+        query = f"""
+            SELECT {_COLUMNS} FROM deletion_jobs
+            WHERE id = %s
+        """
+        rows = self.db.execute_query(query, (job_id,), fetch=True, close_after=False)
+        return _record(rows[0]) if rows else None
+
+    def find_unfinished_job(self, scope, target_id):
+        """The latest job for a project or organization that has not finished, to resume it"""
+        query = f"""
+            SELECT {_COLUMNS} FROM deletion_jobs
+            WHERE scope = %s AND target_id = %s AND status <> 'done'
+            ORDER BY id DESC
+            LIMIT 1
+        """
+        rows = self.db.execute_query(query, (scope, target_id), fetch=True, close_after=False)
+        return _record(rows[0]) if rows else None
+
+    def get_organization_project_ids(self, organization_id):
+        """The projects of an organization"""
+        query = """
+            SELECT id FROM projects
+            WHERE organization_id = %s
+            ORDER BY id
+        """
+        return [row[0] for row in self.db.execute_query(query, (organization_id,), fetch=True, close_after=False)]
+
+    def create_job(self, scope, target_id, project_ids):
+        """Create a deletion job for the given projects"""
+        query = f"""
+            INSERT INTO deletion_jobs (scope, target_id, project_ids)
+            VALUES (%s, %s, %s)
+            RETURNING {_COLUMNS}
+        """
+        return _record(self.db.execute_query(query, (scope, target_id, list(project_ids)), fetch=True,
+                                             close_after=False)[0])
+
+    def add_projects(self, job_id, project_ids):
+        """Add projects to a job (those already in it are skipped)"""
+        query = """
+            UPDATE deletion_jobs
+            SET project_ids = project_ids || ARRAY(SELECT unnest(%s::INTEGER[]) EXCEPT SELECT unnest(project_ids)),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+        """
+        self.db.execute_query(query, (list(project_ids), job_id), close_after=False)
+
+    def mark_vectors_deleted(self, job_id, project_id):
+        """Record that a project's Weaviate chunks are gone"""
+        query = """
+            UPDATE deletion_jobs
+            SET vectors_deleted = array_append(vectors_deleted, %s), status = 'running', updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND NOT (%s = ANY(vectors_deleted))
+        """
+        self.db.execute_query(query, (project_id, job_id, project_id), close_after=False)
+
+    def mark_failed(self, job_id, error):
+        query = """
+            UPDATE deletion_jobs
+            SET status = 'failed', error = %s, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+        """
+        self.db.execute_query(query, (str(error), job_id), close_after=False)
+
+    def purge(self, job: DeletionJobRecord):
+        """
+        Deletes the rows of the job's projects (and of its organization) in one transaction,
+        marking the job done in the same transaction, so a failure leaves every row in place
+        and the job resumable. Returns {table: rows deleted}.
+        """
+        params = {"project_ids": job.project_ids, "organization_id": job.target_id}
+        statements = _PURGE_PROJECTS + (_PURGE_ORGANIZATION if job.scope == "organization" else ())
+        rows_deleted = {}
+        with self.db.transaction(close_after=False) as cursor:
+            for table, statement in statements:
+                cursor.execute(statement, params)
+                if table:
+                    rows_deleted[table] = cursor.rowcount
+            cursor.execute("""
+                UPDATE deletion_jobs
+                SET status = 'done', rows_deleted = %s, error = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            """, (json.dumps(rows_deleted), job.job_id))
+        return rows_deleted
@@ -0,0 +1,31 @@
+class DeletionJobRecord:
+    """A bulk deletion of a project or an organization, with how far it has got."""
+
+    def __init__(self, job_id, scope, target_id, project_ids, vectors_deleted=None, status="pending",
+                 rows_deleted=None, error=None):
+        self.job_id = job_id
+        # "project" or "organization"
+        self.scope = scope
+        self.target_id = target_id
+        # Resolved when the job is created, so a resumed job deletes the same projects (plus, for an
+        # organization, any project created since)
+        self.project_ids = list(project_ids)
+        self.vectors_deleted = list(vectors_deleted or ())
+        self.status = status
+        self.rows_deleted = rows_deleted
+        self.error = error
+
+    def as_dict(self):
+        return {
+            "job_id": self.job_id,
+            "scope": self.scope,
+            "target_id": self.target_id,
+            "project_ids": self.project_ids,
+            "vectors_deleted": self.vectors_deleted,
+            "status": self.status,
+            "rows_deleted": self.rows_deleted,
+            "error": self.error,
+        }
+
+    def __repr__(self):
+        return f"DeletionJobRecord(job_id={self.job_id}, scope={self.scope!r}, target_id={self.target_id}, status={self.status!r})"
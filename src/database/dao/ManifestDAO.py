@@ -0,0 +1,137 @@
+from database.dbutil import Database
+from database.dao.ManifestRecord import ManifestRecord
+
+_COLUMNS = "s3_key, etag, size, page_count, status, text_key, project_id, document_id"
+
+# Rows per INSERT statement when syncing large prefixes
+UPSERT_BATCH_SIZE = 1000
+
+
+def _record(row):
+    return ManifestRecord(row[0], row[1], row[2], row[3], row[4], row[5], row[6], row[7])
+
+
+def _prefix_pattern(prefix):
+    escaped = (prefix or "").replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped + "%"
+
+
+class ManifestDAO:
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        if self.db:
+            self.db.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.db: self.db.close()
+
+    def get_entries(self, prefix):
+        """Get the manifest entries under an S3 prefix, in key order"""
+        query = f"""
+            SELECT {_COLUMNS} FROM project_manifest
+            WHERE s3_key LIKE %s ESCAPE '\\'
+            ORDER BY s3_key
+        """
+        return [_record(row) for row in self.db.execute_query(query, (_prefix_pattern(prefix),), fetch=True)]
+
+    def get_entry(self, s3_key):
+        """Get the manifest entry of one object"""
+        query = f"""
+            SELECT {_COLUMNS} FROM project_manifest
+            WHERE s3_key = %s
+        """
+        rows = self.db.execute_query(query, (s3_key,), fetch=True)
+        return _record(rows[0]) if rows else None
+
+    def upsert_entries(self, records):
+        """
+        Inserts or refreshes entries from a listing. The page count survives when the ETag is
+        unchanged; project and document links survive unless the new entry sets them.
+        """
+        for start in range(0, len(records), UPSERT_BATCH_SIZE):
+            batch = records[start:start + UPSERT_BATCH_SIZE]
+            values = []
+            params = []
+            for record in batch:
+                values.append("(%s, %s, %s, %s, %s, %s, %s, %s)")
+                params.extend((record.s3_key, record.etag, record.size, record.page_count, record.status,
+                               record.text_key, record.project_id, record.document_id))
+            query = f"""
+                INSERT INTO project_manifest ({_COLUMNS})
+                VALUES {", ".join(values)}
+                ON CONFLICT (s3_key) DO UPDATE SET
+                    page_count = CASE WHEN project_manifest.etag IS NOT DISTINCT FROM EXCLUDED.etag
+                                      THEN COALESCE(EXCLUDED.page_count, project_manifest.page_count)
+                                      ELSE EXCLUDED.page_count END,
+                    etag = EXCLUDED.etag,
+                    size = EXCLUDED.size,
+                    status = EXCLUDED.status,
+                    text_key = EXCLUDED.text_key,
+                    project_id = COALESCE(EXCLUDED.project_id, project_manifest.project_id),
+                    document_id = COALESCE(EXCLUDED.document_id, project_manifest.document_id),
+                    updated_at = CURRENT_TIMESTAMP
+            """
+            self.db.execute_query(query, params)
+        return records
+
+    def delete_missing(self, prefix, s3_keys):
+        """Removes the entries under a prefix whose objects are no longer listed"""
+        query = """
+            DELETE FROM project_manifest
+            WHERE s3_key LIKE %s ESCAPE '\\' AND NOT (s3_key = ANY(%s))
+            RETURNING s3_key
+        """
+        return [row[0] for row in self.db.execute_query(query, (_prefix_pattern(prefix), list(s3_keys)), fetch=True)]
+
+    def mark_extracted(self, s3_key, etag, page_count, text_key):
+        """Records that an object's text was extracted and saved to text_key"""
+        query = """
+            UPDATE project_manifest
+            SET status = 'extracted', etag = COALESCE(%s, etag), page_count = %s, text_key = %s,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE s3_key = %s
+        """
+        self.db.execute_query(query, (etag, page_count, text_key, s3_key))
+
+    def mark_failed(self, s3_key):
+        """Records that extracting an object failed; it is retried by the next query or sync"""
+        query = """
+            UPDATE project_manifest
+            SET status = 'failed', updated_at = CURRENT_TIMESTAMP
+            WHERE s3_key = %s
+        """
+        self.db.execute_query(query, (s3_key,))
+
+    def record_ingestion(self, s3_key, project_id, document_id, page_count, text_key=None):
+        """
+        Links an object to the document it was ingested as; with the key of the page text saved
+        during ingestion, also marks it extracted so queries read that text instead of extracting again
+        """
+        query = """
+            UPDATE project_manifest
+            SET project_id = %s, document_id = %s, page_count = %s,
+                status = CASE WHEN %s IS NULL THEN status ELSE 'extracted' END,
+                text_key = COALESCE(%s, text_key), updated_at = CURRENT_TIMESTAMP
+            WHERE s3_key = %s
+        """
+        self.db.execute_query(query, (project_id, document_id, page_count, text_key, text_key, s3_key))
+
+    def record_listing(self, prefix):
+        """Records that a prefix was listed, so a prefix without PDFs is not listed again"""
+        query = """
+            INSERT INTO manifest_listings (prefix)
+            VALUES (%s)
+            ON CONFLICT (prefix) DO UPDATE SET listed_at = CURRENT_TIMESTAMP
+        """
+        self.db.execute_query(query, (prefix or "",))
+
+    def is_listed(self, prefix, max_age_seconds=0):
+        """Whether a prefix has been listed into the manifest, within the last max_age_seconds (0 for ever)"""
+        query = """
+            SELECT 1 FROM manifest_listings
+            WHERE prefix = %s AND (%s = 0 OR listed_at > LOCALTIMESTAMP - %s * INTERVAL '1 second')
+        """
+        return bool(self.db.execute_query(query, (prefix or "", max_age_seconds, max_age_seconds), fetch=True))
@@ -0,0 +1,17 @@
+class ManifestRecord:
+    """One PDF of a project's S3 prefix, with what is known about its extraction."""
+
+    def __init__(self, s3_key, etag=None, size=None, page_count=None, status=None, text_key=None,
+                 project_id=None, document_id=None):
+        self.s3_key = s3_key
+        self.etag = etag
+        self.size = size
+        self.page_count = page_count
+        # None for entries that come straight from an S3 listing rather than the manifest table
+        self.status = status
+        self.text_key = text_key
+        self.project_id = project_id
+        self.document_id = document_id
+
+    def __repr__(self):
+        return f"ManifestRecord(s3_key={self.s3_key!r}, status={self.status!r}, page_count={self.page_count})"
@@ -57,7 +57,7 @@ class OrganizationDAO:
         return self.db.execute_query(query, params, fetch=True)
     
     def delete_organization(self, organization_id):
-        """Delete a organization"""
+        """Delete the organization row only; services.deletion_service deletes it with its users and projects"""
         query = """
             DELETE FROM organizations
             WHERE id = %s
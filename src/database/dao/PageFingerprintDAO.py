@@ -0,0 +1,82 @@
+from database.dbutil import Database
+from database.dao.PageFingerprintRecord import PageFingerprintRecord
+from services.fingerprint import SIMHASH_BANDS, simhash_bands
+
+_COLUMNS = "id, project_id, document_id, page_number, content_hash, simhash, extracted_text, chunk_uuid, duplicate_of"
+
+
+def _to_signed(value):
+    # Postgres BIGINT is signed; SimHash values use all 64 bits
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def _record(row):
+    return PageFingerprintRecord(row[0], row[1], row[2], row[3], row[4], _to_unsigned(row[5]), row[6], row[7], row[8])
+
+
+class PageFingerprintDAO:
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        if self.db:
+            self.db.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.db: self.db.close()
+
+    def find_candidates(self, project_id, content_hashes, simhashes):
+        """
+        Returns the project's fingerprints that share a content hash or at least one SimHash
+        band with any of the given pages, in one query.
+        """
+        if not content_hashes and not simhashes:
+            return []
+        band_values = [[] for _ in range(SIMHASH_BANDS)]
+        for value in simhashes:
+            for band, bits in simhash_bands(value, SIMHASH_BANDS):
+                band_values[band].append(bits)
+        query = f"""
+            SELECT {_COLUMNS} FROM page_fingerprints
+            WHERE project_id = %s
+              AND (content_hash = ANY(%s) OR band0 = ANY(%s) OR band1 = ANY(%s) OR band2 = ANY(%s) OR band3 = ANY(%s))
+            ORDER BY id DESC
+        """
+        params = (project_id, list(content_hashes), *band_values)
+        return [_record(row) for row in self.db.execute_query(query, params, fetch=True)]
+
+    def create_fingerprints(self, records):
+        """Inserts one document's fingerprints in one statement and sets their fingerprint_id."""
+        if not records:
+            return records
+        values = []
+        params = []
+        for record in records:
+            values.append("(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)")
+            bands = [bits for _, bits in simhash_bands(record.simhash, SIMHASH_BANDS)]
+            params.extend((record.project_id, record.document_id, record.page_number, record.content_hash,
+                           _to_signed(record.simhash), *bands, record.extracted_text, record.chunk_uuid,
+                           record.duplicate_of))
+        query = f"""
+            INSERT INTO page_fingerprints (project_id, document_id, page_number, content_hash, simhash,
+                                           band0, band1, band2, band3, extracted_text, chunk_uuid, duplicate_of)
+            VALUES {", ".join(values)}
+            RETURNING id, page_number
+        """
+        ids = {row[1]: row[0] for row in self.db.execute_query(query, params, fetch=True)}
+        for record in records:
+            record.fingerprint_id = ids[record.page_number]
+        return records
+
+    def delete_by_document(self, document_id):
+        """Removes a document's fingerprints (before re-ingesting it)."""
+        query = """
+            DELETE FROM page_fingerprints
+            WHERE document_id = %s
+        """
+        self.db.execute_query(query, (document_id,))
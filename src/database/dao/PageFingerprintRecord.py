@@ -0,0 +1,18 @@
+class PageFingerprintRecord:
+    """Fingerprint of one ingested page, with the extraction and Weaviate object it produced."""
+
+    def __init__(self, fingerprint_id, project_id, document_id, page_number, content_hash, simhash,
+                 extracted_text=None, chunk_uuid=None, duplicate_of=None):
+        self.fingerprint_id = fingerprint_id
+        self.project_id = project_id
+        self.document_id = document_id
+        self.page_number = page_number
+        self.content_hash = content_hash
+        self.simhash = simhash
+        self.extracted_text = extracted_text
+        self.chunk_uuid = chunk_uuid
+        self.duplicate_of = duplicate_of
+
+    def __repr__(self):
+        return (f"PageFingerprintRecord(document_id={self.document_id}, page_number={self.page_number}, "
+                f"duplicate_of={self.duplicate_of})")
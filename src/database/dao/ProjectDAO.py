@@ -61,7 +61,7 @@ class ProjectDAO:
         return self.db.execute_query(query, params, fetch=True)
     
     def delete_project(self, project_id):
-        """Delete a project"""
+        """Delete the project row only; services.deletion_service deletes a project with its documents and vectors"""
         query = """
             DELETE FROM projects
             WHERE id = %s
@@ -1,4 +1,5 @@
 import os
+from contextlib import contextmanager
 import psycopg2
 from psycopg2.extras import DictCursor
 from dotenv import load_dotenv
@@ -14,6 +15,23 @@ DB_CONFIG = {
     "port": os.getenv("DB_PORT", 5432),
 }
 
+@contextmanager
+def _untimed(stage):
+    yield
+
+
+# Context manager factory wrapped around each statement, called with a stage name ("db_query",
+# "db_copy", "db_stream"). The app installs services.metrics.timed; the database layer does
+# not depend on services.
+_query_timer = _untimed
+
+
+def set_query_timer(timer):
+    """Times every statement with timer(stage), e.g. services.metrics.timed."""
+    global _query_timer
+    _query_timer = timer or _untimed
+
+
 class Database:
     def __init__(self):
         self.conn = None
@@ -37,7 +55,8 @@ class Database:
     def execute_query(self, query, params=None, fetch=False, close_after=True):
         self.connect()
         with self.conn.cursor(cursor_factory=DictCursor) as cursor:
-            cursor.execute(query, params or ())
+            with _query_timer("db_query"):
+                cursor.execute(query, params or ())
             if fetch:
                 result = cursor.fetchall()
                 self.conn.commit()
@@ -48,6 +67,50 @@ class Database:
             if close_after:
                 self.close()
 
+    def copy_from(self, copy_sql, file, close_after=True):
+        """Runs a COPY ... FROM STDIN statement reading rows from a file-like object."""
+        self.connect()
+        with self.conn.cursor() as cursor:
+            with _query_timer("db_copy"):
+                cursor.copy_expert(copy_sql, file)
+            self.conn.commit()
+            rowcount = cursor.rowcount
+        if close_after:
+            self.close()
+        return rowcount
+
+    def stream_query(self, query, params=None, itersize=2000, close_after=True):
+        """
+        Yields the rows of a query from a server-side (named) cursor, fetching itersize rows
+        per round trip, so result sets larger than memory can be scanned.
+        """
+        self.connect()
+        try:
+            with self.conn.cursor(name=f"stream_{id(self)}", cursor_factory=DictCursor) as cursor:
+                cursor.itersize = itersize
+                with _query_timer("db_stream"):
+                    cursor.execute(query, params or ())
+                yield from cursor
+            self.conn.commit()
+        finally:
+            if close_after:
+                self.close()
+
+    @contextmanager
+    def transaction(self, close_after=True):
+        """Yields a cursor whose statements are committed together, or rolled back together on an error."""
+        self.connect()
+        try:
+            with self.conn.cursor(cursor_factory=DictCursor) as cursor:
+                yield cursor
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            if close_after:
+                self.close()
+
     def initialize_db(self):
         create_tables_query = """
         CREATE TABLE IF NOT EXISTS organizations (
@@ -79,6 +142,77 @@ class Database:
             source_page INTEGER,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
+
+        CREATE TABLE IF NOT EXISTS page_fingerprints (
+            id SERIAL PRIMARY KEY,
+            project_id INTEGER REFERENCES projects(id),
+            document_id INTEGER REFERENCES documents(id) ON DELETE CASCADE,
+            page_number INTEGER NOT NULL,
+            content_hash CHAR(64) NOT NULL,
+            simhash BIGINT NOT NULL,
+            band0 INTEGER NOT NULL,
+            band1 INTEGER NOT NULL,
+            band2 INTEGER NOT NULL,
+            band3 INTEGER NOT NULL,
+            extracted_text TEXT,
+            chunk_uuid UUID,
+            duplicate_of INTEGER REFERENCES page_fingerprints(id) ON DELETE SET NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS page_fingerprints_hash_idx ON page_fingerprints (project_id, content_hash);
+        CREATE INDEX IF NOT EXISTS page_fingerprints_band0_idx ON page_fingerprints (project_id, band0);
+        CREATE INDEX IF NOT EXISTS page_fingerprints_band1_idx ON page_fingerprints (project_id, band1);
+        CREATE INDEX IF NOT EXISTS page_fingerprints_band2_idx ON page_fingerprints (project_id, band2);
+        CREATE INDEX IF NOT EXISTS page_fingerprints_band3_idx ON page_fingerprints (project_id, band3);
+        CREATE INDEX IF NOT EXISTS page_fingerprints_document_idx ON page_fingerprints (document_id);
+
+        CREATE TABLE IF NOT EXISTS project_manifest (
+            s3_key VARCHAR(1024) PRIMARY KEY,
+            etag VARCHAR(255),
+            size BIGINT,
+            page_count INTEGER,
+            status VARCHAR(16) NOT NULL DEFAULT 'pending',
+            text_key VARCHAR(1024),
+            project_id INTEGER REFERENCES projects(id) ON DELETE SET NULL,
+            document_id INTEGER REFERENCES documents(id) ON DELETE SET NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS project_manifest_prefix_idx ON project_manifest (s3_key text_pattern_ops);
+
+        CREATE TABLE IF NOT EXISTS manifest_listings (
+            prefix VARCHAR(1024) PRIMARY KEY,
+            listed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS chunks (
+            id BIGSERIAL PRIMARY KEY,
+            document_id INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+            project_id INTEGER REFERENCES projects(id),
+            page_number INTEGER NOT NULL,
+            chunk_no INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            content_hash CHAR(64) NOT NULL,
+            extractor_version VARCHAR(64) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (document_id, chunk_no)
+        );
+        CREATE INDEX IF NOT EXISTS chunks_project_idx ON chunks (project_id, document_id, chunk_no);
+
+        CREATE TABLE IF NOT EXISTS deletion_jobs (
+            id SERIAL PRIMARY KEY,
+            scope VARCHAR(16) NOT NULL,
+            target_id INTEGER NOT NULL,
+            project_ids INTEGER[] NOT NULL,
+            vectors_deleted INTEGER[] NOT NULL DEFAULT '{}',
+            status VARCHAR(16) NOT NULL DEFAULT 'pending',
+            rows_deleted JSONB,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS deletion_jobs_target_idx ON deletion_jobs (scope, target_id, status);
+        CREATE INDEX IF NOT EXISTS documents_project_idx ON documents (project_id);
+        CREATE INDEX IF NOT EXISTS project_manifest_project_idx ON project_manifest (project_id);
         """
         self.execute_query(create_tables_query)
 
@@ -0,0 +1,101 @@
+import sys
+from itertools import groupby
+from database.dao.ChunkRecord import ChunkRecord
+from services import lexical_index
+from services.fingerprint import content_hash
+from services.metrics import CHUNKS, timed
+
+""" This service is responsible for the chunk store: the Postgres chunks table that holds every
+extracted chunk with its page, content hash and extractor version. It is the source of truth
+for indexing; Weaviate and the lexical index are derived from it and can be rebuilt by
+scanning the table instead of downloading and extracting every PDF again.
+
+Rebuild a project's lexical index from the store:
+
+    PYTHONPATH=src python -m services.chunk_store rebuild-lexical <project_id> """
+
+
+def chunk_records(document_record, chunks, extractor_version):
+    """
+    ChunkRecords for a document's chunks (one chunk per page). extractor_version is one
+    version for every chunk, or a list with the version of each chunk.
+    """
+    versions = extractor_version if isinstance(extractor_version, list) else [extractor_version] * len(chunks)
+    return [ChunkRecord(document_record.document_id, document_record.project_id, chunk_no, chunk_no, text,
+                        content_hash(text), version)
+            for chunk_no, (text, version) in enumerate(zip(chunks, versions))]
+
+
+def store_chunks(chunk_dao, document_record, chunks, extractor_version):
+    """Bulk-loads a document's chunks into the store with COPY. Returns the number of rows."""
+    with timed("chunk_store_load"):
+        loaded = chunk_dao.copy_chunks(chunk_records(document_record, chunks, extractor_version))
+    CHUNKS.inc(len(chunks), destination="chunk_store")
+    return loaded
+
+
+def iter_documents(chunk_dao, project_id=None, document_id=None, min_document_id=None):
+    """
+    Streams the store one document at a time: yields (document_id, project_id, file_name,
+    [ChunkRecord, ...]) in document order. Only one document's chunks are in memory.
+    """
+    chunks = chunk_dao.iter_chunks(project_id=project_id, document_id=document_id, min_document_id=min_document_id)
+    for document_id, document_chunks in groupby(chunks, key=lambda chunk: chunk.document_id):
+        document_chunks = list(document_chunks)
+        yield document_id, document_chunks[0].project_id, document_chunks[0].file_name, document_chunks
+
+
+def rebuild_lexical_index(chunk_dao, project_id):
+    """
+    Re-indexes every document of a project from the store and hides indexed documents the
+    store no longer has. Records the store's watermark from before the scan, so writes made
+    during the rebuild are caught up with at the next sync. Returns the number of documents.
+    """
+    watermark = chunk_dao.project_watermark(project_id)
+    documents = set()
+    with timed("lexical_rebuild"):
+        for document_id, _, file_name, document_chunks in iter_documents(chunk_dao, project_id):
+            lexical_index.add_document(project_id, document_id, file_name, [chunk.text for chunk in document_chunks])
+            documents.add(document_id)
+        index = lexical_index.open_index(project_id)
+        for document_id in (index.document_ids() - documents) if index else ():
+            lexical_index.remove_document(project_id, document_id)
+        lexical_index.compact(project_id)
+    lexical_index.set_watermark(project_id, watermark)
+    return len(documents)
+
+
+def sync_lexical_index(chunk_dao, project_id):
+    """
+    Brings a project's lexical index in line with the store by comparing the watermark the index
+    recorded at its last sync with the store's. Documents loaded since are indexed again; an
+    index that still differs (deleted documents) or has no watermark is rebuilt, and the index
+    of a project without chunks is dropped. Returns "fresh", "caught_up", "rebuilt" or "dropped".
+    """
+    watermark = chunk_dao.project_watermark(project_id)
+    index = lexical_index.open_index(project_id)
+    indexed = index.watermark if index else None
+    if indexed == watermark:
+        return "fresh"
+    if not watermark[1]:
+        lexical_index.drop_project(project_id)
+        return "dropped"
+    if indexed is not None and indexed[0] <= watermark[0]:
+        for document_id in chunk_dao.project_document_ids_after(project_id, indexed[0]):
+            for _, _, file_name, document_chunks in iter_documents(chunk_dao, document_id=document_id):
+                lexical_index.add_document(project_id, document_id, file_name, [chunk.text for chunk in document_chunks])
+        # One page per chunk, so the page count shows whether documents were deleted meanwhile
+        if lexical_index.open_index(project_id).page_count == watermark[1]:
+            lexical_index.set_watermark(project_id, watermark)
+            return "caught_up"
+    rebuild_lexical_index(chunk_dao, project_id)
+    return "rebuilt"
+
+
+if __name__ == "__main__":
+    from database.dbutil import Database
+    from database.dao.ChunkDAO import ChunkDAO
+    if len(sys.argv) != 3 or sys.argv[1] != "rebuild-lexical":
+        sys.exit("usage: python -m services.chunk_store rebuild-lexical <project_id>")
+    with ChunkDAO(Database()) as dao:
+        print(f"Re-indexed {rebuild_lexical_index(dao, int(sys.argv[2]))} documents")
@@ -0,0 +1,218 @@
+import json
+import logging
+import os
+import threading
+import time
+import boto3
+import requests
+from botocore.config import Config
+from requests.adapters import HTTPAdapter
+import google.cloud.documentai_v1 as documentai
+from google.cloud.documentai_v1.services.document_processor_service.transports.grpc import DocumentProcessorServiceGrpcTransport
+from google.oauth2 import service_account
+
+""" Lazily initialized, cached provider for credentials and API clients. Nothing here runs
+at import time: secrets are fetched and clients are built on first use, then reused.
+The Google service account secret is re-read after SECRET_REFRESH_SECONDS so rotated keys
+are picked up without a restart; a failed re-read keeps the previous key and is retried after
+SECRET_RETRY_SECONDS.
+
+Clients are long-lived and shared across threads: boto3 clients get a connection pool sized
+by BOTO_MAX_POOL_CONNECTIONS with TCP keep-alive, and Document AI uses a single gRPC channel
+with keep-alive pings. Registries are cleared in forked children, which must build their own. """
+
+AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
+AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
+AWS_REGION_NAME = os.getenv("AWS_REGION_NAME")
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-2.0-flash")
+GOOGLE_SERVICE_ACCOUNT_SECRET_NAME = os.getenv("GOOGLE_SERVICE_ACCOUNT_SECRET_NAME")
+SECRET_REFRESH_SECONDS = int(os.getenv("SECRET_REFRESH_SECONDS", "3600"))
+SECRET_RETRY_SECONDS = int(os.getenv("SECRET_RETRY_SECONDS", "60"))
+BOTO_MAX_POOL_CONNECTIONS = int(os.getenv("BOTO_MAX_POOL_CONNECTIONS", "50"))
+GRPC_KEEPALIVE_MS = int(os.getenv("GRPC_KEEPALIVE_MS", "30000"))
+
+GOOGLE_CLOUD_SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.RLock()
+# refresh_at: monotonic time after which the secret is read again (None before the first read)
+_service_account = {"info": None, "refresh_at": None}
+_boto_clients = {}
+_http_session = None
+_documentai_client = None
+_gemini_model = None
+_weaviate_client = None
+
+
+def get_boto_client(service_name):
+    """
+    Returns the shared boto3 client for a service, creating it on first use. boto3 clients
+    are thread-safe once created; creation itself is serialized because sessions are not.
+    """
+    client = _boto_clients.get(service_name)
+    if client is not None:
+        return client
+    with _lock:
+        if service_name not in _boto_clients:
+            session = boto3.session.Session(
+                aws_access_key_id=AWS_ACCESS_KEY_ID,
+                aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+                region_name=AWS_REGION_NAME
+            )
+            config = Config(
+                max_pool_connections=BOTO_MAX_POOL_CONNECTIONS,
+                tcp_keepalive=True,
+                retries={"mode": "adaptive", "max_attempts": 5}
+            )
+            _boto_clients[service_name] = session.client(service_name, config=config)
+        return _boto_clients[service_name]
+
+
+def get_s3_client():
+    """Returns the shared S3 client."""
+    return get_boto_client('s3')
+
+
+def get_secretmanager_client():
+    """Returns the shared secretmanager client."""
+    return get_boto_client('secretsmanager')
+
+
+def get_http_session():
+    """Returns the shared requests session (Microsoft Graph) with a keep-alive connection pool."""
+    global _http_session
+    if _http_session is not None:
+        return _http_session
+    with _lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=BOTO_MAX_POOL_CONNECTIONS)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_session = session
+        return _http_session
+
+
+def _load_service_account_info():
+    """The service account info in Secrets Manager, or None if the secret is empty. Raises if it cannot be read."""
+    secret = get_secretmanager_client().get_secret_value(SecretId=GOOGLE_SERVICE_ACCOUNT_SECRET_NAME)
+    if secret:
+        return json.loads(str(secret['SecretString']))
+    logger.warning("google-service-account-key-prod secret not parsed. Falling back to default credentials.")
+    return None
+
+
+def _secret_fresh():
+    refresh_at = _service_account["refresh_at"]
+    return refresh_at is not None and time.monotonic() < refresh_at
+
+
+def get_google_service_account_info():
+    """
+    Returns the Google service account info from Secrets Manager, or None to use default
+    credentials. Cached for SECRET_REFRESH_SECONDS; a rotated key drops the cached Document AI
+    client. When the secret cannot be read, the previous info is kept (default credentials if
+    there is none yet) and the read is retried after SECRET_RETRY_SECONDS.
+    """
+    global _documentai_client
+    with _lock:
+        if _secret_fresh():
+            return _service_account["info"]
+        first_read = _service_account["refresh_at"] is None
+        try:
+            info = _load_service_account_info()
+        except Exception as e:
+            logger.warning(f"Error loading Google Service Account key, keeping the current credentials: {e}")
+            _service_account["refresh_at"] = time.monotonic() + SECRET_RETRY_SECONDS
+            return _service_account["info"]
+        if not first_read and info != _service_account["info"]:
+            logger.info("Google service account secret changed, rebuilding Document AI client.")
+            _documentai_client = None
+        _service_account["info"] = info
+        _service_account["refresh_at"] = time.monotonic() + SECRET_REFRESH_SECONDS
+        return info
+
+
+def _keepalive_channel(host, **kwargs):
+    """Creates the Document AI gRPC channel with keep-alive pings so idle connections survive NATs and LBs."""
+    options = list(kwargs.pop("options", None) or [])
+    options += [
+        ("grpc.keepalive_time_ms", GRPC_KEEPALIVE_MS),
+        ("grpc.keepalive_timeout_ms", 10000),
+        ("grpc.keepalive_permit_without_calls", 1),
+        ("grpc.http2.max_pings_without_data", 0),
+    ]
+    return DocumentProcessorServiceGrpcTransport.create_channel(host, options=options, **kwargs)
+
+
+def get_documentai_client():
+    """Returns the shared Document AI client, built on first use."""
+    global _documentai_client
+    client = _documentai_client
+    if client is not None and _secret_fresh():
+        return client
+    with _lock:
+        service_account_info = get_google_service_account_info()
+        if _documentai_client is None:
+            if service_account_info: # Use service account credentials if available
+                try:
+                    credentials = service_account.Credentials.from_service_account_info(service_account_info, scopes=GOOGLE_CLOUD_SCOPES)
+                except Exception as e:
+                    print(f"Error creating Document AI client with service account: {e}")
+                    raise e
+            else: # Fallback to default credentials (e.g., for local dev if ADC is configured)
+                print("Using default Google Cloud credentials for Document AI client.")
+                credentials = None
+            transport = DocumentProcessorServiceGrpcTransport(credentials=credentials, channel=_keepalive_channel)
+            _documentai_client = documentai.DocumentProcessorServiceClient(transport=transport)
+        return _documentai_client
+
+
+def get_gemini_model():
+    """Returns the shared Gemini model, configuring the SDK on first use."""
+    global _gemini_model
+    if _gemini_model is not None:
+        return _gemini_model
+    with _lock:
+        if _gemini_model is None:
+            import google.generativeai as genai  # heavy import, deferred until the first query
+            genai.configure(api_key=GEMINI_API_KEY)
+            _gemini_model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+        return _gemini_model
+
+
+def get_weaviate_client():
+    """Returns the shared Weaviate client used for searches, connecting on first use."""
+    global _weaviate_client
+    if _weaviate_client is not None:
+        return _weaviate_client
+    with _lock:
+        if _weaviate_client is None:
+            from services import weaviate_service  # heavy import, deferred until the first hybrid query
+            _weaviate_client = weaviate_service.get_weaviate_client()
+        return _weaviate_client
+
+
+def invalidate_credentials():
+    """Forces the next call to re-read secrets and rebuild all clients (e.g. after an auth failure)."""
+    global _documentai_client, _gemini_model, _http_session, _weaviate_client
+    with _lock:
+        _service_account["refresh_at"] = None
+        _service_account["info"] = None
+        _boto_clients.clear()
+        _http_session = None
+        _documentai_client = None
+        _gemini_model = None
+        _weaviate_client = None
+
+
+def _reset_after_fork():
+    # Sockets, gRPC channels and the lock must not be shared with the parent process
+    global _lock
+    _lock = threading.RLock()
+    invalidate_credentials()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,287 @@
+import heapq
+import math
+import os
+import re
+from services import fingerprint
+
+""" This service is responsible for assembling the context passed to Gemini. It ranks
+extracted chunks against the query, drops duplicates and fills a token budget so prompt
+size, latency and cost stay bounded.
+
+Chunks are consumed as a stream: only the best candidates, up to CONTEXT_RETAIN_FACTOR times
+the token budget, are held at once, so memory per request does not grow with project size. """
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "200000"))
+CONTEXT_MAX_CHUNK_TOKENS = int(os.getenv("CONTEXT_MAX_CHUNK_TOKENS", "4000"))
+CONTEXT_RETAIN_FACTOR = float(os.getenv("CONTEXT_RETAIN_FACTOR", "2"))
+# Stops reading the chunk stream after this many tokens (0 reads everything)
+CONTEXT_SCAN_TOKEN_BUDGET = int(os.getenv("CONTEXT_SCAN_TOKEN_BUDGET", "0"))
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv("CONTEXT_NEAR_DUPLICATE_MAX_DISTANCE", "3"))
+
+# Rough average for English/construction text with the Gemini tokenizer
+CHARS_PER_TOKEN = 4
+
+_TERM_RE = re.compile(r"\w+(?:[-.]\w+)*", re.UNICODE)
+
+
+class ContextChunk:
+    """A piece of extracted text with its source location and retrieval score."""
+
+    def __init__(self, text: str, source: str, page: int = None, chunk_no: int = 0, score: float = 0.0):
+        self.text = text
+        self.source = source
+        self.page = page
+        self.chunk_no = chunk_no
+        self.score = score
+
+    def __repr__(self):
+        return f"ContextChunk(source={self.source!r}, page={self.page}, chunk_no={self.chunk_no}, score={self.score:.3f})"
+
+
+class ContextReport:
+    """Summary of what the assembler kept and dropped for a single prompt."""
+
+    def __init__(self, token_budget: int):
+        self.token_budget = token_budget
+        self.chunks_in = 0
+        self.chunks_included = 0
+        self.chunks_merged = 0
+        self.duplicates_dropped = 0
+        self.budget_dropped = 0
+        self.tokens_included = 0
+        self.tokens_dropped = 0
+        self.tokens_scanned = 0
+        self.scan_stopped = False
+        self.peak_bytes = 0
+        # The chunks sent, in context order, when the caller asked to keep them (not part of the report dict)
+        self.selected = []
+
+    def as_dict(self):
+        return {
+            "token_budget": self.token_budget,
+            "chunks_in": self.chunks_in,
+            "chunks_included": self.chunks_included,
+            "chunks_merged": self.chunks_merged,
+            "duplicates_dropped": self.duplicates_dropped,
+            "budget_dropped": self.budget_dropped,
+            "tokens_included": self.tokens_included,
+            "tokens_dropped": self.tokens_dropped,
+            "tokens_scanned": self.tokens_scanned,
+            "scan_stopped": self.scan_stopped,
+            "peak_bytes": self.peak_bytes,
+        }
+
+
+class ByteTracker:
+    """Counts the text and document bytes a request holds at once, and their peak."""
+
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+
+    def hold(self, size: int):
+        self.current += size
+        if self.current > self.peak:
+            self.peak = self.current
+
+    def release(self, size: int):
+        self.current -= size
+
+
+def count_tokens(text: str) -> int:
+    """Estimates the number of model tokens in text without calling the API."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def query_terms(query: str) -> set:
+    return set(term.lower() for term in _TERM_RE.findall(query or ""))
+
+
+def score_chunk(terms: set, text: str) -> float:
+    """Scores a chunk by query-term coverage with a sublinear term-frequency boost."""
+    if not terms:
+        return 0.0
+    counts = {}
+    for term in _TERM_RE.findall(text.lower()):
+        if term in terms:
+            counts[term] = counts.get(term, 0) + 1
+    if not counts:
+        return 0.0
+    coverage = len(counts) / len(terms)
+    return coverage + sum(math.log1p(c) for c in counts.values()) / (10 * len(terms))
+
+
+def split_oversized(chunk: ContextChunk, max_tokens: int, token_counter=count_tokens) -> list:
+    """Splits a chunk that is larger than max_tokens into consecutive windows on line boundaries."""
+    if token_counter(chunk.text) <= max_tokens:
+        return [chunk]
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    pieces = []
+    current = []
+    current_len = 0
+    for line in chunk.text.splitlines(keepends=True):
+        while len(line) > max_chars:
+            if current:
+                pieces.append("".join(current))
+                current, current_len = [], 0
+            pieces.append(line[:max_chars])
+            line = line[max_chars:]
+        if current_len + len(line) > max_chars and current:
+            pieces.append("".join(current))
+            current, current_len = [], 0
+        current.append(line)
+        current_len += len(line)
+    if current:
+        pieces.append("".join(current))
+    return [ContextChunk(piece, chunk.source, chunk.page, chunk.chunk_no + i, chunk.score) for i, piece in enumerate(pieces)]
+
+
+def _chunk_header(chunk: ContextChunk) -> str:
+    if chunk.page is None:
+        return f"[{chunk.source}]"
+    return f"[{chunk.source}, page {chunk.page + 1}]"
+
+
+def assemble_context(query: str, chunks, token_budget: int = None, token_counter=count_tokens,
+                     scan_token_budget: int = None, tracker: ByteTracker = None, dedupe: bool = True,
+                     keep_selected: bool = False):
+    """
+    Builds the context text for a query from ranked chunks.
+
+    Chunks are split if oversized, deduplicated (exact and near-duplicate), ranked against
+    the query unless they already carry a score, and greedily packed into the token budget.
+    Selected chunks are emitted in document order with adjacent chunks from the same page
+    merged under a single source header.
+
+    The chunks are read one at a time. Only the best ranked candidates, up to
+    CONTEXT_RETAIN_FACTOR times the budget, are kept while reading; weaker ones are dropped
+    as they are pushed out. Reading stops early, and a generator is closed so it does no
+    further work, once scan_token_budget tokens are read or, for a query without terms
+    (where ranking is document order), once the budget is filled.
+
+    Args:
+        query: The user query used for ranking
+        chunks: Iterable of ContextChunk objects
+        token_budget: Maximum tokens of context (defaults to CONTEXT_TOKEN_BUDGET)
+        token_counter: Callable returning the token count for a string
+        scan_token_budget: Maximum tokens to read from chunks (defaults to CONTEXT_SCAN_TOKEN_BUDGET, 0 is unlimited)
+        tracker: ByteTracker shared with the producer of chunks, for the peak memory report
+        dedupe: False when the chunks were already deduplicated (e.g. a batch's shared pool)
+        keep_selected: Keep the chunks sent in report.selected (e.g. for a chat session to reuse)
+
+    Returns:
+        tuple: (context_text, ContextReport)
+    """
+    token_budget = CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+    scan_token_budget = CONTEXT_SCAN_TOKEN_BUDGET if scan_token_budget is None else scan_token_budget
+    tracker = tracker or ByteTracker()
+    report = ContextReport(token_budget)
+    terms = query_terms(query)
+    retain_tokens = token_budget * CONTEXT_RETAIN_FACTOR
+
+    # Min-heap of (score, -position, cost, chunk): the root is the weakest retained candidate
+    retained = []
+    retained_cost = 0
+    position = 0
+    deduplicator = ChunkDeduplicator() if dedupe else None
+    try:
+        for chunk in chunks:
+            report.chunks_in += 1
+            report.tokens_scanned += token_counter(chunk.text)
+            for piece in split_oversized(chunk, CONTEXT_MAX_CHUNK_TOKENS, token_counter):
+                if not piece.text.strip():
+                    continue
+                if deduplicator is not None and deduplicator.duplicate_of(piece) is not None:
+                    report.duplicates_dropped += 1
+                    report.tokens_dropped += token_counter(piece.text)
+                    continue
+                if not piece.score:
+                    piece.score = score_chunk(terms, piece.text)
+                cost = token_counter(piece.text) + token_counter(_chunk_header(piece)) + 1
+                heapq.heappush(retained, (piece.score, -position, cost, piece))
+                position += 1
+                retained_cost += cost
+                tracker.hold(len(piece.text))
+                while len(retained) > 1 and retained_cost - retained[0][2] >= retain_tokens:
+                    _, _, dropped_cost, dropped = heapq.heappop(retained)
+                    retained_cost -= dropped_cost
+                    tracker.release(len(dropped.text))
+                    report.budget_dropped += 1
+                    report.tokens_dropped += token_counter(dropped.text)
+            if (scan_token_budget and report.tokens_scanned >= scan_token_budget) or \
+                    (not terms and retained_cost >= token_budget):
+                report.scan_stopped = True
+                break
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+    # Highest score first; ties keep document order
+    ranked = sorted(retained, key=lambda item: (-item[0], -item[1]))
+    retained = None
+    selected = []
+    used = 0
+    for score, negative_position, cost, chunk in ranked:
+        if used + cost > token_budget:
+            report.budget_dropped += 1
+            report.tokens_dropped += token_counter(chunk.text)
+            continue
+        used += cost
+        selected.append((-negative_position, chunk))
+    ranked = None
+
+    selected.sort(key=lambda item: item[0])
+    if keep_selected:
+        report.selected = [chunk for _, chunk in selected]
+    blocks = []
+    previous = None
+    for _, chunk in selected:
+        report.chunks_included += 1
+        report.tokens_included += token_counter(chunk.text)
+        if (previous is not None and previous.source == chunk.source and previous.page == chunk.page
+                and chunk.chunk_no == previous.chunk_no + 1):
+            blocks[-1].append(chunk.text)
+            report.chunks_merged += 1
+        else:
+            blocks.append([_chunk_header(chunk), chunk.text])
+        previous = chunk
+
+    context_text = "\n\n".join("\n".join(block) for block in blocks)
+    tracker.hold(len(context_text))
+    report.peak_bytes = tracker.peak
+    return context_text, report
+
+
+class ChunkDeduplicator:
+    """
+    Recognizes chunks whose text repeats one seen before, exactly (content hash) or nearly
+    (SimHash within NEAR_DUPLICATE_MAX_DISTANCE bits, found through banded lookups). Only
+    hashes are kept unless keep_chunks is set, so dropped chunks are not held in memory.
+    """
+
+    def __init__(self, keep_chunks: bool = False):
+        self.keep_chunks = keep_chunks
+        self.by_hash = {}
+        self.band_index = {}
+
+    def duplicate_of(self, chunk: ContextChunk):
+        """
+        What a chunk duplicates: the first such chunk with keep_chunks, otherwise True. A new
+        chunk is recorded and None returned.
+        """
+        digest = fingerprint.content_hash(chunk.text)
+        seen = self.by_hash.get(digest)
+        if seen is not None:
+            return seen
+        signature = fingerprint.simhash(chunk.text)
+        bands = fingerprint.simhash_bands(signature, NEAR_DUPLICATE_MAX_DISTANCE + 1)
+        for band in bands:
+            for other_signature, other in self.band_index.get(band, ()):
+                if fingerprint.hamming_distance(signature, other_signature) <= NEAR_DUPLICATE_MAX_DISTANCE:
+                    return other
+        kept = chunk if self.keep_chunks else True
+        self.by_hash[digest] = kept
+        for band in bands:
+            self.band_index.setdefault(band, []).append((signature, kept))
+        return None
@@ -0,0 +1,101 @@
+import os
+from database.dao.PageFingerprintRecord import PageFingerprintRecord
+from services import text_layer as text_layer_quality
+from services.extraction_service import iter_pages, open_pdf
+from services.fingerprint import SIMHASH_BANDS, content_hash, hamming_distance, simhash
+from services.metrics import timed
+
+""" This service is responsible for recognizing pages that were already ingested into a
+project, so reissued sets (addenda, bulletins, conformed sets) reuse the existing extraction
+and vectors instead of paying for Document AI and embeddings again.
+
+Pages are fingerprinted from their PDF text layer: an exact hash of the normalized text and
+a 64-bit SimHash. A page matches a stored page with the same hash, or with a SimHash within
+PAGE_DUPLICATE_MAX_DISTANCE bits. Pages with fewer than MIN_FINGERPRINT_WORDS words (scans,
+blank sheets) are never matched, since their text layer says nothing about their content. """
+
+# Fingerprint uploaded pages and reuse the extraction and vectors of duplicates
+PAGE_DEDUP_ENABLED = os.getenv("PAGE_DEDUP_ENABLED", "true").lower() == "true"
+PAGE_DUPLICATE_MAX_DISTANCE = int(os.getenv("PAGE_DUPLICATE_MAX_DISTANCE", "3"))
+MIN_FINGERPRINT_WORDS = int(os.getenv("MIN_FINGERPRINT_WORDS", "25"))
+
+
+def check_max_distance(distance):
+    """
+    Candidates are looked up by SimHash band, which only finds every page within
+    SIMHASH_BANDS - 1 bits; a larger distance would silently miss near duplicates.
+    """
+    if not 0 <= distance <= SIMHASH_BANDS - 1:
+        raise ValueError(f"PAGE_DUPLICATE_MAX_DISTANCE must be between 0 and {SIMHASH_BANDS - 1}, got {distance}")
+    return distance
+
+
+check_max_distance(PAGE_DUPLICATE_MAX_DISTANCE)
+
+
+class PageMatch:
+    """A new page and the stored fingerprint it duplicates (None when the page is new)."""
+
+    def __init__(self, fingerprint, text_layer, match=None, distance=None, quality=None):
+        self.fingerprint = fingerprint
+        self.text_layer = text_layer
+        # TextLayerQuality measured with the text layer, when the extraction router will need it
+        self.quality = quality
+        self.match = match
+        self.distance = distance
+
+    @property
+    def dedupable(self):
+        return len(self.text_layer.split()) >= MIN_FINGERPRINT_WORDS
+
+
+def fingerprint_pages(pdf_file_bytes, project_id, document_id, measure=False):
+    """
+    Fingerprints every page's text layer. Returns one PageMatch per page, not yet matched.
+    With measure, each page's text layer is also measured for the extraction router in the
+    same pass, so new pages are not read again to route them.
+    """
+    pages = []
+    with timed("fingerprint"):
+        for page_number, page in iter_pages(open_pdf(pdf_file_bytes)):
+            quality = None
+            if measure:
+                text_layer, quality = text_layer_quality.measure_page(page)
+            else:
+                text_layer = page.extract_text() or ""
+            fingerprint = PageFingerprintRecord(None, project_id, document_id, page_number,
+                                                content_hash(text_layer), simhash(text_layer))
+            pages.append(PageMatch(fingerprint, text_layer, quality=quality))
+    return pages
+
+
+def find_duplicates(fingerprint_dao, project_id, pages):
+    """
+    Sets match and distance on every page that duplicates a stored page of the project.
+    Exact matches win over near matches; among near matches the closest, then the newest wins.
+    Only stored pages that have an extraction to reuse are considered.
+    """
+    candidates_for = [page for page in pages if page.dedupable]
+    if not candidates_for:
+        return pages
+    with timed("fingerprint_lookup"):
+        stored = fingerprint_dao.find_candidates(project_id,
+                                                 {page.fingerprint.content_hash for page in candidates_for},
+                                                 [page.fingerprint.simhash for page in candidates_for])
+    stored = [record for record in stored if record.extracted_text is not None]
+    by_hash = {}
+    for record in stored:
+        by_hash.setdefault(record.content_hash, record)
+    for page in candidates_for:
+        exact = by_hash.get(page.fingerprint.content_hash)
+        if exact is not None:
+            page.match, page.distance = exact, 0
+            continue
+        best = None
+        for record in stored:
+            distance = hamming_distance(page.fingerprint.simhash, record.simhash)
+            if distance <= PAGE_DUPLICATE_MAX_DISTANCE and (best is None or distance < best[0]):
+                best = (distance, record)
+        if best:
+            page.distance, page.match = best
+    return pages
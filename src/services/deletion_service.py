@@ -0,0 +1,111 @@
+import argparse
+import json
+import logging
+import time
+from services import lexical_index
+from services import weaviate_service
+from services.metrics import timed
+
+""" This service is responsible for deleting whole projects and organizations: their documents,
+chunks, fingerprints and manifest entries in Postgres, their chunks in Weaviate and their
+lexical indexes.
+
+Deletion is set based. Each project's Weaviate chunks go with one filtered delete_many per
+collection, and the rows of every project go with one DELETE per table, all in one
+transaction. A deletion_jobs row records the projects at the start and each project whose
+vectors are gone, so an interrupted run resumes where it stopped. Vectors are deleted before
+the rows: until the job is done the rows are still there to find the job again, and the
+project is never left half deleted in Postgres. Lexical indexes are derived from the chunks
+table: once its rows are gone every task drops the project's index at its next sync with the
+chunk store, so dropping this task's copy right away is only a shortcut and not a job step.
+
+    PYTHONPATH=src python -m services.deletion_service project 42
+    PYTHONPATH=src python -m services.deletion_service organization 7
+    PYTHONPATH=src python -m services.deletion_service status 13 """
+
+SCOPES = ("project", "organization")
+
+logger = logging.getLogger(__name__)
+
+
+class DeletionError(Exception):
+    pass
+
+
+def start_job(job_dao, scope, target_id, progress=logger.info):
+    """The unfinished job for the project or organization if there is one, otherwise a new job."""
+    if scope not in SCOPES:
+        raise DeletionError(f"scope must be one of {', '.join(SCOPES)}")
+    job = job_dao.find_unfinished_job(scope, target_id)
+    if job is not None:
+        if scope == "organization":
+            # Projects created since the job started would otherwise keep the organization's row alive
+            added = [project_id for project_id in job_dao.get_organization_project_ids(target_id)
+                     if project_id not in job.project_ids]
+            if added:
+                job_dao.add_projects(job.job_id, added)
+                job.project_ids = job.project_ids + added
+        progress(f"Resuming deletion job {job.job_id} ({len(job.vectors_deleted)} of {len(job.project_ids)} projects "
+              f"already removed from Weaviate)")
+        return job
+    # A project is deleted by id even if its row is already gone, to clear what it left behind
+    project_ids = [target_id] if scope == "project" else job_dao.get_organization_project_ids(target_id)
+    return job_dao.create_job(scope, target_id, project_ids)
+
+
+def run_job(job_dao, weaviate_client, job, progress=logger.info):
+    """Deletes a job's vectors project by project, then its rows in one transaction. Returns the finished job."""
+    started = time.monotonic()
+    try:
+        collections = weaviate_service.document_collections(weaviate_client)
+        remaining = [project_id for project_id in job.project_ids if project_id not in job.vectors_deleted]
+        for project_id in remaining:
+            with timed("delete_project_vectors"):
+                deleted = sum(weaviate_service.remove_project_chunks(weaviate_client, project_id, collection_name)
+                              for collection_name in collections)
+            job_dao.mark_vectors_deleted(job.job_id, project_id)
+            job.vectors_deleted.append(project_id)
+            progress(f"Job {job.job_id}: project {project_id} removed from Weaviate ({deleted} chunks), "
+                     f"{len(job.vectors_deleted)}/{len(job.project_ids)}")
+        with timed("delete_project_rows"):
+            job.rows_deleted = job_dao.purge(job)
+    except Exception as e:
+        job_dao.mark_failed(job.job_id, e)
+        job.status, job.error = "failed", str(e)
+        progress(f"Job {job.job_id} failed, run it again to resume: {e}")
+        raise
+    job.status, job.error = "done", None
+    for project_id in job.project_ids:
+        try:
+            lexical_index.drop_project(project_id)
+        except OSError as e:
+            logger.warning(f"Could not drop the lexical index of project {project_id}, "
+                           f"it goes at the next sync with the chunk store: {e}")
+    progress(f"Job {job.job_id} done in {time.monotonic() - started:.1f}s: {job.rows_deleted}")
+    return job
+
+
+def delete(job_dao, weaviate_client, scope, target_id, progress=logger.info):
+    """Deletes a project or an organization with everything in it, resuming an interrupted deletion."""
+    return run_job(job_dao, weaviate_client, start_job(job_dao, scope, target_id, progress), progress)
+
+
+if __name__ == "__main__":
+    from database.dbutil import Database
+    from database.dao.DeletionJobDAO import DeletionJobDAO
+    from services.client_provider import get_weaviate_client
+
+    parser = argparse.ArgumentParser(description="Delete projects and organizations from Postgres and Weaviate")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("project", help="Delete a project").add_argument("target_id", type=int)
+    commands.add_parser("organization", help="Delete an organization and all its projects").add_argument("target_id", type=int)
+    commands.add_parser("status", help="Show a deletion job").add_argument("job_id", type=int)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    with DeletionJobDAO(Database()) as dao:
+        if args.command == "status":
+            job = dao.get_job(args.job_id)
+            print(json.dumps(job.as_dict() if job else None, indent=2))
+        else:
+            delete(dao, get_weaviate_client(), args.command, args.target_id, progress=logger.info)
@@ -0,0 +1,289 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+import google.cloud.documentai_v1 as documentai
+from services.client_provider import get_s3_client
+from services.metrics import CACHE_HITS, CACHE_MISSES, timed
+
+""" This service is responsible for keeping the full Document AI output for every processed
+page, so re-chunking, table extraction and re-embedding can run without new API calls.
+
+Each page result is the serialized documentai.Document protobuf (text, layout, blocks,
+paragraphs, tables and bounding boxes), zlib compressed and keyed by the sha256 of the
+single-page PDF that was sent, under the processor id that produced it. A per-PDF manifest
+lists the page keys in order. Objects live in S3 and are mirrored to a local disk cache,
+which is read first; sync_to_local() pre-fills it for offline runs.
+
+The mirror holds at most DOCAI_STORE_CACHE_MAX_BYTES: past that, the objects least recently
+read or written (file mtime, shared by every worker of the host) are removed. An empty
+DOCAI_STORE_CACHE_DIR turns the mirror off. """
+
+DOCAI_STORE_ENABLED = os.getenv("DOCAI_STORE_ENABLED", "true").lower() in ("1", "true", "yes")
+DOCAI_STORE_BUCKET = os.getenv("DOCAI_STORE_BUCKET", os.getenv("S3_BUCKET_NAME"))
+DOCAI_STORE_PREFIX = os.getenv("DOCAI_STORE_PREFIX", "docai-raw/")
+DOCAI_STORE_CACHE_DIR = os.getenv("DOCAI_STORE_CACHE_DIR", "/tmp/docai-store")
+# 0 for no limit, e.g. for a sync_to_local() of the whole store
+DOCAI_STORE_CACHE_MAX_BYTES = int(os.getenv("DOCAI_STORE_CACHE_MAX_BYTES", str(1024 ** 3)))
+# Eviction goes below the limit by this much, so it does not rescan the mirror on every write
+DOCAI_STORE_CACHE_EVICT_RATIO = 0.9
+DOCAI_STORE_COMPRESSION_LEVEL = int(os.getenv("DOCAI_STORE_COMPRESSION_LEVEL", "6"))
+PROCESSOR_ID = os.getenv("GOOGLE_DOCUMENT_AI_PROCESSOR_ID") or "default"
+
+# Mirror writes go to a temp file first; eviction leaves these alone unless a crashed writer
+# left one behind for longer than any write takes
+_TMP_PREFIX = ".tmp-"
+_STALE_TMP_SECONDS = 3600
+
+
+_cache_lock = threading.Lock()
+# Mirror size as of this worker's last scan plus what it has written since (None before the first scan)
+_cache_bytes = None
+
+
+def content_key(file_content: bytes) -> str:
+    """Store key for a page: the sha256 of the exact bytes sent to Document AI."""
+    return hashlib.sha256(file_content).hexdigest()
+
+
+def _object_key(key, suffix):
+    return f"{DOCAI_STORE_PREFIX}{PROCESSOR_ID}/{key[:2]}/{key}{suffix}"
+
+
+def _local_path(object_key):
+    return os.path.join(DOCAI_STORE_CACHE_DIR, object_key)
+
+
+def _write_local(object_key, data):
+    if not DOCAI_STORE_CACHE_DIR:
+        return
+    path = _local_path(object_key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temp file and rename so concurrent readers never see a partial object
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=_TMP_PREFIX)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    _account_local(len(data))
+
+
+def _read_local(object_key):
+    """The mirrored bytes of an object, marked as recently used, or None."""
+    if not DOCAI_STORE_CACHE_DIR:
+        return None
+    path = _local_path(object_key)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)
+    except FileNotFoundError:
+        # Never mirrored, or evicted (possibly by another worker)
+        return None
+    return data
+
+
+def _account_local(size):
+    global _cache_bytes
+    if not DOCAI_STORE_CACHE_MAX_BYTES:
+        return
+    with _cache_lock:
+        if _cache_bytes is None:
+            _cache_bytes = evict_local(DOCAI_STORE_CACHE_MAX_BYTES)
+            return
+        _cache_bytes += size
+        if _cache_bytes > DOCAI_STORE_CACHE_MAX_BYTES:
+            _cache_bytes = evict_local(int(DOCAI_STORE_CACHE_MAX_BYTES * DOCAI_STORE_CACHE_EVICT_RATIO))
+
+
+def evict_local(max_bytes):
+    """
+    Removes the least recently used mirrored objects until the mirror holds at most max_bytes.
+    Temp files of writes in progress (in any worker) are skipped. Returns its size.
+    """
+    files = []
+    stale_before = time.time() - _STALE_TMP_SECONDS
+    for directory, _, names in os.walk(DOCAI_STORE_CACHE_DIR):
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+                if name.startswith(_TMP_PREFIX):
+                    if stat.st_mtime < stale_before:
+                        os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    if removed:
+        print(f"Evicted {removed} Document AI results from {DOCAI_STORE_CACHE_DIR}; {total} bytes left", flush=True)
+    return total
+
+
+def _read_object(object_key, cache):
+    """Returns the stored bytes from local disk or S3 (mirroring them locally), or None."""
+    data = _read_local(object_key)
+    if data is not None:
+        CACHE_HITS.inc(cache=f"{cache}_local")
+        return data
+    s3_client = get_s3_client()
+    with timed("docai_store_get"):
+        try:
+            data = s3_client.get_object(Bucket=DOCAI_STORE_BUCKET, Key=object_key)["Body"].read()
+        except s3_client.exceptions.NoSuchKey:
+            CACHE_MISSES.inc(cache=cache)
+            return None
+    CACHE_HITS.inc(cache=cache)
+    _write_local(object_key, data)
+    return data
+
+
+def _write_object(object_key, data):
+    with timed("docai_store_put"):
+        get_s3_client().put_object(Bucket=DOCAI_STORE_BUCKET, Key=object_key, Body=data)
+    _write_local(object_key, data)
+
+
+def encode_document(document) -> bytes:
+    return zlib.compress(documentai.Document.serialize(document), DOCAI_STORE_COMPRESSION_LEVEL)
+
+
+def decode_document(data: bytes):
+    return documentai.Document.deserialize(zlib.decompress(data))
+
+
+def get_document(key):
+    """Returns the stored documentai.Document for a page key, or None if it was never stored."""
+    if not DOCAI_STORE_ENABLED:
+        return None
+    try:
+        data = _read_object(_object_key(key, ".pb.z"), "docai_store")
+    except Exception as e:
+        print(f"Error reading Document AI result {key} from the store: {e}")
+        return None
+    return decode_document(data) if data is not None else None
+
+
+def put_document(key, document):
+    """Stores a page's documentai.Document. Failures are logged; the store is never required to answer."""
+    if not DOCAI_STORE_ENABLED:
+        return
+    try:
+        _write_object(_object_key(key, ".pb.z"), encode_document(document))
+    except Exception as e:
+        print(f"Error saving Document AI result {key} to the store: {e}")
+
+
+def get_manifest(pdf_key):
+    """Returns the ordered page keys stored for a whole PDF (keyed by content_key of the PDF), or None."""
+    if not DOCAI_STORE_ENABLED:
+        return None
+    try:
+        data = _read_object(_object_key(pdf_key, ".manifest.json"), "docai_manifest")
+    except Exception as e:
+        print(f"Error reading Document AI manifest {pdf_key}: {e}")
+        return None
+    return json.loads(data)["pages"] if data is not None else None
+
+
+def put_manifest(pdf_key, page_keys):
+    if not DOCAI_STORE_ENABLED:
+        return
+    try:
+        _write_object(_object_key(pdf_key, ".manifest.json"), json.dumps({"pages": list(page_keys)}).encode("utf-8"))
+    except Exception as e:
+        print(f"Error saving Document AI manifest {pdf_key}: {e}")
+
+
+def load_pdf_documents(pdf_key):
+    """
+    Returns the stored page Documents of a PDF in page order, or None if the manifest or
+    any page is missing. Works offline once sync_to_local() has filled the disk cache.
+    """
+    page_keys = get_manifest(pdf_key)
+    if page_keys is None:
+        return None
+    documents = []
+    for page_key in page_keys:
+        document = get_document(page_key)
+        if document is None:
+            return None
+        documents.append(document)
+    return documents
+
+
+def sync_to_local():
+    """
+    Copies every stored object for the current processor into the local disk cache. Returns
+    the number downloaded. Objects past DOCAI_STORE_CACHE_MAX_BYTES are evicted again, so set
+    it to 0 (or large enough) to mirror the whole store.
+    """
+    if not DOCAI_STORE_CACHE_DIR:
+        raise ValueError("DOCAI_STORE_CACHE_DIR is not set")
+    s3_client = get_s3_client()
+    prefix = f"{DOCAI_STORE_PREFIX}{PROCESSOR_ID}/"
+    downloaded = 0
+    continuation_token = None
+    while True:
+        kwargs = {"Bucket": DOCAI_STORE_BUCKET, "Prefix": prefix}
+        if continuation_token:
+            kwargs["ContinuationToken"] = continuation_token
+        response = s3_client.list_objects_v2(**kwargs)
+        for obj in response.get("Contents", []):
+            if not os.path.exists(_local_path(obj["Key"])):
+                data = s3_client.get_object(Bucket=DOCAI_STORE_BUCKET, Key=obj["Key"])["Body"].read()
+                _write_local(obj["Key"], data)
+                downloaded += 1
+        if not response.get("IsTruncated"):
+            return downloaded
+        continuation_token = response["NextContinuationToken"]
+
+
+def layout_text(document, layout) -> str:
+    """Text covered by a layout's text anchor."""
+    return "".join(document.text[int(segment.start_index):int(segment.end_index)]
+                   for segment in layout.text_anchor.text_segments)
+
+
+def document_tables(document) -> list:
+    """Tables of every page as {"page", "header_rows", "body_rows"} with rows of cell text."""
+    tables = []
+    for page in document.pages:
+        for table in page.tables:
+            tables.append({
+                "page": page.page_number,
+                "header_rows": [[layout_text(document, cell.layout).strip() for cell in row.cells] for row in table.header_rows],
+                "body_rows": [[layout_text(document, cell.layout).strip() for cell in row.cells] for row in table.body_rows],
+            })
+    return tables
+
+
+def document_paragraphs(document) -> list:
+    """Paragraphs of every page as {"page", "text", "bounding_box"} with normalized (x, y) vertices."""
+    paragraphs = []
+    for page in document.pages:
+        for paragraph in page.paragraphs:
+            vertices = [(vertex.x, vertex.y) for vertex in paragraph.layout.bounding_poly.normalized_vertices]
+            paragraphs.append({"page": page.page_number, "text": layout_text(document, paragraph.layout),
+                               "bounding_box": vertices})
+    return paragraphs
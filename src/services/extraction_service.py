@@ -1,115 +1,86 @@
-import boto3
 from io import BytesIO
-import json
 import os
+import pypdf
 from pypdf import PdfReader, PdfWriter
 import google.cloud.documentai_v1 as documentai
-import google.generativeai as genai
+from services import docai_store
+from services import pdf_splitter
+from services import text_layer
+from services.governor import get_governor
+from services.client_provider import get_documentai_client, get_s3_client
+from services.metrics import PAGES, timed
 
 """ This service is responsible for extracting content from PDF files and preparing
 it for storage in Weaviate. """
 
 
-# Configure AWS, Gemini API and Google Cloud Document AI credentials
-AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
-AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
-AWS_REGION_NAME = os.getenv("AWS_REGION_NAME")
+# Configure AWS and Google Cloud Document AI settings; credentials and clients come from client_provider
 S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
 # Google Cloud Document AI Configuration
 PROJECT_ID = os.getenv("GOOGLE_CLOUD_PROJECT_ID")
 PROCESSOR_ID = os.getenv("GOOGLE_DOCUMENT_AI_PROCESSOR_ID")
 PROCESSOR_LOCATION = os.getenv("GOOGLE_DOCUMENT_AI_PROCESSOR_LOCATION")
-GOOGLE_SERVICE_ACCOUNT_SECRET_NAME = os.getenv("GOOGLE_SERVICE_ACCOUNT_SECRET_NAME")
-
-genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel('gemini-2.0-flash')
-
-def get_s3_client():
-    """Creates and returns an S3 client."""
-    return boto3.client(
-        's3',
-        aws_access_key_id=AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-        region_name=AWS_REGION_NAME
-    )
-def get_secretmanager_client():
-    """Creates and returns a secretmanager client."""
-    return boto3.client(
-        'secretsmanager',
-        aws_access_key_id=AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-        region_name=AWS_REGION_NAME
-    )
-def get_documentai_client():
-    """Creates and returns a Document AI client."""
-     # Instantiates a client
-    if google_service_account_info: # Use service account credentials if available
-        try:
-            client = documentai.DocumentProcessorServiceClient.from_service_account_info(google_service_account_info)
-        except Exception as e:
-            print(f"Error creating Document AI client with service account: {e}")
-            raise e
-    else: # Fallback to default credentials (e.g., for local dev if ADC is configured)
-        print("Using default Google Cloud credentials for Document AI client.")
-        client = documentai.DocumentProcessorServiceClient()
-    return client
-
-# setup Google credentials for Document AI 
-try:
-        
-    service_account_key_json_str = get_secretmanager_client().get_secret_value(SecretId=GOOGLE_SERVICE_ACCOUNT_SECRET_NAME)    
-    if service_account_key_json_str:
-        super_secret = service_account_key_json_str['SecretString']
-        google_service_account_info = json.loads(str(super_secret))
-    else:
-        google_service_account_info = None
-        print("Warning: google-service-account-key-prod secret not parsed. Falling back to default credentials.")
-except Exception as e:
-    print(f"Error loading Google Service Account key: {e}")
-    print("Exception loading google service account, will try default credentials")
+
+# Bump whenever this module changes what it extracts, so stored chunks of older extractions can be found
+EXTRACTOR_VERSION = "2"
+
+# Extract pages with a usable text layer locally and send only the rest to Document AI
+EXTRACTION_ROUTER_ENABLED = os.getenv("EXTRACTION_ROUTER_ENABLED", "true").lower() == "true"
+
+ROUTE_PYPDF = "pypdf"
+ROUTE_DOCUMENTAI = "documentai"
+
+
+class PageRoute:
+    """The path one page took through the extraction router, and why."""
+
+    __slots__ = ("page_num", "method", "reason", "quality")
+
+    def __init__(self, page_num, method, reason, quality):
+        self.page_num = page_num
+        self.method = method
+        self.reason = reason
+        self.quality = quality
+
+    @property
+    def ocr(self):
+        return self.method == ROUTE_DOCUMENTAI
+
+    def __repr__(self):
+        return f"PageRoute({self.page_num}, {self.method!r}, {self.reason!r}, {self.quality!r})"
+
+
+def extractor_version(use_document_ai=False) -> str:
+    """Identifies the extractor behind stored chunks: method, its version and EXTRACTOR_VERSION."""
+    if use_document_ai:
+        return f"documentai:{PROCESSOR_ID}:v{EXTRACTOR_VERSION}"
+    return f"pypdf:{pypdf.__version__}:v{EXTRACTOR_VERSION}"
 
 
 def extract_and_chunk(pdf_file_bytes, chunk_len=0, use_document_ai=False) -> list:
     """
         Extracts content from a PDF file and returns a list of chunks.
-        pdf_file_bytes: Bytes of the PDF file to process
+        pdf_file_bytes: Bytes of the PDF file to process, or a memory-mapped file / file object
         chunk_len: Maximum length of each chunk (0 for one chunk per page)
     """
     try:
         if chunk_len != 0:
             raise NotImplementedError("Chunking is not implemented yet.")
+        if use_document_ai and EXTRACTION_ROUTER_ENABLED:
+            return extract_pages_routed(pdf_file_bytes)[0]
         if use_document_ai:
-            document_ai_client = get_documentai_client()
-        else:
-            document_ai_client = None
+            return extract_pages_with_document_ai(pdf_file_bytes)
         chunk_list = []
-        pdf_texts = []
-        pdf_reader = PdfReader(BytesIO(pdf_file_bytes))
+        pdf_reader = open_pdf(pdf_file_bytes)
         page_count = len(pdf_reader.pages)
-        extracted_text_pages = []
-        for page_num in range(page_count):
-            page = pdf_reader.pages[page_num]
-            if document_ai_client:
-                print(f"Extracting from {page_num} of {page_count} pages with Document AI.")
-                # Extract content of each page to bytes
-                with BytesIO() as page_bytes_stream:
-                    writer = PdfWriter()  # Create a NEW PdfWriter object here                                    
-                    writer.add_page(page)
-                    writer.write(page_bytes_stream)
-                    page_content_bytes = page_bytes_stream.getvalue()
-                    page_text = process_pdf_with_document_ai(page_content_bytes, document_ai_client) # Process each page as PDF bytes
-            else:
-                print(f"Extracting from {page_num} of {page_count} pages with pypdf.")
-                page_text = page.extract_text() # use Pypdf temporarily            
+        for page_num, page in iter_pages(pdf_reader):
+            print(f"Extracting from {page_num} of {page_count} pages with pypdf.")
+            with timed("pypdf_extract"):
+                page_text = page.extract_text() # use Pypdf temporarily
+            PAGES.inc(method="pypdf")
             # SAVE TO CHUNKS LIST HERE
             chunk_list.append(page_text)
-            #extracted_text_pages.append(page_text)
-
-        #extracted_text = "\n".join(extracted_text_pages) # Join text from all pages
-        #pdf_texts.append(extracted_text)
-        #save_text_to_s3(s3_client, S3_BUCKET_NAME, pdf_key, extracted_text) # Save text to S3
     except Exception as e:
         raise e
         #print(f"Error processing {pdf_key} with Document AI page by page: {e}")
@@ -117,8 +88,150 @@ def extract_and_chunk(pdf_file_bytes, chunk_len=0, use_document_ai=False) -> lis
     return chunk_list
 
 
+def extract_pages_with_document_ai(pdf_file_bytes, document_ai_client=None) -> list:
+    """
+        Extracts a PDF page by page with Document AI and returns the page texts.
+        Pages already in the Document AI store are not sent again; when every page of the PDF
+        is stored the PDF is not even split, and no Document AI client is created.
+        document_ai_client: Client to use on store misses (defaults to the shared client)
+    """
+    pdf_key = docai_store.content_key(pdf_file_bytes)
+    documents = docai_store.load_pdf_documents(pdf_key)
+    if documents is not None:
+        PAGES.inc(len(documents), method="documentai_store")
+        return [document.text for document in documents]
+
+    pdf_reader = open_pdf(pdf_file_bytes)
+    page_count = len(pdf_reader.pages)
+    split = page_splitter(pdf_reader)
+    page_texts = []
+    page_keys = []
+    for page_num, page in iter_pages(pdf_reader):
+        print(f"Extracting from {page_num} of {page_count} pages with Document AI.")
+        page_content_bytes = split(page_num, page)
+        document = process_page_with_document_ai(page_content_bytes, document_ai_client)
+        page_texts.append(document.text)
+        page_keys.append(docai_store.content_key(page_content_bytes))
+    docai_store.put_manifest(pdf_key, page_keys)
+    return page_texts
+
+
+def extract_pages_routed(pdf_file_bytes, page_numbers=None, document_ai_client=None, measured=None):
+    """
+        Extracts pages (all, or the given page numbers) choosing per page: the pypdf text layer
+        when text_layer judges it usable, Document AI otherwise. Returns (page texts, PageRoutes)
+        in page order; a page that goes to Document AI is still read from the store if it was
+        processed before.
+        document_ai_client: Client to use for OCR (defaults to the shared client)
+        measured: {page_num: (text, TextLayerQuality)} of pages already measured, which are
+        not extracted again
+    """
+    measured = measured or {}
+    pdf_reader = open_pdf(pdf_file_bytes)
+    split = page_splitter(pdf_reader)
+    page_texts = []
+    routes = []
+    for page_num, page in iter_pages(pdf_reader, page_numbers):
+        if page_num in measured:
+            page_text, quality = measured[page_num]
+        else:
+            with timed("pypdf_extract"):
+                page_text, quality = text_layer.measure_page(page)
+        reason = text_layer.ocr_reason(quality)
+        if reason is None:
+            PAGES.inc(method="pypdf")
+            routes.append(PageRoute(page_num, ROUTE_PYPDF, None, quality))
+        else:
+            print(f"Extracting page {page_num} with Document AI ({reason}).")
+            page_text = process_page_with_document_ai(split(page_num, page), document_ai_client).text
+            routes.append(PageRoute(page_num, ROUTE_DOCUMENTAI, reason, quality))
+        page_texts.append(page_text)
+    ocr_pages = sum(1 for route in routes if route.ocr)
+    print(f"Routed {len(routes)} pages: {len(routes) - ocr_pages} from the text layer, {ocr_pages} to Document AI.")
+    return page_texts, routes
+
+
+def extract_selected_pages_with_document_ai(pdf_file_bytes, page_numbers, document_ai_client=None) -> dict:
+    """
+        Extracts only the given pages with Document AI (for example the pages that are not
+        duplicates of already ingested ones). Returns {page_number: text}.
+    """
+    pdf_reader = open_pdf(pdf_file_bytes)
+    split = page_splitter(pdf_reader)
+    page_texts = {}
+    for page_num, page in iter_pages(pdf_reader, page_numbers):
+        print(f"Extracting page {page_num} with Document AI.")
+        document = process_page_with_document_ai(split(page_num, page), document_ai_client)
+        page_texts[page_num] = document.text
+    return page_texts
+
+
+def open_pdf(pdf_source) -> PdfReader:
+    """
+        Opens a PDF from bytes, a memory-mapped file or a seekable file object. pypdf reads
+        objects on demand, so a memory-mapped file is never copied onto the heap.
+    """
+    if isinstance(pdf_source, (bytes, bytearray, memoryview)):
+        pdf_source = BytesIO(pdf_source)
+    return PdfReader(pdf_source)
+
+
+def iter_pages(pdf_reader, page_numbers=None):
+    """
+        Yields (page_num, page) and drops pypdf's resolved-object cache after each page, so
+        the content streams and resources of finished pages are freed as extraction goes.
+    """
+    for page_num in range(len(pdf_reader.pages)) if page_numbers is None else page_numbers:
+        yield page_num, pdf_reader.pages[page_num]
+        pdf_reader.resolved_objects.clear()
+
+
+def page_splitter(pdf_reader):
+    """
+        Returns split(page_num, page) -> bytes of that page as a standalone PDF. Pages share one
+        PdfSplitter, which serializes each shared resource once for the whole PDF; PDF_SPLITTER=writer
+        (or an encrypted PDF) uses a PdfWriter per page instead.
+    """
+    if pdf_splitter.PDF_SPLITTER == "writer" or pdf_reader.is_encrypted:
+        return lambda page_num, page: split_page(page)
+    splitter = pdf_splitter.PdfSplitter(pdf_reader)
+
+    def split(page_num, page):
+        with timed("page_split"):
+            return splitter.part([page_num])
+    return split
+
+
+def split_page(page) -> bytes:
+    """Returns one page of an open PDF as a standalone single-page PDF, with a PdfWriter of its own."""
+    # Extract content of each page to bytes
+    with timed("page_split"), BytesIO() as page_bytes_stream:
+        writer = PdfWriter()  # Create a NEW PdfWriter object here
+        writer.add_page(page)
+        writer.write(page_bytes_stream)
+        return page_bytes_stream.getvalue()
+
+
+def process_page_with_document_ai(file_content: bytes, document_ai_client=None):
+    """Returns the full Document AI result for a PDF page, from the store if it was processed before."""
+    key = docai_store.content_key(file_content)
+    document = docai_store.get_document(key)
+    if document is not None:
+        PAGES.inc(method="documentai_store")
+        return document
+    document = call_document_ai(file_content, document_ai_client or get_documentai_client())
+    PAGES.inc(method="documentai")
+    docai_store.put_document(key, document)
+    return document
+
+
 def process_pdf_with_document_ai(file_content: bytes, document_ai_client) -> str:
     """Processes a single PDF file content (or a page) using Google Document AI and returns extracted text."""
+    return process_page_with_document_ai(file_content, document_ai_client).text
+
+
+def call_document_ai(file_content: bytes, document_ai_client):
+    """Sends PDF bytes to the Document AI processor and returns the resulting documentai.Document."""
    
     # The full resource name of the processor, e.g.:
     # projects/project-id/locations/location/processors/processor-id
@@ -130,16 +243,14 @@ def process_pdf_with_document_ai(file_content: bytes, document_ai_client) -> str
     # Configure the process request
     request = documentai.ProcessRequest(name=name, raw_document=raw_document_object) # Use raw_document parameter
     try:
-        # Recognizes text in the PDF document
-        result = document_ai_client.process_document(request=request)
+        # Recognizes text in the PDF document; the governor handles quota, retries and the circuit breaker
+        with timed("documentai"):
+            result = get_governor("documentai").call(document_ai_client.process_document, request=request)
         document_object = result.document
-        document_text = document_object.text
-        document_pages = document_object.pages
-        for page in document_pages:
+        for page in document_object.pages:
             if page.tables:
                 print(f"Page {page.page_number} has {len(page.tables)} tables.")
-        return document_text
+        return document_object
     except Exception as e:
         print(f"Error processing PDF with Document AI: {e}")
         raise e
-
@@ -0,0 +1,90 @@
+import hashlib
+import re
+
+""" Text fingerprinting helpers shared by the context assembler and ingestion:
+normalization, exact content hashes and 64-bit SimHash for near-duplicate detection. """
+
+SIMHASH_BITS = 64
+# Bands stored per page fingerprint (page_fingerprints.band0-3), so near duplicates are only
+# guaranteed to be found within SIMHASH_BANDS - 1 bits
+SIMHASH_BANDS = 4
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Per-lane counter width; supports up to 2**32 - 1 shingles per text without overflow
+_LANE_BITS = 32
+
+
+def _build_spread_tables():
+    # _SPREAD[i][b] places bit j of byte b (the i-th most significant byte) into lane 8 * (7 - i) + j
+    tables = []
+    for byte_index in range(8):
+        base_bit = 8 * (7 - byte_index)
+        table = []
+        for byte in range(256):
+            spread = 0
+            for j in range(8):
+                if byte & (1 << j):
+                    spread |= 1 << ((base_bit + j) * _LANE_BITS)
+            table.append(spread)
+        tables.append(table)
+    return tables
+
+
+_SPREAD = _build_spread_tables()
+
+
+def normalize_text(text: str) -> str:
+    """Lowercases text and collapses whitespace so trivial layout differences hash the same."""
+    return " ".join(_WORD_RE.findall(text.lower()))
+
+
+def content_hash(text: str) -> str:
+    """Returns the sha256 hex digest of the normalized text."""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def simhash(text: str, shingle_size=3) -> int:
+    """
+    Computes a 64-bit SimHash over word shingles of the normalized text.
+    Texts that share most of their shingles end up a small Hamming distance apart.
+    """
+    words = normalize_text(text).split()
+    if not words:
+        return 0
+    if len(words) < shingle_size:
+        shingles = [" ".join(words)]
+    else:
+        shingles = [" ".join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1)]
+
+    # Count set bits per position for all shingles at once: every hash is spread into 64
+    # lanes of _LANE_BITS bits inside one big integer, so a shingle costs 8 table lookups
+    # and additions instead of 64 per-bit updates.
+    lanes = 0
+    for shingle in shingles:
+        h = hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest()
+        for byte_index in range(8):
+            lanes += _SPREAD[byte_index][h[byte_index]]
+
+    half = len(shingles) / 2
+    lane_mask = (1 << _LANE_BITS) - 1
+    value = 0
+    for bit in range(SIMHASH_BITS):
+        if (lanes >> (bit * _LANE_BITS)) & lane_mask > half:
+            value |= 1 << bit
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """Number of differing bits between two fingerprints."""
+    return bin(a ^ b).count("1")
+
+
+def simhash_bands(value: int, bands=SIMHASH_BANDS):
+    """
+    Splits a fingerprint into equal bit bands. Two fingerprints within (bands - 1) bits
+    of each other are guaranteed to share at least one band, which makes bands usable as
+    lookup keys for near-duplicate candidates.
+    """
+    width = SIMHASH_BITS // bands
+    mask = (1 << width) - 1
+    return [(band, (value >> (band * width)) & mask) for band in range(bands)]
@@ -0,0 +1,334 @@
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from services import metrics
+
+""" Shared governor for outbound calls to Google APIs (Document AI, Gemini). Each API gets
+a token bucket for its quota, an AIMD concurrency limit that backs off on 429s, retries
+with exponential backoff and jitter on retryable gRPC codes, and a circuit breaker that
+fails fast while the backend is degraded. """
+
+logger = logging.getLogger(__name__)
+
+# gRPC status codes worth retrying; RESOURCE_EXHAUSTED is also treated as a throttle signal
+RETRYABLE_STATUS_CODES = {"RESOURCE_EXHAUSTED", "UNAVAILABLE", "DEADLINE_EXCEEDED", "INTERNAL", "ABORTED", "UNKNOWN"}
+RETRYABLE_HTTP_CODES = {429, 500, 502, 503, 504}
+THROTTLE_STATUS_CODES = {"RESOURCE_EXHAUSTED"}
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the circuit breaker is open."""
+
+
+def _status_name(exc):
+    code = getattr(exc, "grpc_status_code", None)
+    if code is None:
+        code = getattr(exc, "code", None)
+        if callable(code):  # grpc.RpcError exposes code() as a method
+            try:
+                code = code()
+            except Exception:
+                code = None
+    if code is None:
+        return None
+    return getattr(code, "name", code)
+
+
+def is_throttle(exc) -> bool:
+    status = _status_name(exc)
+    return status in THROTTLE_STATUS_CODES or status == 429
+
+
+def is_retryable(exc) -> bool:
+    status = _status_name(exc)
+    return status in RETRYABLE_STATUS_CODES or status in RETRYABLE_HTTP_CODES
+
+
+class TokenBucket:
+    """Classic token bucket: refills at rate tokens/second up to capacity."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens=1.0):
+        """Blocks until tokens are available."""
+        while True:
+            with self.lock:
+                self._refill(time.monotonic())
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def available(self) -> float:
+        with self.lock:
+            self._refill(time.monotonic())
+            return self.tokens
+
+
+class AIMDLimiter:
+    """
+    Concurrency limit with additive increase on success and multiplicative decrease on throttling.
+    A burst of throttles from calls that were in flight together decreases the limit once: only
+    calls started after the last decrease can decrease it again.
+    """
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = 64, decrease_factor: float = 0.5):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        # Number of decreases so far; each call carries the value it started under
+        self.decreases = 0
+        self.condition = threading.Condition()
+
+    def acquire(self) -> int:
+        """Blocks until a slot is free. Returns the ticket to pass to release."""
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+            return self.decreases
+
+    def release(self, ticket: int, throttled=False):
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                if ticket == self.decreases:
+                    self.limit = max(self.minimum, self.limit * self.decrease_factor)
+                    self.decreases += 1
+            else:
+                # Roughly +1 per window of `limit` successful calls
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self.condition.notify_all()
+
+
+class CircuitBreaker:
+    """
+    Opens when the error rate over a rolling time window crosses a threshold, rejects calls
+    while open, then lets a single probe through (half-open) after the cool-down.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, error_threshold=0.5, min_calls=10, window_seconds=30.0, cool_down_seconds=15.0):
+        self.error_threshold = error_threshold
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.cool_down_seconds = cool_down_seconds
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.outcomes = deque()
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cool_down_seconds:
+                self.state = self.HALF_OPEN
+                self.probe_in_flight = False
+            if self.state == self.HALF_OPEN and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            return False
+
+    def record(self, success: bool):
+        with self.lock:
+            now = time.monotonic()
+            if self.state == self.HALF_OPEN:
+                self.probe_in_flight = False
+                if success:
+                    self.state = self.CLOSED
+                    self.outcomes.clear()
+                else:
+                    self._open(now)
+                return
+            self.outcomes.append((now, success))
+            while self.outcomes and now - self.outcomes[0][0] > self.window_seconds:
+                self.outcomes.popleft()
+            if len(self.outcomes) >= self.min_calls:
+                failures = sum(1 for _, ok in self.outcomes if not ok)
+                if failures / len(self.outcomes) >= self.error_threshold:
+                    self._open(now)
+
+    def record_neutral(self):
+        """A call whose outcome says nothing about backend health: not counted, and a half-open probe stays half open."""
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                # Let the next call probe instead
+                self.probe_in_flight = False
+
+    def _open(self, now):
+        if self.state != self.OPEN:
+            logger.warning("Circuit breaker opened")
+        self.state = self.OPEN
+        self.opened_at = now
+        self.outcomes.clear()
+
+
+class Governor:
+    """Rate limits, retries and circuit-breaks calls to one external API."""
+
+    def __init__(self, name, rate_per_second, burst, initial_concurrency=4, max_concurrency=32,
+                 max_attempts=5, base_delay=0.5, max_delay=30.0, breaker=None, sleep=time.sleep):
+        self.name = name
+        self.bucket = TokenBucket(rate_per_second, burst)
+        self.limiter = AIMDLimiter(initial_concurrency, maximum=max_concurrency)
+        self.breaker = breaker or CircuitBreaker()
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.stats_lock = threading.Lock()
+        self.stats = {"calls": 0, "successes": 0, "failures": 0, "retries": 0, "throttled": 0, "rejected": 0}
+
+    def _count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def backoff(self, attempt) -> float:
+        """Full-jitter exponential backoff for the given (0-based) retry attempt."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Calls fn(*args, **kwargs) under this API's quota, concurrency limit and circuit breaker.
+        Retryable errors are retried with backoff; the last error is re-raised.
+
+        Raises:
+            CircuitOpenError: If the breaker is open and the call was not attempted
+        """
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self._count("rejected")
+                raise CircuitOpenError(f"{self.name} circuit breaker is open")
+            self.bucket.acquire()
+            ticket = self.limiter.acquire()
+            self._count("calls")
+            throttled = False
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                throttled = is_throttle(e)
+                retryable = is_retryable(e)
+                # Client errors (bad request, permission) say nothing about backend health
+                if retryable:
+                    self.breaker.record(success=False)
+                else:
+                    self.breaker.record_neutral()
+                self._count("throttled" if throttled else "failures")
+                attempt += 1
+                if not retryable or attempt >= self.max_attempts:
+                    raise
+                delay = self.backoff(attempt - 1)
+                logger.info(f"{self.name} call failed ({e}); retry {attempt} in {delay:.2f}s")
+                self._count("retries")
+            else:
+                self.breaker.record(success=True)
+                self._count("successes")
+                return result
+            finally:
+                self.limiter.release(ticket, throttled=throttled)
+            self.sleep(delay)
+
+    def snapshot(self) -> dict:
+        """Current state for metrics and diagnostics."""
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats.update({
+            "tokens_available": round(self.bucket.available(), 2),
+            "concurrency_limit": round(self.limiter.limit, 2),
+            "in_flight": self.limiter.in_flight,
+            "circuit_state": self.breaker.state,
+        })
+        return stats
+
+
+# Per-API defaults; tune to the project's quota with environment variables
+# Rates and bursts below are per task. Each gunicorn worker has its own governors, so each gets
+# its share of them (gunicorn.conf.py exports the worker count as WEB_CONCURRENCY).
+GOVERNOR_WORKERS = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+
+
+def _per_worker(rate_per_second, burst, initial_concurrency):
+    return {
+        "rate_per_second": rate_per_second / GOVERNOR_WORKERS,
+        # At least one whole token, or no call could ever start
+        "burst": max(1.0, burst / GOVERNOR_WORKERS),
+        "initial_concurrency": initial_concurrency,
+    }
+
+
+GOVERNOR_CONFIG = {
+    "documentai": _per_worker(
+        rate_per_second=float(os.getenv("DOCUMENT_AI_RATE_PER_SECOND", "10")),
+        burst=float(os.getenv("DOCUMENT_AI_BURST", "20")),
+        initial_concurrency=int(os.getenv("DOCUMENT_AI_CONCURRENCY", "8")),
+    ),
+    "gemini": _per_worker(
+        rate_per_second=float(os.getenv("GEMINI_RATE_PER_SECOND", "20")),
+        burst=float(os.getenv("GEMINI_BURST", "20")),
+        initial_concurrency=int(os.getenv("GEMINI_CONCURRENCY", "8")),
+    ),
+}
+
+_governors = {}
+_governors_lock = threading.Lock()
+
+
+def get_governor(name) -> Governor:
+    """Returns the process-wide governor for an API, creating it on first use."""
+    with _governors_lock:
+        if name not in _governors:
+            _governors[name] = Governor(name, **GOVERNOR_CONFIG.get(name, {"rate_per_second": 10, "burst": 10}))
+        return _governors[name]
+
+
+def governor_snapshots() -> dict:
+    with _governors_lock:
+        governors = list(_governors.values())
+    return {governor.name: governor.snapshot() for governor in governors}
+
+
+_CIRCUIT_STATE_VALUES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
+
+def _collect_governor_metrics():
+    snapshots = governor_snapshots()
+    counters = ["calls", "successes", "failures", "retries", "throttled", "rejected"]
+    families = [
+        (f"governor_{name}_total", "counter", f"Outbound API {name} seen by the governor.",
+         [({"api": api}, snapshot[name]) for api, snapshot in snapshots.items()])
+        for name in counters
+    ]
+    families += [
+        ("governor_tokens_available", "gauge", "Tokens left in the API rate limit bucket.",
+         [({"api": api}, snapshot["tokens_available"]) for api, snapshot in snapshots.items()]),
+        ("governor_concurrency_limit", "gauge", "Current AIMD concurrency limit.",
+         [({"api": api}, snapshot["concurrency_limit"]) for api, snapshot in snapshots.items()]),
+        ("governor_in_flight", "gauge", "Calls currently in flight.",
+         [({"api": api}, snapshot["in_flight"]) for api, snapshot in snapshots.items()]),
+        ("governor_circuit_state", "gauge", "Circuit breaker state (0 closed, 1 half-open, 2 open).",
+         [({"api": api}, _CIRCUIT_STATE_VALUES[snapshot["circuit_state"]]) for api, snapshot in snapshots.items()]),
+    ]
+    return families
+
+
+metrics.REGISTRY.register_collector(_collect_governor_metrics)
@@ -2,10 +2,19 @@ import logging
 from database.dao.DocumentDAO import DocumentDAO
 from services import extraction_service
 from services import weaviate_service
+from services import lexical_index
+from services import dedup_service
+from services import manifest_service
+from services import page_text_store
+from services import chunk_store
 from database.dao import DocumentRecord
+from services.metrics import CHUNKS, PAGES, timed
+from services.profiling import profile_request
 
 class IngestionService:
-    def __init__(self, weaviate_client, document_dao, extraction_service_module=None, weaviate_service_module=None, logger=None):
+    def __init__(self, weaviate_client, document_dao, extraction_service_module=None, weaviate_service_module=None, logger=None,
+                 lexical_index_module=None, fingerprint_dao=None, use_document_ai=False, manifest_dao=None,
+                 chunk_dao=None, s3_client=None):
         """
         Initialize the ingestion service with dependencies
         
@@ -15,12 +24,25 @@ class IngestionService:
             logger: Logger instance (will create one if not provided)
             extraction_service_module: Module for extraction services (for testing)
             weaviate_service_module: Module for weaviate services (for testing)
+            lexical_index_module: Module for the per-project BM25 index (for testing)
+            fingerprint_dao: PageFingerprintDAO; enables reuse of already ingested duplicate pages
+            use_document_ai: Extract new pages with Document AI instead of the PDF text layer
+            manifest_dao: ManifestDAO; links ingested S3 objects to their document in the project manifest
+            chunk_dao: ChunkDAO; stores the extracted chunks in Postgres, the source for rebuilding indexes
+            s3_client: S3 client; saves the page text next to an S3 document, so queries read it instead of extracting again
         """
         self.document_dao = document_dao
         self.weaviate_client = weaviate_client
         self.logger = logger if logger is not None else logging.getLogger(__name__)
         self.extraction_service = extraction_service_module or extraction_service
         self.weaviate_service = weaviate_service_module or weaviate_service
+        self.lexical_index = lexical_index_module or lexical_index
+        self.fingerprint_dao = fingerprint_dao
+        self.use_document_ai = use_document_ai
+        self.manifest_dao = manifest_dao
+        self.chunk_dao = chunk_dao
+        self.s3_client = s3_client
+        self.last_profile_id = None
 
     def __enter__(self):
         return self
@@ -28,25 +50,44 @@ class IngestionService:
     def __exit__(self, exc_type, exc_val, exc_tb):
         return      
 
-    def ingest_document(self, document_record: DocumentRecord, document_bytes, allow_reingest = False):
+    def ingest_document(self, document_record: DocumentRecord, document_bytes, allow_reingest = False, profile = False):
         """
         Process a document through the full ingestion pipeline:
         1. Store document metadata in PostgreSQL
-        2. Extract content into chunks
+        2. Extract content into chunks, and store them in the chunk store (when a chunk DAO is configured)
         3. Store chunks in Weaviate vector database
+        4. Add the pages to the project's lexical (BM25) index
+        5. Record page fingerprints (when a fingerprint DAO is configured)
+        6. Save the page text next to an S3 document (when an S3 client is configured) and link the
+           object to the document in the project manifest, marked extracted once its text is saved
+           (when a manifest DAO is configured)
         
         Args:
             document_record: DocumentRecord object containing document metadata
             document_bytes: Raw bytes of the document file
+            allow_reingest: Replace the chunks of an existing document
+            profile: Capture a sampling profile and stage timeline; the id is left in last_profile_id
             
         Returns:
             Document ID if successful, None if failed
         """
-        
+        if not profile:
+            return self._ingest_document(document_record, document_bytes, allow_reingest)
+        with profile_request(f"ingest {document_record.file_name}") as session:
+            self.last_profile_id = session.profile_id
+            result = self._ingest_document(document_record, document_bytes, allow_reingest)
+        self.logger.info(f"Ingestion profile stored: {session.profile_id}")
+        return result
+
+    def _ingest_document(self, document_record: DocumentRecord, document_bytes, allow_reingest):
         if allow_reingest and document_record.document_id:
             # Remove existing document and chunks
             self.logger.info(f"Re-ingesting document: {document_record.document_id}")
             self.weaviate_service.remove_document_chunks(self.weaviate_client, document_record.document_id)
+            if self.fingerprint_dao:
+                self.fingerprint_dao.delete_by_document(document_record.document_id)
+            if self.chunk_dao:
+                self.chunk_dao.delete_by_document(document_record.document_id)
             document_record = self.document_dao.update_document(document_record)
         else:
             if document_record.document_id:
@@ -61,17 +102,51 @@ class IngestionService:
         try:
             # Step 2: Extract content into chunks
             self.logger.info(f"Extracting content from document: {document_id}")
-            chunks = self.extraction_service.extract_and_chunk(document_bytes, 0)
+            fingerprints = None
+            vectors = None
+            routes = {}
+            with timed("extraction"):
+                if self.fingerprint_dao:
+                    chunks, vectors, fingerprints, routes = self._extract_reusing_duplicates(document_record, document_bytes)
+                elif self._routed():
+                    chunks, page_routes = self.extraction_service.extract_pages_routed(document_bytes)
+                    routes = {route.page_num: route for route in page_routes}
+                else:
+                    chunks = self.extraction_service.extract_and_chunk(document_bytes, 0, use_document_ai=self.use_document_ai)
 
             if not chunks:
                 self.logger.warning(f"No content chunks extracted from document: {document_id}")
                 return document_id
+
+            # The chunk store is the source of truth the indexes below can be rebuilt from
+            # (recording, per page, whether the router sent it to Document AI)
+            if self.chunk_dao:
+                default_version = self.extraction_service.extractor_version(self.use_document_ai)
+                versions = [self.extraction_service.extractor_version(routes[page_num].ocr) if page_num in routes
+                            else default_version for page_num in range(len(chunks))]
+                chunk_store.store_chunks(self.chunk_dao, document_record, chunks, versions)
             
             # Step 3: Store chunks in Weaviate            
             self.logger.info(f"Storing {len(chunks)} chunks in Weaviate for document: {document_id}")
               
             # Store chunk in Weaviate
-            self.weaviate_service.insert_document_chunks(self.weaviate_client, document_record, chunks)
+            self.weaviate_service.insert_document_chunks(self.weaviate_client, document_record, chunks, vectors)
+            CHUNKS.inc(len(chunks), destination="weaviate")
+
+            # Step 4: Index pages for keyword search; a new segment replaces any earlier version
+            self.lexical_index.add_document(document_record.project_id, document_id, document_record.file_name, chunks)
+            CHUNKS.inc(len(chunks), destination="lexical_index")
+
+            # Step 5: Record page fingerprints so later reissues of these pages are recognized
+            if fingerprints:
+                self.fingerprint_dao.create_fingerprints(fingerprints)
+
+            # Step 6: Keep the project manifest fresh for query planning; with the page text saved,
+            # the first query after ingestion reads it instead of extracting the PDF again
+            bucket, s3_key = manifest_service.s3_location_from_url(document_record.source_url)
+            text_key = self._save_page_text(bucket, s3_key, chunks) if s3_key else None
+            if self.manifest_dao and s3_key:
+                self.manifest_dao.record_ingestion(s3_key, document_record.project_id, document_id, len(chunks), text_key)
             
             self.logger.info(f"Document ingestion completed successfully: {document_id}")
             return document_id
@@ -80,3 +155,70 @@ class IngestionService:
             self.logger.error(f"Error ingesting document: {e}")
             return None
 
+    def _save_page_text(self, bucket, s3_key, page_texts):
+        """Saves the pages next to the PDF, as extraction at query time does. Returns the key, or None if not saved."""
+        if not self.s3_client:
+            return None
+        try:
+            return page_text_store.save_pages(self.s3_client, bucket, s3_key, page_texts)
+        except Exception as e:
+            self.logger.error(f"Error saving page text for {s3_key}: {e}")
+            return None
+
+    def _routed(self):
+        """Whether Document AI extraction goes through the per-page router."""
+        return self.use_document_ai and self.extraction_service.EXTRACTION_ROUTER_ENABLED
+
+    def _extract_reusing_duplicates(self, document_record: DocumentRecord, document_bytes):
+        """
+        Extracts one chunk per page, reusing the extraction and vector of pages that duplicate
+        already ingested pages of the project. Returns (chunks, vectors, fingerprints, routes);
+        vectors holds None for pages that must be embedded, and routes maps the page numbers of
+        new pages that went through the extraction router to their PageRoute.
+        """
+        project_id = document_record.project_id
+        document_id = document_record.document_id
+        # Routed extraction reuses the text layer and measurements of the fingerprint pass
+        pages = dedup_service.fingerprint_pages(document_bytes, project_id, document_id, measure=self._routed())
+        dedup_service.find_duplicates(self.fingerprint_dao, project_id, pages)
+
+        # A matched page whose Weaviate object no longer exists still reuses the extracted text
+        reused_uuids = {page.match.chunk_uuid for page in pages if page.match and page.match.chunk_uuid}
+        reused_vectors = self.weaviate_service.get_chunk_vectors(self.weaviate_client, reused_uuids)
+
+        new_page_numbers = [page.fingerprint.page_number for page in pages if page.match is None]
+        routes = {}
+        if self._routed():
+            measured = {number: (pages[number].text_layer, pages[number].quality) for number in new_page_numbers
+                        if pages[number].quality is not None}
+            new_page_texts, page_routes = self.extraction_service.extract_pages_routed(
+                document_bytes, new_page_numbers, measured=measured)
+            new_texts = dict(zip(new_page_numbers, new_page_texts))
+            routes = {route.page_num: route for route in page_routes}
+        elif self.use_document_ai:
+            new_texts = self.extraction_service.extract_selected_pages_with_document_ai(document_bytes, new_page_numbers)
+        else:
+            new_texts = {page_number: pages[page_number].text_layer for page_number in new_page_numbers}
+            PAGES.inc(len(new_page_numbers), method="pypdf")
+
+        chunks, vectors, fingerprints = [], [], []
+        for page in pages:
+            fingerprint = page.fingerprint
+            if page.match:
+                fingerprint.extracted_text = page.match.extracted_text
+                fingerprint.duplicate_of = page.match.fingerprint_id
+                vectors.append(reused_vectors.get(str(page.match.chunk_uuid)))
+            else:
+                fingerprint.extracted_text = new_texts[fingerprint.page_number]
+                vectors.append(None)
+            fingerprint.chunk_uuid = self.weaviate_service.chunk_uuid(document_id, fingerprint.page_number)
+            chunks.append(fingerprint.extracted_text)
+            fingerprints.append(fingerprint)
+
+        duplicates = len(pages) - len(new_page_numbers)
+        reused = sum(1 for vector in vectors if vector)
+        PAGES.inc(duplicates, method="duplicate")
+        CHUNKS.inc(reused, destination="reused_vector")
+        self.logger.info(f"Document {document_id}: {duplicates} of {len(pages)} pages duplicate ingested pages, "
+                         f"{reused} vectors reused")
+        return chunks, vectors, fingerprints, routes
@@ -0,0 +1,369 @@
+import fcntl
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import threading
+from array import array
+from collections import Counter
+from services.metrics import timed
+
+""" This service is responsible for the per-project BM25 lexical index used for keyword-heavy
+queries: spec sections ("08 71 00"), sheet ids ("A-501") and door tags.
+
+A project index is a list of immutable segments, one per ingested document, under
+LEXICAL_INDEX_DIR/<project_id>/. Each segment has a JSON term dictionary
+(term -> [offset, postings]), a postings file of uint32 (page, term frequency) pairs and a
+page text file; postings and text are memory-mapped, so opening an index reads only the
+dictionary and queries touch only the postings of their terms.
+
+segments.json lists the live segments and tombstones ({document_id: segment number}: pages of
+that document in older segments are hidden). It is replaced atomically under a file lock,
+so ingestion in one process and queries in another always see a consistent index. Once there
+are more than LEXICAL_INDEX_MAX_SEGMENTS segments they are merged into one.
+
+LEXICAL_INDEX_DIR is local to the task: it starts empty on every new task or deploy and is not
+shared between tasks. The index is derived data: segments.json also records the chunk store's
+watermark for the project (largest chunk id and chunk count) when the index was last synced
+with it, and retrieval_service compares it with the store's to catch up with documents
+ingested through other tasks, rebuild after deletions, or drop the index of a project that no
+longer has chunks. """
+
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", "/tmp/lexical-index")
+LEXICAL_INDEX_MAX_SEGMENTS = int(os.getenv("LEXICAL_INDEX_MAX_SEGMENTS", "16"))
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+MANIFEST_NAME = "segments.json"
+BUILDING_PREFIX = ".building-"
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-./][a-z0-9]+)*")
+# MasterFormat section numbers: "08 71 00", "08 71 00.13", "087100"
+_SPEC_SECTION_RE = re.compile(r"\b(\d{2})\s(\d{2})\s(\d{2})(?:\.(\d{2}))?\b")
+
+# Guards only the dicts below; writers of one project serialize on that project's lock, so
+# an ingest or compaction never blocks searches or writers of other projects
+_lock = threading.RLock()
+_open_indexes = {}
+_writer_locks = {}
+
+
+def tokenize(text: str) -> list:
+    """
+    Lowercased word tokens. Compound identifiers are kept whole and also split into parts
+    ("a-501" gives "a-501", "a", "501"), and spaced spec section numbers are also emitted
+    in their compact form ("08 71 00" gives "087100"), so either spelling matches.
+    """
+    text = text.lower()
+    tokens = []
+    for token in _TOKEN_RE.findall(text):
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in re.split(r"[-./]", token) if part)
+    for match in _SPEC_SECTION_RE.finditer(text):
+        section = "".join(match.group(1, 2, 3))
+        tokens.append(section)
+        if match.group(4):
+            tokens.append(f"{section}.{match.group(4)}")
+    return tokens
+
+
+class LexicalHit:
+    def __init__(self, document_id, file_name, page, score, text):
+        self.document_id = document_id
+        self.file_name = file_name
+        self.page = page
+        self.score = score
+        self.text = text
+
+    def __repr__(self):
+        return f"LexicalHit({self.file_name!r}, page={self.page}, score={self.score:.3f})"
+
+
+def _map_file(path, typecode=None):
+    """Memory-maps a file read-only; empty files map to an empty buffer."""
+    if os.path.getsize(path) == 0:
+        return None, memoryview(array(typecode or "B"))
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    return mapped, view.cast(typecode) if typecode else view
+
+
+class Segment:
+    """A read-only, memory-mapped segment."""
+
+    def __init__(self, path, number):
+        self.path = path
+        self.number = number
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.vocab = meta["vocab"]
+        # docs: [document_id, file_name, page, length, text_offset, text_bytes]
+        self.docs = meta["docs"]
+        self._postings_map, self.postings = _map_file(os.path.join(path, "postings.bin"), "I")
+        self._text_map, self.text = _map_file(os.path.join(path, "text.bin"))
+
+    def postings_for(self, term):
+        entry = self.vocab.get(term)
+        if entry is None:
+            return ()
+        offset, count = entry
+        return self.postings[offset:offset + 2 * count].tolist()
+
+    def page_text(self, ordinal):
+        _, _, _, _, offset, length = self.docs[ordinal]
+        return bytes(self.text[offset:offset + length]).decode("utf-8")
+
+
+def write_segment(path, pages):
+    """
+    Writes a segment directory for pages given as (document_id, file_name, page, text) tuples.
+    The directory is built next to its final location and renamed into place; a failed
+    write removes its partial directory.
+    """
+    postings = {}
+    docs = []
+    text_bytes = bytearray()
+    for ordinal, (document_id, file_name, page, text) in enumerate(pages):
+        tokens = tokenize(text)
+        for term, frequency in Counter(tokens).items():
+            postings.setdefault(term, []).extend((ordinal, frequency))
+        encoded = text.encode("utf-8")
+        docs.append([document_id, file_name, page, len(tokens), len(text_bytes), len(encoded)])
+        text_bytes += encoded
+
+    vocab = {}
+    postings_array = array("I")
+    for term in sorted(postings):
+        vocab[term] = [len(postings_array), len(postings[term]) // 2]
+        postings_array.extend(postings[term])
+
+    tmp_path = tempfile.mkdtemp(dir=os.path.dirname(path), prefix=BUILDING_PREFIX)
+    try:
+        with open(os.path.join(tmp_path, "postings.bin"), "wb") as f:
+            postings_array.tofile(f)
+        with open(os.path.join(tmp_path, "text.bin"), "wb") as f:
+            f.write(text_bytes)
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump({"vocab": vocab, "docs": docs}, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+class ProjectIndex:
+    """Live view over a project's segments with the corpus statistics BM25 needs."""
+
+    def __init__(self, project_dir, manifest, segments):
+        self.project_dir = project_dir
+        self.manifest = manifest
+        self.segments = segments
+        deleted = manifest["deleted"]
+        # Per segment: whether each page is live, i.e. not hidden by a tombstone
+        self.live = []
+        lengths = []
+        for segment in segments:
+            live = [deleted.get(str(doc[0]), -1) <= segment.number for doc in segment.docs]
+            self.live.append(live)
+            lengths.extend(doc[3] for doc, is_live in zip(segment.docs, live) if is_live)
+        self.page_count = len(lengths)
+        self.watermark = manifest.get("watermark")
+        avg_length = (sum(lengths) / len(lengths)) if lengths else 1.0
+        self.norms = [[BM25_K1 * (1 - BM25_B + BM25_B * doc[3] / avg_length) for doc in segment.docs]
+                      for segment in segments]
+
+    def document_ids(self):
+        """Ids of the documents with live pages."""
+        return {doc[0] for segment, live in zip(self.segments, self.live)
+                for doc, is_live in zip(segment.docs, live) if is_live}
+
+    def search(self, query, k=10):
+        """Returns the top k pages for the query by BM25 score."""
+        terms = set(tokenize(query))
+        if not terms or not self.page_count:
+            return []
+        # Document frequencies are corpus-wide, so gather every segment's postings first
+        postings = {term: [segment.postings_for(term) for segment in self.segments] for term in terms}
+        scores = {}
+        for term, per_segment in postings.items():
+            df = sum(len(pairs) for pairs in per_segment) // 2
+            if not df:
+                continue
+            idf = math.log(1 + (self.page_count - df + 0.5) / (df + 0.5))
+            for seg_index, pairs in enumerate(per_segment):
+                live = self.live[seg_index]
+                norms = self.norms[seg_index]
+                for i in range(0, len(pairs), 2):
+                    ordinal, frequency = pairs[i], pairs[i + 1]
+                    if live[ordinal]:
+                        key = (seg_index, ordinal)
+                        scores[key] = scores.get(key, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + norms[ordinal])
+        hits = []
+        for (seg_index, ordinal), score in heapq.nlargest(k, scores.items(), key=lambda item: item[1]):
+            segment = self.segments[seg_index]
+            document_id, file_name, page, _, _, _ = segment.docs[ordinal]
+            hits.append(LexicalHit(document_id, file_name, page, score, segment.page_text(ordinal)))
+        return hits
+
+
+def _project_dir(project_id):
+    # int() so a project id can never name a path outside LEXICAL_INDEX_DIR
+    return os.path.join(LEXICAL_INDEX_DIR, str(int(project_id)))
+
+
+def _read_manifest(project_dir):
+    try:
+        with open(os.path.join(project_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"segments": [], "deleted": {}, "next_segment": 0}
+
+
+def _write_manifest(project_dir, manifest):
+    fd, tmp_path = tempfile.mkstemp(dir=project_dir, prefix=".manifest-")
+    with os.fdopen(fd, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, os.path.join(project_dir, MANIFEST_NAME))
+
+
+def _new_segment(project_dir, manifest):
+    """
+    Returns the number and name of the next segment. Called under the project's write lock,
+    so any segment directory the manifest does not list, and any half-built one, was left by
+    a writer that crashed before updating segments.json; both are removed so the name is free.
+    """
+    number = manifest["next_segment"]
+    name = f"seg-{number:08d}"
+    for entry in os.listdir(project_dir):
+        if entry.startswith(BUILDING_PREFIX) or (entry == name and name not in manifest["segments"]):
+            shutil.rmtree(os.path.join(project_dir, entry), ignore_errors=True)
+    return number, name
+
+
+class _ProjectWriteLock:
+    """Serializes index writers for one project across threads and processes."""
+
+    def __init__(self, project_id):
+        self.project_dir = _project_dir(project_id)
+
+    def __enter__(self):
+        os.makedirs(self.project_dir, exist_ok=True)
+        with _lock:
+            self._thread_lock = _writer_locks.setdefault(self.project_dir, threading.Lock())
+        self._thread_lock.acquire()
+        self._file = open(os.path.join(self.project_dir, ".lock"), "w")
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self.project_dir
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+        self._thread_lock.release()
+        return False
+
+
+def add_document(project_id, document_id, file_name, page_texts):
+    """
+    Indexes a document's pages as a new segment, replacing any previous version of the
+    document. Merges segments once there are more than LEXICAL_INDEX_MAX_SEGMENTS.
+    """
+    with timed("lexical_index_add"), _ProjectWriteLock(project_id) as project_dir:
+        manifest = _read_manifest(project_dir)
+        number, name = _new_segment(project_dir, manifest)
+        write_segment(os.path.join(project_dir, name),
+                      [(document_id, file_name, page, text) for page, text in enumerate(page_texts)])
+        manifest["segments"].append(name)
+        manifest["deleted"][str(document_id)] = number
+        manifest["next_segment"] = number + 1
+        _write_manifest(project_dir, manifest)
+        if len(manifest["segments"]) > LEXICAL_INDEX_MAX_SEGMENTS:
+            _compact(project_dir, manifest)
+
+
+def remove_document(project_id, document_id):
+    """Hides every indexed page of a document."""
+    with _ProjectWriteLock(project_id) as project_dir:
+        manifest = _read_manifest(project_dir)
+        manifest["deleted"][str(document_id)] = manifest["next_segment"]
+        _write_manifest(project_dir, manifest)
+
+
+def set_watermark(project_id, watermark):
+    """Records the chunk store's watermark the project's index is now in line with."""
+    with _ProjectWriteLock(project_id) as project_dir:
+        manifest = _read_manifest(project_dir)
+        manifest["watermark"] = watermark
+        _write_manifest(project_dir, manifest)
+
+
+def drop_project(project_id):
+    """Deletes a project's whole index; readers see no index once segments.json is gone."""
+    with _ProjectWriteLock(project_id) as project_dir:
+        try:
+            os.remove(os.path.join(project_dir, MANIFEST_NAME))
+        except FileNotFoundError:
+            pass
+        with _lock:
+            _open_indexes.pop(project_id, None)
+        shutil.rmtree(project_dir, ignore_errors=True)
+
+
+def compact(project_id):
+    """Merges all segments of a project into one, dropping deleted pages."""
+    with _ProjectWriteLock(project_id) as project_dir:
+        _compact(project_dir, _read_manifest(project_dir))
+
+
+def _compact(project_dir, manifest):
+    index = _load(project_dir, manifest)
+    pages = []
+    for segment, live in zip(index.segments, index.live):
+        for ordinal, doc in enumerate(segment.docs):
+            if live[ordinal]:
+                pages.append((doc[0], doc[1], doc[2], segment.page_text(ordinal)))
+    number, name = _new_segment(project_dir, manifest)
+    with timed("lexical_index_compact"):
+        write_segment(os.path.join(project_dir, name), pages)
+    old_segments = manifest["segments"]
+    _write_manifest(project_dir, {"segments": [name], "deleted": {}, "next_segment": number + 1,
+                                  "watermark": manifest.get("watermark")})
+    # Readers that still map the old files keep them until they reopen; unlinking is safe
+    for old in old_segments:
+        shutil.rmtree(os.path.join(project_dir, old), ignore_errors=True)
+
+
+def _load(project_dir, manifest, previous=None):
+    """Opens the manifest's segments, reusing already mapped ones from a previous index."""
+    reusable = {os.path.basename(segment.path): segment for segment in (previous.segments if previous else ())}
+    segments = [reusable.get(name) or Segment(os.path.join(project_dir, name), int(name.split("-")[1]))
+                for name in manifest["segments"]]
+    return ProjectIndex(project_dir, manifest, segments)
+
+
+def open_index(project_id):
+    """Returns the project's index, reopening it only when segments.json has been replaced."""
+    project_dir = _project_dir(project_id)
+    try:
+        stat = os.stat(os.path.join(project_dir, MANIFEST_NAME))
+    except FileNotFoundError:
+        return None
+    version = (stat.st_ino, stat.st_mtime_ns)
+    with _lock:
+        cached = _open_indexes.get(project_id)
+        if cached and cached[0] == version:
+            return cached[1]
+        index = _load(project_dir, _read_manifest(project_dir), cached[1] if cached else None)
+        _open_indexes[project_id] = (version, index)
+        return index
+
+
+def search(project_id, query, k=10):
+    """Top k pages of a project for the query by BM25; empty if the project has no index."""
+    with timed("lexical_search"):
+        index = open_index(project_id)
+        return index.search(query, k) if index else []
@@ -0,0 +1,159 @@
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from database.dao.ManifestRecord import ManifestRecord
+from services import page_text_store
+from services.metrics import timed
+
+""" This service is responsible for the project manifest: the Postgres table listing every PDF
+under a project's S3 prefix with its ETag, size, page count, extraction status and saved-text
+key. Queries and ingestion plan their work from it instead of listing S3 and probing for saved
+text on every request.
+
+The manifest is filled by a parallel, paginated listing (the first query of an unknown prefix,
+or the sync job below) and kept fresh by extraction, ingestion and the OneDrive sync as they
+run. A prefix is listed again once its last listing is older than MANIFEST_LISTING_TTL_SECONDS,
+so objects changed directly in S3 are picked up too; a prefix without PDFs is not listed on
+every query either. Saved text older than its PDF belongs to a replaced version and is not used. Run the sync
+job for a prefix whose objects changed outside the API:
+
+    PYTHONPATH=src python -m services.manifest_service <prefix> [<prefix> ...] """
+
+PROJECT_MANIFEST_ENABLED = os.getenv("PROJECT_MANIFEST_ENABLED", "true").lower() == "true"
+MANIFEST_LIST_WORKERS = int(os.getenv("MANIFEST_LIST_WORKERS", "8"))
+# 0 lists a prefix only once
+MANIFEST_LISTING_TTL_SECONDS = int(os.getenv("MANIFEST_LISTING_TTL_SECONDS", "3600"))
+
+MANIFEST_PENDING = "pending"
+MANIFEST_EXTRACTED = "extracted"
+MANIFEST_FAILED = "failed"
+
+
+def get_manifest_dao():
+    """A ManifestDAO on a new connection. psycopg2 is only imported when the manifest is used."""
+    from database.dbutil import Database
+    from database.dao.ManifestDAO import ManifestDAO
+    return ManifestDAO(Database())
+
+
+def text_key_for(pdf_key):
+    """The key of the saved extraction of a PDF (.pdf replaced with .pages)."""
+    return page_text_store.text_key_for(pdf_key)
+
+
+def s3_location_from_url(source_url):
+    """The (bucket, key) of an s3://bucket/key URL, or (None, None) for other sources."""
+    if not source_url or not source_url.startswith("s3://"):
+        return None, None
+    bucket, _, key = source_url[len("s3://"):].partition("/")
+    return (bucket, key) if bucket and key else (None, None)
+
+
+def s3_key_from_url(source_url):
+    """The object key of an s3://bucket/key URL, or None for other sources."""
+    return s3_location_from_url(source_url)[1]
+
+
+def _list_pages(s3_client, bucket, prefix, delimiter=None):
+    kwargs = {"Bucket": bucket, "Prefix": prefix or ""}
+    if delimiter:
+        kwargs["Delimiter"] = delimiter
+    while True:
+        with timed("s3_list"):
+            response = s3_client.list_objects_v2(**kwargs)
+        yield response
+        if not response.get('IsTruncated'):
+            return
+        kwargs["ContinuationToken"] = response['NextContinuationToken']
+
+
+def _list_all(s3_client, bucket, prefix):
+    return [obj for response in _list_pages(s3_client, bucket, prefix) for obj in response.get('Contents', [])]
+
+
+def list_objects_parallel(s3_client, bucket, prefix, max_workers=MANIFEST_LIST_WORKERS):
+    """
+    Lists every object under a prefix. The first level of "folders" under the prefix is
+    listed concurrently, each one paginated to the end, so large projects are not limited to
+    one sequential LIST per 1,000 keys. Returns the objects in key order.
+    """
+    objects = []
+    sub_prefixes = []
+    for response in _list_pages(s3_client, bucket, prefix, delimiter="/"):
+        objects.extend(response.get('Contents', []))
+        sub_prefixes.extend(common['Prefix'] for common in response.get('CommonPrefixes', []))
+    if sub_prefixes:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(sub_prefixes))) as pool:
+            for listed in pool.map(lambda sub_prefix: _list_all(s3_client, bucket, sub_prefix), sub_prefixes):
+                objects.extend(listed)
+    objects.sort(key=lambda obj: obj['Key'])
+    return objects
+
+
+def build_entries(objects):
+    """
+    Manifest entries for the PDFs in a listing; a PDF with a saved extraction next to it, written
+    after the PDF, is extracted. Extractions not yet migrated from .txt are used until they are.
+    """
+    listed = {obj['Key']: obj for obj in objects}
+    entries = []
+    for obj in objects:
+        pdf_key = obj['Key']
+        if not pdf_key.lower().endswith('.pdf'):
+            continue
+        text_key = next((key for key in (text_key_for(pdf_key), page_text_store.legacy_text_key_for(pdf_key))
+                         if key in listed and not _older_than(listed[key], obj)), None)
+        if text_key:
+            entries.append(ManifestRecord(pdf_key, obj.get('ETag'), obj.get('Size'), status=MANIFEST_EXTRACTED, text_key=text_key))
+        else:
+            entries.append(ManifestRecord(pdf_key, obj.get('ETag'), obj.get('Size'), status=MANIFEST_PENDING))
+    return entries
+
+
+def _older_than(obj, other):
+    modified, other_modified = obj.get('LastModified'), other.get('LastModified')
+    return modified is not None and other_modified is not None and modified < other_modified
+
+
+def sync_manifest(manifest_dao, s3_client, bucket, prefix):
+    """Lists a prefix and brings its manifest entries in line with it. Returns the entries."""
+    with timed("manifest_sync"):
+        entries = build_entries(list_objects_parallel(s3_client, bucket, prefix))
+        manifest_dao.upsert_entries(entries)
+        removed = manifest_dao.delete_missing(prefix, [entry.s3_key for entry in entries])
+        manifest_dao.record_listing(prefix)
+    print(f"Manifest synced for {prefix!r}: {len(entries)} PDFs, {len(removed)} removed")
+    return entries
+
+
+def load_project_manifest(manifest_dao, s3_client, bucket, prefix):
+    """
+    The manifest entries of a prefix. A prefix not listed within MANIFEST_LISTING_TTL_SECONDS is
+    listed and synced first, even if it has entries (e.g. from uploads or a sub-prefix).
+    """
+    with timed("manifest_read"):
+        if manifest_dao.is_listed(prefix, MANIFEST_LISTING_TTL_SECONDS):
+            return manifest_dao.get_entries(prefix)
+    return sync_manifest(manifest_dao, s3_client, bucket, prefix)
+
+
+def record_extraction(manifest_dao, entry, page_count):
+    """Marks an entry extracted after its text was saved next to the PDF."""
+    try:
+        manifest_dao.mark_extracted(entry.s3_key, entry.etag, page_count, text_key_for(entry.s3_key))
+    except Exception as e:
+        print(f"Error updating manifest for {entry.s3_key}: {e}")
+
+
+def record_failure(manifest_dao, entry):
+    try:
+        manifest_dao.mark_failed(entry.s3_key)
+    except Exception as e:
+        print(f"Error updating manifest for {entry.s3_key}: {e}")
+
+
+if __name__ == "__main__":
+    from services.client_provider import get_s3_client
+    for sync_prefix in sys.argv[1:] or [""]:
+        with get_manifest_dao() as dao:
+            sync_manifest(dao, get_s3_client(), os.getenv("S3_BUCKET_NAME"), sync_prefix)
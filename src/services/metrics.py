@@ -0,0 +1,292 @@
+import bisect
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from services import profiling
+
+""" In-process metrics with a Prometheus text exposition. Stage latencies are histograms
+labelled by stage; pages, chunks, cache hits and errors are counters. Observations take a
+single short lock, so instrumenting hot paths costs well under a microsecond.
+
+Under gunicorn each worker has its own registry, and a scrape reaches one of them. With
+METRICS_MULTIPROCESS_DIR set (gunicorn.conf.py sets it) every worker writes a snapshot of its
+metrics there, every METRICS_FLUSH_SECONDS and when scraped; /metrics then sums the counters
+and histograms of all workers, including the final counts of workers that have exited, so
+Prometheus sees one monotonic series. Scrape-time collectors (cache sizes, governor state)
+are per-worker state and keep a worker label. """
+
+METRICS_PREFIX = "gemini_poc"
+METRICS_MULTIPROCESS_DIR = os.getenv("METRICS_MULTIPROCESS_DIR")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+# Snapshot file holding the summed metrics of exited workers
+_EXITED_WORKERS_FILE = "exited.json"
+
+# Latency buckets in seconds, from S3 GETs up to whole-document extraction
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Size buckets in bytes, from a single page of text up to a large drawing set
+BYTE_BUCKETS = (64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2,
+                256 * 1024 ** 2, 1024 ** 3)
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple((name, labels[name]) for name in self.label_names)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        key = tuple((name, labels[name]) for name in self.label_names)
+        return self.values.get(key, 0)
+
+    def snapshot(self):
+        with self.lock:
+            return {"name": self.name, "type": "counter", "documentation": self.documentation,
+                    "items": [[key, value] for key, value in self.values.items()]}
+
+
+class Histogram:
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple((name, labels[name]) for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                # per-bucket counts (last slot is +Inf), sum, count
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels):
+        key = tuple((name, labels[name]) for name in self.label_names)
+        series = self.series.get(key)
+        return series[2] if series else 0
+
+    def snapshot(self):
+        with self.lock:
+            return {"name": self.name, "type": "histogram", "documentation": self.documentation,
+                    "buckets": list(self.buckets),
+                    "items": [[key, [list(series[0]), series[1], series[2]]] for key, series in self.series.items()]}
+
+
+class MetricsRegistry:
+    def __init__(self, multiprocess_dir=None):
+        self.multiprocess_dir = multiprocess_dir
+        self.metrics = []
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def counter(self, name, documentation, label_names=()):
+        metric = Counter(f"{METRICS_PREFIX}_{name}", documentation, label_names)
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(f"{METRICS_PREFIX}_{name}", documentation, label_names, buckets)
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        """
+        Registers a callable evaluated at scrape time. It returns a list of
+        (name, type, documentation, [(labels_dict, value), ...]) tuples.
+        """
+        with self.lock:
+            self.collectors.append(collector)
+
+    def snapshot(self):
+        """This process's metrics and collector samples, as JSON-serializable data."""
+        with self.lock:
+            metrics = list(self.metrics)
+            collectors = list(self.collectors)
+        return {"metrics": [metric.snapshot() for metric in metrics],
+                "collectors": [[name, metric_type, documentation, [[labels, value] for labels, value in samples]]
+                               for collector in collectors
+                               for name, metric_type, documentation, samples in collector()]}
+
+    def render(self) -> str:
+        if not self.multiprocess_dir:
+            return _render(self.snapshot())
+        self.flush()
+        return _render(merge_snapshots(self.multiprocess_dir))
+
+    def flush(self):
+        """Writes this worker's snapshot to multiprocess_dir."""
+        _write_json(os.path.join(self.multiprocess_dir, f"worker-{os.getpid()}.json"), self.snapshot())
+
+    def start_flusher(self, interval=METRICS_FLUSH_SECONDS):
+        """Flushes every interval seconds in a daemon thread (call it in each worker after fork)."""
+        def flush_forever():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.flush()
+                except OSError as e:
+                    print(f"Could not write metrics snapshot: {e}", flush=True)
+        threading.Thread(target=flush_forever, name="metrics-flush", daemon=True).start()
+
+
+def _write_json(path, data):
+    # Write to a temp file and rename so a scrape never reads a partial snapshot
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".metrics-")
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _merge_metrics(merged, snapshot):
+    """Adds a snapshot's counters and histograms into merged ({name: metric snapshot})."""
+    for metric in snapshot["metrics"]:
+        target = merged.setdefault(metric["name"], dict(metric, items={}))
+        for key, value in metric["items"]:
+            key = tuple(tuple(pair) for pair in key)
+            if metric["type"] == "counter":
+                target["items"][key] = target["items"].get(key, 0) + value
+            elif key in target["items"]:
+                bucket_counts, total, count = target["items"][key]
+                target["items"][key] = [[a + b for a, b in zip(bucket_counts, value[0])], total + value[1], count + value[2]]
+            else:
+                target["items"][key] = value
+
+
+def merge_snapshots(multiprocess_dir):
+    """One snapshot summing every worker's (and exited workers') metrics; collector samples get a worker label."""
+    merged = {}
+    collectors = {}
+    exited = _read_json(os.path.join(multiprocess_dir, _EXITED_WORKERS_FILE))
+    if exited:
+        _merge_metrics(merged, exited)
+    for path in sorted(glob.glob(os.path.join(multiprocess_dir, "worker-*.json"))):
+        snapshot = _read_json(path)
+        if snapshot is None:
+            continue
+        _merge_metrics(merged, snapshot)
+        worker = os.path.basename(path)[len("worker-"):-len(".json")]
+        for name, metric_type, documentation, samples in snapshot["collectors"]:
+            family = collectors.setdefault(name, [name, metric_type, documentation, []])
+            family[3].extend([dict(labels, worker=worker), value] for labels, value in samples)
+    for metric in merged.values():
+        metric["items"] = [[list(key), value] for key, value in metric["items"].items()]
+    return {"metrics": list(merged.values()), "collectors": list(collectors.values())}
+
+
+def record_worker_exit(multiprocess_dir, pid):
+    """Folds an exited worker's counters and histograms into the exited-workers file (run in the gunicorn master)."""
+    path = os.path.join(multiprocess_dir, f"worker-{pid}.json")
+    snapshot = _read_json(path)
+    if snapshot is None:
+        return
+    merged = {}
+    exited_path = os.path.join(multiprocess_dir, _EXITED_WORKERS_FILE)
+    exited = _read_json(exited_path)
+    if exited:
+        _merge_metrics(merged, exited)
+    _merge_metrics(merged, snapshot)
+    for metric in merged.values():
+        metric["items"] = [[list(key), value] for key, value in metric["items"].items()]
+    _write_json(exited_path, {"metrics": list(merged.values()), "collectors": []})
+    os.remove(path)
+
+
+def _render(snapshot) -> str:
+    lines = []
+    for metric in snapshot["metrics"]:
+        name = metric["name"]
+        lines.append(f"# HELP {name} {metric['documentation']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        items = sorted((tuple(tuple(pair) for pair in key), value) for key, value in metric["items"])
+        if metric["type"] == "counter":
+            for key, value in items:
+                lines.append(f"{name}{_format_labels(key)} {value}")
+            continue
+        buckets = tuple(metric["buckets"])
+        for key, (bucket_counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + (float("inf"),), bucket_counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{name}_count{_format_labels(key)} {count}")
+    for name, metric_type, documentation, samples in snapshot["collectors"]:
+        full_name = f"{METRICS_PREFIX}_{name}"
+        lines.append(f"# HELP {full_name} {documentation}")
+        lines.append(f"# TYPE {full_name} {metric_type}")
+        for labels, value in samples:
+            lines.append(f"{full_name}{_format_labels(tuple(sorted(labels.items())))} {value}")
+    return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry(METRICS_MULTIPROCESS_DIR)
+
+STAGE_DURATION = REGISTRY.histogram("stage_duration_seconds", "Latency of pipeline stages.", ["stage"])
+STAGE_ERRORS = REGISTRY.counter("stage_errors_total", "Exceptions raised inside pipeline stages.", ["stage"])
+PAGES = REGISTRY.counter("pages_total", "Pages extracted, by extraction method.", ["method"])
+CHUNKS = REGISTRY.counter("chunks_total", "Chunks produced for indexing or context.", ["destination"])
+CACHE_HITS = REGISTRY.counter("cache_hits_total", "Cache hits.", ["cache"])
+CACHE_MISSES = REGISTRY.counter("cache_misses_total", "Cache misses.", ["cache"])
+CONTEXT_PEAK_BYTES = REGISTRY.histogram("context_peak_bytes", "Peak bytes of documents and text held while building one query context.",
+                                        buckets=BYTE_BUCKETS)
+
+
+@contextmanager
+def timed(stage):
+    """
+    Times the enclosed block into the stage latency histogram and counts exceptions.
+    Inside a profiling session the block is also recorded as a span.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        ended = time.perf_counter()
+        STAGE_DURATION.observe(ended - started, stage=stage)
+        profiling.record_span(stage, started, ended)
+
+
+def render_latest() -> str:
+    """Prometheus text exposition of every registered metric."""
+    return REGISTRY.render()
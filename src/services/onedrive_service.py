@@ -3,8 +3,10 @@ import boto3
 import io
 import os
 import json
+from services import manifest_service
+from services.client_provider import get_http_session, get_s3_client
 
-def download_from_graph_to_s3(folder_id, access_token, s3_bucket_name, s3_prefix="", s3_client=None):
+def download_from_graph_to_s3(folder_id, access_token, s3_bucket_name, s3_prefix="", s3_client=None, manifest_dao=None):
     """
     Downloads files and folders recursively from a Microsoft Graph URL and uploads them to AWS S3.
 
@@ -14,8 +16,11 @@ def download_from_graph_to_s3(folder_id, access_token, s3_bucket_name, s3_prefix
         access_token (str): Your Microsoft Graph access token.
         s3_bucket_name (str): The name of the AWS S3 bucket to upload files to.
         s3_prefix (str, optional):  An optional prefix to add to the S3 keys. Defaults to "".
-        s3_client (boto3.client, optional):  Pre-initialized boto3 S3 client. If None, a new client will be created.
-                                            Defaults to None.
+        s3_client (boto3.client, optional):  Pre-initialized boto3 S3 client. If None, the shared pooled client
+                                            from client_provider is used. Defaults to None.
+        manifest_dao (ManifestDAO, optional): Project manifest to sync for s3_prefix once the files are uploaded,
+                                            so queries see added and replaced PDFs. If None, a new one is used
+                                            when the manifest is enabled. Defaults to None.
 
     Returns:
         None
@@ -27,7 +32,8 @@ def download_from_graph_to_s3(folder_id, access_token, s3_bucket_name, s3_prefix
     }
 
     if s3_client is None:
-        s3_client = boto3.client('s3')
+        s3_client = get_s3_client()
+    http = get_http_session()
 
     def _upload_folder_contents_to_s3(folder_url, s3_current_prefix):
         """
@@ -38,7 +44,7 @@ def download_from_graph_to_s3(folder_id, access_token, s3_bucket_name, s3_prefix
             s3_current_prefix (str): The S3 key prefix for this folder.
         """
         try:
-            response = requests.get(folder_url, headers=headers)
+            response = http.get(folder_url, headers=headers)
             response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
             data = response.json()
 
@@ -57,7 +63,7 @@ def download_from_graph_to_s3(folder_id, access_token, s3_bucket_name, s3_prefix
                         download_url = f"https://graph.microsoft.com/v1.0/me/drive/items/{item_id}/content"
                         print(f"Downloading file: {item_name} and uploading to s3://{s3_bucket_name}/{s3_key}")
                         try:
-                            file_response = requests.get(download_url, headers=headers, stream=True) # stream=True for large files
+                            file_response = http.get(download_url, headers=headers, stream=True) # stream=True for large files
                             file_response.raise_for_status()
 
                             s3_client.upload_fileobj(
@@ -90,6 +96,18 @@ def download_from_graph_to_s3(folder_id, access_token, s3_bucket_name, s3_prefix
     _upload_folder_contents_to_s3(graph_url, s3_prefix)
     print("Download and S3 upload completed.")
 
+    # New ETags make queries skip replaced PDFs' saved text and page-cache entries
+    if manifest_dao is None and not manifest_service.PROJECT_MANIFEST_ENABLED:
+        return
+    try:
+        if manifest_dao is not None:
+            manifest_service.sync_manifest(manifest_dao, s3_client, s3_bucket_name, s3_prefix)
+        else:
+            with manifest_service.get_manifest_dao() as dao:
+                manifest_service.sync_manifest(dao, s3_client, s3_bucket_name, s3_prefix)
+    except Exception as e:
+        print(f"Error syncing the project manifest for '{s3_prefix}': {e}")
+
 """
 def download_onedrive_file_to_s3(onedrive_file_id, access_token, s3_object_key, s3_bucket_name = "assist-poc-bucket", drive_id=None):
     ""
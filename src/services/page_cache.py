@@ -0,0 +1,176 @@
+import os
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from services.metrics import CACHE_HITS, CACHE_MISSES, REGISTRY
+
+""" This service is responsible for the per-worker cache of extracted page text, so queries on
+active projects do not download the same saved extractions from S3 again.
+
+Each PDF is stored compactly: all its pages as one UTF-8 buffer with an array of page
+offsets, under an interned key, and tagged with the ETag it was extracted from; a lookup with
+a different ETag is a miss. The cache is bounded by PAGE_CACHE_MAX_BYTES and evicts with a
+segmented LRU: new PDFs enter a probation segment and move to the protected segment
+(PAGE_CACHE_PROTECTED_RATIO of the bytes) on their second hit, so a one-off query over a
+large project cannot flush the projects that are queried all day. """
+
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+PAGE_CACHE_PROTECTED_RATIO = float(os.getenv("PAGE_CACHE_PROTECTED_RATIO", "0.8"))
+
+# Approximate per-entry bookkeeping (key, tuple, dict slot) on top of buffer and offsets
+_ENTRY_OVERHEAD = 200
+
+
+class CachedPages:
+    """The pages of one PDF as a single UTF-8 buffer and page offsets."""
+
+    __slots__ = ("etag", "buffer", "offsets")
+
+    def __init__(self, etag, page_texts):
+        self.etag = etag
+        encoded = [page_text.encode("utf-8") for page_text in page_texts]
+        self.offsets = array("I", [0])
+        for page in encoded:
+            self.offsets.append(self.offsets[-1] + len(page))
+        self.buffer = b"".join(encoded)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def size(self):
+        return len(self.buffer) + self.offsets.itemsize * len(self.offsets) + _ENTRY_OVERHEAD
+
+    def page(self, page_num):
+        return self.buffer[self.offsets[page_num]:self.offsets[page_num + 1]].decode("utf-8")
+
+    def pages(self):
+        for page_num in range(len(self)):
+            yield self.page(page_num)
+
+
+class PageTextCache:
+    def __init__(self, max_bytes=PAGE_CACHE_MAX_BYTES, protected_ratio=PAGE_CACHE_PROTECTED_RATIO):
+        self.max_bytes = max_bytes
+        self.protected_max_bytes = int(max_bytes * protected_ratio)
+        self.probation = OrderedDict()
+        self.protected = OrderedDict()
+        self.probation_bytes = 0
+        self.protected_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @property
+    def size_bytes(self):
+        return self.probation_bytes + self.protected_bytes
+
+    def get(self, pdf_key, etag):
+        """The cached pages of a PDF version, or None."""
+        with self.lock:
+            entry = self.protected.get(pdf_key)
+            if entry is not None and entry.etag == etag:
+                self.protected.move_to_end(pdf_key)
+            else:
+                entry = self.probation.get(pdf_key)
+                if entry is not None and entry.etag == etag:
+                    # Second use: promote, demoting the protected segment's oldest entries if it is full
+                    del self.probation[pdf_key]
+                    self.probation_bytes -= entry.size
+                    self.protected[pdf_key] = entry
+                    self.protected_bytes += entry.size
+                    while self.protected_bytes > self.protected_max_bytes and len(self.protected) > 1:
+                        demoted_key, demoted = self.protected.popitem(last=False)
+                        self.protected_bytes -= demoted.size
+                        self.probation[demoted_key] = demoted
+                        self.probation_bytes += demoted.size
+                    self._evict()
+                else:
+                    entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if entry is None:
+            CACHE_MISSES.inc(cache="page_text")
+        else:
+            CACHE_HITS.inc(cache="page_text")
+        return entry
+
+    def put(self, pdf_key, etag, page_texts):
+        """Caches the pages of a PDF version, replacing any other version. Returns the entry."""
+        entry = CachedPages(etag, page_texts)
+        if entry.size > self.max_bytes:
+            return entry
+        pdf_key = sys.intern(pdf_key)
+        with self.lock:
+            self._remove(pdf_key)
+            self.probation[pdf_key] = entry
+            self.probation_bytes += entry.size
+            self._evict()
+        return entry
+
+    def invalidate(self, pdf_key):
+        with self.lock:
+            self._remove(pdf_key)
+
+    def invalidate_prefix(self, prefix):
+        """Drops every PDF under a prefix (e.g. after a project sync)."""
+        with self.lock:
+            for pdf_key in [key for key in (*self.probation, *self.protected) if key.startswith(prefix or "")]:
+                self._remove(pdf_key)
+
+    def clear(self):
+        with self.lock:
+            self.probation.clear()
+            self.protected.clear()
+            self.probation_bytes = self.protected_bytes = 0
+
+    def _remove(self, pdf_key):
+        entry = self.probation.pop(pdf_key, None)
+        if entry is not None:
+            self.probation_bytes -= entry.size
+        entry = self.protected.pop(pdf_key, None)
+        if entry is not None:
+            self.protected_bytes -= entry.size
+
+    def _evict(self):
+        while self.size_bytes > self.max_bytes:
+            segment = self.probation if self.probation else self.protected
+            _, entry = segment.popitem(last=False)
+            if segment is self.probation:
+                self.probation_bytes -= entry.size
+            else:
+                self.protected_bytes -= entry.size
+            self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.probation) + len(self.protected),
+                "bytes": self.size_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+PAGE_TEXT_CACHE = PageTextCache()
+
+
+def _collect():
+    stats = PAGE_TEXT_CACHE.stats()
+    return [
+        ("page_cache_bytes", "gauge", "Bytes of page text held by the page cache.", [({}, stats["bytes"])]),
+        ("page_cache_entries", "gauge", "PDFs held by the page cache.", [({}, stats["entries"])]),
+        ("page_cache_hit_ratio", "gauge", "Page cache hits per lookup since start.", [({}, stats["hit_ratio"])]),
+        ("page_cache_evictions_total", "counter", "PDFs evicted from the page cache.", [({}, stats["evictions"])]),
+    ]
+
+
+REGISTRY.register_collector(_collect)
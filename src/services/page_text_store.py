@@ -0,0 +1,234 @@
+import argparse
+import mmap
+import os
+import struct
+import sys
+from array import array
+import zstandard
+from services.metrics import CACHE_HITS, CACHE_MISSES, timed
+
+""" This service is responsible for the saved extractions stored next to each PDF in S3.
+
+A saved extraction is one object per PDF (<name>.pages) in a compact container: a fixed
+header, an index of page frame offsets, then every page as its own zstd frame. Because the
+pages are compressed independently, one page or a range of pages can be read with a single
+S3 byte-range GET (or from a local memory-mapped file) without transferring the rest:
+
+    magic "PGTX" | version u16 | reserved u16 | page_count u32
+    (page_count + 1) x u64 frame offsets, relative to the end of the index
+    page_count zstd frames
+
+Extractions saved before this format are uncompressed .txt files with pages separated by a
+form feed. They are still read, and can be converted in place with:
+
+    PYTHONPATH=src python -m services.page_text_store migrate <prefix> [--delete-legacy] """
+
+PAGE_TEXT_SUFFIX = ".pages"
+LEGACY_TEXT_SUFFIX = ".txt"
+LEGACY_PAGE_SEPARATOR = "\f"
+PAGE_TEXT_ZSTD_LEVEL = int(os.getenv("PAGE_TEXT_ZSTD_LEVEL", "9"))
+# First range read of an object: the header and index of PDFs up to ~2,000 pages, usually a few pages too
+PAGE_TEXT_HEADER_READ = int(os.getenv("PAGE_TEXT_HEADER_READ", str(16 * 1024)))
+
+MAGIC = b"PGTX"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<4sHHI")
+
+
+class PageTextFormatError(Exception):
+    pass
+
+
+def text_key_for(pdf_key):
+    """The key of the saved extraction of a PDF (.pdf replaced with .pages)."""
+    return pdf_key.rsplit('.', 1)[0] + PAGE_TEXT_SUFFIX
+
+
+def legacy_text_key_for(pdf_key):
+    """The key of a PDF's extraction saved in the old .txt format."""
+    return pdf_key.rsplit('.', 1)[0] + LEGACY_TEXT_SUFFIX
+
+
+def split_legacy_text(saved_text):
+    """The pages of an old .txt extraction. Saves without separators are a single page."""
+    return saved_text.split(LEGACY_PAGE_SEPARATOR)
+
+
+def encode_pages(page_texts, level=PAGE_TEXT_ZSTD_LEVEL) -> bytes:
+    """Builds the container for a PDF's page texts."""
+    compressor = zstandard.ZstdCompressor(level=level)
+    frames = [compressor.compress(page_text.encode("utf-8")) for page_text in page_texts]
+    offsets = array("Q", [0])
+    for frame in frames:
+        offsets.append(offsets[-1] + len(frame))
+    if sys.byteorder == "big":
+        offsets.byteswap()
+    return _HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(frames)) + offsets.tobytes() + b"".join(frames)
+
+
+def _index_end(page_count):
+    return _HEADER.size + 8 * (page_count + 1)
+
+
+def _parse_header(head):
+    if len(head) < _HEADER.size:
+        raise PageTextFormatError("Truncated page text header")
+    magic, version, _, page_count = _HEADER.unpack_from(head)
+    if magic != MAGIC:
+        raise PageTextFormatError("Not a page text object")
+    if version != FORMAT_VERSION:
+        raise PageTextFormatError(f"Unsupported page text version {version}")
+    return page_count
+
+
+class PageTextReader:
+    """
+    Random access to the pages of one container. read_range(start, end) returns bytes
+    [start, end) of the object; the first read fetches the header, index and whatever pages
+    fit in PAGE_TEXT_HEADER_READ, and later reads only fetch the frames asked for.
+    """
+
+    def __init__(self, read_range, head_size=PAGE_TEXT_HEADER_READ):
+        self.read_range = read_range
+        head = read_range(0, head_size)
+        self.page_count = _parse_header(head)
+        index_end = _index_end(self.page_count)
+        if len(head) < index_end:
+            head = head + read_range(len(head), index_end)
+        self.offsets = array("Q", head[_HEADER.size:index_end])
+        if sys.byteorder == "big":
+            self.offsets.byteswap()
+        self.data_start = index_end
+        self._head = head
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def __len__(self):
+        return self.page_count
+
+    def _frames(self, start, stop):
+        begin = self.data_start + self.offsets[start]
+        end = self.data_start + self.offsets[stop]
+        if end <= len(self._head):
+            return self._head[begin:end]
+        return self.read_range(begin, end)
+
+    def page(self, page_num):
+        if not 0 <= page_num < self.page_count:
+            raise IndexError(f"Page {page_num} out of range ({self.page_count} pages)")
+        return self.pages(page_num, page_num + 1)[0]
+
+    def pages(self, start=0, stop=None):
+        """The texts of pages [start, stop), fetched with one read."""
+        stop = self.page_count if stop is None else min(stop, self.page_count)
+        if start >= stop:
+            return []
+        frames = self._frames(start, stop)
+        base = self.offsets[start]
+        return [self._decompressor.decompress(frames[self.offsets[n] - base:self.offsets[n + 1] - base]).decode("utf-8")
+                for n in range(start, stop)]
+
+
+def decode_pages(data) -> list:
+    """Every page text of a container held in memory (bytes or a memory map)."""
+    return PageTextReader(lambda start, end: data[start:end], head_size=len(data)).pages()
+
+
+def open_local(path):
+    """A reader over a container on local disk. Pages are read from a memory map of the file."""
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return PageTextReader(lambda start, end: mapped[start:end])
+
+
+def open_s3(s3_client, bucket, key):
+    """A reader that fetches a container from S3 with byte-range GETs."""
+    def read_range(start, end):
+        with timed("s3_get_range"):
+            response = s3_client.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end - 1}")
+            return response['Body'].read()
+    return PageTextReader(read_range)
+
+
+def read_pages(s3_client, bucket, pdf_key, start=0, stop=None):
+    """The texts of pages [start, stop) of a PDF's saved extraction, read with range GETs."""
+    return open_s3(s3_client, bucket, text_key_for(pdf_key)).pages(start, stop)
+
+
+def save_pages(s3_client, bucket, pdf_key, page_texts):
+    """Saves a PDF's page texts next to it. Returns the key written."""
+    text_key = text_key_for(pdf_key)
+    body = encode_pages(page_texts)
+    with timed("s3_put"):
+        s3_client.put_object(Bucket=bucket, Key=text_key, Body=body)
+    return text_key
+
+
+def load_pages(s3_client, bucket, pdf_key, text_key=None):
+    """
+    Every page text of a PDF's saved extraction, or None if it has none. text_key names the
+    object when it is known (e.g. from the manifest); otherwise the .pages object is tried
+    first and then an old .txt one.
+    """
+    candidates = [text_key] if text_key else [text_key_for(pdf_key), legacy_text_key_for(pdf_key)]
+    for key in candidates:
+        with timed("s3_get"):
+            try:
+                data = s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+            except s3_client.exceptions.NoSuchKey:
+                continue
+        CACHE_HITS.inc(cache="s3_text")
+        if key.endswith(LEGACY_TEXT_SUFFIX):
+            return split_legacy_text(data.decode("utf-8"))
+        return decode_pages(data)
+    CACHE_MISSES.inc(cache="s3_text")
+    return None
+
+
+def migrate_prefix(s3_client, bucket, prefix, delete_legacy=False):
+    """
+    Rewrites every old .txt extraction under a prefix as a .pages object. Extractions that
+    already have a .pages object are skipped. Returns (converted, bytes before, bytes after).
+    """
+    from services.manifest_service import list_objects_parallel
+    objects = list_objects_parallel(s3_client, bucket, prefix)
+    keys = {obj['Key'] for obj in objects}
+    pdf_bases = {key.rsplit('.', 1)[0] for key in keys if key.lower().endswith('.pdf')}
+    converted = before = after = 0
+    for obj in objects:
+        legacy_key = obj['Key']
+        if not legacy_key.endswith(LEGACY_TEXT_SUFFIX):
+            continue
+        base = legacy_key[:-len(LEGACY_TEXT_SUFFIX)]
+        if base not in pdf_bases:
+            continue
+        if base + PAGE_TEXT_SUFFIX not in keys:
+            data = s3_client.get_object(Bucket=bucket, Key=legacy_key)['Body'].read()
+            body = encode_pages(split_legacy_text(data.decode("utf-8")))
+            s3_client.put_object(Bucket=bucket, Key=base + PAGE_TEXT_SUFFIX, Body=body)
+            converted += 1
+            before += len(data)
+            after += len(body)
+        if delete_legacy:
+            s3_client.delete_object(Bucket=bucket, Key=legacy_key)
+    return converted, before, after
+
+
+if __name__ == "__main__":
+    from services.client_provider import get_s3_client
+
+    parser = argparse.ArgumentParser(description="Convert saved .txt extractions to the .pages format")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = commands.add_parser("migrate", help="Convert every .txt extraction under a prefix")
+    migrate_parser.add_argument("prefix", nargs="?", default="")
+    migrate_parser.add_argument("--delete-legacy", action="store_true", help="Delete the .txt objects once converted")
+    args = parser.parse_args()
+
+    bucket_name = os.getenv("S3_BUCKET_NAME")
+    client = get_s3_client()
+    converted, before, after = migrate_prefix(client, bucket_name, args.prefix, args.delete_legacy)
+    print(f"Converted {converted} extractions under {args.prefix!r}: {before} bytes -> {after} bytes")
+    # Point the manifest at the new objects
+    from services import manifest_service
+    if manifest_service.PROJECT_MANIFEST_ENABLED:
+        with manifest_service.get_manifest_dao() as dao:
+            manifest_service.sync_manifest(dao, client, bucket_name, args.prefix)
@@ -0,0 +1,142 @@
+import os
+from collections import OrderedDict
+from io import BytesIO
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject
+from services.metrics import timed
+
+""" This service is responsible for splitting a PDF into standalone single-page (or page-group)
+PDFs for Document AI without re-serializing the resources the pages share.
+
+A new PdfWriter per page copies and serializes every font, image and form XObject the page
+uses, so a drawing set whose sheets share a title block image pays for that image once per
+sheet. PdfSplitter walks the source once: each object is serialized the first time a page
+needs it, and its bytes and outgoing references are kept (up to PDF_SPLIT_CACHE_MAX_BYTES)
+for the following pages. A part is then written from those bytes under the original object
+numbers, with only its page objects, a page tree and a catalog built for it.
+
+References that do not lead to a part's pages (another sheet linked from an annotation, a
+form field parent) are left out; the PDF format reads a reference to a missing object as
+null. Set PDF_SPLITTER=writer to go back to one PdfWriter per page. """
+
+PDF_SPLITTER = os.getenv("PDF_SPLITTER", "onepass")
+PDF_SPLIT_CACHE_MAX_BYTES = int(os.getenv("PDF_SPLIT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Keys never followed: links back up the tree or to the page an annotation sits on
+_SKIPPED_KEYS = {"/Parent", "/P"}
+
+
+def _references(obj):
+    """The indirect references held by an object, not following _SKIPPED_KEYS."""
+    references = []
+    stack = [obj]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, IndirectObject):
+            references.append((value.idnum, value.generation))
+        elif isinstance(value, DictionaryObject):
+            stack.extend(item for key, item in value.items() if key not in _SKIPPED_KEYS)
+        elif isinstance(value, ArrayObject):
+            stack.extend(value)
+    return references
+
+
+def _serialize(obj):
+    with BytesIO() as out:
+        obj.write_to_stream(out)
+        return out.getvalue()
+
+
+class PdfSplitter:
+    def __init__(self, pdf_reader, cache_max_bytes=PDF_SPLIT_CACHE_MAX_BYTES):
+        self.reader = pdf_reader
+        self.cache_max_bytes = cache_max_bytes
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self.page_refs = [(page.indirect_reference.idnum, page.indirect_reference.generation)
+                          for page in pdf_reader.pages]
+        self.page_ids = {idnum for idnum, _ in self.page_refs}
+        self.next_id = max([int(pdf_reader.trailer.get("/Size", 0))] + [idnum + 1 for idnum in self.page_ids])
+
+    def _object(self, ref):
+        """(bytes, references) of an object, serialized on first use."""
+        entry = self.cache.get(ref)
+        if entry is not None:
+            self.cache.move_to_end(ref)
+            return entry
+        obj = self.reader.get_object(IndirectObject(ref[0], ref[1], self.reader))
+        if obj is None:
+            return None
+        entry = (_serialize(obj), _references(obj))
+        size = len(entry[0])
+        if size <= self.cache_max_bytes:
+            self.cache[ref] = entry
+            self.cache_bytes += size
+            while self.cache_bytes > self.cache_max_bytes:
+                _, (data, _) = self.cache.popitem(last=False)
+                self.cache_bytes -= len(data)
+        return entry
+
+    def part(self, page_numbers) -> bytes:
+        """A standalone PDF of the given pages, in that order."""
+        pages_id = self.next_id
+        catalog_id = pages_id + 1
+        objects = {}
+        page_objects = {}
+        pending = []
+        for page_num in page_numbers:
+            page = self.reader.pages[page_num]
+            page_ref = self.page_refs[page_num]
+            page_dict = DictionaryObject({key: value for key, value in page.items() if key != "/Parent"})
+            page_dict[NameObject("/Parent")] = IndirectObject(pages_id, 0, self.reader)
+            page_objects[page_ref] = _serialize(page_dict)
+            pending.extend(_references(page_dict))
+        while pending:
+            ref = pending.pop()
+            if ref in objects or ref in page_objects or ref[0] in self.page_ids or ref[0] >= pages_id:
+                continue
+            entry = self._object(ref)
+            if entry is None:
+                continue
+            objects[ref] = entry[0]
+            pending.extend(entry[1])
+        objects.update(page_objects)
+
+        kids = " ".join(f"{idnum} {generation} R" for idnum, generation in (self.page_refs[n] for n in page_numbers))
+        objects[(pages_id, 0)] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_numbers)} >>".encode()
+        objects[(catalog_id, 0)] = f"<< /Type /Catalog /Pages {pages_id} 0 R >>".encode()
+        return _write_pdf(objects, catalog_id)
+
+    def parts(self, page_numbers=None, pages_per_part=1):
+        """Yields (page numbers, PDF bytes) for consecutive groups of pages, one part at a time."""
+        page_numbers = list(range(len(self.page_refs)) if page_numbers is None else page_numbers)
+        for start in range(0, len(page_numbers), pages_per_part):
+            group = page_numbers[start:start + pages_per_part]
+            with timed("page_split"):
+                data = self.part(group)
+            yield group, data
+
+
+def _write_pdf(objects, catalog_id):
+    out = BytesIO()
+    out.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for (idnum, generation), data in sorted(objects.items()):
+        offsets.append((idnum, generation, out.tell()))
+        out.write(b"%d %d obj\n" % (idnum, generation))
+        out.write(data)
+        out.write(b"\nendobj\n")
+    xref_offset = out.tell()
+    out.write(b"xref\n0 1\n0000000000 65535 f \n")
+    # One subsection per run of consecutive object numbers
+    start = 0
+    while start < len(offsets):
+        end = start + 1
+        while end < len(offsets) and offsets[end][0] == offsets[end - 1][0] + 1:
+            end += 1
+        out.write(b"%d %d\n" % (offsets[start][0], end - start))
+        for _, generation, offset in offsets[start:end]:
+            out.write(b"%010d %05d n \n" % (offset, generation))
+        start = end
+    out.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+              % (offsets[-1][0] + 1, catalog_id, xref_offset))
+    return out.getvalue()
@@ -0,0 +1,220 @@
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+""" Opt-in profiling for a single request. While a session is active a background thread
+samples the request's stack every PROFILE_SAMPLE_INTERVAL seconds and every metrics.timed()
+stage is recorded as a span. The result is stored as a speedscope JSON (open it at
+https://www.speedscope.app) and a span timeline JSON. With no active session the only cost
+on the hot path is one context variable lookup per stage.
+
+PROFILE_OUTPUT_DIR holds at most PROFILE_OUTPUT_MAX_BYTES: past that, the oldest profiles are
+removed, so profiles requested over the life of a task cannot fill its disk. """
+
+PROFILE_OUTPUT_DIR = os.getenv("PROFILE_OUTPUT_DIR", "/tmp/profiles")
+PROFILE_S3_PREFIX = os.getenv("PROFILE_S3_PREFIX")  # e.g. "profiles/"; stored in S3_BUCKET_NAME when set
+# 0 for no limit
+PROFILE_OUTPUT_MAX_BYTES = int(os.getenv("PROFILE_OUTPUT_MAX_BYTES", str(256 * 1024 ** 2)))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
+
+PROFILE_KINDS = {"speedscope": "speedscope.json", "spans": "spans.json"}
+
+_current = contextvars.ContextVar("profile_session", default=None)
+
+
+class ProfileSession:
+    """Collects stack samples of one thread plus the stage spans recorded while it is active."""
+
+    def __init__(self, name, sample_interval=PROFILE_SAMPLE_INTERVAL):
+        self.profile_id = uuid.uuid4().hex
+        self.name = name
+        self.sample_interval = sample_interval
+        self.thread_id = threading.get_ident()
+        self.frames = []
+        self.frame_index = {}
+        self.samples = []
+        self.weights = []
+        self.spans = []
+        self.lock = threading.Lock()
+        self.started = None
+        self.ended = None
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._sampler = threading.Thread(target=self._sample_loop, name=f"profiler-{self.profile_id[:8]}", daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._sampler:
+            self._sampler.join()
+        self.ended = time.perf_counter()
+
+    def _frame_id(self, code):
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        index = self.frame_index.get(key)
+        if index is None:
+            index = self.frame_index[key] = len(self.frames)
+            self.frames.append({"name": code.co_name, "file": code.co_filename, "line": code.co_firstlineno})
+        return index
+
+    def _sample_loop(self):
+        previous = time.perf_counter()
+        while not self._stop.wait(self.sample_interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_id(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()  # speedscope wants root first
+            self.samples.append(stack)
+            self.weights.append(now - previous)
+            previous = now
+
+    def record_span(self, name, start, end):
+        with self.lock:
+            self.spans.append({
+                "name": name,
+                "start": start - self.started,
+                "end": end - self.started,
+                "duration": end - start,
+                "thread": threading.get_ident(),
+            })
+
+    def speedscope(self) -> dict:
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "gemini-poc",
+            "shared": {"frames": self.frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": self.name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": self.ended - self.started,
+                "samples": self.samples,
+                "weights": self.weights,
+            }],
+        }
+
+    def span_timeline(self) -> dict:
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span["start"])
+        return {
+            "profile_id": self.profile_id,
+            "name": self.name,
+            "duration": self.ended - self.started,
+            "sample_count": len(self.samples),
+            "spans": spans,
+        }
+
+
+def current_session():
+    return _current.get()
+
+
+def record_span(name, start, end):
+    """Adds a stage span to the active session, if any."""
+    session = _current.get()
+    if session is not None:
+        session.record_span(name, start, end)
+
+
+@contextmanager
+def profile_request(name, enabled=True):
+    """
+    Profiles the enclosed block on the current thread and stores the result.
+    Yields the ProfileSession, or None when disabled.
+    """
+    if not enabled:
+        yield None
+        return
+    session = ProfileSession(name)
+    token = _current.set(session)
+    session.start()
+    try:
+        yield session
+    finally:
+        session.stop()
+        _current.reset(token)
+        try:
+            store_profile(session)
+        except Exception as e:
+            print(f"Error storing profile {session.profile_id}: {e}")
+
+
+def _profile_path(profile_id, kind):
+    return os.path.join(PROFILE_OUTPUT_DIR, f"{profile_id}.{PROFILE_KINDS[kind]}")
+
+
+def store_profile(session: ProfileSession):
+    """Writes both artifacts to PROFILE_OUTPUT_DIR and, when configured, to S3."""
+    os.makedirs(PROFILE_OUTPUT_DIR, exist_ok=True)
+    artifacts = {"speedscope": session.speedscope(), "spans": session.span_timeline()}
+    for kind, document in artifacts.items():
+        body = json.dumps(document).encode("utf-8")
+        with open(_profile_path(session.profile_id, kind), "wb") as f:
+            f.write(body)
+        if PROFILE_S3_PREFIX:
+            from services.client_provider import get_s3_client
+            get_s3_client().put_object(Bucket=S3_BUCKET_NAME, Key=f"{PROFILE_S3_PREFIX}{session.profile_id}.{PROFILE_KINDS[kind]}",
+                                       Body=body, ContentType="application/json")
+    print(f"Stored profile {session.profile_id} for {session.name} ({len(session.samples)} samples, {len(session.spans)} spans)")
+    if PROFILE_OUTPUT_MAX_BYTES:
+        prune_profiles(PROFILE_OUTPUT_MAX_BYTES)
+
+
+def prune_profiles(max_bytes):
+    """Removes the oldest stored profiles until PROFILE_OUTPUT_DIR holds at most max_bytes. Returns its size."""
+    suffixes = tuple(f".{suffix}" for suffix in PROFILE_KINDS.values())
+    files = []
+    for name in os.listdir(PROFILE_OUTPUT_DIR):
+        if not name.endswith(suffixes):
+            continue
+        path = os.path.join(PROFILE_OUTPUT_DIR, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Pruned by another worker
+            pass
+        total -= size
+    return total
+
+
+def load_profile(profile_id, kind):
+    """Returns the stored artifact bytes, or None if this worker or S3 does not have it."""
+    if kind not in PROFILE_KINDS or not profile_id.isalnum():
+        return None
+    path = _profile_path(profile_id, kind)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return f.read()
+    if PROFILE_S3_PREFIX:
+        from services.client_provider import get_s3_client
+        s3_client = get_s3_client()
+        try:
+            return s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=f"{PROFILE_S3_PREFIX}{profile_id}.{PROFILE_KINDS[kind]}")['Body'].read()
+        except s3_client.exceptions.NoSuchKey:
+            return None
+    return None
@@ -0,0 +1,307 @@
+import argparse
+import json
+import os
+import tempfile
+from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from database.dao.DocumentRecord import DocumentRecord
+from services import chunk_store
+from services import weaviate_service
+from services.metrics import CHUNKS, timed
+
+""" This service is responsible for rebuilding the Weaviate index without downtime.
+
+Queries and ingestion go through the DOCUMENT_COLLECTION alias (collection aliases need
+Weaviate server 1.32 or later). A reindex creates the next
+versioned collection (Document_v<n>) with the current schema and vectorizer, fills it from
+the chunk store with parallel workers, checkpointing finished documents so an interrupted run
+resumes where it stopped, checks that it holds every stored chunk, and then points the alias
+at it in one operation. The previous collection is kept, so switching back is instant:
+
+    PYTHONPATH=src python -m services.reindex_service build [--workers 8] [--model ...]
+    PYTHONPATH=src python -m services.reindex_service switch Document_v1   # roll back
+    PYTHONPATH=src python -m services.reindex_service drop Document_v1     # once no longer needed
+
+Documents ingested while a build runs, and documents re-ingested since the build started, are
+picked up by a catch-up pass before validation.
+
+An index from before aliases were used is a collection named DOCUMENT_COLLECTION itself, and
+an alias cannot share its name. Copy it into Document_v0 (ids and vectors as they are) first,
+then drop it, which deletes it and creates the alias pointing at Document_v0 in its place:
+
+    PYTHONPATH=src python -m services.reindex_service migrate
+    PYTHONPATH=src python -m services.reindex_service drop Document """
+
+REINDEX_WORKERS = int(os.getenv("REINDEX_WORKERS", "8"))
+REINDEX_CHECKPOINT_DIR = os.getenv("REINDEX_CHECKPOINT_DIR", "/tmp/weaviate-reindex")
+REINDEX_CHECKPOINT_EVERY = int(os.getenv("REINDEX_CHECKPOINT_EVERY", "50"))
+
+
+class ReindexError(Exception):
+    pass
+
+
+class ReindexCheckpoint:
+    """The documents already copied into a collection, saved to disk as the build goes."""
+
+    def __init__(self, collection_name, done=None, max_document_id=None, started_at=None):
+        self.collection_name = collection_name
+        self.done = set(done or ())
+        self.max_document_id = max_document_id
+        # Database time the first run of the build started; chunks written later may be newer than the copy
+        self.started_at = started_at
+        self._unsaved = 0
+
+    @property
+    def path(self):
+        return os.path.join(REINDEX_CHECKPOINT_DIR, f"{self.collection_name}.json")
+
+    @classmethod
+    def load(cls, collection_name):
+        checkpoint = cls(collection_name)
+        try:
+            with open(checkpoint.path) as f:
+                state = json.load(f)
+            checkpoint.done = set(state["done"])
+            checkpoint.max_document_id = state["max_document_id"]
+            if state.get("started_at"):
+                checkpoint.started_at = datetime.fromisoformat(state["started_at"])
+        except FileNotFoundError:
+            pass
+        return checkpoint
+
+    def saw(self, document_id):
+        if self.max_document_id is None or document_id > self.max_document_id:
+            self.max_document_id = document_id
+
+    def mark(self, document_id):
+        self.done.add(document_id)
+        self._unsaved += 1
+        if self._unsaved >= REINDEX_CHECKPOINT_EVERY:
+            self.save()
+
+    def save(self):
+        os.makedirs(REINDEX_CHECKPOINT_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=REINDEX_CHECKPOINT_DIR)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"done": sorted(self.done), "max_document_id": self.max_document_id,
+                       "started_at": self.started_at.isoformat() if self.started_at else None}, f)
+        os.replace(tmp_path, self.path)
+        self._unsaved = 0
+
+
+def _iter_documents(chunk_dao, min_document_id=None, document_ids=None):
+    if document_ids is None:
+        yield from chunk_store.iter_documents(chunk_dao, min_document_id=min_document_id)
+        return
+    for document_id in document_ids:
+        yield from chunk_store.iter_documents(chunk_dao, document_id=document_id)
+
+
+def _copy_documents(client, chunk_dao, collection_name, checkpoint, workers, min_document_id=None, document_ids=None):
+    """
+    Copies every stored document not yet in the checkpoint, or only those in document_ids.
+    At most 2 x workers documents are in flight.
+    """
+    copied = 0
+    failed = 0
+
+    def finish(futures):
+        nonlocal copied, failed
+        for future in futures:
+            errors = future.result()
+            if errors:
+                failed += 1
+            else:
+                checkpoint.mark(future.document_id)
+                copied += 1
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = set()
+        for document_id, project_id, file_name, chunks in _iter_documents(chunk_dao, min_document_id, document_ids):
+            checkpoint.saw(document_id)
+            if document_id in checkpoint.done:
+                continue
+            document_record = DocumentRecord(document_id, file_name, project_id, chunks[0].source_url, chunks[0].source_page)
+            future = pool.submit(weaviate_service.upsert_document_chunks, client, collection_name, document_record,
+                                 [chunk.text for chunk in chunks])
+            future.document_id = document_id
+            in_flight.add(future)
+            CHUNKS.inc(len(chunks), destination="reindex")
+            if len(in_flight) >= 2 * workers:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                finish(finished)
+        finish(in_flight)
+    checkpoint.save()
+    if failed:
+        raise ReindexError(f"{failed} documents failed to copy into {collection_name}; run the build again to retry them")
+    return copied
+
+
+def validate(client, chunk_dao, collection_name, allow_shrink=False):
+    """
+    Checks that a collection holds exactly the chunks in the store, and that it is not smaller
+    than the live index (documents ingested before the chunk store existed are not in it).
+    """
+    expected = chunk_dao.count_chunks()
+    actual = weaviate_service.count_objects(client, collection_name)
+    if actual != expected:
+        raise ReindexError(f"{collection_name} has {actual} objects, the chunk store {expected} chunks")
+    live = weaviate_service.alias_target(client)
+    if live is None and client.collections.exists(weaviate_service.DOCUMENT_COLLECTION):
+        live = weaviate_service.DOCUMENT_COLLECTION
+    if live and not allow_shrink:
+        live_count = weaviate_service.count_objects(client, live)
+        if live_count > actual:
+            raise ReindexError(f"The live collection {live} has {live_count} objects but the chunk store only "
+                               f"{actual}; re-ingest the missing documents or pass allow_shrink")
+    return actual
+
+
+def build(client, chunk_dao, version=None, workers=REINDEX_WORKERS, model=weaviate_service.WEAVIATE_VECTORIZER_MODEL,
+          activate=True, allow_shrink=False):
+    """
+    Builds (or resumes building) a versioned collection from the chunk store, validates it and,
+    when activate is set, points the alias at it. Returns (collection name, previous alias target).
+    """
+    if activate and weaviate_service.legacy_collection_exists(client):
+        print(weaviate_service.legacy_migration_steps())
+        raise ReindexError(f"Migrate {weaviate_service.DOCUMENT_COLLECTION} before building a new version")
+
+    if version is None:
+        version = (weaviate_service.collection_versions(client) or [0])[-1] + 1
+    collection_name = weaviate_service.versioned_collection_name(version)
+    if collection_name == weaviate_service.alias_target(client):
+        raise ReindexError(f"{collection_name} is the live collection")
+    if not client.collections.exists(collection_name):
+        weaviate_service.create_document_collection(client, collection_name, model)
+
+    checkpoint = ReindexCheckpoint.load(collection_name)
+    if checkpoint.started_at is None:
+        checkpoint.started_at = chunk_dao.clock()
+        checkpoint.save()
+    with timed("reindex_copy"):
+        copied = _copy_documents(client, chunk_dao, collection_name, checkpoint, workers)
+        # Documents ingested into the live collection while the copy ran
+        copied += _copy_documents(client, chunk_dao, collection_name, checkpoint, workers,
+                                  min_document_id=checkpoint.max_document_id)
+        # Re-ingested documents keep their ids, so the passes above skipped them as done
+        rewritten = [document_id for document_id in chunk_dao.document_ids_written_since(checkpoint.started_at)
+                     if document_id in checkpoint.done]
+        for document_id in rewritten:
+            checkpoint.done.discard(document_id)
+            # The new version of a document may have fewer chunks than the copied one
+            weaviate_service.remove_document_chunks(client, document_id, collection_name)
+        copied += _copy_documents(client, chunk_dao, collection_name, checkpoint, workers, document_ids=rewritten)
+    print(f"Copied {copied} documents into {collection_name} ({len(checkpoint.done)} in total)")
+    objects = validate(client, chunk_dao, collection_name, allow_shrink)
+    print(f"{collection_name} validated: {objects} objects")
+
+    previous = None
+    if activate:
+        previous = weaviate_service.switch_alias(client, collection_name)
+        print(f"{weaviate_service.DOCUMENT_COLLECTION} now points at {collection_name}"
+              + (f"; roll back with: switch {previous}" if previous else ""))
+    return collection_name, previous
+
+
+def switch(client, collection_name):
+    """Points the alias at an existing collection (also used to roll back). Returns the previous target."""
+    if not client.collections.exists(collection_name):
+        raise ReindexError(f"{collection_name} does not exist")
+    return weaviate_service.switch_alias(client, collection_name)
+
+
+def migrate(client):
+    """
+    Copies an unversioned DOCUMENT_COLLECTION into a fresh <alias>_v0 with its ids and vectors
+    and checks the counts match. The unversioned collection keeps serving until it is dropped.
+    Returns the number of objects copied.
+    """
+    if not weaviate_service.legacy_collection_exists(client):
+        raise ReindexError(f"{weaviate_service.DOCUMENT_COLLECTION} is not an unversioned collection; nothing to migrate")
+    collection_name = weaviate_service.versioned_collection_name(0)
+    # Start from scratch each time, so objects deleted from the source since a previous run are not kept
+    if client.collections.exists(collection_name):
+        client.collections.delete(collection_name)
+    weaviate_service.create_document_collection(client, collection_name)
+    with timed("reindex_copy"):
+        failed = weaviate_service.copy_collection(client, weaviate_service.DOCUMENT_COLLECTION, collection_name)
+    if failed:
+        raise ReindexError(f"{failed} objects failed to copy into {collection_name}; run migrate again")
+    _check_migrated(client, collection_name)
+    count = weaviate_service.count_objects(client, collection_name)
+    print(f"Copied {count} objects into {collection_name}; switch to it with: drop {weaviate_service.DOCUMENT_COLLECTION}")
+    return count
+
+
+def _check_migrated(client, collection_name):
+    expected = weaviate_service.count_objects(client, weaviate_service.DOCUMENT_COLLECTION)
+    actual = weaviate_service.count_objects(client, collection_name)
+    if actual != expected:
+        raise ReindexError(f"{collection_name} has {actual} objects, {weaviate_service.DOCUMENT_COLLECTION} "
+                           f"{expected}; run migrate again")
+
+
+def drop(client, collection_name):
+    """
+    Deletes a collection that the alias no longer points at. Dropping the unversioned
+    DOCUMENT_COLLECTION, once migrate has copied it, also creates the alias pointing at
+    <alias>_v0 straight after, since the alias needs its name.
+    """
+    if collection_name == weaviate_service.alias_target(client):
+        raise ReindexError(f"{collection_name} is the live collection")
+    if collection_name == weaviate_service.DOCUMENT_COLLECTION and weaviate_service.legacy_collection_exists(client):
+        migrated = weaviate_service.versioned_collection_name(0)
+        if not client.collections.exists(migrated):
+            raise ReindexError(f"{collection_name} has not been migrated; run migrate first")
+        # Chunks ingested or removed since migrate ran would otherwise be lost or come back
+        _check_migrated(client, migrated)
+        client.collections.delete(collection_name)
+        weaviate_service.switch_alias(client, migrated)
+        print(f"{collection_name} now points at {migrated}")
+        return
+    client.collections.delete(collection_name)
+
+
+def status(client):
+    live = weaviate_service.alias_target(client)
+    return {weaviate_service.versioned_collection_name(version): {
+                "objects": weaviate_service.count_objects(client, weaviate_service.versioned_collection_name(version)),
+                "live": weaviate_service.versioned_collection_name(version) == live}
+            for version in weaviate_service.collection_versions(client)}
+
+
+if __name__ == "__main__":
+    from database.dbutil import Database
+    from database.dao.ChunkDAO import ChunkDAO
+    from services.client_provider import get_weaviate_client
+
+    parser = argparse.ArgumentParser(description="Zero-downtime Weaviate reindex from the chunk store")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="Build the next collection version and switch to it")
+    build_parser.add_argument("--version", type=int, help="Version to build or resume (default: next)")
+    build_parser.add_argument("--workers", type=int, default=REINDEX_WORKERS)
+    build_parser.add_argument("--model", default=weaviate_service.WEAVIATE_VECTORIZER_MODEL)
+    build_parser.add_argument("--no-switch", action="store_true", help="Validate but keep the alias where it is")
+    build_parser.add_argument("--allow-shrink", action="store_true",
+                              help="Switch even if the live collection has more objects than the chunk store")
+    commands.add_parser("switch", help="Point the alias at a collection").add_argument("collection")
+    commands.add_parser("drop", help="Delete a collection that is not live").add_argument("collection")
+    commands.add_parser("migrate", help=f"Copy an unversioned {weaviate_service.DOCUMENT_COLLECTION} collection into "
+                                        f"{weaviate_service.versioned_collection_name(0)}")
+    commands.add_parser("status", help="List collection versions")
+    args = parser.parse_args()
+
+    weaviate_client = get_weaviate_client()
+    if args.command == "build":
+        with ChunkDAO(Database()) as dao:
+            build(weaviate_client, dao, args.version, args.workers, args.model, not args.no_switch, args.allow_shrink)
+    elif args.command == "switch":
+        print(f"Previous target: {switch(weaviate_client, args.collection)}")
+    elif args.command == "drop":
+        drop(weaviate_client, args.collection)
+    elif args.command == "migrate":
+        migrate(weaviate_client)
+    else:
+        print(json.dumps(status(weaviate_client), indent=2))
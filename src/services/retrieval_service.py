@@ -0,0 +1,138 @@
+import os
+import time
+from services import chunk_store
+from services import lexical_index
+from services.context_service import ContextChunk
+from services.fingerprint import content_hash
+from services.singleflight import SingleFlight
+
+""" This service is responsible for retrieving the pages of a project that are relevant to a
+query, so /query can send those instead of the project's whole text.
+
+"lexical" retrieval uses the project's in-process BM25 index. "hybrid" also runs a Weaviate
+vector search and merges the two rankings with reciprocal rank fusion, which needs no score
+calibration between BM25 and vector distances. """
+
+RETRIEVAL_MODES = ("full", "lexical", "hybrid")
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "20"))
+RRF_K = 60
+# Keep a project's lexical index in line with the chunk store (this task's disk may not have it)
+LEXICAL_INDEX_REBUILD = os.getenv("LEXICAL_INDEX_REBUILD", "true").lower() == "true"
+LEXICAL_REBUILD_RETRY_SECONDS = float(os.getenv("LEXICAL_REBUILD_RETRY_SECONDS", "300"))
+# How often a project's index is compared with the chunk store; 0 compares on every query
+LEXICAL_SYNC_INTERVAL_SECONDS = float(os.getenv("LEXICAL_SYNC_INTERVAL_SECONDS", "60"))
+
+_rebuild_flight = SingleFlight()
+# project_id -> when a sync last failed, so a broken chunk store is not retried on every query
+_rebuild_failed = {}
+# project_id -> when the index was last found in line with the chunk store
+_synced_at = {}
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """
+    Fuses ranked lists of keys. Each key scores sum(1 / (k + rank)) over the lists it
+    appears in. Returns (key, score) pairs, best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
+
+
+def _vector_search(project_id, query, limit):
+    # Imported on use so lexical-only deployments never load the Weaviate client
+    from services.client_provider import get_weaviate_client
+    from services.weaviate_service import search_chunks
+    return search_chunks(get_weaviate_client(), project_id, query, limit)
+
+
+def _vector_search_batch(project_id, queries, limit):
+    from services.client_provider import get_weaviate_client
+    from services.weaviate_service import search_chunks_batch
+    return search_chunks_batch(get_weaviate_client(), project_id, queries, limit)
+
+
+def _fuse(hits, vector_results, k):
+    """Merges a query's lexical hits and vector results (chunk properties) with RRF."""
+    # Pages and Weaviate chunks are the same text, so content identifies them across both
+    chunks = {}
+    lexical_ranking = []
+    for hit in hits:
+        key = (hit.document_id, content_hash(hit.text))
+        chunks[key] = (hit.text, hit.file_name, hit.page)
+        lexical_ranking.append(key)
+    vector_ranking = []
+    for properties in vector_results:
+        key = (properties.get("document_id"), content_hash(properties.get("contents") or ""))
+        chunks.setdefault(key, (properties.get("contents") or "", properties.get("file_name"), None))
+        vector_ranking.append(key)
+
+    fused = reciprocal_rank_fusion([lexical_ranking, vector_ranking])[:k]
+    return [ContextChunk(chunks[key][0], chunks[key][1], chunks[key][2], score=score) for key, score in fused]
+
+
+def _sync_from_chunk_store(project_id):
+    # Imported on use so the query path only connects to Postgres when an index is checked
+    from database.dbutil import Database
+    from database.dao.ChunkDAO import ChunkDAO
+    with ChunkDAO(Database()) as chunk_dao:
+        outcome = chunk_store.sync_lexical_index(chunk_dao, project_id)
+    if outcome != "fresh":
+        print(f"Lexical index of project {project_id} {outcome.replace('_', ' ')} from the chunk store", flush=True)
+
+
+def ensure_lexical_index(project_id, sync=None):
+    """
+    Keeps this task's lexical index of the project in line with the chunk store. LEXICAL_INDEX_DIR
+    is local disk, empty on a new task and not shared between tasks, and documents are ingested
+    and deleted through other tasks, so at most every LEXICAL_SYNC_INTERVAL_SECONDS the index's
+    watermark is compared with the store's and the index caught up, rebuilt or dropped (once,
+    however many queries ask at the same time). A failed sync is logged and retried after
+    LEXICAL_REBUILD_RETRY_SECONDS; meanwhile queries use the index as it is.
+    """
+    if not LEXICAL_INDEX_REBUILD:
+        return
+    now = time.monotonic()
+    synced_at = _synced_at.get(project_id)
+    if synced_at is not None and now - synced_at < LEXICAL_SYNC_INTERVAL_SECONDS:
+        return
+    failed_at = _rebuild_failed.get(project_id)
+    if failed_at is not None and now - failed_at < LEXICAL_REBUILD_RETRY_SECONDS:
+        return
+    try:
+        _rebuild_flight.do(("lexical_sync", project_id), sync or _sync_from_chunk_store, project_id)
+        _rebuild_failed.pop(project_id, None)
+        _synced_at[project_id] = time.monotonic()
+    except Exception as e:
+        print(f"Could not sync the lexical index of project {project_id}: {e}", flush=True)
+        _rebuild_failed[project_id] = time.monotonic()
+
+
+def retrieve(project_id, query, mode="lexical", k=None, vector_search=None):
+    """
+    Returns the top k pages of a project for the query as ContextChunks carrying their
+    retrieval score. An empty list means the project has no index yet.
+    """
+    k = k or RETRIEVAL_TOP_K
+    ensure_lexical_index(project_id)
+    hits = lexical_index.search(project_id, query, k)
+    if mode == "lexical":
+        return [ContextChunk(hit.text, hit.file_name, hit.page, score=hit.score) for hit in hits]
+    return _fuse(hits, (vector_search or _vector_search)(project_id, query, k), k)
+
+
+def retrieve_batch(project_id, queries, mode="lexical", k=None, vector_search_batch=None):
+    """
+    retrieve() for many queries of one project: hybrid mode runs the vector searches of all
+    queries as one batched request. Returns one list of ContextChunks per query.
+    """
+    k = k or RETRIEVAL_TOP_K
+    ensure_lexical_index(project_id)
+    hits = [lexical_index.search(project_id, query, k) for query in queries]
+    if mode == "lexical":
+        return [[ContextChunk(hit.text, hit.file_name, hit.page, score=hit.score) for hit in query_hits]
+                for query_hits in hits]
+    vector_results = (vector_search_batch or _vector_search_batch)(project_id, queries, k)
+    return [_fuse(query_hits, results, k) for query_hits, results in zip(hits, vector_results)]
@@ -0,0 +1,339 @@
+import fcntl
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from services import fingerprint
+from services.context_service import ContextChunk, query_terms
+from services.metrics import REGISTRY
+
+""" This service is responsible for multi-turn chat sessions: the conversation so far and the
+chunks already retrieved for it, kept server side so a follow-up question does not redo
+retrieval from scratch.
+
+Each session keeps the chunks that made it into its earlier prompts (each text once, at most
+SESSION_MAX_CHUNK_BYTES of text) and the index of terms they contain. A follow-up whose terms
+are mostly covered by those chunks (SESSION_REUSE_MIN_COVERAGE) is answered from them alone;
+otherwise retrieval runs for it and its results are added to the session.
+
+Sessions live in this worker's memory, bounded by SESSION_MAX_SESSIONS (least recently used
+first out) and expired after SESSION_TTL_SECONDS without use. Their turns are also written to
+SESSION_DIR, so a follow-up that lands on another worker of the host still has the
+conversation; that worker retrieves the chunks again. Across hosts the load balancer keeps
+a client on one task. Saving merges the turns this worker added with those other workers
+saved meanwhile, under a file lock, so concurrent follow-ups never drop a turn. Creating a
+session also sweeps SESSION_DIR: files not used within SESSION_TTL_SECONDS are removed, then
+the oldest past SESSION_MAX_SESSIONS. """
+
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "1000"))
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "1800"))
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "10"))
+SESSION_MAX_CHUNK_BYTES = int(os.getenv("SESSION_MAX_CHUNK_BYTES", str(1024 * 1024)))
+SESSION_REUSE_MIN_COVERAGE = float(os.getenv("SESSION_REUSE_MIN_COVERAGE", "0.6"))
+# Shared by the workers of one host; empty keeps sessions in the worker that created them
+SESSION_DIR = os.getenv("SESSION_DIR", "/tmp/chat-sessions")
+
+_SESSION_ID_RE = re.compile(r"[0-9a-f]{32}")
+_TMP_PREFIX = ".tmp-"
+_LOCK_NAME = ".lock"
+
+
+class ChatSession:
+    """One conversation about a project: its turns and the chunks retrieved for them."""
+
+    def __init__(self, session_id, project_location, project_id=None, retrieval="full",
+                 max_turns=SESSION_MAX_TURNS, max_chunk_bytes=SESSION_MAX_CHUNK_BYTES):
+        self.session_id = session_id
+        self.project_location = project_location
+        self.project_id = project_id
+        self.retrieval = retrieval
+        self.max_turns = max_turns
+        self.max_chunk_bytes = max_chunk_bytes
+        self.turns = []
+        self.turn_count = 0
+        # turn_count as of the last load or save; later turns are this worker's own
+        self.saved_turn_count = 0
+        self.chunks = deque()
+        self.chunk_bytes = 0
+        self.term_counts = {}
+        self.hashes = set()
+        self.last_used = 0.0
+        # Turns of one session run one at a time, each seeing the previous turn's answer
+        self.lock = threading.Lock()
+
+    def coverage(self, query: str) -> float:
+        """Fraction of the query's terms found in the session's chunks (0 without chunks)."""
+        terms = query_terms(query)
+        if not terms or not self.chunks:
+            return 0.0
+        return sum(1 for term in terms if term in self.term_counts) / len(terms)
+
+    def context_chunks(self):
+        """Unscored copies of the session's chunks, so each turn ranks them against its own query."""
+        return [ContextChunk(chunk.text, chunk.source, chunk.page, chunk.chunk_no) for _, chunk in self.chunks]
+
+    def remember(self, chunks) -> int:
+        """Adds chunks not seen before, dropping the oldest past max_chunk_bytes. Returns the number added."""
+        added = 0
+        for chunk in chunks:
+            digest = fingerprint.content_hash(chunk.text)
+            if len(chunk.text) > self.max_chunk_bytes or digest in self.hashes:
+                continue
+            self.chunks.append((digest, ContextChunk(chunk.text, chunk.source, chunk.page, chunk.chunk_no)))
+            self.hashes.add(digest)
+            self.chunk_bytes += len(chunk.text)
+            self._count_terms(chunk.text, 1)
+            added += 1
+            while self.chunk_bytes > self.max_chunk_bytes:
+                digest, dropped = self.chunks.popleft()
+                self.hashes.discard(digest)
+                self.chunk_bytes -= len(dropped.text)
+                self._count_terms(dropped.text, -1)
+        return added
+
+    def add_turn(self, query: str, answer: str):
+        self.turns.append((query, answer))
+        self.turn_count += 1
+        del self.turns[:-self.max_turns]
+
+    def as_dict(self):
+        return {
+            "session_id": self.session_id,
+            "location": self.project_location,
+            "project_id": self.project_id,
+            "retrieval": self.retrieval,
+            "turns": [{"query": query, "response": answer} for query, answer in self.turns],
+            "turn_count": self.turn_count,
+            "chunks": len(self.chunks),
+            "chunk_bytes": self.chunk_bytes,
+        }
+
+    def _count_terms(self, text, delta):
+        for term in query_terms(text):
+            count = self.term_counts.get(term, 0) + delta
+            if count > 0:
+                self.term_counts[term] = count
+            else:
+                self.term_counts.pop(term, None)
+
+
+class SessionStore:
+    def __init__(self, max_sessions=SESSION_MAX_SESSIONS, ttl_seconds=SESSION_TTL_SECONDS, session_dir=None,
+                 clock=time.monotonic):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.session_dir = session_dir
+        self.clock = clock
+        self.sessions = OrderedDict()
+        self.created = 0
+        self.expired = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def create(self, project_location, project_id=None, retrieval="full") -> ChatSession:
+        session = ChatSession(uuid.uuid4().hex, project_location, project_id, retrieval)
+        with self.lock:
+            session.last_used = self.clock()
+            self.sessions[session.session_id] = session
+            self.created += 1
+            self._evict()
+        self.sweep()
+        self.save(session)
+        return session
+
+    def get(self, session_id):
+        """
+        The session, marked as used, or None if it does not exist or has expired. With a
+        session_dir, turns another worker added are picked up, and a session started on
+        another worker is taken over (without its chunks).
+        """
+        if not _SESSION_ID_RE.fullmatch(session_id or ""):
+            return None
+        snapshot = self._load(session_id) if self.session_dir else None
+        with self.lock:
+            self._evict()
+            session = self.sessions.get(session_id)
+            if self.session_dir:
+                if snapshot is None:
+                    # Deleted or expired by another worker
+                    self.sessions.pop(session_id, None)
+                    return None
+                if session is None:
+                    session = ChatSession(session_id, snapshot["location"], snapshot["project_id"], snapshot["retrieval"])
+                    self.sessions[session_id] = session
+                if snapshot["turn_count"] > session.turn_count:
+                    session.turns = [tuple(turn) for turn in snapshot["turns"]]
+                    session.turn_count = session.saved_turn_count = snapshot["turn_count"]
+            if session is not None:
+                session.last_used = self.clock()
+                self.sessions.move_to_end(session_id)
+                self._evict()
+            return session
+
+    def save(self, session):
+        """
+        Writes a session's metadata and turns for the other workers (its chunks stay in this
+        worker). Turns other workers saved since this one last loaded or saved the session are
+        kept, followed by this worker's new turns, and the session takes the merged history.
+        """
+        if not self.session_dir:
+            return
+        os.makedirs(self.session_dir, exist_ok=True)
+        with self._dir_lock():
+            saved = self._read(session.session_id)
+            if saved is not None and saved["turn_count"] > session.saved_turn_count:
+                new_turns = session.turn_count - session.saved_turn_count
+                turns = [tuple(turn) for turn in saved["turns"]] + (session.turns[-new_turns:] if new_turns else [])
+                session.turns = turns[-session.max_turns:]
+                session.turn_count = saved["turn_count"] + new_turns
+            snapshot = {"location": session.project_location, "project_id": session.project_id,
+                        "retrieval": session.retrieval, "turns": session.turns, "turn_count": session.turn_count}
+            # Write to a temp file and rename so other workers never read a partial session
+            fd, tmp_path = tempfile.mkstemp(dir=self.session_dir, prefix=_TMP_PREFIX)
+            with os.fdopen(fd, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self._path(session.session_id))
+            session.saved_turn_count = session.turn_count
+
+    def delete(self, session_id) -> bool:
+        if not _SESSION_ID_RE.fullmatch(session_id or ""):
+            return False
+        with self.lock:
+            deleted = self.sessions.pop(session_id, None) is not None
+        if self.session_dir:
+            try:
+                os.remove(self._path(session_id))
+                deleted = True
+            except FileNotFoundError:
+                pass
+        return deleted
+
+    def sweep(self) -> int:
+        """
+        Removes session files not used within the TTL, then the least recently used past
+        max_sessions, so abandoned sessions do not pile up in session_dir. Temp files left by a
+        crashed writer go once they are older than the TTL. Returns the number of files removed.
+        """
+        if not self.session_dir:
+            return 0
+        # Files are shared by processes, so their age is wall-clock time, not self.clock
+        expires_before = time.time() - self.ttl_seconds
+        live = []
+        removed = 0
+        try:
+            entries = list(os.scandir(self.session_dir))
+        except FileNotFoundError:
+            return 0
+        for entry in entries:
+            is_session = entry.name.endswith(".json") and _SESSION_ID_RE.fullmatch(entry.name[:-5])
+            if not is_session and not entry.name.startswith(_TMP_PREFIX):
+                continue
+            try:
+                mtime = entry.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            if mtime < expires_before:
+                removed += _remove(entry.path)
+            elif is_session:
+                live.append((mtime, entry.path))
+        if len(live) > self.max_sessions:
+            live.sort()
+            for _, path in live[:len(live) - self.max_sessions]:
+                removed += _remove(path)
+        return removed
+
+    def clear(self):
+        with self.lock:
+            self.sessions.clear()
+
+    def _path(self, session_id):
+        return os.path.join(self.session_dir, f"{session_id}.json")
+
+    @contextmanager
+    def _dir_lock(self):
+        """Serializes session file updates across the workers sharing session_dir."""
+        with open(os.path.join(self.session_dir, _LOCK_NAME), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self, session_id):
+        try:
+            with open(self._path(session_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _load(self, session_id):
+        """
+        The saved snapshot of a session, or None if there is none or it has not been used within
+        the TTL. Loading marks the file as used, so the sweep keeps a session that is being read.
+        """
+        path = self._path(session_id)
+        try:
+            if os.path.getmtime(path) < time.time() - self.ttl_seconds:
+                os.remove(path)
+                return None
+            snapshot = self._read(session_id)
+            os.utime(path)
+            return snapshot
+        except FileNotFoundError:
+            return None
+
+    def _evict(self):
+        # Least recently used first, so expired sessions are all at the front
+        expires_before = self.clock() - self.ttl_seconds
+        while self.sessions:
+            session = next(iter(self.sessions.values()))
+            if session.last_used > expires_before:
+                break
+            self.sessions.popitem(last=False)
+            self.expired += 1
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "sessions": len(self.sessions),
+                "max_sessions": self.max_sessions,
+                "chunk_bytes": sum(session.chunk_bytes for session in self.sessions.values()),
+                "created": self.created,
+                "expired": self.expired,
+                "evictions": self.evictions,
+            }
+
+
+def _remove(path) -> int:
+    # Another worker may have swept or deleted it first
+    try:
+        os.remove(path)
+        return 1
+    except FileNotFoundError:
+        return 0
+
+
+SESSION_STORE = SessionStore(session_dir=SESSION_DIR or None)
+
+
+def _collect():
+    stats = SESSION_STORE.stats()
+    return [
+        ("chat_sessions", "gauge", "Chat sessions held by this worker.", [({}, stats["sessions"])]),
+        ("chat_session_chunk_bytes", "gauge", "Bytes of retrieved chunk text held by chat sessions.",
+         [({}, stats["chunk_bytes"])]),
+        ("chat_sessions_expired_total", "counter", "Chat sessions dropped after their TTL.", [({}, stats["expired"])]),
+        ("chat_sessions_evicted_total", "counter", "Chat sessions evicted to stay within SESSION_MAX_SESSIONS.",
+         [({}, stats["evictions"])]),
+    ]
+
+
+REGISTRY.register_collector(_collect)
@@ -0,0 +1,56 @@
+import threading
+from concurrent.futures import Future
+
+""" Single-flight call coalescing. Concurrent callers asking for the same key attach to
+the one in-flight computation and share its result (or its exception) instead of
+repeating expensive backend calls. """
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.shared = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Runs fn(*args, **kwargs) once per key among concurrent callers.
+
+        Args:
+            key: Hashable identity of the computation
+            fn: Callable producing the result
+
+        Returns:
+            The result of the single in-flight call. If that call raised, every waiter
+            re-raises the same exception.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is None:
+                future = Future()
+                self._calls[key] = future
+                self.leaders += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,90 @@
+import os
+import unicodedata
+from pypdf.generic import NameObject
+
+""" This service is responsible for judging whether a PDF page's own text layer is good enough
+to index, so only the pages that need OCR are sent to Document AI.
+
+Vector CAD sheets and exported specifications carry a complete text layer; scans carry none,
+or only an OCR'd stamp or title block. A page goes to OCR when its text layer has fewer than
+ROUTER_MIN_CHARS characters, when more than ROUTER_MAX_GARBAGE_RATIO of them are glyphs
+without a usable Unicode mapping, or when images cover more than ROUTER_MAX_IMAGE_COVERAGE
+of the page and it has fewer than ROUTER_IMAGE_PAGE_MIN_CHARS characters. """
+
+ROUTER_MIN_CHARS = int(os.getenv("ROUTER_MIN_CHARS", "100"))
+ROUTER_MAX_GARBAGE_RATIO = float(os.getenv("ROUTER_MAX_GARBAGE_RATIO", "0.1"))
+ROUTER_MAX_IMAGE_COVERAGE = float(os.getenv("ROUTER_MAX_IMAGE_COVERAGE", "0.5"))
+ROUTER_IMAGE_PAGE_MIN_CHARS = int(os.getenv("ROUTER_IMAGE_PAGE_MIN_CHARS", "1000"))
+
+# Unicode categories of glyphs that pypdf could not map: control, surrogate, private use, unassigned
+_GARBAGE_CATEGORIES = {"Cc", "Cs", "Co", "Cn"}
+
+
+class TextLayerQuality:
+    """The measurements the route of a page is decided on."""
+
+    __slots__ = ("chars", "garbage_ratio", "image_coverage")
+
+    def __init__(self, chars, garbage_ratio, image_coverage):
+        self.chars = chars
+        self.garbage_ratio = garbage_ratio
+        self.image_coverage = image_coverage
+
+    def __repr__(self):
+        return (f"TextLayerQuality(chars={self.chars}, garbage_ratio={self.garbage_ratio:.3f}, "
+                f"image_coverage={self.image_coverage:.2f})")
+
+
+def garbage_ratio(text: str) -> float:
+    """The share of non-whitespace characters that are replacement, control or private-use glyphs."""
+    chars = 0
+    garbage = 0
+    for char in text:
+        if char.isspace():
+            continue
+        chars += 1
+        if char == "\ufffd" or unicodedata.category(char) in _GARBAGE_CATEGORIES:
+            garbage += 1
+    return garbage / chars if chars else 0.0
+
+
+def _image_names(page):
+    try:
+        xobjects = page["/Resources"].get_object().get("/XObject")
+        if xobjects is None:
+            return set()
+        xobjects = xobjects.get_object()
+        return {NameObject(name) for name in xobjects if xobjects[name].get_object().get("/Subtype") == "/Image"}
+    except (KeyError, AttributeError):
+        return set()
+
+
+def measure_page(page):
+    """
+    Extracts a page's text layer and measures it in the same pass over its content stream.
+    Image coverage is the area of the placed images (capped at the page), from the current
+    transformation matrix at each image draw. Returns (text, TextLayerQuality).
+    """
+    image_names = _image_names(page)
+    image_area = 0.0
+
+    def visit(operator, operands, cm, tm):
+        nonlocal image_area
+        if (operator == b"Do" and operands and operands[0] in image_names) or operator == b"INLINE IMAGE":
+            image_area += abs(cm[0] * cm[3] - cm[1] * cm[2])
+
+    text = page.extract_text(visitor_operand_before=visit) or ""
+    page_area = abs(float(page.mediabox.width) * float(page.mediabox.height)) or 1.0
+    chars = sum(1 for char in text if not char.isspace())
+    return text, TextLayerQuality(chars, garbage_ratio(text), min(image_area / page_area, 1.0))
+
+
+def ocr_reason(quality: TextLayerQuality):
+    """Why a page needs OCR, or None when its text layer can be used as it is."""
+    if quality.chars < ROUTER_MIN_CHARS:
+        return "sparse_text"
+    if quality.garbage_ratio > ROUTER_MAX_GARBAGE_RATIO:
+        return "garbage_glyphs"
+    if quality.image_coverage > ROUTER_MAX_IMAGE_COVERAGE and quality.chars < ROUTER_IMAGE_PAGE_MIN_CHARS:
+        return "image_page"
+    return None
@@ -0,0 +1,99 @@
+import mmap
+import os
+import tempfile
+from services.metrics import timed
+
+""" This service is responsible for receiving uploaded documents without holding them in memory.
+
+StreamingUpload takes the request body chunk by chunk and, in the same pass, writes it to a
+spooled temporary file and sends it to S3 as a multipart upload of UPLOAD_PART_SIZE parts.
+At most one part is buffered. Once the upload completes, the spooled file is memory-mapped,
+so extraction reads pages from the page cache instead of from a copy on the heap. """
+
+# S3 requires at least 5 MiB for every part but the last
+UPLOAD_PART_SIZE = max(int(os.getenv("UPLOAD_PART_SIZE", str(8 * 1024 * 1024))), 5 * 1024 * 1024)
+UPLOAD_SPOOL_MAX_MEMORY = int(os.getenv("UPLOAD_SPOOL_MAX_MEMORY", str(1024 * 1024)))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+
+class UploadTooLargeError(Exception):
+    pass
+
+
+class StreamingUpload:
+    """
+    One-pass upload of a stream to a spooled temp file and an S3 multipart upload.
+
+    Call start(), then write() every chunk, calling flush_parts() whenever part_ready is set
+    (it does the blocking S3 calls, so async callers run it in a thread), then complete().
+    On any failure call abort() so S3 discards the uploaded parts.
+    """
+
+    def __init__(self, s3_client, bucket, key, part_size=UPLOAD_PART_SIZE, max_bytes=MAX_UPLOAD_BYTES):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.max_bytes = max_bytes
+        self.spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_MEMORY)
+        self.size = 0
+        self.upload_id = None
+        self.etag = None
+        self.parts = []
+        self._buffer = bytearray()
+
+    def start(self):
+        with timed("s3_multipart_start"):
+            self.upload_id = self.s3_client.create_multipart_upload(Bucket=self.bucket, Key=self.key)["UploadId"]
+
+    @property
+    def part_ready(self):
+        return len(self._buffer) >= self.part_size
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise UploadTooLargeError(f"Upload exceeds {self.max_bytes} bytes")
+        self.spool.write(data)
+        self._buffer += data
+
+    def _upload_part(self, data):
+        with timed("s3_upload_part"):
+            response = self.s3_client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                                  PartNumber=len(self.parts) + 1, Body=bytes(data))
+        self.parts.append({"PartNumber": len(self.parts) + 1, "ETag": response["ETag"]})
+
+    def flush_parts(self):
+        """Uploads every full part that is buffered."""
+        while len(self._buffer) >= self.part_size:
+            self._upload_part(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+
+    def complete(self):
+        """Uploads the last part, completes the S3 object and returns the spooled file memory-mapped."""
+        self.flush_parts()
+        if self._buffer or not self.parts:
+            self._upload_part(self._buffer)
+            self._buffer = bytearray()
+        with timed("s3_multipart_complete"):
+            response = self.s3_client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                                                MultipartUpload={"Parts": self.parts})
+        self.etag = (response or {}).get("ETag")
+        return self.map()
+
+    def map(self):
+        """Memory-maps the spooled file (moving it to disk first if it is still in memory)."""
+        self.spool.flush()
+        self.spool.rollover()
+        return mmap.mmap(self.spool.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def abort(self):
+        if self.upload_id:
+            try:
+                self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            except Exception as e:
+                print(f"Error aborting multipart upload of {self.key}: {e}")
+        self.close()
+
+    def close(self):
+        self.spool.close()
@@ -1,11 +1,16 @@
 import argparse
+import json
 import weaviate
 import os
+import re
 from dotenv import load_dotenv
 from weaviate.classes.init import Auth
+from weaviate.util import generate_uuid5
 from weaviate.classes.query import Filter
+from weaviate.classes.data import DataObject
 from weaviate.classes.config import Configure, Property, DataType
 from database.dao.DocumentRecord import DocumentRecord
+from services.metrics import timed
 
 """ This service is responsible for connecting to Weaviate and managing the data in the Document collection."""
 
@@ -13,6 +18,14 @@ from database.dao.DocumentRecord import DocumentRecord
 WEAVIATE_URL = os.getenv("WEAVIATE_REST_URL", "http://localhost:8080")
 WEAVIATE_API_KEY = os.getenv("WEAVIATE_API_KEY")
 
+# Queries and ingestion use this alias; it points at one versioned collection (<alias>_v<n>).
+# Collection aliases need Weaviate server 1.32+ and weaviate-client 4.16.0+.
+DOCUMENT_COLLECTION = os.getenv("WEAVIATE_DOCUMENT_COLLECTION", "Document")
+WEAVIATE_VECTORIZER_MODEL = os.getenv("WEAVIATE_VECTORIZER_MODEL", "Snowflake/snowflake-arctic-embed-l-v2.0")
+# Objects one delete_many removes at most (the server's QUERY_MAXIMUM_RESULTS)
+WEAVIATE_DELETE_MAX_OBJECTS = int(os.getenv("WEAVIATE_DELETE_MAX_OBJECTS", "10000"))
+_VERSION_RE = re.compile(re.escape(DOCUMENT_COLLECTION) + r"_v(\d+)")
+
 def get_weaviate_client():
     """
     Connect to Weaviate and return the client object.
@@ -29,36 +42,137 @@ def get_weaviate_client():
     
     return client
 
+def document_collection_config(model=WEAVIATE_VECTORIZER_MODEL):
+    """Properties and vectorizer of a Document collection."""
+    properties = [Property(name="project_id", data_type=DataType.INT),
+                  Property(name="document_id", data_type=DataType.INT),
+                  Property(name="file_name", data_type=DataType.TEXT),
+                  Property(name="source_url", data_type=DataType.TEXT),
+                  Property(name="source_page", data_type=DataType.INT),
+                  Property(name="chunk_no", data_type=DataType.TEXT),
+                  Property(name="contents", data_type=DataType.TEXT)
+    ]
+    vectorizer_config = [Configure.NamedVectors.text2vec_weaviate(
+        name="chunk_vector",
+        source_properties=["file_name", "contents"],
+        model=model
+    )]
+    return properties, vectorizer_config
+
+def versioned_collection_name(version: int):
+    return f"{DOCUMENT_COLLECTION}_v{version}"
+
+def collection_versions(client):
+    """Versions of the Document collection that exist, ascending."""
+    versions = []
+    for name in client.collections.list_all(simple=True):
+        match = _VERSION_RE.fullmatch(name)
+        if match:
+            versions.append(int(match.group(1)))
+    return sorted(versions)
+
+def create_document_collection(client, collection_name, model=WEAVIATE_VECTORIZER_MODEL):
+    properties, vectorizer_config = document_collection_config(model)
+    client.collections.create(collection_name, properties=properties, vectorizer_config=vectorizer_config)
+
+def alias_target(client):
+    """The collection the DOCUMENT_COLLECTION alias points to, or None when there is no alias."""
+    alias = client.alias.get(alias_name=DOCUMENT_COLLECTION)
+    return alias.collection if alias else None
+
+def legacy_collection_exists(client):
+    """Whether DOCUMENT_COLLECTION is still an unversioned collection from before aliases were used."""
+    return alias_target(client) is None and client.collections.exists(DOCUMENT_COLLECTION)
+
+def legacy_migration_steps():
+    return (f"{DOCUMENT_COLLECTION} is an unversioned collection and an alias cannot share its name. Copy it first with\n"
+            f"    PYTHONPATH=src python -m services.reindex_service migrate\n"
+            f"then, once {versioned_collection_name(0)} is validated, replace it with the alias with\n"
+            f"    PYTHONPATH=src python -m services.reindex_service drop {DOCUMENT_COLLECTION}")
+
+def switch_alias(client, collection_name):
+    """
+    Points the DOCUMENT_COLLECTION alias at collection_name in one operation and returns the
+    previous target. Refuses while an unversioned collection named DOCUMENT_COLLECTION (from
+    before aliases were used) exists: it is only deleted by an explicit reindex drop, after
+    reindex migrate has copied it.
+    """
+    previous = alias_target(client)
+    if previous:
+        client.alias.update(alias_name=DOCUMENT_COLLECTION, new_target_collection=collection_name)
+        return previous
+    if client.collections.exists(DOCUMENT_COLLECTION):
+        print(legacy_migration_steps())
+        raise RuntimeError(f"{DOCUMENT_COLLECTION} has to be migrated before the alias can be created")
+    client.alias.create(alias_name=DOCUMENT_COLLECTION, target_collection=collection_name)
+    return None
+
 def create_collections(client, recreate_if_exists=False):
     """
-    Create collections in Weaviate.
-    """    
-    collection_name = "Document"
-    if client.collections.exists(collection_name):
-        if recreate_if_exists:
-            client.collections.delete(collection_name)  # THIS WILL DELETE ALL DATA IN THE COLLECTION
-        else:
-            return; # Collection already exists, not recreating
-
-    # Create the collection    
-    client.collections.create(collection_name, 
-                            properties=[Property(name="project_id", data_type=DataType.INT),
-                                        Property(name="document_id", data_type=DataType.INT),
-                                        Property(name="file_name", data_type=DataType.TEXT),
-                                        Property(name="source_url", data_type=DataType.TEXT),
-                                        Property(name="source_page", data_type=DataType.INT),
-                                        Property(name="chunk_no", data_type=DataType.TEXT),                                        
-                                        Property(name="contents", data_type=DataType.TEXT)
-                            ],
-                            vectorizer_config=[Configure.NamedVectors.text2vec_weaviate(
-                                name="chunk_vector",
-                                source_properties=["file_name", "contents"],
-                                model="Snowflake/snowflake-arctic-embed-l-v2.0"
-                            )]
-    )
+    Create collections in Weaviate: a versioned Document collection and the alias queries use.
+    To change the schema or vectorizer of a populated index, run services.reindex_service,
+    which builds the new version alongside the old one; recreate_if_exists deletes all data.
+    An unversioned Document collection is left in place; recreating it needs the migration
+    reindex_service describes.
+    """
+    if client.alias.exists(alias_name=DOCUMENT_COLLECTION) or client.collections.exists(DOCUMENT_COLLECTION):
+        if not recreate_if_exists:
+            return # Collection already exists, not recreating
+        if legacy_collection_exists(client):
+            print(legacy_migration_steps())
+            raise RuntimeError(f"{DOCUMENT_COLLECTION} has to be migrated before it can be recreated")
+        previous = alias_target(client)
+        collection_name = versioned_collection_name((collection_versions(client) or [0])[-1] + 1)
+        create_document_collection(client, collection_name)
+        switch_alias(client, collection_name)
+        client.collections.delete(previous)  # THIS WILL DELETE ALL DATA IN THE COLLECTION
+        return
+
+    collection_name = versioned_collection_name(1)
+    create_document_collection(client, collection_name)
+    switch_alias(client, collection_name)
     return
-    
-def insert_document_chunks(client, document_record: DocumentRecord, chunks):
+
+def copy_collection(client, source_name, target_name, batch_size=500):
+    """
+    Copies every object of one collection into another with its id and vectors, so nothing is
+    embedded again. Returns the number of objects that failed.
+    """
+    source = client.collections.get(source_name)
+    target = client.collections.get(target_name)
+    failed = 0
+    batch = []
+
+    def flush():
+        nonlocal failed
+        with timed("weaviate_insert"):
+            response = target.data.insert_many(batch)
+        if response.errors:
+            print(f"{len(response.errors)} objects failed to copy into {target_name}, first: {next(iter(response.errors.values()))}")
+        failed += len(response.errors)
+        batch.clear()
+
+    for obj in source.iterator(include_vector=True):
+        batch.append(DataObject(properties=obj.properties, uuid=obj.uuid, vector=obj.vector))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return failed
+
+def chunk_uuid(document_id, chunk_no):
+    """Deterministic object id for a document's chunk, so other pages can refer to its vector."""
+    return str(generate_uuid5(f"{document_id}:{chunk_no}"))
+
+def chunk_properties(document_record: DocumentRecord, chunk):
+    return {"document_id": document_record.document_id,
+            "file_name": document_record.file_name,
+            "project_id": document_record.project_id,
+            "source_url": document_record.source_url,
+            "source_page": document_record.source_page,
+            "contents": chunk}
+
+def insert_document_chunks(client, document_record: DocumentRecord, chunks, vectors=None):
     """
     Connect to Weaviate and insert records for file content chunks. This will always insert and
     does not check for existence.
@@ -66,10 +180,12 @@ def insert_document_chunks(client, document_record: DocumentRecord, chunks):
     Args:
         chunks: A list of dictionaries, each containing the chunk data with keys 'project_id', 'file_id', 
                 'file_name', 'source_location', 'source_page', and 'chunk_content'.
+        vectors: Optional list parallel to chunks; a chunk with a vector (e.g. reused from a
+                 duplicate page) is stored with it instead of being embedded again.
     """
         
     # Check if the records already exist using the file_id
-    documents = client.collections.get("Document")
+    documents = client.collections.get(DOCUMENT_COLLECTION)
 
     
     """ query_result = documents.query.fetch_objects(
@@ -80,14 +196,12 @@ def insert_document_chunks(client, document_record: DocumentRecord, chunks):
     print(f"returned", len(query_result.objects))"""
         
     # Insert the records
-    with documents.batch.dynamic() as batch:
-        for chunk in chunks:
-            batch.add_object({"document_id": document_record.document_id, 
-                                "file_name": document_record.file_name, 
-                                "project_id": document_record.project_id,
-                                "source_url": document_record.source_url,
-                                "source_page": document_record.source_page,
-                                "contents": chunk})
+    with timed("weaviate_insert"), documents.batch.dynamic() as batch:
+        for chunk_no, chunk in enumerate(chunks):
+            vector = vectors[chunk_no] if vectors else None
+            batch.add_object(chunk_properties(document_record, chunk),
+                             uuid=chunk_uuid(document_record.document_id, chunk_no),
+                             **({"vector": vector} if vector else {}))
             if batch.number_errors > 10:
                 print("Batch import stopped due to excessive errors.")
                 break
@@ -101,13 +215,104 @@ def insert_document_chunks(client, document_record: DocumentRecord, chunks):
     
     return True
 
-def remove_document_chunks(client, document_id: int):
+def upsert_document_chunks(client, collection_name, document_record: DocumentRecord, chunks):
+    """
+    Writes a document's chunks to a specific collection in one synchronous batch, replacing
+    objects with the same ids, so it is safe to call from several threads and to repeat.
+    Returns the number of objects that failed.
+    """
+    collection = client.collections.get(collection_name)
+    objects = [DataObject(properties=chunk_properties(document_record, chunk), uuid=chunk_uuid(document_record.document_id, chunk_no))
+               for chunk_no, chunk in enumerate(chunks)]
+    with timed("weaviate_insert"):
+        response = collection.data.insert_many(objects)
+    if response.errors:
+        print(f"{len(response.errors)} objects of document {document_record.document_id} failed, first: {next(iter(response.errors.values()))}")
+    return len(response.errors)
+
+def count_objects(client, collection_name):
+    with timed("weaviate_count"):
+        return client.collections.get(collection_name).aggregate.over_all(total_count=True).total_count
+
+def remove_document_chunks(client, document_id: int, collection_name=DOCUMENT_COLLECTION):
     """
     Remove all chunks for a document from Weaviate.
     """
-    documents = client.collections.get("Document")
-    documents.data.delete_many(
-        where=Filter.by_property("document_id").equal(document_id)
-    )
+    documents = client.collections.get(collection_name)
+    with timed("weaviate_delete"):
+        documents.data.delete_many(
+            where=Filter.by_property("document_id").equal(document_id)
+        )
     return
     
+
+def document_collections(client):
+    """Every Document collection holding chunks: the versions kept for rollback as well as the live one."""
+    names = [versioned_collection_name(version) for version in collection_versions(client)]
+    return names or [DOCUMENT_COLLECTION]
+
+def remove_project_chunks(client, project_id: int, collection_name=DOCUMENT_COLLECTION):
+    """
+    Remove all chunks of a project from a collection with one filtered delete, repeated only
+    while a delete reaches the server's per-request limit. Returns the number of objects deleted.
+    """
+    documents = client.collections.get(collection_name)
+    deleted = 0
+    while True:
+        with timed("weaviate_delete"):
+            result = documents.data.delete_many(where=Filter.by_property("project_id").equal(project_id))
+        deleted += result.successful
+        if result.failed:
+            raise RuntimeError(f"Weaviate failed to delete {result.failed} chunks of project {project_id} in {collection_name}")
+        if result.matches < WEAVIATE_DELETE_MAX_OBJECTS:
+            return deleted
+
+def get_chunk_vectors(client, uuids):
+    """Returns {uuid: named vectors} for the chunks that still exist."""
+    if not uuids:
+        return {}
+    documents = client.collections.get(DOCUMENT_COLLECTION)
+    with timed("weaviate_fetch_vectors"):
+        response = documents.query.fetch_objects(
+            filters=Filter.by_id().contains_any(list(uuids)),
+            include_vector=True,
+            limit=len(uuids),
+        )
+    return {str(obj.uuid): obj.vector for obj in response.objects}
+
+def search_chunks(client, project_id: int, query: str, limit=20):
+    """
+    Vector search over a project's chunks. Returns the properties of the closest chunks,
+    best first.
+    """
+    documents = client.collections.get(DOCUMENT_COLLECTION)
+    with timed("weaviate_search"):
+        response = documents.query.near_text(
+            query=query,
+            limit=limit,
+            filters=Filter.by_property("project_id").equal(project_id),
+            target_vector="chunk_vector",
+        )
+    return [obj.properties for obj in response.objects]
+
+# Properties returned by batched vector searches (GraphQL needs them listed)
+SEARCH_PROPERTIES = ("project_id", "document_id", "file_name", "source_url", "source_page", "chunk_no", "contents")
+
+def search_chunks_batch(client, project_id: int, queries, limit=20):
+    """
+    Vector search for several queries in one request: a GraphQL query with one aliased
+    nearText search per query. Returns the properties of the closest chunks for each query,
+    best first.
+    """
+    if not queries:
+        return []
+    fields = " ".join(SEARCH_PROPERTIES)
+    searches = " ".join(
+        f'q{i}: {DOCUMENT_COLLECTION}(nearText: {{concepts: [{json.dumps(query)}], targetVectors: ["chunk_vector"]}}, '
+        f'where: {{path: ["project_id"], operator: Equal, valueInt: {int(project_id)}}}, limit: {int(limit)}) {{ {fields} }}'
+        for i, query in enumerate(queries))
+    with timed("weaviate_search"):
+        response = client.graphql_raw_query(f"{{ Get {{ {searches} }} }}")
+    if response.errors:
+        raise RuntimeError(f"Batched vector search failed: {response.errors}")
+    return [response.get.get(f"q{i}") or [] for i in range(len(queries))]
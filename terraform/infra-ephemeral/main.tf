@@ -145,9 +145,17 @@ resource "aws_alb_target_group" "app_target_group" {
   protocol             = "HTTP"
   vpc_id               = var.vpc_id
   target_type          = "ip"
+  deregistration_delay = 30
+
+  # Chat sessions keep their retrieved chunks in the task that served them
+  stickiness {
+    type            = "lb_cookie"
+    cookie_duration = 1800
+    enabled         = true
+  }
 
   health_check {
-    path                 = "/"
+    path                 = "/healthz"
     protocol             = "HTTP"
     matcher              = "200"
     healthy_threshold    = 2
@@ -183,6 +191,8 @@ resource "aws_ecs_task_definition" "app_task_definition" {
           hostPort      = 80
         }
       ],
+      # serve.py drains for DRAIN_SECONDS, then gunicorn waits up to GRACEFUL_TIMEOUT
+      stopTimeout = 60,
       environment = [
         { name = "AWS_ACCESS_KEY_ID", value = var.aws_access_key_id },
         { name = "AWS_SECRET_ACCESS_KEY", value = var.aws_secret_access_key },
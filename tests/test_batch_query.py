@@ -0,0 +1,130 @@
+import json
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import main
+from services import lexical_index, retrieval_service, weaviate_service
+from services.context_service import ContextChunk
+
+SCHEDULE = "Door hardware schedule: hinges, closers and locksets for every door on level 2. " * 3
+ROOFING = "Roofing membrane: fully adhered EPDM over tapered insulation with a 20 year warranty. " * 3
+
+
+def post_batch(payload):
+    response = TestClient(main.app).post("/query/batch", json=payload)
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    return response, lines
+
+
+class TestBatchQuery:
+    def test_shared_retrieval_and_streamed_answers(self):
+        retrieved = [[ContextChunk(SCHEDULE, "a.pdf", 0, score=2.0), ContextChunk(ROOFING, "b.pdf", 3, score=1.0)],
+                     [ContextChunk(SCHEDULE, "a.pdf", 0, score=0.5)],
+                     [ContextChunk(ROOFING, "b.pdf", 3, score=3.0)]]
+        contexts = {}
+
+        def fake_gemini(query, context):
+            contexts[query] = context
+            return f"answer to {query}"
+
+        with patch.object(main, "retrieve_batch", return_value=retrieved) as retrieve_batch, \
+             patch.object(main, "call_gemini_api", side_effect=fake_gemini):
+            response, lines = post_batch({"queries": ["hinges?", "closers?", "roof?"], "project_id": 4,
+                                          "location": "p/", "retrieval": "hybrid"})
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        retrieve_batch.assert_called_once_with(4, ["hinges?", "closers?", "roof?"], "hybrid")
+        answers, done = lines[:-1], lines[-1]
+        assert sorted(line["index"] for line in answers) == [0, 1, 2]
+        assert all(line["response"] == f"answer to {line['query']}" for line in answers)
+        assert done == {"done": True, "failed": 0, "queries": 3, "shared_chunks": 2, "duplicates_dropped": 2}
+        assert contexts["hinges?"].count("Door hardware schedule") == 3
+        assert "Roofing" not in contexts["closers?"]
+
+    def test_project_without_index_is_read_once(self):
+        pages = [ContextChunk(SCHEDULE, "a.pdf", 0), ContextChunk(SCHEDULE, "a.pdf", 1), ContextChunk(ROOFING, "a.pdf", 2)]
+        with patch.object(main, "iter_project_pages", return_value=iter(pages)) as iter_project_pages, \
+             patch.object(main, "call_gemini_api", return_value="ok"):
+            _, lines = post_batch({"queries": ["hinges?", "roof?", "closers?"], "location": "p/"})
+
+        iter_project_pages.assert_called_once_with("p/")
+        assert lines[-1]["shared_chunks"] == 2 and lines[-1]["duplicates_dropped"] == 1
+        assert all(line["context"]["chunks_included"] == 2 for line in lines[:-1])
+
+    def test_failures_are_reported_per_query(self):
+        def fake_gemini(query, context):
+            if query == "bad":
+                raise HTTPException(status_code=503, detail="Gemini API temporarily unavailable")
+            return "ok"
+
+        with patch.object(main, "iter_project_pages", return_value=iter([ContextChunk(SCHEDULE, "a.pdf", 0)])), \
+             patch.object(main, "call_gemini_api", side_effect=fake_gemini):
+            response, lines = post_batch({"queries": ["good", "bad"], "location": "p/"})
+
+        assert response.status_code == 200
+        assert {line["query"]: line.get("status") for line in lines[:-1]} == {"good": None, "bad": 503}
+        assert lines[-1]["failed"] == 1
+
+    def test_generation_fan_out_is_bounded(self):
+        running = 0
+        peak = 0
+        lock = threading.Lock()
+
+        def slow_gemini(query, context):
+            nonlocal running, peak
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            time.sleep(0.05)
+            with lock:
+                running -= 1
+            return "ok"
+
+        with patch.object(main, "iter_project_pages", return_value=iter([ContextChunk(SCHEDULE, "a.pdf", 0)])), \
+             patch.object(main, "call_gemini_api", side_effect=slow_gemini):
+            _, lines = post_batch({"queries": [f"q{n}" for n in range(8)], "location": "p/", "concurrency": 2})
+
+        assert len(lines) == 9 and peak == 2
+
+    def test_validation(self):
+        assert post_batch({"queries": [], "location": "p/"})[0].status_code == 400
+        assert post_batch({"queries": ["a", ""], "location": "p/"})[0].status_code == 400
+        assert post_batch({"queries": ["a"], "retrieval": "fuzzy"})[0].status_code == 400
+        assert post_batch({"queries": ["a"], "location": "p/", "concurrency": "lots"})[0].status_code == 400
+        assert post_batch({"queries": ["a"], "location": "p/", "concurrency": 2.5})[0].status_code == 400
+        with patch.object(main, "BATCH_QUERY_MAX_QUERIES", 2):
+            assert post_batch({"queries": ["a", "b", "c"], "location": "p/"})[0].status_code == 400
+
+
+class TestBatchRetrieval:
+    def test_hybrid_runs_one_vector_search_for_all_queries(self):
+        hit = lexical_index.LexicalHit(1, "a.pdf", 0, 3.0, SCHEDULE)
+        vector_search_batch = MagicMock(return_value=[
+            [{"document_id": 1, "contents": SCHEDULE, "file_name": "a.pdf"}],
+            [{"document_id": 2, "contents": ROOFING, "file_name": "b.pdf"}]])
+        with patch.object(lexical_index, "search", return_value=[hit]), \
+             patch.object(retrieval_service, "ensure_lexical_index"):
+            results = retrieval_service.retrieve_batch(4, ["hinges?", "roof?"], "hybrid",
+                                                       vector_search_batch=vector_search_batch)
+
+        vector_search_batch.assert_called_once_with(4, ["hinges?", "roof?"], retrieval_service.RETRIEVAL_TOP_K)
+        assert [chunk.text for chunk in results[0]] == [SCHEDULE]
+        assert [chunk.text for chunk in results[1]] == [SCHEDULE, ROOFING]
+
+    def test_weaviate_batch_is_one_graphql_request(self):
+        client = MagicMock()
+        client.graphql_raw_query.return_value = SimpleNamespace(
+            errors=None, get={"q0": [{"contents": "a"}], "q1": []})
+        results = weaviate_service.search_chunks_batch(client, 4, ['door "D1"', "roof"], limit=5)
+
+        assert results == [[{"contents": "a"}], []]
+        query = client.graphql_raw_query.call_args.args[0]
+        assert client.graphql_raw_query.call_count == 1
+        assert 'q0: Document(nearText: {concepts: ["door \\"D1\\""]' in query
+        assert "valueInt: 4" in query and "limit: 5" in query
@@ -0,0 +1,108 @@
+from unittest.mock import MagicMock
+
+from database.dao.ChunkDAO import ChunkDAO
+from database.dao.ChunkRecord import ChunkRecord
+from database.dao.DocumentRecord import DocumentRecord
+from services import chunk_store, lexical_index
+from services.ingestion_service import IngestionService
+
+
+class FakeCopyDatabase:
+    def __init__(self):
+        self.copied = None
+
+    def copy_from(self, copy_sql, file):
+        self.copy_sql = copy_sql
+        self.copied = file.read()
+        return self.copied.count("\n")
+
+
+class TestChunkStore:
+    def test_copy_escapes_text_format(self):
+        db = FakeCopyDatabase()
+        document = DocumentRecord(7, "set.pdf", 3, "s3://b/set.pdf", 0)
+        records = chunk_store.chunk_records(document, ["line one\nline\ttwo \\ end\x00", "page two"], "pypdf:5:v1")
+
+        assert ChunkDAO(db).copy_chunks(records) == 2
+        first, second = db.copied.splitlines()
+        assert first.split("\t")[:4] == ["7", "3", "0", "0"]
+        assert first.split("\t")[4] == "line one\\nline\\ttwo \\\\ end"
+        assert second.split("\t")[4:] == ["page two", records[1].content_hash, "pypdf:5:v1"]
+        assert db.copy_sql.startswith("COPY chunks (document_id, project_id, page_number, chunk_no, text")
+
+    def test_iter_documents_groups_streamed_chunks(self):
+        dao = MagicMock()
+        dao.iter_chunks.return_value = iter([
+            ChunkRecord(1, 3, 0, 0, "a0", "h", "v", file_name="a.pdf"),
+            ChunkRecord(1, 3, 1, 1, "a1", "h", "v", file_name="a.pdf"),
+            ChunkRecord(2, 3, 0, 0, "b0", "h", "v", file_name="b.pdf"),
+        ])
+        documents = [(document_id, file_name, [chunk.text for chunk in chunks])
+                     for document_id, _, file_name, chunks in chunk_store.iter_documents(dao, 3)]
+
+        assert documents == [(1, "a.pdf", ["a0", "a1"]), (2, "b.pdf", ["b0"])]
+
+    def test_rebuild_lexical_index(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(lexical_index, "LEXICAL_INDEX_DIR", str(tmp_path))
+        monkeypatch.setattr(lexical_index, "_open_indexes", {})
+        dao = MagicMock()
+        dao.iter_chunks.return_value = iter([
+            ChunkRecord(1, 3, 0, 0, "door hardware schedule", "h", "v", file_name="a.pdf"),
+            ChunkRecord(2, 3, 0, 0, "roofing membrane", "h", "v", file_name="b.pdf"),
+        ])
+
+        dao.project_watermark.return_value = [8, 2]
+
+        assert chunk_store.rebuild_lexical_index(dao, 3) == 2
+        assert lexical_index.search(3, "roofing")[0].document_id == 2
+        assert lexical_index.open_index(3).watermark == [8, 2]
+
+    def test_sync_lexical_index_follows_the_store(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(lexical_index, "LEXICAL_INDEX_DIR", str(tmp_path))
+        monkeypatch.setattr(lexical_index, "_open_indexes", {})
+        stored = {1: [ChunkRecord(1, 3, 0, 0, "door hardware schedule", "h", "v", file_name="a.pdf")]}
+
+        def iter_chunks(project_id=None, document_id=None, min_document_id=None):
+            return iter([chunk for key in sorted(stored) if document_id in (None, key) for chunk in stored[key]])
+
+        dao = MagicMock()
+        dao.iter_chunks.side_effect = iter_chunks
+        dao.project_watermark.return_value = [1, 1]
+        assert chunk_store.sync_lexical_index(dao, 3) == "rebuilt"
+        assert chunk_store.sync_lexical_index(dao, 3) == "fresh"
+
+        # Another task ingests a document: only that document is read again
+        stored[2] = [ChunkRecord(2, 3, 0, 0, "roofing membrane", "h", "v", file_name="b.pdf")]
+        dao.project_watermark.return_value = [2, 2]
+        dao.project_document_ids_after.return_value = [2]
+        dao.iter_chunks.reset_mock()
+        assert chunk_store.sync_lexical_index(dao, 3) == "caught_up"
+        assert dao.iter_chunks.call_args.kwargs["document_id"] == 2
+        assert lexical_index.search(3, "roofing")[0].document_id == 2
+
+        # A deleted document changes the count but not the largest id
+        del stored[1]
+        dao.project_watermark.return_value = [2, 1]
+        dao.project_document_ids_after.return_value = []
+        assert chunk_store.sync_lexical_index(dao, 3) == "rebuilt"
+        assert lexical_index.search(3, "door") == []
+
+        stored.clear()
+        dao.project_watermark.return_value = [0, 0]
+        assert chunk_store.sync_lexical_index(dao, 3) == "dropped"
+        assert lexical_index.open_index(3) is None
+
+    def test_ingestion_stores_chunks(self):
+        chunk_dao = MagicMock()
+        document_dao = MagicMock()
+        document_dao.create_document.return_value = DocumentRecord(9, "set.pdf", 3, "s3://b/set.pdf", 0)
+        extraction_service = MagicMock()
+        extraction_service.extract_and_chunk.return_value = ["page one", "page two"]
+        extraction_service.extractor_version.return_value = "pypdf:5:v1"
+        service = IngestionService(MagicMock(), document_dao, extraction_service, MagicMock(),
+                                   lexical_index_module=MagicMock(), chunk_dao=chunk_dao)
+
+        assert service.ingest_document(DocumentRecord(None, "set.pdf", 3, "s3://b/set.pdf", 0), b"%PDF") == 9
+        records = chunk_dao.copy_chunks.call_args.args[0]
+        assert [(r.document_id, r.page_number, r.text, r.extractor_version) for r in records] == [
+            (9, 0, "page one", "pypdf:5:v1"), (9, 1, "page two", "pypdf:5:v1")]
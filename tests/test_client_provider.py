@@ -0,0 +1,46 @@
+from unittest.mock import patch
+
+import pytest
+
+from services import client_provider
+
+
+class TestServiceAccountRefresh:
+    @pytest.fixture(autouse=True)
+    def fresh_state(self):
+        client_provider.invalidate_credentials()
+        yield
+        client_provider.invalidate_credentials()
+
+    def test_failed_reload_keeps_previous_info_and_client(self):
+        key = {"client_email": "svc@example.com"}
+        client = object()
+        now = [0.0]
+        with patch.object(client_provider, "_load_service_account_info", side_effect=[key, RuntimeError("throttled"), key]) as load, \
+             patch.object(client_provider.time, "monotonic", side_effect=lambda: now[0]):
+            assert client_provider.get_google_service_account_info() == key
+            client_provider._documentai_client = client
+
+            now[0] = client_provider.SECRET_REFRESH_SECONDS + 1
+            assert client_provider.get_google_service_account_info() == key
+            assert client_provider._documentai_client is client
+
+            # Retried after SECRET_RETRY_SECONDS, not a whole refresh period later
+            now[0] += client_provider.SECRET_RETRY_SECONDS - 1
+            client_provider.get_google_service_account_info()
+            assert load.call_count == 2
+            now[0] += 2
+            assert client_provider.get_google_service_account_info() == key
+            assert load.call_count == 3
+            assert client_provider._documentai_client is client
+
+    def test_rotated_key_drops_documentai_client(self):
+        now = [0.0]
+        with patch.object(client_provider, "_load_service_account_info", side_effect=[{"key": 1}, {"key": 2}]), \
+             patch.object(client_provider.time, "monotonic", side_effect=lambda: now[0]):
+            client_provider.get_google_service_account_info()
+            client_provider._documentai_client = object()
+            now[0] = client_provider.SECRET_REFRESH_SECONDS + 1
+
+            assert client_provider.get_google_service_account_info() == {"key": 2}
+            assert client_provider._documentai_client is None
@@ -0,0 +1,102 @@
+import pytest
+
+from services.context_service import ContextChunk, assemble_context, count_tokens
+
+
+class TestContextService:
+    @pytest.fixture
+    def chunks(self):
+        return [
+            ContextChunk("General conditions apply to all contractors on site.", "specs.pdf", 0),
+            ContextChunk("Door hardware schedule for section 08 71 00 lists lever sets.", "specs.pdf", 1),
+            ContextChunk("Roofing membrane shall be fully adhered over insulation board.", "specs.pdf", 2),
+        ]
+
+    def test_ranks_relevant_chunk_into_small_budget(self, chunks):
+        """Test that the best matching chunk wins when only one fits"""
+        budget = count_tokens(chunks[1].text) + 20
+        context, report = assemble_context("door hardware 08 71 00", chunks, token_budget=budget)
+
+        assert "Door hardware schedule" in context
+        assert "Roofing" not in context
+        assert report.chunks_included == 1
+        assert report.budget_dropped == 2
+        assert report.tokens_included <= budget
+
+    def test_drops_exact_and_near_duplicates(self, chunks):
+        """Test that reissued copies of a page are only included once"""
+        text = " ".join(f"word{i}" for i in range(200))
+        duplicates = [
+            ContextChunk(text, "set-a.pdf", 0),
+            ContextChunk(text.upper(), "set-b.pdf", 0),
+            ContextChunk(text + " addendum", "set-c.pdf", 0),
+        ]
+        context, report = assemble_context("word5", duplicates + chunks, token_budget=100000)
+
+        assert report.duplicates_dropped == 2
+        assert context.count("word199") == 1
+
+    def test_merges_adjacent_chunks_from_same_page(self):
+        """Test that consecutive chunks of one page share a single header"""
+        pieces = [
+            ContextChunk("First half of the page about concrete.", "a.pdf", 3, 0),
+            ContextChunk("Second half of the page about rebar.", "a.pdf", 3, 1),
+        ]
+        context, report = assemble_context("concrete", pieces, token_budget=1000)
+
+        assert context.count("[a.pdf, page 4]") == 1
+        assert report.chunks_merged == 1
+        assert context.index("First half") < context.index("Second half")
+
+    def test_splits_oversized_chunks(self, monkeypatch):
+        """Test that a page larger than the chunk limit is windowed instead of dropped"""
+        monkeypatch.setattr("services.context_service.CONTEXT_MAX_CHUNK_TOKENS", 50)
+        big = ContextChunk("\n".join(f"line {i} about steel framing" for i in range(100)), "big.pdf", 0)
+        context, report = assemble_context("steel", [big], token_budget=120)
+
+        assert report.chunks_in == 1
+        assert report.chunks_included >= 1
+        assert report.budget_dropped >= 1
+        assert "line 0 about steel" in context
+
+
+class TestStreamingContext:
+    def test_retains_only_best_candidates_while_streaming(self):
+        """Test that weak chunks are dropped as they stream past instead of being held"""
+        filler = [ContextChunk(f"filler page {i} " + "lorem ipsum " * 40, "set.pdf", i) for i in range(200)]
+        target = ContextChunk("Curtain wall anchors are stainless steel.", "set.pdf", 500)
+        budget = 400
+        context, report = assemble_context("curtain wall anchors", iter(filler[:100] + [target] + filler[100:]),
+                                           token_budget=budget)
+
+        assert "Curtain wall anchors" in context
+        assert report.chunks_in == 201
+        assert report.chunks_included + report.budget_dropped == 201
+        # Never more than the retained window of text held at once, plus the context itself
+        assert report.peak_bytes < 3 * budget * 4 + len(filler[0].text) + len(context)
+
+    def test_stops_reading_once_budget_is_full(self):
+        """Test that a query without terms closes the stream as soon as the budget is filled"""
+        consumed = []
+
+        def pages():
+            for i in range(1000):
+                consumed.append(i)
+                yield ContextChunk(" ".join(f"p{i}w{j}" for j in range(100)), "set.pdf", i)
+
+        stream = pages()
+        context, report = assemble_context("", stream, token_budget=500)
+
+        assert report.scan_stopped
+        assert len(consumed) < 10
+        assert "[set.pdf, page 1]" in context
+        assert next(stream, None) is None  # closed
+
+    def test_scan_token_budget(self):
+        """Test that the stream is cut off after the scan budget"""
+        pages = (ContextChunk(f"page {i} about mechanical ducts " * 20, "m.pdf", i) for i in range(100))
+        _, report = assemble_context("ducts", pages, token_budget=100000, scan_token_budget=1000)
+
+        assert report.scan_stopped
+        assert report.tokens_scanned >= 1000
+        assert report.chunks_in < 100
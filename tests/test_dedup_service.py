@@ -0,0 +1,125 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from database.dao.PageFingerprintRecord import PageFingerprintRecord
+from services import dedup_service
+from services.fingerprint import SIMHASH_BANDS, content_hash, simhash, simhash_bands
+from services.ingestion_service import IngestionService
+from database.dao.DocumentRecord import DocumentRecord
+
+
+SHEET = " ".join(f"door D-{n} hardware set {n % 7} hinges closer lockset" for n in range(20))
+
+
+def page(page_number, text):
+    fingerprint = PageFingerprintRecord(None, 10, 2, page_number, content_hash(text), simhash(text))
+    return dedup_service.PageMatch(fingerprint, text)
+
+
+def stored(fingerprint_id, text, chunk_uuid="uuid-1"):
+    return PageFingerprintRecord(fingerprint_id, 10, 1, 0, content_hash(text), simhash(text), f"extracted {fingerprint_id}", chunk_uuid)
+
+
+class TestFindDuplicates:
+    def test_exact_near_and_sparse_pages(self):
+        revised = SHEET.replace("D-19", "D-19A")
+        pages = [page(0, SHEET), page(1, revised), page(2, "BLANK"), page(3, "unrelated concrete slab " * 30)]
+        dao = MagicMock()
+        dao.find_candidates.return_value = [stored(5, SHEET), stored(6, "BLANK")]
+
+        dedup_service.find_duplicates(dao, 10, pages)
+
+        assert (pages[0].match.fingerprint_id, pages[0].distance) == (5, 0)
+        # Revised sheet: different text, but within the SimHash distance of the stored page
+        assert pages[1].fingerprint.content_hash != pages[0].fingerprint.content_hash
+        assert pages[1].match.fingerprint_id == 5 and pages[1].distance <= dedup_service.PAGE_DUPLICATE_MAX_DISTANCE
+        assert pages[2].match is None  # too few words to trust
+        assert pages[3].match is None
+
+
+class TestMaxDistance:
+    def test_bands_find_pages_only_up_to_bands_minus_one_bits(self):
+        value = simhash(SHEET)
+        width = 64 // SIMHASH_BANDS
+        # One flipped bit in each of the first n bands
+        flipped = {n: value ^ sum(1 << (band * width) for band in range(n)) for n in (SIMHASH_BANDS - 1, SIMHASH_BANDS)}
+
+        assert set(simhash_bands(value)) & set(simhash_bands(flipped[SIMHASH_BANDS - 1]))
+        assert not set(simhash_bands(value)) & set(simhash_bands(flipped[SIMHASH_BANDS]))
+
+    def test_distance_beyond_band_guarantee_is_rejected(self):
+        assert dedup_service.check_max_distance(SIMHASH_BANDS - 1) == SIMHASH_BANDS - 1
+        with pytest.raises(ValueError):
+            dedup_service.check_max_distance(SIMHASH_BANDS)
+
+
+class TestIngestionReusesDuplicates:
+    def test_duplicate_pages_reuse_text_and_vectors(self):
+        pages = [page(0, SHEET), page(1, "new sheet " * 30)]
+        pages[0].match, pages[0].distance = stored(5, SHEET, "uuid-5"), 0
+        weaviate_service = MagicMock()
+        weaviate_service.get_chunk_vectors.return_value = {"uuid-5": {"chunk_vector": [0.1, 0.2]}}
+        weaviate_service.chunk_uuid.side_effect = lambda document_id, chunk_no: f"{document_id}:{chunk_no}"
+        extraction_service = MagicMock(EXTRACTION_ROUTER_ENABLED=False)
+        dao = MagicMock()
+        document_dao = MagicMock()
+        document_dao.create_document.return_value = DocumentRecord(2, "reissue.pdf", 10, "s3://b/reissue.pdf", 0)
+        service = IngestionService(MagicMock(), document_dao, extraction_service, weaviate_service,
+                                   lexical_index_module=MagicMock(), fingerprint_dao=dao, use_document_ai=True)
+        extraction_service.extract_selected_pages_with_document_ai.return_value = {1: "docai page 1"}
+
+        with patch.object(dedup_service, "fingerprint_pages", return_value=pages), \
+             patch.object(dedup_service, "find_duplicates", side_effect=lambda dao, project_id, pages: pages):
+            assert service.ingest_document(DocumentRecord(None, "reissue.pdf", 10, "s3://b/reissue.pdf", 0), b"%PDF") == 2
+
+        extraction_service.extract_selected_pages_with_document_ai.assert_called_once_with(b"%PDF", [1])
+        _, _, chunks, vectors = weaviate_service.insert_document_chunks.call_args.args
+        assert chunks == ["extracted 5", "docai page 1"]
+        assert vectors == [{"chunk_vector": [0.1, 0.2]}, None]
+        fingerprints = dao.create_fingerprints.call_args.args[0]
+        assert [f.duplicate_of for f in fingerprints] == [5, None]
+        assert [f.chunk_uuid for f in fingerprints] == ["2:0", "2:1"]
+
+
+class TestUploadIngestionReusesDuplicates:
+    def test_duplicate_pages_skip_extraction(self):
+        import main
+        from services import extraction_service, weaviate_service
+
+        pages = [page(0, SHEET), page(1, "new sheet " * 30)]
+        pages[0].match, pages[0].distance = stored(5, SHEET, "uuid-5"), 0
+        fingerprint_dao = MagicMock()
+        document_dao = MagicMock()
+        document_dao.create_document.return_value = DocumentRecord(2, "reissue.pdf", 10, "s3://b/reissue.pdf", 0)
+        with patch("database.dbutil.Database"), \
+             patch("database.dao.DocumentDAO.DocumentDAO", return_value=MagicMock(__enter__=lambda self: document_dao)), \
+             patch("database.dao.ChunkDAO.ChunkDAO"), \
+             patch("database.dao.PageFingerprintDAO.PageFingerprintDAO", return_value=fingerprint_dao), \
+             patch("services.client_provider.get_weaviate_client"), \
+             patch.object(main.manifest_service, "PROJECT_MANIFEST_ENABLED", False), \
+             patch.object(dedup_service, "fingerprint_pages", return_value=pages), \
+             patch.object(dedup_service, "find_duplicates", side_effect=lambda dao, project_id, pages: pages), \
+             patch.object(extraction_service, "extract_and_chunk") as extract_and_chunk, \
+             patch.object(weaviate_service, "get_chunk_vectors", return_value={"uuid-5": {"chunk_vector": [0.1]}}), \
+             patch.object(weaviate_service, "insert_document_chunks") as insert, \
+             patch("services.lexical_index.add_document"), \
+             patch("services.chunk_store.store_chunks"):
+            assert main.ingest_uploaded_document(10, "reissue.pdf", "uploads/10/reissue.pdf", b"%PDF") == 2
+
+        extract_and_chunk.assert_not_called()
+        _, _, chunks, vectors = insert.call_args.args
+        assert chunks == ["extracted 5", "new sheet " * 30]
+        assert vectors == [{"chunk_vector": [0.1]}, None]
+        assert [f.duplicate_of for f in fingerprint_dao.create_fingerprints.call_args.args[0]] == [5, None]
+
+    def test_dedup_can_be_turned_off(self):
+        import main
+
+        with patch("database.dbutil.Database"), patch("database.dao.DocumentDAO.DocumentDAO"), \
+             patch("database.dao.ChunkDAO.ChunkDAO"), patch("services.client_provider.get_weaviate_client"), \
+             patch.object(main.manifest_service, "PROJECT_MANIFEST_ENABLED", False), \
+             patch.object(dedup_service, "PAGE_DEDUP_ENABLED", False), \
+             patch("services.ingestion_service.IngestionService") as ingestion_service:
+            main.ingest_uploaded_document(10, "set.pdf", "uploads/10/set.pdf", b"%PDF")
+        assert ingestion_service.call_args.kwargs["fingerprint_dao"] is None
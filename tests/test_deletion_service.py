@@ -0,0 +1,170 @@
+from contextlib import contextmanager
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from database.dao.DeletionJobDAO import DeletionJobDAO
+from database.dao.DeletionJobRecord import DeletionJobRecord
+from database.dbutil import Database
+from services import deletion_service, lexical_index, weaviate_service
+
+
+class FakeJobDAO:
+    """Deletion jobs kept in memory, with purge recording the jobs it was called for."""
+
+    def __init__(self, organization_projects=()):
+        self.jobs = {}
+        self.organization_projects = list(organization_projects)
+        self.purged = []
+
+    def find_unfinished_job(self, scope, target_id):
+        jobs = [job for job in self.jobs.values() if (job.scope, job.target_id) == (scope, target_id) and job.status != "done"]
+        if not jobs:
+            return None
+        job = jobs[-1]
+        return DeletionJobRecord(job.job_id, job.scope, job.target_id, job.project_ids, job.vectors_deleted, job.status)
+
+    def get_organization_project_ids(self, organization_id):
+        return self.organization_projects
+
+    def create_job(self, scope, target_id, project_ids):
+        job = DeletionJobRecord(len(self.jobs) + 1, scope, target_id, project_ids)
+        self.jobs[job.job_id] = DeletionJobRecord(job.job_id, scope, target_id, project_ids)
+        return job
+
+    def add_projects(self, job_id, project_ids):
+        self.jobs[job_id].project_ids = self.jobs[job_id].project_ids + list(project_ids)
+
+    def mark_vectors_deleted(self, job_id, project_id):
+        self.jobs[job_id].vectors_deleted.append(project_id)
+        self.jobs[job_id].status = "running"
+
+    def mark_failed(self, job_id, error):
+        self.jobs[job_id].status, self.jobs[job_id].error = "failed", str(error)
+
+    def purge(self, job):
+        self.purged.append(list(job.project_ids))
+        self.jobs[job.job_id].status = "done"
+        return {"documents": 10000}
+
+
+class TestDeletionService:
+    def test_one_weaviate_delete_per_project_and_one_purge(self):
+        job_dao = FakeJobDAO(organization_projects=[3, 4, 5])
+        with patch.object(weaviate_service, "document_collections", return_value=["Document_v1"]), \
+             patch.object(weaviate_service, "remove_project_chunks", return_value=7) as remove, \
+             patch.object(lexical_index, "drop_project") as drop_project:
+            job = deletion_service.delete(job_dao, MagicMock(), "organization", 9, progress=lambda message: None)
+
+        assert [call.args[1:] for call in remove.call_args_list] == [(3, "Document_v1"), (4, "Document_v1"), (5, "Document_v1")]
+        assert job_dao.purged == [[3, 4, 5]]
+        assert [call.args[0] for call in drop_project.call_args_list] == [3, 4, 5]
+        assert job.status == "done" and job.rows_deleted == {"documents": 10000}
+
+    def test_failed_index_drop_does_not_fail_a_purged_job(self):
+        job_dao = FakeJobDAO()
+        with patch.object(weaviate_service, "document_collections", return_value=["Document_v1"]), \
+             patch.object(weaviate_service, "remove_project_chunks", return_value=7), \
+             patch.object(lexical_index, "drop_project", side_effect=OSError("read-only file system")):
+            job = deletion_service.delete(job_dao, MagicMock(), "project", 3, progress=lambda message: None)
+
+        assert job.status == "done" and job_dao.jobs[job.job_id].status == "done"
+
+    def test_interrupted_deletion_resumes(self):
+        job_dao = FakeJobDAO(organization_projects=[3, 4, 5])
+        weaviate_down = [7, RuntimeError("weaviate unavailable")]
+        with patch.object(weaviate_service, "document_collections", return_value=["Document_v1"]), \
+             patch.object(weaviate_service, "remove_project_chunks", side_effect=weaviate_down), \
+             patch.object(lexical_index, "drop_project"):
+            with pytest.raises(RuntimeError):
+                deletion_service.delete(job_dao, MagicMock(), "organization", 9, progress=lambda message: None)
+        assert job_dao.jobs[1].status == "failed" and job_dao.jobs[1].vectors_deleted == [3]
+        assert not job_dao.purged
+
+        with patch.object(weaviate_service, "document_collections", return_value=["Document_v1"]), \
+             patch.object(weaviate_service, "remove_project_chunks", return_value=7) as remove, \
+             patch.object(lexical_index, "drop_project"):
+            job = deletion_service.delete(job_dao, MagicMock(), "organization", 9, progress=lambda message: None)
+
+        assert job.job_id == 1 and [call.args[1] for call in remove.call_args_list] == [4, 5]
+        assert job_dao.purged == [[3, 4, 5]]
+
+    def test_resumed_organization_job_picks_up_new_projects(self):
+        job_dao = FakeJobDAO(organization_projects=[3, 4])
+        job = deletion_service.start_job(job_dao, "organization", 9)
+        job_dao.mark_failed(job.job_id, "interrupted")
+        job_dao.organization_projects = [3, 4, 6]
+
+        with patch.object(weaviate_service, "document_collections", return_value=["Document_v1"]), \
+             patch.object(weaviate_service, "remove_project_chunks", return_value=7) as remove, \
+             patch.object(lexical_index, "drop_project"):
+            job = deletion_service.delete(job_dao, MagicMock(), "organization", 9, progress=lambda message: None)
+
+        assert job.job_id == 1 and job_dao.jobs[1].project_ids == [3, 4, 6]
+        assert [call.args[1] for call in remove.call_args_list] == [3, 4, 6]
+        assert job_dao.purged == [[3, 4, 6]]
+
+    def test_project_deleted_by_id(self):
+        job = deletion_service.start_job(FakeJobDAO(), "project", 42)
+        assert job.project_ids == [42]
+        with pytest.raises(deletion_service.DeletionError):
+            deletion_service.start_job(FakeJobDAO(), "user", 1)
+
+    def test_weaviate_delete_repeats_only_at_the_server_limit(self):
+        client = MagicMock()
+        delete_many = client.collections.get.return_value.data.delete_many
+        delete_many.side_effect = [SimpleNamespace(matches=3, successful=3, failed=0),
+                                   SimpleNamespace(matches=3, successful=3, failed=0),
+                                   SimpleNamespace(matches=1, successful=1, failed=0)]
+        with patch.object(weaviate_service, "WEAVIATE_DELETE_MAX_OBJECTS", 3):
+            assert weaviate_service.remove_project_chunks(client, 4, "Document_v1") == 7
+        assert delete_many.call_count == 3
+        client.collections.get.assert_called_with("Document_v1")
+
+
+class FakeTransactionDatabase:
+    def __init__(self):
+        self.cursor = MagicMock(rowcount=5)
+
+    @contextmanager
+    def transaction(self, close_after=True):
+        yield self.cursor
+
+
+class TestDeletionJobDAO:
+    def test_purge_is_one_transaction_of_set_based_deletes(self):
+        db = FakeTransactionDatabase()
+        rows = DeletionJobDAO(db).purge(DeletionJobRecord(1, "organization", 9, [3, 4]))
+
+        statements = [" ".join(call.args[0].split()) for call in db.cursor.execute.call_args_list]
+        assert [statement.split(" WHERE")[0] for statement in statements] == [
+            "DELETE FROM page_fingerprints", "DELETE FROM chunks", "DELETE FROM project_manifest",
+            "DELETE FROM documents", "DELETE FROM projects", "UPDATE projects SET created_by_user = NULL",
+            "DELETE FROM users", "DELETE FROM organizations", "UPDATE deletion_jobs SET status = 'done', rows_deleted = %s, error = NULL, updated_at = CURRENT_TIMESTAMP"]
+        assert db.cursor.execute.call_args_list[0].args[1] == {"project_ids": [3, 4], "organization_id": 9}
+        assert rows == {"page_fingerprints": 5, "chunks": 5, "project_manifest": 5, "documents": 5, "projects": 5,
+                        "users": 5, "organizations": 5}
+
+    def test_project_purge_leaves_organization(self):
+        db = FakeTransactionDatabase()
+        assert "users" not in DeletionJobDAO(db).purge(DeletionJobRecord(1, "project", 3, [3]))
+
+    def test_transaction_rolls_back_on_error(self):
+        db = Database()
+        db.conn = MagicMock()
+        with pytest.raises(ValueError):
+            with db.transaction(close_after=False):
+                raise ValueError("statement failed")
+        db.conn.rollback.assert_called_once()
+        db.conn.commit.assert_not_called()
+
+
+class TestDropLexicalIndex:
+    def test_drop_project(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(lexical_index, "LEXICAL_INDEX_DIR", str(tmp_path))
+        monkeypatch.setattr(lexical_index, "_open_indexes", {})
+        lexical_index.add_document(3, 1, "a.pdf", ["door hardware schedule"])
+        assert lexical_index.search(3, "door")
+        lexical_index.drop_project(3)
+        assert lexical_index.search(3, "door") == [] and not (tmp_path / "3").exists()
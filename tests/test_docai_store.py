@@ -0,0 +1,124 @@
+import pytest
+from unittest.mock import MagicMock, patch
+import google.cloud.documentai_v1 as documentai
+
+from services import docai_store, extraction_service
+
+
+class FakeS3:
+    class NoSuchKey(Exception):
+        pass
+
+    def __init__(self):
+        self.objects = {}
+        self.exceptions = MagicMock(NoSuchKey=self.NoSuchKey)
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise self.NoSuchKey(Key)
+        return {"Body": MagicMock(read=MagicMock(return_value=self.objects[Key]))}
+
+
+def make_document(text="Door schedule\nD1 Oak\n"):
+    def anchor(start, end):
+        return documentai.Document.TextAnchor(text_segments=[documentai.Document.TextAnchor.TextSegment(start_index=start, end_index=end)])
+
+    def cell(start, end):
+        return documentai.Document.Page.Table.TableCell(layout=documentai.Document.Page.Layout(text_anchor=anchor(start, end)))
+
+    table = documentai.Document.Page.Table(
+        header_rows=[documentai.Document.Page.Table.TableRow(cells=[cell(0, 4), cell(5, 13)])],
+        body_rows=[documentai.Document.Page.Table.TableRow(cells=[cell(14, 16), cell(17, 20)])])
+    paragraph = documentai.Document.Page.Paragraph(layout=documentai.Document.Page.Layout(
+        text_anchor=anchor(0, 13),
+        bounding_poly=documentai.BoundingPoly(normalized_vertices=[documentai.NormalizedVertex(x=0.1, y=0.2)])))
+    page = documentai.Document.Page(page_number=1, tables=[table], paragraphs=[paragraph])
+    return documentai.Document(text=text, pages=[page])
+
+
+class TestDocaiStore:
+    @pytest.fixture
+    def store(self, tmp_path):
+        s3 = FakeS3()
+        with patch.object(docai_store, "get_s3_client", return_value=s3), \
+             patch.object(docai_store, "DOCAI_STORE_CACHE_DIR", str(tmp_path)), \
+             patch.object(docai_store, "DOCAI_STORE_ENABLED", True), \
+             patch.object(docai_store, "_cache_bytes", None):
+            yield s3
+
+    def test_round_trip_keeps_layout_and_tables(self, store, tmp_path):
+        key = docai_store.content_key(b"page bytes")
+        docai_store.put_document(key, make_document())
+
+        # A fresh local cache falls back to S3 and mirrors the object to disk
+        with patch.object(docai_store, "DOCAI_STORE_CACHE_DIR", str(tmp_path / "fresh")):
+            document = docai_store.get_document(key)
+            assert (tmp_path / "fresh").exists()
+
+        assert document.text == "Door schedule\nD1 Oak\n"
+        assert docai_store.document_tables(document) == [
+            {"page": 1, "header_rows": [["Door", "schedule"]], "body_rows": [["D1", "Oak"]]}]
+        paragraphs = docai_store.document_paragraphs(document)
+        assert paragraphs[0]["text"] == "Door schedule"
+        assert paragraphs[0]["bounding_box"] == [(pytest.approx(0.1), pytest.approx(0.2))]
+
+    def test_missing_document_returns_none(self, store):
+        assert docai_store.get_document("0" * 64) is None
+        assert docai_store.load_pdf_documents("0" * 64) is None
+
+    def test_stored_pages_skip_document_ai(self, store):
+        client = MagicMock()
+        client.processor_path.return_value = "projects/p/locations/us/processors/x"
+        client.process_document.return_value = MagicMock(document=make_document("page text"))
+        with patch.object(extraction_service, "get_documentai_client", return_value=client):
+            first = extraction_service.process_page_with_document_ai(b"%PDF page")
+            second = extraction_service.process_page_with_document_ai(b"%PDF page")
+
+        assert client.process_document.call_count == 1
+        assert first.text == second.text == "page text"
+
+    def test_disabled_store_is_bypassed(self, store):
+        with patch.object(docai_store, "DOCAI_STORE_ENABLED", False):
+            docai_store.put_document("abc", make_document())
+            assert docai_store.get_document("abc") is None
+        assert store.objects == {}
+
+    def test_local_mirror_evicts_least_recently_used(self, store, tmp_path):
+        import os
+
+        objects = [docai_store._object_key(str(n) * 64, ".pb.z") for n in range(4)]
+        with patch.object(docai_store, "DOCAI_STORE_CACHE_MAX_BYTES", 300):
+            for age, object_key in enumerate(objects[:3]):
+                docai_store._write_object(object_key, b"x" * 100)
+                os.utime(docai_store._local_path(object_key), (age, age))
+            # Reading the oldest object makes it the most recently used
+            assert docai_store._read_object(objects[0], "docai_store") == b"x" * 100
+            docai_store._write_object(objects[3], b"x" * 100)
+
+        mirrored = {object_key for object_key in objects if os.path.exists(docai_store._local_path(object_key))}
+        assert mirrored == {objects[0], objects[3]}
+        # Evicted objects are still read from S3
+        assert docai_store._read_object(objects[1], "docai_store") == b"x" * 100
+
+    def test_eviction_skips_writes_in_progress(self, store, tmp_path):
+        import os
+
+        object_dir = tmp_path / "docai-raw"
+        object_dir.mkdir()
+        (object_dir / ".tmp-writing").write_bytes(b"x" * 100)
+        (object_dir / ".tmp-crashed").write_bytes(b"x" * 100)
+        os.utime(object_dir / ".tmp-crashed", (0, 0))
+        (object_dir / "object.pb.z").write_bytes(b"x" * 100)
+
+        assert docai_store.evict_local(0) == 0
+
+        assert sorted(path.name for path in object_dir.iterdir()) == [".tmp-writing"]
+
+    def test_mirror_can_be_turned_off(self, store, tmp_path):
+        with patch.object(docai_store, "DOCAI_STORE_CACHE_DIR", ""):
+            docai_store.put_document("abc", make_document())
+            assert docai_store.get_document("abc").text == make_document().text
+        assert list(tmp_path.iterdir()) == []
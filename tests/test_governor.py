@@ -0,0 +1,118 @@
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from services.governor import AIMDLimiter, CircuitBreaker, CircuitOpenError, Governor
+
+
+class TestGovernor:
+    @pytest.fixture
+    def sleeps(self):
+        return []
+
+    @pytest.fixture
+    def governor(self, sleeps):
+        return Governor("test", rate_per_second=1000, burst=1000, max_attempts=4,
+                        breaker=CircuitBreaker(min_calls=100), sleep=sleeps.append)
+
+    def test_retries_retryable_errors_with_backoff(self, governor, sleeps):
+        """Test that UNAVAILABLE is retried until the call succeeds"""
+        outcomes = [google_exceptions.ServiceUnavailable("down"), google_exceptions.ServiceUnavailable("down"), "ok"]
+
+        def flaky():
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        assert governor.call(flaky) == "ok"
+        assert len(sleeps) == 2
+        assert all(0 <= delay <= governor.max_delay for delay in sleeps)
+        assert governor.snapshot()["retries"] == 2
+
+    def test_does_not_retry_client_errors(self, governor, sleeps):
+        """Test that INVALID_ARGUMENT is raised immediately"""
+        def bad_request():
+            raise google_exceptions.InvalidArgument("bad page")
+
+        with pytest.raises(google_exceptions.InvalidArgument):
+            governor.call(bad_request)
+        assert sleeps == []
+        assert governor.snapshot()["calls"] == 1
+
+    def test_throttling_shrinks_concurrency(self, governor):
+        """Test that 429s multiplicatively decrease the concurrency limit"""
+        before = governor.limiter.limit
+
+        def throttled():
+            raise google_exceptions.ResourceExhausted("quota")
+
+        with pytest.raises(google_exceptions.ResourceExhausted):
+            governor.call(throttled)
+        assert governor.limiter.limit < before
+        assert governor.snapshot()["throttled"] == governor.max_attempts
+
+    def test_limiter_grows_additively(self):
+        """Test that successes slowly raise the limit"""
+        limiter = AIMDLimiter(initial=2, maximum=4)
+        for _ in range(10):
+            limiter.release(limiter.acquire())
+        assert 2 < limiter.limit <= 4
+
+    def test_concurrent_throttles_decrease_once(self):
+        """Test that throttles of calls in flight together halve the limit once, not once each"""
+        limiter = AIMDLimiter(initial=8)
+        tickets = [limiter.acquire() for _ in range(4)]
+        for ticket in tickets:
+            limiter.release(ticket, throttled=True)
+        assert limiter.limit == 4
+
+        # A call started after the decrease can decrease again
+        limiter.release(limiter.acquire(), throttled=True)
+        assert limiter.limit == 2
+
+    def test_circuit_opens_and_rejects(self):
+        """Test that a burst of server errors opens the breaker and fails fast"""
+        breaker = CircuitBreaker(error_threshold=0.5, min_calls=4, cool_down_seconds=60)
+        governor = Governor("test", rate_per_second=1000, burst=1000, max_attempts=1, breaker=breaker)
+
+        def failing():
+            raise google_exceptions.InternalServerError("boom")
+
+        for _ in range(4):
+            with pytest.raises(google_exceptions.InternalServerError):
+                governor.call(failing)
+        assert breaker.state == CircuitBreaker.OPEN
+        with pytest.raises(CircuitOpenError):
+            governor.call(lambda: "never called")
+        assert governor.snapshot()["rejected"] == 1
+
+    def test_half_open_probe_closes_circuit(self):
+        """Test that a successful probe after the cool-down closes the breaker"""
+        breaker = CircuitBreaker(min_calls=1, cool_down_seconds=0)
+        breaker.record(success=False)
+        assert breaker.state == CircuitBreaker.OPEN
+        assert breaker.allow()
+        assert not breaker.allow()
+        breaker.record(success=True)
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_client_error_does_not_close_half_open_circuit(self):
+        """Test that a client error during the half-open probe neither closes nor re-opens the breaker"""
+        breaker = CircuitBreaker(min_calls=1, cool_down_seconds=0)
+        governor = Governor("test", rate_per_second=1000, burst=1000, max_attempts=1, breaker=breaker)
+        breaker.record(success=False)
+
+        def bad_request():
+            raise google_exceptions.InvalidArgument("bad page")
+
+        with pytest.raises(google_exceptions.InvalidArgument):
+            governor.call(bad_request)
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert breaker.allow()
+
+    def test_quota_is_split_between_workers(self, monkeypatch):
+        from services import governor
+
+        monkeypatch.setattr(governor, "GOVERNOR_WORKERS", 4)
+        assert governor._per_worker(10, 20, 8) == {"rate_per_second": 2.5, "burst": 5.0, "initial_concurrency": 8}
+        assert governor._per_worker(10, 2, 8)["burst"] == 1.0
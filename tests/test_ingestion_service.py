@@ -1,7 +1,9 @@
 import pytest
 from unittest.mock import MagicMock, patch
 import logging
+import os
 
+from services import page_text_store, profiling
 from services.ingestion_service import IngestionService
 from database.dao.DocumentDAO import DocumentDAO
 from database.dao.DocumentRecord import DocumentRecord
@@ -37,6 +39,10 @@ class TestIngestionService:
         mock_service.remove_document_chunks = MagicMock()
         return mock_service
         
+    @pytest.fixture
+    def mock_lexical_index(self):
+        return MagicMock()
+
     @pytest.fixture
     def sample_document_record(self):
         return DocumentRecord(
@@ -49,13 +55,14 @@ class TestIngestionService:
     
     @pytest.fixture
     def ingestion_service(self, mock_weaviate_client, mock_document_dao, mock_logger, 
-                        mock_extraction_service, mock_weaviate_service):
+                        mock_extraction_service, mock_weaviate_service, mock_lexical_index):
         return IngestionService(
             weaviate_client=mock_weaviate_client,
             document_dao=mock_document_dao,
             logger=mock_logger,
             extraction_service_module=mock_extraction_service,
-            weaviate_service_module=mock_weaviate_service
+            weaviate_service_module=mock_weaviate_service,
+            lexical_index_module=mock_lexical_index
         )
     
     def test_init(self, mock_weaviate_client, mock_document_dao):
@@ -88,8 +95,10 @@ class TestIngestionService:
         # Assert
         assert result == 123
         mock_document_dao.create_document.assert_called_once_with(sample_document_record)
-        ingestion_service.extraction_service.extract_and_chunk.assert_called_once_with(document_bytes, 0)
+        ingestion_service.extraction_service.extract_and_chunk.assert_called_once_with(document_bytes, 0, use_document_ai=False)
         ingestion_service.weaviate_service.insert_document_chunks.assert_called_once()
+        ingestion_service.lexical_index.add_document.assert_called_once_with(
+            10, 123, "test_document.pdf", ingestion_service.extraction_service.extract_and_chunk.return_value)
         ingestion_service.logger.info.assert_called()
     
     def test_ingest_document_reingest(self, ingestion_service, mock_document_dao, mock_weaviate_service):
@@ -114,7 +123,7 @@ class TestIngestionService:
         mock_weaviate_service.remove_document_chunks.assert_called_once_with(
             ingestion_service.weaviate_client, 456
         )
-        ingestion_service.extraction_service.extract_and_chunk.assert_called_once_with(document_bytes, 0)
+        ingestion_service.extraction_service.extract_and_chunk.assert_called_once_with(document_bytes, 0, use_document_ai=False)
     
     def test_ingest_document_reingest_without_permission(self, ingestion_service, sample_document_record):
         """Test that re-ingestion fails when not allowed"""
@@ -187,3 +196,65 @@ class TestIngestionService:
         # Assert
         assert result is None
         ingestion_service.logger.error.assert_called()
+
+    def test_ingest_document_profile(self, ingestion_service, sample_document_record, mock_document_dao,
+                                     tmp_path, monkeypatch):
+        """Test that an opt-in profile is captured and stored for the ingestion"""
+        # Setup
+        monkeypatch.setattr("services.profiling.PROFILE_OUTPUT_DIR", str(tmp_path))
+        document_bytes = b"test document content"
+        mock_document_dao.create_document.return_value = DocumentRecord(
+            document_id=222,
+            file_name="test_document.pdf",
+            project_id=10,
+            source_page=0,
+            source_url="http://test.com"
+        )
+
+        # Execute
+        result = ingestion_service.ingest_document(sample_document_record, document_bytes, profile=True)
+
+        # Assert
+        assert result == 222
+        profile_id = ingestion_service.last_profile_id
+        assert (tmp_path / f"{profile_id}.speedscope.json").exists()
+        assert "extraction" in (tmp_path / f"{profile_id}.spans.json").read_text()
+
+    def test_profiles_are_pruned_oldest_first(self, monkeypatch, tmp_path):
+        """Test that stored profiles cannot grow past the byte limit"""
+        monkeypatch.setattr("services.profiling.PROFILE_OUTPUT_DIR", str(tmp_path))
+        for age, profile_id in enumerate(["new", "old"]):
+            for suffix in ("spans.json", "speedscope.json"):
+                path = tmp_path / f"{profile_id}.{suffix}"
+                path.write_bytes(b"x" * 100)
+                os.utime(path, (1000 - age, 1000 - age))
+        (tmp_path / "notes.txt").write_bytes(b"x" * 1000)
+
+        assert profiling.prune_profiles(250) == 200
+
+        assert sorted(path.name for path in tmp_path.iterdir()) == ["new.spans.json", "new.speedscope.json", "notes.txt"]
+
+    def test_ingest_document_updates_manifest(self, ingestion_service, mock_document_dao):
+        """Test that an S3 document is linked to its document id in the project manifest"""
+        ingestion_service.manifest_dao = MagicMock()
+        doc_record = DocumentRecord(None, "set.pdf", 10, "s3://bucket/uploads/10/set.pdf", 0)
+        mock_document_dao.create_document.return_value = DocumentRecord(321, "set.pdf", 10, "s3://bucket/uploads/10/set.pdf", 0)
+
+        assert ingestion_service.ingest_document(doc_record, b"%PDF") == 321
+        ingestion_service.manifest_dao.record_ingestion.assert_called_once_with("uploads/10/set.pdf", 10, 321, 2, None)
+
+    def test_ingest_document_saves_page_text_and_marks_extracted(self, ingestion_service, mock_extraction_service,
+                                                                 mock_document_dao):
+        """Test that the saved page text lets the first query after an upload skip extraction"""
+        ingestion_service.manifest_dao = MagicMock()
+        ingestion_service.s3_client = MagicMock()
+        mock_extraction_service.extract_and_chunk.return_value = ["page one", "page two"]
+        doc_record = DocumentRecord(None, "set.pdf", 10, "s3://bucket/uploads/10/set.pdf", 0)
+        mock_document_dao.create_document.return_value = DocumentRecord(321, "set.pdf", 10, "s3://bucket/uploads/10/set.pdf", 0)
+
+        assert ingestion_service.ingest_document(doc_record, b"%PDF") == 321
+        put = ingestion_service.s3_client.put_object.call_args.kwargs
+        assert (put["Bucket"], put["Key"]) == ("bucket", "uploads/10/set.pages")
+        assert page_text_store.decode_pages(put["Body"]) == ["page one", "page two"]
+        ingestion_service.manifest_dao.record_ingestion.assert_called_once_with(
+            "uploads/10/set.pdf", 10, 321, 2, "uploads/10/set.pages")
@@ -0,0 +1,176 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from services import lexical_index, retrieval_service
+from services.retrieval_service import reciprocal_rank_fusion, retrieve
+
+
+PAGES = [
+    "Section 08 71 00 door hardware. Provide hinges and closers for door D-101.",
+    "Sheet A-501 wall sections and details for the curtain wall.",
+    "Concrete slab on grade, footing and rebar schedule.",
+]
+
+
+class TestLexicalIndex:
+    @pytest.fixture(autouse=True)
+    def index_dir(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(lexical_index, "LEXICAL_INDEX_DIR", str(tmp_path))
+        monkeypatch.setattr(lexical_index, "_open_indexes", {})
+        return tmp_path
+
+    def test_tokenize_keeps_construction_identifiers(self):
+        tokens = lexical_index.tokenize("See A-501 and section 08 71 00.13")
+        assert "a-501" in tokens and "501" in tokens
+        assert "087100" in tokens and "087100.13" in tokens
+
+    def test_search_finds_exact_identifiers(self):
+        lexical_index.add_document(1, 10, "specs.pdf", PAGES)
+
+        assert lexical_index.search(1, "087100 hardware")[0].page == 0
+        assert lexical_index.search(1, "08 71 00")[0].page == 0
+        top = lexical_index.search(1, "what is on A-501?")[0]
+        assert (top.file_name, top.page) == ("specs.pdf", 1)
+        assert top.text == PAGES[1]
+        assert lexical_index.search(2, "door") == []
+
+    def test_reingest_replaces_and_remove_hides(self):
+        lexical_index.add_document(1, 10, "specs.pdf", PAGES)
+        lexical_index.add_document(1, 11, "addendum.pdf", ["Addendum revises door hardware."])
+        lexical_index.add_document(1, 10, "specs.pdf", ["Door hardware withdrawn."])
+
+        assert {(hit.document_id, hit.text) for hit in lexical_index.search(1, "door")} == {
+            (10, "Door hardware withdrawn."), (11, "Addendum revises door hardware.")}
+
+        lexical_index.remove_document(1, 11)
+        assert [hit.document_id for hit in lexical_index.search(1, "door")] == [10]
+
+    def test_compaction_keeps_live_pages(self, monkeypatch, index_dir):
+        monkeypatch.setattr(lexical_index, "LEXICAL_INDEX_MAX_SEGMENTS", 2)
+        for document_id in range(4):
+            lexical_index.add_document(1, document_id, f"doc{document_id}.pdf", [f"door tag D-{document_id}"])
+        lexical_index.remove_document(1, 0)
+        lexical_index.compact(1)
+
+        assert len([p for p in (index_dir / "1").iterdir() if p.name.startswith("seg-")]) == 1
+        assert sorted(hit.document_id for hit in lexical_index.search(1, "door")) == [1, 2, 3]
+        assert lexical_index.search(1, "d-2")[0].document_id == 2
+
+    def test_add_recovers_from_crash_before_manifest_write(self, index_dir):
+        lexical_index.add_document(1, 10, "specs.pdf", PAGES)
+        # A writer that died after renaming seg-1 into place but before writing segments.json,
+        # and one that died while building
+        lexical_index.write_segment(str(index_dir / "1" / "seg-00000001"), [(11, "lost.pdf", 0, "lost door")])
+        (index_dir / "1" / ".building-stale").mkdir()
+
+        lexical_index.add_document(1, 12, "addendum.pdf", ["Addendum revises door hardware."])
+
+        assert {hit.document_id for hit in lexical_index.search(1, "door")} == {10, 12}
+        assert not list((index_dir / "1").glob(".building-*"))
+
+    def test_failed_segment_write_leaves_no_partial_directory(self, index_dir):
+        with patch.object(lexical_index.os, "replace", side_effect=OSError("disk full")):
+            with pytest.raises(OSError):
+                lexical_index.write_segment(str(index_dir / "seg-00000000"), [(10, "specs.pdf", 0, "door")])
+
+        assert list(index_dir.iterdir()) == []
+
+
+class TestRetrieval:
+    def test_reciprocal_rank_fusion(self):
+        fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "a"]])
+        assert [key for key, _ in fused] == ["a", "c", "b"]
+
+    def test_hybrid_merges_lexical_and_vector_hits(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(lexical_index, "LEXICAL_INDEX_DIR", str(tmp_path))
+        monkeypatch.setattr(lexical_index, "_open_indexes", {})
+        monkeypatch.setattr(retrieval_service, "LEXICAL_INDEX_REBUILD", False)
+        lexical_index.add_document(1, 10, "specs.pdf", PAGES)
+        vector_hits = [{"document_id": 10, "file_name": "specs.pdf", "contents": PAGES[2]},
+                       {"document_id": 10, "file_name": "specs.pdf", "contents": PAGES[0]}]
+
+        chunks = retrieve(1, "door hardware", "hybrid", k=5, vector_search=lambda *args: vector_hits)
+
+        assert [chunk.text for chunk in chunks] == [PAGES[0], PAGES[2]]
+        assert chunks[0].page == 0 and chunks[0].score > chunks[1].score
+
+
+class TestProjectIdValidation:
+    @pytest.mark.parametrize("path, body", [
+        ("/query", {"query": "door?", "location": "p/", "retrieval": "lexical"}),
+        ("/query/batch", {"queries": ["door?"], "location": "p/", "retrieval": "lexical"}),
+        ("/sessions", {"location": "p/", "retrieval": "lexical"}),
+    ])
+    @pytest.mark.parametrize("project_id", ["../x", "4", 4.5, True, [4]])
+    def test_non_integer_project_id_is_a_400(self, path, body, project_id):
+        from fastapi.testclient import TestClient
+        import main
+
+        response = TestClient(main.app).post(path, json={**body, "project_id": project_id})
+        assert response.status_code == 400
+
+    def test_index_path_stays_in_index_dir(self):
+        with pytest.raises(ValueError):
+            lexical_index._project_dir("../x")
+
+
+class TestWriterLocks:
+    def test_writer_does_not_block_other_projects(self, tmp_path, monkeypatch):
+        import threading
+
+        monkeypatch.setattr(lexical_index, "LEXICAL_INDEX_DIR", str(tmp_path))
+        monkeypatch.setattr(lexical_index, "_open_indexes", {})
+        lexical_index.add_document(2, 1, "a.pdf", PAGES)
+        searched = threading.Event()
+
+        def search_other_project():
+            assert lexical_index.search(2, "door")
+            lexical_index.add_document(3, 1, "b.pdf", PAGES)
+            searched.set()
+
+        with lexical_index._ProjectWriteLock(1):
+            worker = threading.Thread(target=search_other_project)
+            worker.start()
+            assert searched.wait(5)
+        worker.join()
+
+
+class TestIndexRebuild:
+    @pytest.fixture(autouse=True)
+    def index_dir(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(lexical_index, "LEXICAL_INDEX_DIR", str(tmp_path))
+        monkeypatch.setattr(lexical_index, "_open_indexes", {})
+        monkeypatch.setattr(retrieval_service, "_rebuild_failed", {})
+        monkeypatch.setattr(retrieval_service, "_synced_at", {})
+
+    def test_missing_index_is_rebuilt_once(self):
+        rebuild = MagicMock(side_effect=lambda project_id: lexical_index.add_document(project_id, 10, "specs.pdf", PAGES))
+        retrieval_service.ensure_lexical_index(5, rebuild)
+        retrieval_service.ensure_lexical_index(5, rebuild)
+        rebuild.assert_called_once_with(5)
+        assert lexical_index.search(5, "d-101")[0].document_id == 10
+
+    def test_failed_rebuild_is_not_retried_on_every_query(self):
+        rebuild = MagicMock(side_effect=ConnectionError("postgres down"))
+        retrieval_service.ensure_lexical_index(5, rebuild)
+        retrieval_service.ensure_lexical_index(5, rebuild)
+        assert rebuild.call_count == 1
+        with patch.object(retrieval_service, "LEXICAL_REBUILD_RETRY_SECONDS", 0):
+            retrieval_service.ensure_lexical_index(5, rebuild)
+        assert rebuild.call_count == 2
+
+    def test_index_is_compared_with_chunk_store_again_after_interval(self):
+        sync = MagicMock()
+        retrieval_service.ensure_lexical_index(5, sync)
+        retrieval_service.ensure_lexical_index(5, sync)
+        assert sync.call_count == 1
+        with patch.object(retrieval_service, "LEXICAL_SYNC_INTERVAL_SECONDS", 0):
+            retrieval_service.ensure_lexical_index(5, sync)
+        assert sync.call_count == 2
+
+    def test_retrieve_rebuilds_from_chunk_store(self):
+        with patch.object(retrieval_service, "_sync_from_chunk_store",
+                          side_effect=lambda project_id: lexical_index.add_document(project_id, 10, "specs.pdf", PAGES)):
+            chunks = retrieve(6, "door hardware", "lexical")
+        assert chunks[0].text == PAGES[0]
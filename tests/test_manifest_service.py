@@ -0,0 +1,137 @@
+from unittest.mock import MagicMock, patch
+
+import main
+from database.dao.ManifestRecord import ManifestRecord
+from services import manifest_service
+from services.page_cache import PageTextCache
+
+
+class FakeListingS3:
+    """list_objects_v2 with pagination and Delimiter support, counting calls per prefix."""
+
+    def __init__(self, keys, page_size=2):
+        self.keys = sorted(keys)
+        self.page_size = page_size
+        self.list_calls = []
+        self.get_calls = []
+
+    def list_objects_v2(self, Bucket, Prefix="", Delimiter=None, ContinuationToken=None):
+        self.list_calls.append(Prefix)
+        contents, common = [], []
+        for key in self.keys:
+            if not key.startswith(Prefix):
+                continue
+            rest = key[len(Prefix):]
+            if Delimiter and Delimiter in rest:
+                folder = Prefix + rest.split(Delimiter)[0] + Delimiter
+                if folder not in common:
+                    common.append(folder)
+            else:
+                contents.append({"Key": key, "ETag": f'"{key}"', "Size": len(key)})
+        start = int(ContinuationToken or 0)
+        response = {"Contents": contents[start:start + self.page_size],
+                    "CommonPrefixes": [{"Prefix": folder} for folder in common]}
+        if start + self.page_size < len(contents):
+            response.update(IsTruncated=True, NextContinuationToken=str(start + self.page_size))
+        return response
+
+
+class TestManifestSync:
+    def test_parallel_paginated_listing(self):
+        keys = [f"p/set-{folder}/sheet-{n}.pdf" for folder in range(3) for n in range(5)] + ["p/spec.pdf", "p/spec.txt"]
+        s3 = FakeListingS3(keys)
+        objects = manifest_service.list_objects_parallel(s3, "bucket", "p/")
+
+        assert [obj["Key"] for obj in objects] == sorted(keys)
+        assert {"p/set-0/", "p/set-1/", "p/set-2/"} <= set(s3.list_calls)
+
+    def test_sync_marks_saved_text_and_removes_missing(self):
+        s3 = FakeListingS3(["p/a.pdf", "p/a.txt", "p/b.pdf", "p/notes.docx"])
+        dao = MagicMock()
+        dao.delete_missing.return_value = ["p/gone.pdf"]
+
+        entries = manifest_service.sync_manifest(dao, s3, "bucket", "p/")
+
+        assert [(entry.s3_key, entry.status, entry.text_key) for entry in entries] == [
+            ("p/a.pdf", "extracted", "p/a.txt"), ("p/b.pdf", "pending", None)]
+        dao.upsert_entries.assert_called_once_with(entries)
+        dao.delete_missing.assert_called_once_with("p/", ["p/a.pdf", "p/b.pdf"])
+
+    def test_prefix_is_relisted_only_after_listing_ttl(self):
+        s3 = FakeListingS3(["other/a.pdf"])
+        dao = MagicMock()
+        dao.get_entries.return_value = []
+        dao.is_listed.return_value = False
+
+        assert manifest_service.load_project_manifest(dao, s3, "bucket", "p/") == []
+        dao.record_listing.assert_called_once_with("p/")
+        dao.is_listed.assert_called_with("p/", manifest_service.MANIFEST_LISTING_TTL_SECONDS)
+        dao.is_listed.return_value = True
+        calls = len(s3.list_calls)
+        assert manifest_service.load_project_manifest(dao, s3, "bucket", "p/") == []
+        assert len(s3.list_calls) == calls
+
+    def test_prefix_with_entries_but_no_listing_is_synced(self):
+        # An upload created an entry, but the rest of the prefix was never listed
+        s3 = FakeListingS3(["p/a.pdf", "p/uploaded.pdf"])
+        dao = MagicMock()
+        dao.get_entries.return_value = [ManifestRecord("p/uploaded.pdf", '"u"', 10, status="extracted")]
+        dao.is_listed.return_value = False
+
+        entries = manifest_service.load_project_manifest(dao, s3, "bucket", "p/")
+
+        assert [entry.s3_key for entry in entries] == ["p/a.pdf", "p/uploaded.pdf"]
+
+    def test_saved_text_older_than_its_pdf_is_stale(self):
+        entries = manifest_service.build_entries([
+            {"Key": "p/a.pdf", "ETag": '"new"', "Size": 1, "LastModified": 2},
+            {"Key": "p/a.pages", "LastModified": 1},
+            {"Key": "p/b.pdf", "ETag": '"b"', "Size": 1, "LastModified": 1},
+            {"Key": "p/b.pages", "LastModified": 2},
+        ])
+
+        assert [(entry.s3_key, entry.status) for entry in entries] == [("p/a.pdf", "pending"), ("p/b.pdf", "extracted")]
+
+    def test_onedrive_sync_updates_manifest(self):
+        from services import onedrive_service
+        http = MagicMock()
+        http.get.return_value.json.return_value = {"value": [{"id": "1", "name": "a.pdf", "file": {}}]}
+        s3 = FakeListingS3(["p/a.pdf"])
+        s3.upload_fileobj = MagicMock()
+        dao = MagicMock()
+        with patch.object(onedrive_service, "get_http_session", return_value=http):
+            onedrive_service.download_from_graph_to_s3("folder", "token", "bucket", "p/", s3_client=s3, manifest_dao=dao)
+
+        s3.upload_fileobj.assert_called_once()
+        assert [entry.s3_key for entry in dao.upsert_entries.call_args.args[0]] == ["p/a.pdf"]
+        dao.record_listing.assert_called_once_with("p/")
+
+    def test_s3_key_from_url(self):
+        assert manifest_service.s3_key_from_url("s3://bucket/uploads/7/set.pdf") == "uploads/7/set.pdf"
+        assert manifest_service.s3_key_from_url("https://example.com/set.pdf") is None
+
+
+class TestQueryPlanning:
+    def test_query_reads_manifest_without_listing(self):
+        s3 = MagicMock()
+        s3.get_object.return_value = {"Body": MagicMock(read=MagicMock(return_value=b"page one\fpage two"))}
+        dao = MagicMock()
+        dao.get_entries.return_value = [
+            ManifestRecord("p/a.pdf", '"a"', 10, 2, "extracted", "p/a.txt"),
+            ManifestRecord("p/b.pdf", '"b"', 10, None, "pending"),
+        ]
+        with patch.object(main, "get_s3_client", return_value=s3), \
+             patch.object(main, "PAGE_TEXT_CACHE", PageTextCache()), \
+             patch.object(manifest_service, "PROJECT_MANIFEST_ENABLED", True), \
+             patch.object(manifest_service, "get_manifest_dao", return_value=dao), \
+             patch.object(main, "get_documentai_client"), \
+             patch.object(main, "extract_pdf_pages_with_document_ai", return_value=["b page"]) as extract:
+            pages = list(main.iter_project_pages("p/"))
+
+        assert [(page.source, page.page, page.text) for page in pages] == [
+            ("p/a.pdf", 0, "page one"), ("p/a.pdf", 1, "page two"), ("p/b.pdf", 0, "b page")]
+        s3.list_objects_v2.assert_not_called()
+        # Only the extracted entry's saved text is read; the pending one goes straight to extraction
+        assert [call.kwargs["Key"] for call in s3.get_object.call_args_list] == ["p/a.txt"]
+        extract.assert_called_once()
+        dao.mark_extracted.assert_called_once_with("p/b.pdf", '"b"', 1, "p/b.pages")
@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from services.metrics import MetricsRegistry, record_worker_exit
+
+
+class TestMetrics:
+    @pytest.fixture
+    def registry(self):
+        return MetricsRegistry()
+
+    def test_histogram_renders_cumulative_buckets(self, registry):
+        """Test Prometheus histogram exposition for one labelled series"""
+        histogram = registry.histogram("stage_duration_seconds", "Latency.", ["stage"], buckets=(0.1, 1.0))
+        histogram.observe(0.05, stage="s3_get")
+        histogram.observe(0.5, stage="s3_get")
+        histogram.observe(5.0, stage="s3_get")
+
+        text = registry.render()
+
+        assert 'gemini_poc_stage_duration_seconds_bucket{stage="s3_get",le="0.1"} 1' in text
+        assert 'gemini_poc_stage_duration_seconds_bucket{stage="s3_get",le="1.0"} 2' in text
+        assert 'gemini_poc_stage_duration_seconds_bucket{stage="s3_get",le="+Inf"} 3' in text
+        assert 'gemini_poc_stage_duration_seconds_count{stage="s3_get"} 3' in text
+
+    def test_counters_and_collectors(self, registry):
+        """Test counters and scrape-time collectors"""
+        counter = registry.counter("cache_hits_total", "Hits.", ["cache"])
+        counter.inc(cache="s3_text")
+        counter.inc(2, cache="s3_text")
+        registry.register_collector(lambda: [("in_flight", "gauge", "In flight.", [({"api": "gemini"}, 4)])])
+
+        text = registry.render()
+
+        assert 'gemini_poc_cache_hits_total{cache="s3_text"} 3' in text
+        assert "# TYPE gemini_poc_in_flight gauge" in text
+        assert 'gemini_poc_in_flight{api="gemini"} 4' in text
+
+    def test_workers_are_summed(self, tmp_path, monkeypatch):
+        """Test that /metrics reports the sum over all workers, including exited ones"""
+        workers = []
+        for pid, hits in ((101, 2), (102, 5), (103, 1)):
+            worker = MetricsRegistry(str(tmp_path))
+            worker.counter("cache_hits_total", "Hits.", ["cache"]).inc(hits, cache="s3_text")
+            worker.histogram("stage_duration_seconds", "Latency.", ["stage"], buckets=(1.0,)).observe(0.5, stage="s3_get")
+            worker.register_collector(lambda pid=pid: [("in_flight", "gauge", "In flight.", [({}, pid)])])
+            monkeypatch.setattr(os, "getpid", lambda pid=pid: pid)
+            worker.flush()
+            workers.append(worker)
+        record_worker_exit(str(tmp_path), 103)
+        monkeypatch.setattr(os, "getpid", lambda: 101)
+
+        text = workers[0].render()
+
+        assert 'gemini_poc_cache_hits_total{cache="s3_text"} 8' in text
+        assert 'gemini_poc_stage_duration_seconds_bucket{stage="s3_get",le="1.0"} 3' in text
+        assert 'gemini_poc_stage_duration_seconds_count{stage="s3_get"} 3' in text
+        assert 'gemini_poc_in_flight{worker="101"} 101' in text
+        assert 'gemini_poc_in_flight{worker="102"} 102' in text
+        assert 'worker="103"' not in text
+        assert text.count("# TYPE gemini_poc_cache_hits_total counter") == 1
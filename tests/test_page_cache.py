@@ -0,0 +1,65 @@
+from unittest.mock import MagicMock, patch
+
+import main
+from database.dao.ManifestRecord import ManifestRecord
+from services import manifest_service
+from services.context_service import ByteTracker
+from services.page_cache import CachedPages, PageTextCache
+
+
+def pages(size, count=2):
+    return ["x" * size] * count
+
+
+class TestPageTextCache:
+    def test_compact_entry_round_trips_pages(self):
+        entry = CachedPages('"e1"', ["première page", "", "third"])
+        assert list(entry.pages()) == ["première page", "", "third"]
+        assert entry.page(2) == "third"
+
+    def test_etag_mismatch_is_a_miss(self):
+        cache = PageTextCache(max_bytes=10000)
+        cache.put("p/a.pdf", '"v1"', ["one"])
+        assert cache.get("p/a.pdf", '"v2"') is None
+        assert list(cache.get("p/a.pdf", '"v1"').pages()) == ["one"]
+        assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+    def test_byte_bound_and_scan_resistance(self):
+        cache = PageTextCache(max_bytes=5000, protected_ratio=0.5)
+        cache.put("hot.pdf", None, pages(500))
+        cache.get("hot.pdf", None)  # second use: protected
+        for n in range(10):  # a one-off scan over a large project
+            cache.put(f"scan-{n}.pdf", None, pages(500))
+
+        assert cache.size_bytes <= 5000
+        assert cache.get("hot.pdf", None) is not None
+        assert cache.get("scan-0.pdf", None) is None
+        assert cache.stats()["evictions"] > 0
+
+    def test_invalidate(self):
+        cache = PageTextCache(max_bytes=10000)
+        cache.put("p/a.pdf", None, ["a"])
+        cache.put("q/b.pdf", None, ["b"])
+        cache.invalidate_prefix("p/")
+        cache.invalidate("q/b.pdf")
+        assert cache.stats()["entries"] == 0 and cache.size_bytes == 0
+
+
+class TestQueryUsesPageCache:
+    def test_second_query_skips_s3(self):
+        s3 = MagicMock()
+        s3.get_object.return_value = {"Body": MagicMock(read=MagicMock(return_value=b"page one\fpage two"))}
+        dao = MagicMock()
+        dao.get_entries.return_value = [ManifestRecord("p/a.pdf", '"a"', 10, 2, "extracted", "p/a.txt")]
+        with patch.object(main, "get_s3_client", return_value=s3), \
+             patch.object(main, "PAGE_TEXT_CACHE", PageTextCache(max_bytes=10000)), \
+             patch.object(manifest_service, "PROJECT_MANIFEST_ENABLED", True), \
+             patch.object(manifest_service, "get_manifest_dao", return_value=dao):
+            first = [page.text for page in main.iter_project_pages("p/")]
+            tracker = ByteTracker()
+            second = [page.text for page in main.iter_project_pages("p/", tracker)]
+
+        assert first == second == ["page one", "page two"]
+        assert s3.get_object.call_count == 1
+        # Cached pages count toward the request's peak like pages read from S3
+        assert tracker.peak == len("page one" + "page two") and tracker.current == 0
@@ -0,0 +1,101 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from services import manifest_service, page_text_store
+
+
+class FakeRangeS3:
+    """get_object with Range support, put/delete and an unpaginated listing; records every GET."""
+
+    class NoSuchKey(Exception):
+        pass
+
+    def __init__(self, objects=None):
+        self.objects = dict(objects or {})
+        self.exceptions = MagicMock(NoSuchKey=self.NoSuchKey)
+        self.gets = []
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body
+
+    def delete_object(self, Bucket, Key):
+        del self.objects[Key]
+
+    def get_object(self, Bucket, Key, Range=None):
+        self.gets.append((Key, Range))
+        if Key not in self.objects:
+            raise self.NoSuchKey(Key)
+        data = self.objects[Key]
+        if Range:
+            start, end = Range.split("=")[1].split("-")
+            data = data[int(start):int(end) + 1]
+        return {"Body": MagicMock(read=MagicMock(return_value=data))}
+
+    def list_objects_v2(self, Bucket, Prefix="", Delimiter=None, ContinuationToken=None):
+        return {"Contents": [{"Key": key, "ETag": '"e"', "Size": len(body)}
+                             for key, body in sorted(self.objects.items()) if key.startswith(Prefix)]}
+
+
+PAGES = [f"Sheet A-{n}: door schedule, fire rating {n * 15} minutes. " * 20 for n in range(50)] + ["", "π ≥ 3"]
+
+
+class TestFormat:
+    def test_round_trip_and_compression(self):
+        data = page_text_store.encode_pages(PAGES)
+        assert page_text_store.decode_pages(data) == PAGES
+        assert len(data) < len("\f".join(PAGES).encode("utf-8")) / 4
+        assert page_text_store.decode_pages(page_text_store.encode_pages([])) == []
+
+    def test_rejects_other_objects(self):
+        with pytest.raises(page_text_store.PageTextFormatError):
+            page_text_store.decode_pages(b"page one\fpage two")
+
+    def test_range_reads_fetch_only_the_requested_pages(self):
+        s3 = FakeRangeS3()
+        page_text_store.save_pages(s3, "bucket", "p/a.pdf", PAGES)
+        size = len(s3.objects["p/a.pages"])
+
+        reader = page_text_store.open_s3(s3, "bucket", "p/a.pages")
+        assert reader.page(40) == PAGES[40]
+        assert reader.pages(48) == PAGES[48:]
+        assert len(reader) == len(PAGES)
+
+        ranges = [tuple(map(int, get_range.split("=")[1].split("-"))) for _, get_range in s3.gets]
+        assert ranges[0] == (0, page_text_store.PAGE_TEXT_HEADER_READ - 1)
+        assert sum(end + 1 - start for start, end in ranges[1:]) < size / 10
+
+    def test_index_larger_than_first_read(self):
+        s3 = FakeRangeS3()
+        page_text_store.save_pages(s3, "bucket", "p/a.pdf", PAGES)
+        reader = page_text_store.PageTextReader(
+            lambda start, end: s3.objects["p/a.pages"][start:end], head_size=32)
+        assert reader.pages(10, 12) == PAGES[10:12]
+
+    def test_local_memory_map(self, tmp_path):
+        path = tmp_path / "a.pages"
+        path.write_bytes(page_text_store.encode_pages(PAGES))
+        assert page_text_store.open_local(str(path)).page(3) == PAGES[3]
+
+
+class TestLegacyText:
+    def test_load_falls_back_to_txt(self):
+        s3 = FakeRangeS3({"p/a.txt": b"page one\fpage two"})
+        assert page_text_store.load_pages(s3, "bucket", "p/a.pdf") == ["page one", "page two"]
+        assert [key for key, _ in s3.gets] == ["p/a.pages", "p/a.txt"]
+        assert page_text_store.load_pages(s3, "bucket", "p/b.pdf") is None
+
+    def test_migration_converts_and_deletes(self):
+        s3 = FakeRangeS3({"p/a.pdf": b"%PDF", "p/a.txt": "\f".join(PAGES).encode("utf-8"),
+                          "p/b.pdf": b"%PDF", "p/b.txt": b"old", "p/b.pages": page_text_store.encode_pages(["new"]),
+                          "p/readme.txt": b"not an extraction"})
+        converted, before, after = page_text_store.migrate_prefix(s3, "bucket", "p/", delete_legacy=True)
+
+        assert converted == 1 and after < before
+        assert page_text_store.decode_pages(s3.objects["p/a.pages"]) == PAGES
+        assert page_text_store.decode_pages(s3.objects["p/b.pages"]) == ["new"]
+        assert sorted(s3.objects) == ["p/a.pages", "p/a.pdf", "p/b.pages", "p/b.pdf", "p/readme.txt"]
+
+    def test_manifest_prefers_pages_object(self):
+        entries = manifest_service.build_entries([{"Key": key} for key in ("p/a.pdf", "p/a.pages", "p/a.txt", "p/b.pdf", "p/b.txt")])
+        assert [entry.text_key for entry in entries] == ["p/a.pages", "p/b.txt"]
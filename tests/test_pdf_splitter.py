@@ -0,0 +1,78 @@
+from io import BytesIO
+from unittest.mock import patch
+
+from pypdf import PdfReader
+
+from services import extraction_service, pdf_splitter
+
+TITLE_BLOCK = bytes(range(256)) * 64
+
+
+def drawing_set(sheets):
+    """Sheets sharing one font and one title block image; each sheet links to the next through an annotation."""
+    objects = {1: b"<< /Type /Catalog /Pages 2 0 R >>",
+               3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+               4: b"<< /Type /XObject /Subtype /Image /Width 128 /Height 128 /ColorSpace /DeviceGray "
+                  b"/BitsPerComponent 8 /Length %d >>\nstream\n" % len(TITLE_BLOCK) + TITLE_BLOCK + b"\nendstream"}
+    page_ids = [10 + 2 * n for n in range(sheets)]
+    for n, page_id in enumerate(page_ids):
+        content = b"BT /F1 12 Tf 40 700 Td (Sheet A-%d door schedule) Tj ET q 100 0 0 100 400 40 cm /Im1 Do Q" % n
+        objects[page_id + 1] = b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream"
+        link = page_ids[(n + 1) % sheets]
+        objects[page_id] = (b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents %d 0 R "
+                            b"/Resources << /Font << /F1 3 0 R >> /XObject << /Im1 4 0 R >> >> "
+                            b"/Annots [<< /Type /Annot /Subtype /Link /Rect [0 0 10 10] /P %d 0 R /Dest [%d 0 R /Fit] >>] >>"
+                            % (page_id + 1, page_id, link))
+    objects[2] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % page_id for page_id in page_ids), sheets)
+    out = b"%PDF-1.4\n"
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(out)
+        out += b"%d 0 obj\n" % object_id + objects[object_id] + b"\nendobj\n"
+    size = max(objects) + 1
+    xref = len(out)
+    out += b"xref\n0 %d\n" % size
+    out += b"".join(b"%010d 00000 n \n" % offsets[object_id] if object_id in offsets else b"0000000000 65535 f \n"
+                    for object_id in range(size))
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, xref)
+    return out
+
+
+class TestPdfSplitter:
+    def test_parts_are_standalone_pages(self):
+        splitter = pdf_splitter.PdfSplitter(extraction_service.open_pdf(drawing_set(4)))
+        for page_numbers, data in splitter.parts():
+            part = PdfReader(BytesIO(data), strict=True)
+            assert len(part.pages) == 1
+            assert part.pages[0].extract_text().strip() == f"Sheet A-{page_numbers[0]} door schedule"
+            assert part.pages[0]["/Resources"]["/XObject"]["/Im1"].get_object().get_data() == TITLE_BLOCK
+            # The link to the next sheet points at an object left out of the part
+            assert part.pages[0]["/Annots"][0].get_object()["/P"].get_object() == part.pages[0]
+
+    def test_shared_resources_serialized_once(self):
+        splitter = pdf_splitter.PdfSplitter(extraction_service.open_pdf(drawing_set(6)))
+        with patch.object(pdf_splitter, "_serialize", wraps=pdf_splitter._serialize) as serialize:
+            parts = list(splitter.parts())
+        serialized = sum(len(call.args[0].get_data()) for call in serialize.call_args_list
+                         if hasattr(call.args[0], "get_data") and call.args[0].get("/Subtype") == "/Image")
+        assert serialized == len(TITLE_BLOCK)
+        assert all(TITLE_BLOCK in data for _, data in parts)
+
+    def test_page_groups(self):
+        splitter = pdf_splitter.PdfSplitter(extraction_service.open_pdf(drawing_set(5)))
+        groups = list(splitter.parts(pages_per_part=2))
+        assert [page_numbers for page_numbers, _ in groups] == [[0, 1], [2, 3], [4]]
+        part = PdfReader(BytesIO(groups[0][1]), strict=True)
+        assert [page.extract_text().strip() for page in part.pages] == ["Sheet A-0 door schedule", "Sheet A-1 door schedule"]
+
+    def test_cache_is_bounded(self):
+        splitter = pdf_splitter.PdfSplitter(extraction_service.open_pdf(drawing_set(3)), cache_max_bytes=1000)
+        list(splitter.parts())
+        assert splitter.cache_bytes <= 1000
+
+    def test_writer_fallback(self):
+        source = extraction_service.open_pdf(drawing_set(2))
+        with patch.object(pdf_splitter, "PDF_SPLITTER", "writer"):
+            split = extraction_service.page_splitter(source)
+        data = split(1, source.pages[1])
+        assert PdfReader(BytesIO(data)).pages[0].extract_text().strip() == "Sheet A-1 door schedule"
@@ -0,0 +1,178 @@
+from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+
+from database.dao.ChunkRecord import ChunkRecord
+from services import reindex_service, weaviate_service
+
+
+class FakeCollection:
+    def __init__(self):
+        self.objects = {}
+        self.vectors = {}
+        self.data = SimpleNamespace(insert_many=self.insert_many, delete_many=self.delete_many)
+        self.aggregate = SimpleNamespace(over_all=lambda total_count: SimpleNamespace(total_count=len(self.objects)))
+
+    def insert_many(self, objects):
+        for obj in objects:
+            self.objects[obj.uuid] = obj.properties
+            self.vectors[obj.uuid] = getattr(obj, "vector", None)
+        return SimpleNamespace(errors={})
+
+    def delete_many(self, where):
+        matches = [uuid for uuid, properties in self.objects.items() if properties.get(where.target) == where.value]
+        for uuid in matches:
+            del self.objects[uuid]
+        return SimpleNamespace(matches=len(matches), successful=len(matches), failed=0)
+
+    def iterator(self, include_vector=False):
+        return iter([SimpleNamespace(uuid=uuid, properties=properties, vector=self.vectors.get(uuid))
+                     for uuid, properties in self.objects.items()])
+
+
+class FakeWeaviate:
+    """Collections and aliases, resolving an alias like the server does."""
+
+    def __init__(self):
+        self.stored = {}
+        self.aliases = {}
+        self.collections = SimpleNamespace(exists=lambda name: name in self.stored, create=self._create,
+                                           delete=lambda name: self.stored.pop(name), get=self._get,
+                                           list_all=lambda simple: {name: None for name in self.stored})
+        self.alias = SimpleNamespace(
+            get=lambda alias_name: SimpleNamespace(collection=self.aliases[alias_name]) if alias_name in self.aliases else None,
+            exists=lambda alias_name: alias_name in self.aliases,
+            create=lambda alias_name, target_collection: self.aliases.__setitem__(alias_name, target_collection),
+            update=lambda alias_name, new_target_collection: self.aliases.__setitem__(alias_name, new_target_collection))
+
+    def _create(self, name, **kwargs):
+        self.stored[name] = FakeCollection()
+
+    def _get(self, name):
+        return self.stored[self.aliases.get(name, name)]
+
+
+def chunk_dao(documents):
+    rows = [ChunkRecord(document_id, 1, n, n, f"doc {document_id} page {n}", "h", "v", file_name=f"{document_id}.pdf",
+                        source_url=f"s3://b/{document_id}.pdf", source_page=0)
+            for document_id, pages in documents for n in range(pages)]
+    dao = MagicMock()
+    dao.iter_chunks.side_effect = lambda project_id=None, document_id=None, min_document_id=None: iter(
+        [row for row in rows if min_document_id is None or row.document_id > min_document_id])
+    dao.count_chunks.return_value = len(rows)
+    dao.clock.return_value = datetime(2026, 1, 1)
+    dao.document_ids_written_since.return_value = []
+    return dao
+
+
+class TestReindex:
+    @pytest.fixture(autouse=True)
+    def checkpoint_dir(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(reindex_service, "REINDEX_CHECKPOINT_DIR", str(tmp_path))
+        monkeypatch.setattr(weaviate_service, "create_document_collection",
+                            lambda client, name, model=None: client.collections.create(name))
+
+    def test_build_validates_and_switches_alias(self):
+        client = FakeWeaviate()
+        weaviate_service.create_collections(client)
+        assert client.aliases == {"Document": "Document_v1"}
+
+        name, previous = reindex_service.build(client, chunk_dao([(1, 3), (2, 2)]), workers=2, allow_shrink=True)
+
+        assert (name, previous) == ("Document_v2", "Document_v1")
+        assert client.aliases["Document"] == "Document_v2"
+        assert "Document_v1" in client.stored  # kept for rollback
+        assert len(client.collections.get("Document").objects) == 5
+        reindex_service.switch(client, "Document_v1")
+        assert client.aliases["Document"] == "Document_v1"
+
+    def test_resume_skips_checkpointed_documents(self, monkeypatch):
+        client = FakeWeaviate()
+        checkpoint = reindex_service.ReindexCheckpoint("Document_v1", done=[1], max_document_id=1)
+        checkpoint.save()
+        client.collections.create("Document_v1")
+        client.stored["Document_v1"].insert_many([SimpleNamespace(uuid=weaviate_service.chunk_uuid(1, n), properties={})
+                                                  for n in range(3)])
+        calls = []
+        original = weaviate_service.upsert_document_chunks
+
+        def tracking(client, collection_name, document_record, chunks):
+            calls.append(document_record.document_id)
+            return original(client, collection_name, document_record, chunks)
+
+        monkeypatch.setattr(weaviate_service, "upsert_document_chunks", tracking)
+        reindex_service.build(client, chunk_dao([(1, 3), (2, 2)]), version=1)
+
+        assert calls == [2]
+        assert client.aliases["Document"] == "Document_v1"
+
+    def test_count_mismatch_keeps_alias(self):
+        client = FakeWeaviate()
+        weaviate_service.create_collections(client)
+        dao = chunk_dao([(1, 3)])
+        dao.count_chunks.return_value = 4
+
+        with pytest.raises(reindex_service.ReindexError):
+            reindex_service.build(client, dao)
+        assert client.aliases["Document"] == "Document_v1"
+
+    def test_reingested_document_is_copied_again(self):
+        client = FakeWeaviate()
+        weaviate_service.create_collections(client)
+        checkpoint = reindex_service.ReindexCheckpoint("Document_v2", done=[1], max_document_id=1,
+                                                       started_at=datetime(2026, 1, 1))
+        checkpoint.save()
+        client.collections.create("Document_v2")
+        # Copied before document 1 was re-ingested with one page less
+        client.stored["Document_v2"].insert_many([SimpleNamespace(uuid=weaviate_service.chunk_uuid(1, n),
+                                                                  properties={"document_id": 1, "contents": "old"})
+                                                  for n in range(3)])
+        dao = chunk_dao([(1, 2)])
+        dao.document_ids_written_since.return_value = [1]
+
+        reindex_service.build(client, dao, version=2, allow_shrink=True)
+
+        dao.document_ids_written_since.assert_called_with(datetime(2026, 1, 1))
+        contents = sorted(obj["contents"] for obj in client.stored["Document_v2"].objects.values())
+        assert contents == ["doc 1 page 0", "doc 1 page 1"]
+        assert client.aliases["Document"] == "Document_v2"
+
+
+class TestLegacyCollection:
+    @pytest.fixture(autouse=True)
+    def checkpoint_dir(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(reindex_service, "REINDEX_CHECKPOINT_DIR", str(tmp_path))
+        monkeypatch.setattr(weaviate_service, "create_document_collection",
+                            lambda client, name, model=None: client.collections.create(name))
+
+    def legacy_client(self):
+        client = FakeWeaviate()
+        client.collections.create("Document")
+        client.stored["Document"].insert_many([SimpleNamespace(uuid=f"u{n}", properties={"document_id": n},
+                                                               vector={"chunk_vector": [n]}) for n in range(3)])
+        return client
+
+    def test_legacy_collection_is_never_deleted_implicitly(self):
+        client = self.legacy_client()
+
+        with pytest.raises(RuntimeError):
+            weaviate_service.create_collections(client, recreate_if_exists=True)
+        with pytest.raises(reindex_service.ReindexError):
+            reindex_service.build(client, chunk_dao([(1, 3)]))
+        with pytest.raises(reindex_service.ReindexError):
+            reindex_service.drop(client, "Document")
+
+        assert len(client.stored["Document"].objects) == 3 and client.aliases == {}
+
+    def test_migrate_then_drop_replaces_collection_with_alias(self):
+        client = self.legacy_client()
+
+        assert reindex_service.migrate(client) == 3
+        assert "Document" in client.stored and client.aliases == {}
+        reindex_service.drop(client, "Document")
+
+        assert client.aliases == {"Document": "Document_v0"}
+        migrated = client.collections.get("Document")
+        assert migrated.vectors["u2"] == {"chunk_vector": [2]} and len(migrated.objects) == 3
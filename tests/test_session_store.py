@@ -0,0 +1,182 @@
+import os
+import time
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+import main
+from services.context_service import ContextChunk
+from services.session_store import ChatSession, SessionStore
+
+LEVEL_1 = "Door hardware schedule level 1: hinges and closers for doors 101 to 140. " * 3
+LEVEL_2 = "Door hardware schedule level 2: hinges and locksets for doors 201 to 260. " * 3
+ROOFING = "Roofing membrane: fully adhered EPDM over tapered insulation. " * 3
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestSessionStore:
+    def test_ttl_expiry(self):
+        clock = FakeClock()
+        store = SessionStore(max_sessions=10, ttl_seconds=60, clock=clock)
+        idle = store.create("p/")
+        active = store.create("p/")
+        clock.now = 50
+        assert store.get(active.session_id) is active
+        clock.now = 70
+        assert store.get(idle.session_id) is None
+        assert store.get(active.session_id) is active
+        assert store.stats()["expired"] == 1
+
+    def test_least_recently_used_evicted_past_max_sessions(self):
+        store = SessionStore(max_sessions=2, ttl_seconds=60, clock=FakeClock())
+        first, second = store.create("p/"), store.create("p/")
+        store.get(first.session_id)
+        store.create("p/")
+        assert store.get(second.session_id) is None and store.get(first.session_id) is first
+        assert store.stats()["evictions"] == 1
+
+    def test_chunks_are_bounded_and_deduplicated(self):
+        session = ChatSession("s", "p/", max_chunk_bytes=len(LEVEL_1) + len(LEVEL_2))
+        assert session.remember([ContextChunk(LEVEL_1, "a.pdf", 0), ContextChunk(LEVEL_1, "a.pdf", 0)]) == 1
+        assert session.coverage("hinges for doors 101") == 1.0
+        session.remember([ContextChunk(LEVEL_2, "a.pdf", 1), ContextChunk(ROOFING, "b.pdf", 0)])
+        assert [chunk.text for chunk in session.context_chunks()] == [LEVEL_2, ROOFING]
+        assert session.coverage("101") == 0.0
+        # A chunk pushed out can come back later
+        assert session.remember([ContextChunk(LEVEL_1, "a.pdf", 0)]) == 1
+
+    def test_other_workers_see_turns_through_session_dir(self, tmp_path):
+        worker_a = SessionStore(ttl_seconds=60, session_dir=str(tmp_path), clock=FakeClock())
+        worker_b = SessionStore(ttl_seconds=60, session_dir=str(tmp_path), clock=FakeClock())
+        session = worker_a.create("p/", 4, "hybrid")
+        session.remember([ContextChunk(LEVEL_1, "a.pdf", 0)])
+        session.add_turn("hinges?", "butt hinges")
+        worker_a.save(session)
+
+        taken_over = worker_b.get(session.session_id)
+        assert (taken_over.project_id, taken_over.retrieval, taken_over.turns) == (4, "hybrid", [("hinges?", "butt hinges")])
+        assert not taken_over.chunks
+        taken_over.add_turn("level 2?", "lever sets")
+        worker_b.save(taken_over)
+        assert worker_a.get(session.session_id).turn_count == 2
+        assert worker_b.delete(session.session_id)
+        assert worker_a.get(session.session_id) is None
+        assert worker_a.get("../../etc/passwd") is None
+
+    def test_concurrent_follow_ups_on_two_workers_keep_both_turns(self, tmp_path):
+        worker_a = SessionStore(ttl_seconds=60, session_dir=str(tmp_path), clock=FakeClock())
+        worker_b = SessionStore(ttl_seconds=60, session_dir=str(tmp_path), clock=FakeClock())
+        session_a = worker_a.create("p/")
+        session_b = worker_b.get(session_a.session_id)
+
+        # Both workers answer a follow-up before either sees the other's turn
+        session_a.add_turn("hinges?", "butt hinges")
+        session_b.add_turn("closers?", "surface closers")
+        worker_a.save(session_a)
+        worker_b.save(session_b)
+
+        assert session_b.turn_count == 2
+        assert worker_a.get(session_a.session_id).turns == [("hinges?", "butt hinges"), ("closers?", "surface closers")]
+        session_a.add_turn("locksets?", "lever sets")
+        worker_a.save(session_a)
+        assert worker_b.get(session_a.session_id).turn_count == 3
+
+    def test_reading_a_session_keeps_its_file_from_the_sweep(self, tmp_path):
+        store = SessionStore(ttl_seconds=60, session_dir=str(tmp_path), clock=FakeClock())
+        session = store.create("p/")
+        path = tmp_path / f"{session.session_id}.json"
+        almost_expired = time.time() - 50
+        os.utime(path, (almost_expired, almost_expired))
+
+        assert store.get(session.session_id) is session
+        assert path.stat().st_mtime > almost_expired + 30
+
+    def test_abandoned_session_files_are_swept(self, tmp_path):
+        store = SessionStore(max_sessions=2, ttl_seconds=60, session_dir=str(tmp_path), clock=FakeClock())
+        abandoned = [store.create("p/") for _ in range(2)]
+        (tmp_path / ".tmp-crashed").write_text("{")
+        # Two minutes pass without the abandoned sessions being used
+        two_minutes_ago = time.time() - 120
+        for path in tmp_path.iterdir():
+            os.utime(path, (two_minutes_ago, two_minutes_ago))
+
+        kept = [store.create("p/") for _ in range(3)]
+
+        names = sorted(path.name for path in tmp_path.iterdir() if path.name != ".lock")
+        assert len(names) == 3
+        assert all(f"{session.session_id}.json" not in names for session in abandoned)
+        assert f"{kept[-1].session_id}.json" in names and ".tmp-crashed" not in names
+        store.sweep()
+        assert len(list(tmp_path.glob("*.json"))) == 2
+
+    def test_history_is_bounded(self):
+        session = ChatSession("s", "p/", max_turns=2)
+        for n in range(3):
+            session.add_turn(f"q{n}", f"a{n}")
+        assert session.turns == [("q1", "a1"), ("q2", "a2")] and session.turn_count == 3
+
+
+class TestSessionEndpoints:
+    def setup_method(self):
+        main.SESSION_STORE.clear()
+        self.session_dir = patch.object(main.SESSION_STORE, "session_dir", None)
+        self.session_dir.start()
+        self.client = TestClient(main.app)
+        self.prompts = []
+
+    def teardown_method(self):
+        self.session_dir.stop()
+
+    def fake_gemini(self, query, context, history=None):
+        self.prompts.append((query, context, history))
+        return f"answer to {query}"
+
+    def ask(self, session_id, query):
+        return self.client.post(f"/sessions/{session_id}/query", json={"query": query})
+
+    def test_follow_up_reuses_session_chunks(self):
+        session_id = self.client.post("/sessions", json={"location": "p/", "project_id": 4,
+                                                         "retrieval": "lexical"}).json()["session_id"]
+        retrieved = [ContextChunk(LEVEL_1, "a.pdf", 0, score=9.0), ContextChunk(LEVEL_2, "a.pdf", 1, score=8.0)]
+        with patch.object(main, "retrieve", return_value=retrieved) as retrieve, \
+             patch.object(main, "iter_project_pages") as iter_project_pages, \
+             patch.object(main, "call_gemini_api", side_effect=self.fake_gemini):
+            first = self.ask(session_id, "Which hinges are scheduled for doors on level 1?").json()
+            follow_up = self.ask(session_id, "and for level 2?").json()
+
+        retrieve.assert_called_once_with(4, "Which hinges are scheduled for doors on level 1?", "lexical")
+        iter_project_pages.assert_not_called()
+        assert first["turn"] == 1 and first["context"]["session_reused"] is False
+        assert first["context"]["session_chunks_added"] == 2
+        assert follow_up["turn"] == 2 and follow_up["context"]["session_reused"] is True
+        query, context, history = self.prompts[1]
+        assert "level 2" in context and history == [("Which hinges are scheduled for doors on level 1?",
+                                                      "answer to Which hinges are scheduled for doors on level 1?")]
+        assert self.client.get(f"/sessions/{session_id}").json()["turn_count"] == 2
+
+    def test_follow_up_on_new_topic_extends_retrieval(self):
+        session_id = self.client.post("/sessions", json={"location": "p/"}).json()["session_id"]
+        with patch.object(main, "iter_project_pages", side_effect=[iter([ContextChunk(LEVEL_1, "a.pdf", 0)]),
+                                                                   iter([ContextChunk(ROOFING, "b.pdf", 0)])]), \
+             patch.object(main, "call_gemini_api", side_effect=self.fake_gemini):
+            self.ask(session_id, "hinges for doors 101?")
+            follow_up = self.ask(session_id, "What roofing membrane is specified?").json()
+
+        assert follow_up["context"]["session_reused"] is False
+        assert follow_up["context"]["session_chunks_added"] == 1
+        assert "Door hardware" in self.prompts[1][1] and "EPDM" in self.prompts[1][1]
+
+    def test_unknown_session_and_validation(self):
+        assert self.ask("missing", "hinges?").status_code == 404
+        assert self.client.post("/sessions", json={"retrieval": "fuzzy"}).status_code == 400
+        session_id = self.client.post("/sessions", json={"location": "p/"}).json()["session_id"]
+        assert self.ask(session_id, "").status_code == 400
+        assert self.client.delete(f"/sessions/{session_id}").status_code == 204
+        assert self.client.get(f"/sessions/{session_id}").status_code == 404
@@ -0,0 +1,61 @@
+import threading
+import time
+
+from services.singleflight import SingleFlight
+
+
+class TestSingleFlight:
+    def _run_concurrently(self, count, target):
+        results = [None] * count
+        errors = [None] * count
+
+        def worker(i):
+            try:
+                results[i] = target()
+            except Exception as e:
+                errors[i] = e
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_concurrent_callers_share_one_call(self):
+        """Test that concurrent calls for one key run the function once"""
+        flight = SingleFlight()
+        calls = []
+
+        def slow_extract():
+            calls.append(1)
+            time.sleep(0.2)
+            return "page text"
+
+        results, errors = self._run_concurrently(8, lambda: flight.do("doc.pdf", slow_extract))
+
+        assert len(calls) == 1
+        assert results == ["page text"] * 8
+        assert errors == [None] * 8
+        assert flight.shared == 7
+        assert flight.in_flight() == 0
+
+    def test_failure_propagates_to_all_waiters(self):
+        """Test that every waiter sees the leader's exception"""
+        flight = SingleFlight()
+
+        def failing():
+            time.sleep(0.1)
+            raise RuntimeError("Document AI unavailable")
+
+        results, errors = self._run_concurrently(4, lambda: flight.do("doc.pdf", failing))
+
+        assert all(isinstance(e, RuntimeError) for e in errors)
+        assert flight.in_flight() == 0
+
+    def test_sequential_calls_are_not_cached(self):
+        """Test that a finished call does not serve later callers"""
+        flight = SingleFlight()
+        assert flight.do("k", lambda: 1) == 1
+        assert flight.do("k", lambda: 2) == 2
+        assert flight.leaders == 2
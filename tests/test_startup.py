@@ -0,0 +1,53 @@
+import json
+import os
+import subprocess
+import sys
+
+# Budget for `import main` in a fresh interpreter; override on slow CI runners
+IMPORT_TIME_BUDGET_SECONDS = float(os.getenv("APP_IMPORT_BUDGET_SECONDS", "3.0"))
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_IMPORT_PROBE = """
+import json, socket, sys, time
+def _no_network(*args, **kwargs):
+    raise AssertionError("network access during import")
+socket.socket.connect = _no_network
+socket.create_connection = _no_network
+started = time.perf_counter()
+import main
+elapsed = time.perf_counter() - started
+print(json.dumps({
+    "seconds": elapsed,
+    "deferred": [name for name in ("google.generativeai", "weaviate") if name not in sys.modules],
+}))
+"""
+
+
+class TestStartup:
+    def _probe(self):
+        env = dict(os.environ, PYTHONPATH=os.path.join(REPO_ROOT, "src"))
+        result = subprocess.run([sys.executable, "-c", _IMPORT_PROBE], cwd=REPO_ROOT, env=env,
+                                capture_output=True, text=True, timeout=60)
+        assert result.returncode == 0, result.stderr
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+    def test_import_main_makes_no_network_calls_and_fits_budget(self):
+        """Test that importing the app is side-effect free and within the import-time budget"""
+        probe = self._probe()
+        assert probe["seconds"] < IMPORT_TIME_BUDGET_SECONDS
+        assert probe["deferred"] == ["google.generativeai", "weaviate"]
+
+
+class TestHealthz:
+    def test_fails_while_draining(self, tmp_path, monkeypatch):
+        """Test that the health check turns 503 once serve.py starts draining"""
+        from fastapi.testclient import TestClient
+        import main
+
+        drain_file = tmp_path / "draining"
+        monkeypatch.setattr(main, "DRAIN_FILE", str(drain_file))
+        client = TestClient(main.app)
+        assert client.get("/healthz").status_code == 200
+        drain_file.touch()
+        assert client.get("/healthz").json() == {"status": "draining"}
@@ -0,0 +1,120 @@
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+from database.dao.DocumentRecord import DocumentRecord
+from services import extraction_service, text_layer
+from services.extraction_service import PageRoute
+from services.ingestion_service import IngestionService
+
+SPEC_TEXT = "Section 08 71 00 door hardware: provide hinges, closers and locksets as scheduled. " * 4
+
+
+def make_pdf(page_contents):
+    """A PDF whose pages draw the given content streams, with Helvetica as /F1 and a 2x2 image as /Im1."""
+    objects = {1: b"<< /Type /Catalog /Pages 2 0 R >>",
+               3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+               4: b"<< /Type /XObject /Subtype /Image /Width 2 /Height 2 /ColorSpace /DeviceGray "
+                  b"/BitsPerComponent 8 /Length 4 >>\nstream\n\x00\xff\xff\x00\nendstream"}
+    kids = []
+    for content in page_contents:
+        content_id, page_id = max(objects) + 1, max(objects) + 2
+        objects[content_id] = b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream"
+        objects[page_id] = (b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents %d 0 R "
+                            b"/Resources << /Font << /F1 3 0 R >> /XObject << /Im1 4 0 R >> >> >>" % content_id)
+        kids.append(page_id)
+    objects[2] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % kid for kid in kids), len(kids))
+    out = b"%PDF-1.4\n"
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(out)
+        out += b"%d 0 obj\n" % object_id + objects[object_id] + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offsets[object_id] for object_id in sorted(objects))
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return out
+
+
+def text_page(text=SPEC_TEXT):
+    return b"BT /F1 9 Tf 40 760 Td (" + text.encode("latin-1") + b") Tj ET"
+
+
+SCAN_PAGE = b"q 612 0 0 792 0 0 cm /Im1 Do Q"
+STAMPED_SCAN_PAGE = SCAN_PAGE + b"\n" + text_page("APPROVED FOR CONSTRUCTION - ISSUED 2024-03-01 - SHEET A-101 " * 3)
+DRAWING_WITH_LOGO = text_page() + b"\nq 100 0 0 50 500 20 cm /Im1 Do Q"
+
+
+class TestTextLayerQuality:
+    def test_measures_text_and_image_coverage(self):
+        pdf = extraction_service.open_pdf(make_pdf([text_page(), SCAN_PAGE, DRAWING_WITH_LOGO]))
+        _, text_quality = text_layer.measure_page(pdf.pages[0])
+        _, scan_quality = text_layer.measure_page(pdf.pages[1])
+        logo_text, logo_quality = text_layer.measure_page(pdf.pages[2])
+
+        assert text_quality.chars > 200 and text_quality.image_coverage == 0
+        assert scan_quality.chars == 0 and scan_quality.image_coverage == 1.0
+        assert "door hardware" in logo_text and 0 < logo_quality.image_coverage < 0.02
+
+    def test_garbage_ratio(self):
+        assert text_layer.garbage_ratio("door D-1") == 0
+        assert text_layer.garbage_ratio("ab\ufffd\ue000") == 0.5
+        assert text_layer.garbage_ratio("") == 0
+
+    def test_ocr_reasons(self):
+        assert text_layer.ocr_reason(text_layer.TextLayerQuality(500, 0.0, 0.0)) is None
+        assert text_layer.ocr_reason(text_layer.TextLayerQuality(10, 0.0, 0.0)) == "sparse_text"
+        assert text_layer.ocr_reason(text_layer.TextLayerQuality(500, 0.5, 0.0)) == "garbage_glyphs"
+        assert text_layer.ocr_reason(text_layer.TextLayerQuality(500, 0.0, 0.9)) == "image_page"
+        assert text_layer.ocr_reason(text_layer.TextLayerQuality(5000, 0.0, 0.9)) is None
+
+
+class TestExtractionRouter:
+    def test_only_scanned_pages_go_to_document_ai(self):
+        pdf = make_pdf([text_page(), SCAN_PAGE, DRAWING_WITH_LOGO, STAMPED_SCAN_PAGE])
+        with patch.object(extraction_service, "process_page_with_document_ai",
+                          return_value=SimpleNamespace(text="ocr text")) as ocr:
+            texts, routes = extraction_service.extract_pages_routed(pdf)
+
+        assert [route.method for route in routes] == ["pypdf", "documentai", "pypdf", "documentai"]
+        assert [route.reason for route in routes] == [None, "sparse_text", None, "image_page"]
+        assert ocr.call_count == 2
+        assert texts[1] == texts[3] == "ocr text" and "door hardware" in texts[0]
+
+    def test_selected_pages(self):
+        pdf = make_pdf([SCAN_PAGE, text_page(), SCAN_PAGE])
+        with patch.object(extraction_service, "process_page_with_document_ai") as ocr:
+            texts, routes = extraction_service.extract_pages_routed(pdf, [1])
+        assert [route.page_num for route in routes] == [1] and "door hardware" in texts[0]
+        ocr.assert_not_called()
+
+    def test_pages_measured_while_fingerprinting_are_not_read_again(self):
+        from services import dedup_service
+
+        pdf = make_pdf([text_page(), SCAN_PAGE])
+        pages = dedup_service.fingerprint_pages(pdf, 3, 9, measure=True)
+        measured = {page.fingerprint.page_number: (page.text_layer, page.quality) for page in pages}
+        with patch.object(text_layer, "measure_page") as measure_page, \
+             patch.object(extraction_service, "process_page_with_document_ai", return_value=SimpleNamespace(text="ocr text")):
+            texts, routes = extraction_service.extract_pages_routed(pdf, [0, 1], measured=measured)
+
+        measure_page.assert_not_called()
+        assert [route.method for route in routes] == ["pypdf", "documentai"]
+        assert texts[0] == pages[0].text_layer and texts[1] == "ocr text"
+
+
+class TestIngestionRecordsRoutes:
+    def test_chunk_versions_follow_each_page_route(self):
+        chunk_dao = MagicMock()
+        document_dao = MagicMock()
+        document_dao.create_document.return_value = DocumentRecord(9, "set.pdf", 3, "s3://b/set.pdf", 0)
+        extraction = MagicMock(EXTRACTION_ROUTER_ENABLED=True)
+        extraction.extract_pages_routed.return_value = (["text page", "scanned page"], [
+            PageRoute(0, "pypdf", None, None), PageRoute(1, "documentai", "sparse_text", None)])
+        extraction.extractor_version.side_effect = lambda use_document_ai: "documentai" if use_document_ai else "pypdf"
+        service = IngestionService(MagicMock(), document_dao, extraction, MagicMock(),
+                                   lexical_index_module=MagicMock(), use_document_ai=True, chunk_dao=chunk_dao)
+
+        assert service.ingest_document(DocumentRecord(None, "set.pdf", 3, "s3://b/set.pdf", 0), b"%PDF") == 9
+        extraction.extract_and_chunk.assert_not_called()
+        records = chunk_dao.copy_chunks.call_args.args[0]
+        assert [(r.text, r.extractor_version) for r in records] == [("text page", "pypdf"), ("scanned page", "documentai")]
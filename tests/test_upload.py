@@ -0,0 +1,105 @@
+from io import BytesIO
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+from pypdf import PdfWriter
+
+import main
+from services import extraction_service
+from services.upload_service import StreamingUpload, UploadTooLargeError
+
+
+class FakeMultipartS3:
+    def __init__(self):
+        self.parts = {}
+        self.completed = {}
+        self.aborted = []
+
+    def create_multipart_upload(self, Bucket, Key):
+        self.parts[Key] = []
+        return {"UploadId": "upload-1"}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.parts[Key].append((PartNumber, Body))
+        return {"ETag": f'"etag-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        assert [part["PartNumber"] for part in MultipartUpload["Parts"]] == [number for number, _ in self.parts[Key]]
+        self.completed[Key] = b"".join(body for _, body in self.parts[Key])
+        return {"ETag": f'"multipart-{len(self.parts[Key])}"'}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted.append(Key)
+
+
+def make_pdf(pages=3):
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(72, 72)
+    out = BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+class TestStreamingUpload:
+    def test_parts_spool_and_mmap(self):
+        s3 = FakeMultipartS3()
+        upload = StreamingUpload(s3, "bucket", "key.pdf", part_size=10)
+        upload.start()
+        for piece in (b"0123456", b"789abcdef", b"ghij", b"k"):
+            upload.write(piece)
+            upload.flush_parts()
+        mapped = upload.complete()
+
+        assert [len(body) for _, body in s3.parts["key.pdf"]] == [10, 10, 1]
+        assert s3.completed["key.pdf"] == b"0123456789abcdefghijk"
+        assert mapped[:] == b"0123456789abcdefghijk"
+        mapped.close()
+        upload.close()
+
+    def test_size_limit(self):
+        s3 = FakeMultipartS3()
+        upload = StreamingUpload(s3, "bucket", "key.pdf", part_size=10, max_bytes=5)
+        upload.start()
+        try:
+            upload.write(b"123456")
+            assert False, "expected UploadTooLargeError"
+        except UploadTooLargeError:
+            upload.abort()
+        assert s3.aborted == ["key.pdf"]
+
+    def test_extraction_reads_memory_mapped_pdf(self):
+        upload = StreamingUpload(FakeMultipartS3(), "bucket", "key.pdf")
+        upload.start()
+        upload.write(make_pdf(3))
+        mapped = upload.complete()
+        assert len(extraction_service.extract_and_chunk(mapped)) == 3
+        mapped.close()
+        upload.close()
+
+
+class TestUploadEndpoint:
+    def test_upload_streams_and_ingests(self):
+        s3 = FakeMultipartS3()
+        received = {}
+
+        def fake_ingest(project_id, file_name, s3_key, pdf_source, etag, size):
+            received.update(project_id=project_id, file_name=file_name, body=pdf_source[:], etag=etag, size=size)
+            return 42
+
+        pdf = make_pdf(2)
+        with patch.object(main, "get_s3_client", return_value=s3), \
+             patch.object(main, "ingest_uploaded_document", side_effect=fake_ingest):
+            response = TestClient(main.app).put("/projects/7/documents/set.pdf", content=pdf)
+
+        assert response.status_code == 200
+        assert response.json() == {"document_id": 42, "s3_key": "uploads/7/set.pdf", "bytes": len(pdf)}
+        assert s3.completed["uploads/7/set.pdf"] == pdf
+        assert received == {"project_id": 7, "file_name": "set.pdf", "body": pdf, "etag": '"multipart-1"', "size": len(pdf)}
+
+    def test_rejects_non_pdf(self):
+        s3 = FakeMultipartS3()
+        with patch.object(main, "get_s3_client", return_value=s3):
+            response = TestClient(main.app).put("/projects/7/documents/set.pdf", content=b"hello world")
+        assert response.status_code == 400
+        assert s3.aborted == ["uploads/7/set.pdf"]